@@ -0,0 +1,62 @@
+"""Measure the wall time of `dogaas-cli` invocations which need no tasks.
+
+Usage: python benchmarks/bench_cli_startup.py [--runs N] [--output FILE]
+
+A copy of `src` in a temporary directory is used so no task file is
+touched. Results are printed (or written to FILE) as JSON.
+"""
+
+from pathlib import Path
+import argparse
+import statistics
+import subprocess
+import tempfile
+import shutil
+import time
+import json
+import sys
+
+SRC_DIR = Path(__file__).absolute().parent.parent / "src"
+COMMANDS = {
+    "help": ["--help"],
+    "download_help": ["download", "--help"],
+    "tasks": ["tasks"],
+}
+
+
+def measure(argv: list[str], runs: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cli_dir = Path(tmpdir) / "src"
+        shutil.copytree(SRC_DIR, cli_dir, ignore=shutil.ignore_patterns("tasks.*"))
+        seconds = []
+        for _ in range(runs):
+            started_at = time.perf_counter()
+            subprocess.run(
+                [sys.executable, str(cli_dir / "cli_app.py"), *argv],
+                check=True,
+                capture_output=True,
+            )
+            seconds.append(time.perf_counter() - started_at)
+    return {
+        "argv": argv,
+        "runs": runs,
+        "min_s": min(seconds),
+        "median_s": statistics.median(seconds),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+    results = {name: measure(argv, args.runs) for name, argv in COMMANDS.items()}
+    text = json.dumps({"cli_startup": results}, indent=4)
+    if args.output:
+        args.output.write_text(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Compare two results of `benchmarks.run`.
+
+Usage: python -m benchmarks.compare OLD NEW [--threshold RATIO]
+
+Every `median_s` found in both results is printed with the ratio NEW / OLD.
+The exit status is 1 if any ratio exceeds `--threshold` (default 1.2).
+"""
+
+from pathlib import Path
+from typing import Iterator
+import argparse
+import json
+import sys
+
+
+def iter_medians(result, path: str = "") -> Iterator[tuple[str, float]]:
+    if isinstance(result, dict):
+        for key, value in result.items():
+            if key == "median_s":
+                yield path, value
+            elif key != "meta":
+                yield from iter_medians(value, f"{path}.{key}" if path else key)
+    elif isinstance(result, list):
+        for i, value in enumerate(result):
+            yield from iter_medians(value, f"{path}[{i}]")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("old", type=Path)
+    parser.add_argument("new", type=Path)
+    parser.add_argument("--threshold", type=float, default=1.2)
+    args = parser.parse_args()
+    old = json.loads(args.old.read_text())
+    new = json.loads(args.new.read_text())
+    print(f"{old['meta']['commit']} -> {new['meta']['commit']}")
+    old_medians = dict(iter_medians(old))
+    regressed = False
+    for path, new_median in iter_medians(new):
+        if path not in old_medians:
+            continue
+        ratio = new_median / old_medians[path]
+        mark = " !" if ratio > args.threshold else ""
+        regressed = regressed or bool(mark)
+        print(
+            f"{path}: {old_medians[path]:.4f}s -> {new_median:.4f}s"
+            f" ({ratio:.2f}x){mark}"
+        )
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""Run the benchmark suite against a local `StandInServer`.
+
+Usage: python -m benchmarks.run [--quick] [--only NAME ...] [--output FILE]
+
+Measured, each as its own section of the JSON result:
+
+- `throughput`: `Downloader.download` for several chunk and file sizes.
+- `segments`: segmented downloads from a latent, bandwidth-shaped server.
+- `concurrency`: `DownloadScheduler` with 1-16 jobs over many small files,
+  then `AsyncTaskManager` with 16-256 concurrent fetches over the same.
+- `disk_writer`: a stream read from a shaped network and written to a
+  shaped disk, inline and through `dogaas.diskio.FileWriter`.
+- `task_store`: load / save of the json and sqlite task stores.
+- `task_model`: memory of many tasks in memory, and the peak memory of
+  loading and saving them as json.
+- `cli_startup`: see `bench_cli_startup.py`.
+
+The result carries the git commit it was measured at, so two runs can be
+compared with `python -m benchmarks.compare OLD NEW`.
+"""
+
+from datetime import datetime, timezone
+from pathlib import Path
+import argparse
+import asyncio
+import platform
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+import random
+import time
+import json
+import sys
+
+from benchmarks import bench_cli_startup
+from benchmarks.server import StandInServer
+from src.dogaas.asyncdownloader import AsyncTaskManager
+from src.dogaas.diskio import BufferPool, FileWriter
+from src.dogaas.downloader import DownloadScheduler, DownloaderTask, TaskManager
+from src.dogaas.taskdb import SQLiteTaskDatabase
+
+KiB = 1024
+MiB = 1024 * KiB
+
+
+def _timed(function, runs: int) -> dict:
+    seconds = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - started_at)
+    return {"runs": runs, "min_s": min(seconds), "median_s": statistics.median(seconds)}
+
+
+def _download_once(task_manager: TaskManager, task_name: str, **download_kwargs):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        downloader = task_manager.make_downloader_from_task(task_name)
+        for _ in downloader.download(tmpdir, resume=False, **download_kwargs):
+            pass
+
+
+def _with_throughput(result: dict, size: int) -> dict:
+    result["mib_per_s"] = size / MiB / result["median_s"]
+    return result
+
+
+def bench_throughput(quick: bool) -> list[dict]:
+    file_sizes = [1 * MiB, 16 * MiB] if quick else [1 * MiB, 16 * MiB, 128 * MiB]
+    chunk_sizes = [1 * KiB, 16 * KiB, 64 * KiB, 1 * MiB]
+    runs = 2 if quick else 5
+    results = []
+    with StandInServer() as server:
+        task_manager = TaskManager()
+        for size in file_sizes:
+            server.files[f"/{size}.bin"] = random.Random(size).randbytes(size)
+            task_manager.add_task(str(size), DownloaderTask(f"{server.url}/{size}.bin"))
+            for chunk_size in chunk_sizes:
+                result = _timed(
+                    lambda: _download_once(
+                        task_manager, str(size), chunk_size=chunk_size
+                    ),
+                    runs,
+                )
+                results.append(
+                    {"file_size": size, "chunk_size": chunk_size}
+                    | _with_throughput(result, size)
+                )
+    return results
+
+
+def bench_segments(quick: bool) -> list[dict]:
+    size = 8 * MiB if quick else 32 * MiB
+    bandwidth = 8 * MiB
+    results = []
+    with StandInServer(latency=0.05, bandwidth=bandwidth) as server:
+        server.files["/a.bin"] = random.Random(size).randbytes(size)
+        task_manager = TaskManager()
+        task_manager.add_task("a", DownloaderTask(f"{server.url}/a.bin"))
+        for segments in [1, 2, 4, 8]:
+            result = _timed(
+                lambda: _download_once(task_manager, "a", segments=segments), 1
+            )
+            results.append(
+                {
+                    "file_size": size,
+                    "latency_s": server.latency,
+                    "bandwidth": bandwidth,
+                    "segments": segments,
+                }
+                | _with_throughput(result, size)
+            )
+    return results
+
+
+def bench_concurrency(quick: bool) -> list[dict]:
+    count = 50 if quick else 200
+    size = 64 * KiB
+    results = []
+    with StandInServer(latency=0.02) as server:
+        task_manager = TaskManager()
+        for i in range(count):
+            server.files[f"/{i}.bin"] = random.Random(i).randbytes(size)
+            task_manager.add_task(str(i), DownloaderTask(f"{server.url}/{i}.bin"))
+        for jobs in [1, 2, 4, 8, 16]:
+
+            def run():
+                with tempfile.TemporaryDirectory() as tmpdir:
+                    results_ = DownloadScheduler(task_manager, jobs=jobs).run(tmpdir)
+                    assert all(result.ok for result in results_)
+
+            result = _timed(run, 1)
+            result["files_per_s"] = count / result["median_s"]
+            results.append(
+                {"files": count, "file_size": size, "latency_s": 0.02, "jobs": jobs}
+                | result
+            )
+        for concurrency in [16, 64, 256]:
+
+            async def run_async():
+                with tempfile.TemporaryDirectory() as tmpdir:
+                    async with AsyncTaskManager(task_manager) as async_task_manager:
+                        results_ = await async_task_manager.run(
+                            tmpdir, concurrency=concurrency
+                        )
+                    assert all(result.ok for result in results_)
+
+            result = _timed(lambda: asyncio.run(run_async()), 1)
+            result["files_per_s"] = count / result["median_s"]
+            results.append(
+                {
+                    "files": count,
+                    "file_size": size,
+                    "latency_s": 0.02,
+                    "engine": "async",
+                    "concurrency": concurrency,
+                }
+                | result
+            )
+    return results
+
+
+class _ShapedFile:
+    """A disk which writes `rate` bytes per second."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+
+    def write(self, data) -> int:
+        time.sleep(len(data) / self.rate)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def bench_disk_writer(quick: bool) -> list[dict]:
+    size = 16 * MiB if quick else 64 * MiB
+    chunk = bytes(64 * KiB)
+    rate = 100 * MiB
+    results = []
+
+    def read_chunks():
+        for _ in range(size // len(chunk)):
+            # the network delivers `rate` bytes per second too
+            time.sleep(len(chunk) / rate)
+            yield chunk
+
+    def inline():
+        file = _ShapedFile(rate)
+        for data in read_chunks():
+            file.write(data)
+
+    def threaded():
+        writer = FileWriter(_ShapedFile(rate), BufferPool(MiB, 8))
+        for data in read_chunks():
+            writer.write(data)
+        writer.close()
+
+    for mode, function in [("inline", inline), ("writer", threaded)]:
+        result = _timed(function, 1)
+        results.append(
+            {"file_size": size, "network_rate": rate, "disk_rate": rate, "mode": mode}
+            | _with_throughput(result, size)
+        )
+    return results
+
+
+def _make_tasks(count: int) -> dict[str, DownloaderTask]:
+    return {
+        f"task_{i}": DownloaderTask(f"https://host{i % 16}.example/files/{i}.bin")
+        for i in range(count)
+    }
+
+
+def bench_task_store(quick: bool) -> list[dict]:
+    counts = [1000] if quick else [1000, 100_000, 1_000_000]
+    results = []
+    for count in counts:
+        tasks = _make_tasks(count)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            task_manager = TaskManager(tasks)
+            save = _timed(lambda: task_manager.save_tasks_to_json(tmpdir, "tasks"), 3)
+            load = _timed(
+                lambda: TaskManager().load_tasks_from_json(Path(tmpdir, "tasks.json")),
+                3,
+            )
+            results.append(
+                {"store": "json", "tasks": count, "save": save, "load": load}
+            )
+
+            db_filepath = Path(tmpdir, "tasks.db")
+
+            def save_db():
+                db_filepath.unlink(missing_ok=True)
+                with SQLiteTaskDatabase(db_filepath) as database:
+                    database.add_tasks(tasks.items())
+
+            def load_db():
+                with SQLiteTaskDatabase(db_filepath) as database:
+                    for _ in database.items():
+                        pass
+
+            save = _timed(save_db, 3)
+            load = _timed(load_db, 3)
+            results.append(
+                {"store": "sqlite", "tasks": count, "save": save, "load": load}
+            )
+    return results
+
+
+def _peak_bytes(function) -> int:
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_task_model(quick: bool) -> dict:
+    count = 100_000 if quick else 1_000_000
+    tracemalloc.start()
+    tasks = _make_tasks(count)
+    tasks_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    result = {
+        "tasks": count,
+        "bytes_per_task": tasks_bytes / count,
+        # bound now, as `tasks` is deleted below to measure the manager alone
+        "url_access": _timed(
+            lambda tasks=tasks: [task.url for task in tasks.values()], 3
+        ),
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        task_manager = TaskManager(tasks)
+        del tasks
+        result["save_peak_bytes"] = _peak_bytes(
+            lambda: task_manager.save_tasks_to_json(tmpdir, "tasks")
+        )
+        result["load_peak_bytes"] = _peak_bytes(
+            lambda: TaskManager().load_tasks_from_json(Path(tmpdir, "tasks.json"))
+        )
+    return result
+
+
+def bench_cli_startup_(quick: bool) -> dict:
+    runs = 3 if quick else 10
+    return {
+        name: bench_cli_startup.measure(argv, runs)
+        for name, argv in bench_cli_startup.COMMANDS.items()
+    }
+
+
+BENCHMARKS = {
+    "throughput": bench_throughput,
+    "segments": bench_segments,
+    "concurrency": bench_concurrency,
+    "disk_writer": bench_disk_writer,
+    "task_store": bench_task_store,
+    "task_model": bench_task_model,
+    "cli_startup": bench_cli_startup_,
+}
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--quick", action="store_true", help="smaller inputs, fewer runs"
+    )
+    parser.add_argument("--only", choices=BENCHMARKS, action="append")
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+    results = {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "quick": args.quick,
+        }
+    }
+    for name in args.only or BENCHMARKS:
+        print(f"running {name}...", file=sys.stderr)
+        results[name] = BENCHMARKS[name](args.quick)
+    text = json.dumps(results, indent=4)
+    if args.output:
+        args.output.write_text(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
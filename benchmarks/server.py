@@ -0,0 +1,215 @@
+"""A local stand-in for the HTTP servers dogaas downloads from.
+
+It serves in-memory files with `Accept-Ranges`, `ETag` / `Last-Modified`
+and conditional requests, and can add latency, shape bandwidth and inject
+faults, so downloads can be measured and tested without the network.
+
+Usage: python -m benchmarks.server [--port PORT] [--latency S] [--bandwidth B]
+"""
+
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+import argparse
+import threading
+import hashlib
+import random
+import sys
+import time
+import re
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "StandInServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body: bool):
+        server = self.server
+        with server.lock:
+            server.request_headers.append(dict(self.headers))
+            server.client_ports.append(self.client_address[1])
+            is_error = server.random.random() < server.error_rate
+            is_dropped = server.random.random() < server.drop_rate
+        if server.latency:
+            time.sleep(server.latency)
+        body = server.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        if is_error:
+            self.send_response(503)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        etag, last_modified = server.validators_of(self.path, body)
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match == etag or (
+            if_none_match is None
+            and self.headers.get("If-Modified-Since") == last_modified
+        ):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            self.end_headers()
+            return
+        start, end = 0, len(body) - 1
+        status = 200
+        range_match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range")
+        if (
+            range_match
+            and server.accept_ranges
+            and if_range in (None, etag, last_modified)
+        ):
+            start = int(range_match[1])
+            end = min(int(range_match[2] or end), end)
+            status = 206
+        self.send_response(status)
+        if server.accept_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        if send_body:
+            if is_dropped:
+                # cut the connection halfway through the body
+                end = start + (end - start) // 2
+                self.close_connection = True
+            self._write_shaped(memoryview(body)[start : end + 1])
+
+    def _write_shaped(self, data: memoryview):
+        bandwidth = self.server.bandwidth
+        if not bandwidth:
+            self.wfile.write(data)
+            return
+        block_size = max(1024, int(bandwidth / 50))
+        started_at = time.monotonic()
+        for offset in range(0, len(data), block_size):
+            self.wfile.write(data[offset : offset + block_size])
+            ahead = (offset + block_size) / bandwidth - (time.monotonic() - started_at)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+class StandInServer(ThreadingHTTPServer):
+    """Serve `files` (path -> bytes) on localhost.
+
+    Attributes:
+        accept_ranges (bool): honor `Range` requests.
+        latency (float): seconds to wait before each response.
+        bandwidth (float): bytes per second of each response body.
+        error_rate (float): share of requests answered `503`.
+        drop_rate (float): share of bodies cut off halfway.
+        request_headers (list[dict]): headers of every request.
+        client_ports (list[int]): client port of every request, to tell
+            connections apart.
+    """
+
+    daemon_threads = True
+    # hundreds of clients connect at once; a short backlog stalls them on SYN
+    # retransmits for a second, which would be measured instead
+    request_queue_size = 1024
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency: float = 0.0,
+        bandwidth: Optional[float] = None,
+        error_rate: float = 0.0,
+        drop_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.files: dict[str, bytes] = {}
+        self.accept_ranges = True
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.request_headers: list[dict] = []
+        self.client_ports: list[int] = []
+        self.lock = threading.Lock()
+        self._validators: dict[str, tuple[bytes, str, str]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def handle_error(self, request, client_address):
+        # clients hang up on purpose, e.g. after reading the first segment
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def validators_of(self, path: str, body: bytes) -> tuple[str, str]:
+        """`ETag` and `Last-Modified` of `body`, renewed whenever it is replaced."""
+        with self.lock:
+            cached_body, etag, last_modified = self._validators.get(
+                path, (None, "", "")
+            )
+            if cached_body is not body:
+                etag = '"' + hashlib.md5(body).hexdigest() + '"'
+                last_modified = formatdate(usegmt=True)
+                self._validators[path] = (body, etag, last_modified)
+        return etag, last_modified
+
+    def start(self) -> "StandInServer":
+        self._thread = threading.Thread(
+            target=self.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=float)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--file-size",
+        type=int,
+        action="append",
+        help="serve /<size>.bin of this many bytes; may be repeated",
+    )
+    args = parser.parse_args()
+    server = StandInServer(
+        args.port, args.latency, args.bandwidth, args.error_rate, args.drop_rate
+    )
+    for size in args.file_size or [1024 * 1024]:
+        server.files[f"/{size}.bin"] = random.Random(size).randbytes(size)
+    print(f"serving {', '.join(server.files)} on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,41 @@
+# The download stack (requests, pyserde, tqdm) and the tasks are loaded only
+# by the commands which need them, so `--help`, completion and argument
+# validation stay fast. While a daemon (`daemon start`) is running, the task
+# and download commands are sent to it instead, so they load nothing at all.
+
 from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+import itertools
+import functools
+import threading
+import types
 import sys
 import json
 
+from click.shell_completion import CompletionItem
 from click_aliases import ClickAliasedGroup
-from tqdm import tqdm
 import click
 
-from dogaas.downloader import TaskManager, DownloaderTask, DuplicateTaskError, is_url
+from dogaas.bandwidth import BandwidthLimiter, parse_rate
+from dogaas.importer import FORMATS, detect_format, iter_task_entries
+from dogaas.ipc import DaemonClient, DaemonError
+from dogaas import taskindex
+
+if TYPE_CHECKING:
+    from dogaas.downloader import TaskManager
 
 THIS_SCRIPT_DIR = Path(sys.argv[0]).parent.absolute()
 TASKS_FILENAME_WITHOUT_EXT = "tasks"
 TASKS_FILE_EXT = "json"
-WHERE_TO_SAVE_TASK = THIS_SCRIPT_DIR / f"{TASKS_FILENAME_WITHOUT_EXT}.{TASKS_FILE_EXT}"
+TASKS_DB_FILE_EXT = "db"
+TASKS_JSON_FILEPATH = THIS_SCRIPT_DIR / f"{TASKS_FILENAME_WITHOUT_EXT}.{TASKS_FILE_EXT}"
+TASKS_DB_FILEPATH = (
+    THIS_SCRIPT_DIR / f"{TASKS_FILENAME_WITHOUT_EXT}.{TASKS_DB_FILE_EXT}"
+)
+FETCH_CACHE_FILEPATH = THIS_SCRIPT_DIR / "fetch_cache.json"
+MIRROR_STATS_FILEPATH = THIS_SCRIPT_DIR / "mirror_stats.json"
+METADATA_CACHE_FILEPATH = THIS_SCRIPT_DIR / "metadata_cache.json"
+DOWNLOAD_QUEUE_FILEPATH = THIS_SCRIPT_DIR / "download_queue.json"
 CONFIG_FILENAME = "config.json"
 I18N_DIRNAME = "i18n"
 
@@ -24,12 +48,148 @@ with open(
 ) as f:
     i18ntexts: dict[str, str] = json.load(f)
 
-task_manager = TaskManager()
+DAEMON_SOCKET_FILEPATH = Path(
+    config.get("daemon_socket") or THIS_SCRIPT_DIR / "dogaas.sock"
+)
+
+if config.get("task_database", "json") == "sqlite":
+    WHERE_TO_SAVE_TASK = TASKS_DB_FILEPATH
+else:
+    WHERE_TO_SAVE_TASK = TASKS_JSON_FILEPATH
+
+
+def make_bandwidth_limiter(
+    global_rate=None, per_host_rates: Optional[dict[str, float]] = None
+) -> BandwidthLimiter:
+    """Limits of `config.json`, overridden by the given ones."""
+    if global_rate is None and config.get("bandwidth_limit") is not None:
+        global_rate = parse_rate(config["bandwidth_limit"])
+    return BandwidthLimiter(
+        global_rate=global_rate,
+        per_host_rates={
+            **{
+                host: parse_rate(rate)
+                for host, rate in config.get("per_host_bandwidth_limit", {}).items()
+            },
+            **(per_host_rates or {}),
+        },
+    )
+
+
+@functools.cache
+def get_task_manager() -> "TaskManager":
+    from dogaas.cache import FetchCache
+    from dogaas.diskio import WritePolicy
+    from dogaas.downloader import TaskManager
+    from dogaas.metadata import MetadataCache
+    from dogaas.mirrors import MirrorStatsCache
+    from dogaas.store import ContentStore
+    from dogaas.transport import SessionPool
+
+    session_pool = SessionPool(
+        pool_maxsize=config.get("pool_maxsize", 10),
+        per_host_pool_maxsize=config.get("per_host_pool_maxsize"),
+    )
+    write_policy = WritePolicy(
+        buffer_size=config.get("write_buffer_size", 1024 * 1024),
+        fsync=config.get("fsync", "never"),
+        preallocate=config.get("preallocate", True),
+    )
+    content_store = None
+    if config.get("content_store"):
+        # a relative path is relative to this script, like the other files
+        content_store = ContentStore(THIS_SCRIPT_DIR / config["content_store"])
+    if WHERE_TO_SAVE_TASK == TASKS_DB_FILEPATH:
+        from dogaas.taskdb import SQLiteTaskDatabase
+
+        is_new_task_database = not TASKS_DB_FILEPATH.exists()
+        task_manager = TaskManager(
+            session_pool=session_pool,
+            task_database=SQLiteTaskDatabase(TASKS_DB_FILEPATH),
+            bandwidth_limiter=make_bandwidth_limiter(),
+            fetch_cache=FetchCache(FETCH_CACHE_FILEPATH),
+            mirror_stats=MirrorStatsCache(MIRROR_STATS_FILEPATH),
+            metadata_cache=MetadataCache(
+                METADATA_CACHE_FILEPATH, ttl=config.get("metadata_ttl", 3600)
+            ),
+            write_policy=write_policy,
+            content_store=content_store,
+        )
+        if is_new_task_database and TASKS_JSON_FILEPATH.exists():
+            count = task_manager.tasks.migrate_from_json(TASKS_JSON_FILEPATH)
+            click.echo(
+                i18ntexts["migrated_tasks"].format(
+                    count=count, src=TASKS_JSON_FILEPATH, dest=TASKS_DB_FILEPATH
+                ),
+                err=True,
+            )
+    else:
+        task_manager = TaskManager(
+            session_pool=session_pool,
+            bandwidth_limiter=make_bandwidth_limiter(),
+            fetch_cache=FetchCache(FETCH_CACHE_FILEPATH),
+            mirror_stats=MirrorStatsCache(MIRROR_STATS_FILEPATH),
+            metadata_cache=MetadataCache(
+                METADATA_CACHE_FILEPATH, ttl=config.get("metadata_ttl", 3600)
+            ),
+            write_policy=write_policy,
+            content_store=content_store,
+        )
+        try:
+            task_manager.load_tasks_from_json(WHERE_TO_SAVE_TASK)
+        except FileNotFoundError as e:
+            click.echo(e, err=True)
+    return task_manager
+
+
+@functools.cache
+def get_daemon_client() -> Optional[DaemonClient]:
+    """Client of the running daemon, or `None` to work in this process."""
+    return DaemonClient.connect(DAEMON_SOCKET_FILEPATH)
+
+
+def require_daemon_client() -> DaemonClient:
+    if (client := get_daemon_client()) is None:
+        click.echo(i18ntexts["daemon_not_running"], err=True)
+        sys.exit(1)
+    return client
+
 
-try:
-    task_manager.load_tasks_from_json(WHERE_TO_SAVE_TASK)
-except FileNotFoundError as e:
-    click.echo(e, err=True)
+def save_caches():
+    """Save what was learned from the downloads for the next ones."""
+    get_task_manager().fetch_cache.save()
+    get_task_manager().mirror_stats.save()
+    get_task_manager().metadata_cache.save()
+
+
+def save_tasks():
+    """Save tasks kept in memory; a task database writes each change itself."""
+    if WHERE_TO_SAVE_TASK == TASKS_JSON_FILEPATH:
+        get_task_manager().save_tasks_to_json(
+            THIS_SCRIPT_DIR, TASKS_FILENAME_WITHOUT_EXT
+        )
+
+
+class TaskNameType(click.ParamType):
+    """Name of a saved task, checked and completed with `dogaas.taskindex`."""
+
+    name = "task_name"
+
+    def convert(self, value, param, ctx):
+        if WHERE_TO_SAVE_TASK == TASKS_DB_FILEPATH and not TASKS_DB_FILEPATH.exists():
+            # let the first load migrate `tasks.json` into the database
+            get_task_manager()
+        if taskindex.has_task_name(WHERE_TO_SAVE_TASK, value):
+            return value
+        self.fail(
+            i18ntexts["task_for_given_taskname_not_found"] + f": {value}", param, ctx
+        )
+
+    def shell_complete(self, ctx, param, incomplete):
+        return [
+            CompletionItem(name)
+            for name in taskindex.iter_task_names(WHERE_TO_SAVE_TASK, incomplete)
+        ]
 
 
 @click.group(cls=ClickAliasedGroup)
@@ -37,8 +197,29 @@ def cli():
     pass
 
 
+class RateType(click.ParamType):
+    name = "rate"
+
+    def convert(self, value, param, ctx):
+        try:
+            return parse_rate(value)
+        except ValueError as e:
+            self.fail(str(e), param, ctx)
+
+
+class HostRateType(click.ParamType):
+    name = "host=rate"
+
+    def convert(self, value, param, ctx):
+        host, _, rate = value.partition("=")
+        try:
+            return host.strip().lower(), parse_rate(rate)
+        except ValueError as e:
+            self.fail(str(e), param, ctx)
+
+
 def is_task_exists(msg_if_not_exists=None) -> bool:
-    if len(task_manager.tasks) > 0:
+    if len(get_task_manager().tasks) > 0:
         return True
     else:
         if msg_if_not_exists:
@@ -46,32 +227,117 @@ def is_task_exists(msg_if_not_exists=None) -> bool:
         return False
 
 
-def _tasks():
+def _tasks(page=None, per_page=None, pattern=None, host=None):
     click.echo(i18ntexts["where_to_save"] + f": {str(WHERE_TO_SAVE_TASK)}")
-    if is_task_exists(msg_if_not_exists=i18ntexts["there_are_no_tasks"]):
-        [
-            click.echo(f"{i} {task_name} {task.url}")
-            for i, (task_name, task) in enumerate(task_manager.tasks.items())
-        ]
+    if client := get_daemon_client():
+
+        def query_tasks(**query):
+            return [(name, url) for name, url, _ in client.call("list_tasks", **query)]
+
+        def count_tasks(**query) -> int:
+            return client.call("count_tasks", **query)
+
+        if not count_tasks():
+            click.echo(i18ntexts["there_are_no_tasks"], err=True)
+            return
+    elif is_task_exists(msg_if_not_exists=i18ntexts["there_are_no_tasks"]):
+
+        def query_tasks(**query):
+            for task_name, task in get_task_manager().query_tasks(**query):
+                yield task_name, task.url
+
+        count_tasks = get_task_manager().count_tasks
+    else:
+        return
+    offset = (page - 1) * per_page if page and per_page else 0
+    [
+        click.echo(f"{i} {task_name} {url}")
+        for i, (task_name, url) in enumerate(
+            query_tasks(name=pattern, host=host, offset=offset, limit=per_page),
+            start=offset,
+        )
+    ]
+    if per_page:
+        count = count_tasks(name=pattern, host=host)
+        click.echo(
+            i18ntexts["page_of_pages"].format(
+                page=page or 1, pages=max(1, -(-count // per_page)), count=count
+            )
+        )
 
 
 @cli.command(aliases=["list", "ls", "show"], help=i18ntexts["help_msg_tasks"])
-def tasks():
-    _tasks()
+@click.option(
+    "--page", "-p", type=click.IntRange(min=1), help=i18ntexts["help_opt_page"]
+)
+@click.option(
+    "--per-page", type=click.IntRange(min=1), help=i18ntexts["help_opt_per_page"]
+)
+@click.option("--filter", "-F", "pattern", help=i18ntexts["help_opt_filter_tasks"])
+@click.option("--host", help=i18ntexts["help_opt_host"])
+def tasks(page, per_page, pattern, host):
+    if page and not per_page:
+        per_page = 50
+    _tasks(page, per_page, pattern, host)
+
+
+def _add_via_daemon(
+    client: DaemonClient,
+    name,
+    url,
+    priority=0,
+    checksum=None,
+    postprocess=(),
+    mirrors=(),
+):
+    try:
+        client.call(
+            "add_task",
+            name=name,
+            url=url,
+            priority=priority,
+            checksum=checksum,
+            postprocess=list(postprocess),
+            mirrors=list(mirrors),
+        )
+    except DaemonError as e:
+        if e.error_type == "DuplicateTaskError":
+            click.echo(i18ntexts["duplicate_task_name"], err=True)
+        else:
+            click.echo(i18ntexts["invalid_task"] + f": {e.message}", err=True)
+    else:
+        click.secho(i18ntexts["added_task"], fg="bright_green")
+        click.secho(i18ntexts["task_name"] + ": " + name, fg="green")
+        click.secho("URL: " + url, fg="green")
 
 
-def _add(name, url):
+def _add(name, url, priority=0, checksum=None, postprocess=(), mirrors=()):
+    if client := get_daemon_client():
+        _add_via_daemon(client, name, url, priority, checksum, postprocess, mirrors)
+        return
+    from dogaas.downloader import DownloaderTask, DuplicateTaskError, is_url
+
     if is_url(task_url := url):
-        task = DownloaderTask(task_url)
         try:
-            task_manager.add_task(name, task, raise_if_duplicate=True)
+            task = DownloaderTask(
+                task_url,
+                priority=priority,
+                checksum=checksum,
+                postprocess=list(postprocess),
+                mirrors=list(mirrors),
+            )
+        except ValueError as e:
+            click.echo(i18ntexts["invalid_task"] + f": {e}", err=True)
+            return
+        try:
+            get_task_manager().add_task(name, task, raise_if_duplicate=True)
         except DuplicateTaskError:
             click.echo(i18ntexts["duplicate_task_name"], err=True)
         else:
             click.secho(i18ntexts["added_task"], fg="bright_green")
             click.secho(i18ntexts["task_name"] + ": " + name, fg="green")
             click.secho("URL: " + task_url, fg="green")
-            task_manager.save_tasks_to_json(THIS_SCRIPT_DIR, TASKS_FILENAME_WITHOUT_EXT)
+            save_tasks()
     else:
         click.echo(i18ntexts["invalid_url"], err=True)
 
@@ -89,18 +355,122 @@ def _add(name, url):
     prompt=i18ntexts["input_dl_url"],
     help=i18ntexts["input_dl_url"],
 )
-def add(name, url):
-    _add(name, url)
+@click.option(
+    "--priority",
+    "-P",
+    type=int,
+    default=0,
+    show_default=True,
+    help=i18ntexts["help_opt_priority"],
+)
+@click.option("--checksum", help=i18ntexts["help_opt_checksum"])
+@click.option(
+    "--postprocess",
+    "-X",
+    metavar="STAGE",
+    multiple=True,
+    help=i18ntexts["help_opt_postprocess"],
+)
+@click.option(
+    "--mirror", "-M", "mirrors", multiple=True, help=i18ntexts["help_opt_mirror"]
+)
+def add(name, url, priority, checksum, postprocess, mirrors):
+    _add(name, url, priority, checksum, postprocess, mirrors)
+
+
+@cli.command("import", help=i18ntexts["help_msg_import"])
+@click.argument("file", type=click.File("r", encoding="utf-8"), default="-")
+@click.option(
+    "--format",
+    "-f",
+    "file_format",
+    type=click.Choice(("auto",) + FORMATS),
+    default="auto",
+    show_default=True,
+    help=i18ntexts["help_opt_import_format"],
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=1000,
+    show_default=True,
+    help=i18ntexts["help_opt_batch_size"],
+)
+@click.option(
+    "--allow-duplicate-urls",
+    is_flag=True,
+    help=i18ntexts["help_opt_allow_duplicate_urls"],
+)
+def import_tasks(file, file_format, batch_size, allow_duplicate_urls):
+    if file_format == "auto":
+        file_format = detect_format(file.name)
+    if client := get_daemon_client():
+        report = _import_via_daemon(
+            client,
+            iter_task_entries(file, file_format),
+            batch_size,
+            allow_duplicate_urls,
+        )
+    else:
+        report = get_task_manager().add_tasks(
+            iter_task_entries(file, file_format),
+            batch_size=batch_size,
+            skip_duplicate_urls=not allow_duplicate_urls,
+            on_batch=lambda report: click.echo(
+                i18ntexts["imported_tasks"].format(count=report.added), err=True
+            ),
+        )
+        if report.added:
+            save_tasks()
+    for name, url in report.invalid_entries:
+        click.echo(i18ntexts["invalid_url"] + f": {url}", err=True)
+    click.secho(
+        i18ntexts["import_summary"].format(
+            added=report.added,
+            duplicate_urls=report.duplicate_urls,
+            duplicate_names=report.duplicate_names,
+            invalid=len(report.invalid_entries),
+        ),
+        fg="yellow" if report.invalid_entries else "bright_green",
+    )
+
+
+def _import_via_daemon(client: DaemonClient, entries, batch_size, allow_duplicates):
+    """Send `entries` to the daemon a batch at a time; returns the total report."""
+    report = types.SimpleNamespace(
+        added=0, duplicate_urls=0, duplicate_names=0, invalid_entries=[]
+    )
+    entries = iter(entries)
+    while batch := list(itertools.islice(entries, batch_size)):
+        batch_report = client.call(
+            "add_tasks",
+            entries=batch,
+            skip_duplicate_urls=not allow_duplicates,
+        )
+        report.added += batch_report["added"]
+        report.duplicate_urls += batch_report["duplicate_urls"]
+        report.duplicate_names += batch_report["duplicate_names"]
+        report.invalid_entries += batch_report["invalid_entries"]
+        click.echo(i18ntexts["imported_tasks"].format(count=report.added), err=True)
+    return report
 
 
 def _remove(name):
+    if client := get_daemon_client():
+        try:
+            client.call("remove_task", name=name)
+        except DaemonError:
+            click.echo(i18ntexts["task_for_given_taskname_not_found"], err=True)
+        else:
+            click.secho(i18ntexts["removed_task"] + ": " + name, fg="bright_green")
+        return
     try:
-        task_manager.remove_task(name)
+        get_task_manager().remove_task(name)
     except KeyError:
         click.echo(i18ntexts["task_for_given_taskname_not_found"], err=True)
     else:
         click.secho(i18ntexts["removed_task"] + ": " + name, fg="bright_green")
-        task_manager.save_tasks_to_json(THIS_SCRIPT_DIR, TASKS_FILENAME_WITHOUT_EXT)
+        save_tasks()
 
 
 @cli.command(aliases=["rm", "del"], help=i18ntexts["help_msg_remove"])
@@ -114,36 +484,740 @@ def remove(name):
     _remove(name)
 
 
-def _download(name, dirpath_for_dest):
-    downloader = task_manager.make_downloader_from_task(name)
+def _select_task_names(names, all_tasks, patterns) -> list[str]:
+    """Names of the `--name`, `--all` and `--filter` options, or one asked."""
+    if all_tasks:
+        return get_task_manager().select_task_names()
+    if patterns:
+        return list(names) + get_task_manager().select_task_names(patterns)
+    if names:
+        return list(names)
+    return [click.prompt(i18ntexts["input_dl_task_name"], type=TaskNameType())]
+
+
+def _download(
+    name, dirpath_for_dest, segments=1, resume=True, force=False, spread_mirrors=False
+) -> bool:
+    """Download a task showing its progress, and return whether it succeeded."""
+    import requests
+    from tqdm import tqdm
+
+    from dogaas.downloader import filename_from_url
+
+    task_manager = get_task_manager()
+    filepath = Path(dirpath_for_dest).absolute() / filename_from_url(
+        task_manager.tasks[name].url
+    )
+    if not force and task_manager.link_from_store(name, filepath):
+        click.secho(i18ntexts["dl_linked_from_store"], fg="bright_green")
+        return True
+    downloader = task_manager.make_downloader_from_task(name, force=force)
+    try:
+        downloader.response.raise_for_status()
+    except requests.HTTPError as e:
+        # the error page is not saved as the file
+        downloader.response.close()
+        downloader.stats.finish(e)
+        if task_manager.on_stats:
+            task_manager.on_stats(downloader.stats)
+        save_caches()
+        click.secho(i18ntexts["dl_failed"] + f": {name} ({e})", fg="red", err=True)
+        return False
     progress_bar = tqdm(
-        total=float(downloader.get_filesize_str()),
-        unit="iB",
-        unit_scale=True,
-        mininterval=0,
-        miniters=1,
+        total=downloader.get_filesize() or None, unit="iB", unit_scale=True
+    )
+    try:
+        for event in downloader.iter_progress(
+            dirpath_for_dest,
+            segments=segments,
+            resume=resume,
+            spread_mirrors=spread_mirrors,
+        ):
+            # events carry cumulative counts while tqdm expects increments
+            progress_bar.update(event.downloaded_bytes - progress_bar.n)
+    finally:
+        progress_bar.close()
+        save_caches()
+    if downloader.skipped:
+        click.secho(i18ntexts["dl_not_modified"], fg="bright_green")
+    else:
+        click.secho(i18ntexts["dl_complete"], fg="bright_green")
+    return True
+
+
+def _run_threads_engine(
+    task_manager,
+    task_names,
+    dirpath_for_dest,
+    jobs,
+    segments,
+    resume,
+    force,
+    spread_mirrors,
+    adaptive,
+    order,
+    progress_bar,
+    progress_lock,
+    on_done,
+):
+    from dogaas.downloader import DownloadScheduler
+
+    if adaptive:
+        from dogaas.concurrency import HostConcurrencyController
+
+        # `jobs` stays the cap; each host earns its share of it
+        task_manager.concurrency = HostConcurrencyController(
+            initial_limit=min(2, jobs), max_limit=jobs
+        )
+    scheduler = DownloadScheduler(
+        task_manager,
+        jobs=jobs,
+        segments=segments,
+        resume=resume,
+        force=force,
+        spread_mirrors=spread_mirrors,
+        order=order,
+    )
+    session_pool = task_manager.session_pool
+    # keep every connection of the batch alive instead of discarding extras
+    session_pool.pool_maxsize = max(session_pool.pool_maxsize, jobs * segments)
+    session_pool.warm_up(
+        (task_manager.tasks[task_name].url for task_name in task_names),
+        connections_per_host=jobs,
+    )
+
+    def on_progress(task_name, event):
+        with progress_lock:
+            progress_bar.total = scheduler.total_bytes
+            progress_bar.update(scheduler.downloaded_bytes - progress_bar.n)
+
+    return scheduler.run(
+        dirpath_for_dest, task_names, on_progress=on_progress, on_done=on_done
+    )
+
+
+def _run_async_engine(
+    task_manager,
+    task_names,
+    dirpath_for_dest,
+    jobs,
+    force,
+    order,
+    progress_bar,
+    on_done,
+):
+    import asyncio
+    from dogaas.asyncdownloader import AsyncConnectionPool, AsyncTaskManager
+
+    # bytes done and total of each task, whose sums the bar shows
+    progress = {}
+
+    def on_progress(task_name, event):
+        done, total = progress.get(task_name, (0, 0))
+        progress[task_name] = (event.downloaded_bytes, event.total_bytes)
+        progress_bar.total += event.total_bytes - total
+        progress_bar.update(event.downloaded_bytes - done)
+
+    async def run():
+        # as many connections to a host as tasks in flight, like the threads
+        pool = AsyncConnectionPool(max_connections_per_host=jobs)
+        async with AsyncTaskManager(task_manager, pool) as async_task_manager:
+            return await async_task_manager.run(
+                dirpath_for_dest,
+                task_names,
+                concurrency=jobs,
+                force=force,
+                on_progress=on_progress,
+                on_done=on_done,
+                order=order,
+            )
+
+    return asyncio.run(run())
+
+
+def _download_tasks(
+    task_names,
+    dirpath_for_dest,
+    jobs,
+    segments=1,
+    resume=True,
+    force=False,
+    spread_mirrors=False,
+    adaptive=True,
+    engine="threads",
+    order="priority",
+):
+    from tqdm import tqdm
+
+    task_manager = get_task_manager()
+    if order != "priority":
+        # the sizes to order by; those cached by `plan` are not asked again
+        task_manager.prefetch_metadata(task_names, jobs=max(jobs, 16))
+    progress_bar = tqdm(total=0, unit="iB", unit_scale=True)
+    progress_lock = threading.Lock()
+
+    def on_done(result):
+        with progress_lock:
+            if result.skipped:
+                progress_bar.write(
+                    i18ntexts["dl_not_modified"] + f": {result.task_name}"
+                )
+            elif result.ok:
+                progress_bar.write(i18ntexts["dl_complete"] + f": {result.task_name}")
+            else:
+                progress_bar.write(
+                    i18ntexts["dl_failed"] + f": {result.task_name} ({result.error})"
+                )
+
+    try:
+        if engine == "async":
+            results = _run_async_engine(
+                task_manager,
+                task_names,
+                dirpath_for_dest,
+                jobs,
+                force,
+                order,
+                progress_bar,
+                on_done,
+            )
+        else:
+            results = _run_threads_engine(
+                task_manager,
+                task_names,
+                dirpath_for_dest,
+                jobs,
+                segments,
+                resume,
+                force,
+                spread_mirrors,
+                adaptive,
+                order,
+                progress_bar,
+                progress_lock,
+                on_done,
+            )
+    finally:
+        progress_bar.close()
+        save_caches()
+    failed = [result for result in results if not result.ok]
+    click.secho(
+        i18ntexts["dl_summary"].format(
+            succeeded=len(results) - len(failed), failed=len(failed)
+        ),
+        fg="yellow" if failed else "bright_green",
+    )
+    if failed:
+        sys.exit(1)
+
+
+# states of `dogaas.background`, which is not imported to keep clients light
+FINISHED_DOWNLOAD_STATES = ("done", "skipped", "failed", "cancelled")
+
+
+def _is_given(param_name: str) -> bool:
+    """Whether an option of the running command was given, not defaulted."""
+    return click.get_current_context().get_parameter_source(param_name) not in (
+        click.core.ParameterSource.DEFAULT,
+        click.core.ParameterSource.DEFAULT_MAP,
+    )
+
+
+def _download_via_daemon(client: DaemonClient, task_names, dirpath_for_dest, detach):
+    from tqdm import tqdm
+
+    task_names = list(dict.fromkeys(task_names))
+    client.call(
+        "download",
+        task_names=task_names,
+        dirpath_for_dest=str(Path(dirpath_for_dest).absolute()),
+    )
+    click.echo(i18ntexts["dl_queued"].format(count=len(task_names)), err=True)
+    if detach:
+        return
+    reported_task_names = set()
+    failed = []
+    progress_bar = tqdm(total=0, unit="iB", unit_scale=True)
+    try:
+        with DaemonClient(DAEMON_SOCKET_FILEPATH) as watcher:
+            for snapshot in watcher.watch(interval=0.2):
+                progresses = [snapshot[name] for name in task_names if name in snapshot]
+                progress_bar.total = sum(p["total_bytes"] for p in progresses)
+                progress_bar.update(
+                    sum(p["downloaded_bytes"] for p in progresses) - progress_bar.n
+                )
+                for progress in progresses:
+                    task_name = progress["task_name"]
+                    state = progress["state"]
+                    if (
+                        state not in FINISHED_DOWNLOAD_STATES
+                        or task_name in reported_task_names
+                    ):
+                        continue
+                    reported_task_names.add(task_name)
+                    if state == "done":
+                        progress_bar.write(i18ntexts["dl_complete"] + f": {task_name}")
+                    elif state == "skipped":
+                        progress_bar.write(
+                            i18ntexts["dl_not_modified"] + f": {task_name}"
+                        )
+                    else:
+                        failed.append(task_name)
+                        progress_bar.write(
+                            i18ntexts["dl_failed"]
+                            + f": {task_name} ({progress['error'] or state})"
+                        )
+                if all(
+                    p["state"] in (*FINISHED_DOWNLOAD_STATES, "paused")
+                    for p in progresses
+                ):
+                    break
+    except KeyboardInterrupt:
+        # the daemon keeps downloading; only watching is stopped
+        click.echo(i18ntexts["dl_continues_in_daemon"], err=True)
+        sys.exit(130)
+    finally:
+        progress_bar.close()
+    click.secho(
+        i18ntexts["dl_summary"].format(
+            succeeded=len(reported_task_names) - len(failed), failed=len(failed)
+        ),
+        fg="yellow" if failed else "bright_green",
     )
-    for progress in downloader.download(dirpath_for_dest, yield_progress=True):
-        progress_bar.update(progress)
-    progress_bar.close()
-    click.secho(i18ntexts["dl_complete"], fg="bright_green")
+    if failed:
+        sys.exit(1)
 
 
 @cli.command(aliases=["dl", "do"], help=i18ntexts["help_msg_download"])
 @click.option(
     "--name",
     "-N",
-    type=click.Choice(task_manager.tasks.keys()),
-    prompt=i18ntexts["input_dl_task_name"],
+    "names",
+    type=TaskNameType(),
+    multiple=True,
+    help=i18ntexts["input_dl_task_name"],
+)
+@click.option("--all", "-A", "all_tasks", is_flag=True, help=i18ntexts["help_opt_all"])
+@click.option(
+    "--filter", "-F", "patterns", multiple=True, help=i18ntexts["help_opt_filter"]
+)
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help=i18ntexts["help_opt_jobs"],
+)
+@click.option(
+    "--segments",
+    "-s",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help=i18ntexts["help_opt_segments"],
+)
+@click.option(
+    "--spread-mirrors", is_flag=True, help=i18ntexts["help_opt_spread_mirrors"]
+)
+@click.option(
+    "--engine",
+    type=click.Choice(["threads", "async"]),
+    default="threads",
+    show_default=True,
+    help=i18ntexts["help_opt_engine"],
 )
+@click.option(
+    "--order",
+    type=click.Choice(["priority", "largest", "smallest"]),
+    default="priority",
+    show_default=True,
+    help=i18ntexts["help_opt_order"],
+)
+@click.option(
+    "--adaptive/--no-adaptive",
+    default=True,
+    show_default=True,
+    help=i18ntexts["help_opt_adaptive"],
+)
+@click.option(
+    "--resume/--no-resume",
+    default=True,
+    show_default=True,
+    help=i18ntexts["help_opt_resume"],
+)
+@click.option("--force", is_flag=True, help=i18ntexts["help_opt_force"])
+@click.option("--limit-rate", type=RateType(), help=i18ntexts["help_opt_limit_rate"])
+@click.option(
+    "--host-limit-rate",
+    type=HostRateType(),
+    multiple=True,
+    help=i18ntexts["help_opt_host_limit_rate"],
+)
+@click.option(
+    "--stats",
+    "stats_file",
+    type=click.File("a", encoding="utf-8"),
+    help=i18ntexts["help_opt_stats"],
+)
+@click.option(
+    "--prometheus-textfile",
+    type=click.Path(dir_okay=False),
+    default=config.get("prometheus_textfile"),
+    help=i18ntexts["help_opt_prometheus_textfile"],
+)
+@click.option("--detach", is_flag=True, help=i18ntexts["help_opt_detach"])
 @click.option(
     "--dirpath-for-dest",
     "--dest",
     prompt=i18ntexts["input_destdir_for_dl"],
     type=click.Path(file_okay=False),
 )
-def download(name, dirpath_for_dest):
-    _download(name, dirpath_for_dest)
+def download(
+    names,
+    all_tasks,
+    patterns,
+    jobs,
+    segments,
+    spread_mirrors,
+    engine,
+    order,
+    adaptive,
+    resume,
+    force,
+    limit_rate,
+    host_limit_rate,
+    stats_file,
+    prometheus_textfile,
+    detach,
+    dirpath_for_dest,
+):
+    client = get_daemon_client()
+    # these options only apply to downloads made by this process; the daemon
+    # runs with the jobs and segments it was started with
+    if client and not (
+        _is_given("jobs")
+        or _is_given("segments")
+        or force
+        or spread_mirrors
+        or engine == "async"
+        or order != "priority"
+        or not adaptive
+        or not resume
+        or limit_rate is not None
+        or host_limit_rate
+        or stats_file
+        or prometheus_textfile
+    ):
+        if all_tasks:
+            task_names = client.call("select_task_names")
+        else:
+            task_names = list(names)
+            if patterns:
+                task_names += client.call("select_task_names", patterns=patterns)
+            elif not names:
+                task_names = [
+                    click.prompt(i18ntexts["input_dl_task_name"], type=TaskNameType())
+                ]
+        if not task_names:
+            click.echo(i18ntexts["there_are_no_tasks"], err=True)
+        else:
+            _download_via_daemon(client, task_names, dirpath_for_dest, detach)
+        return
+    if engine == "async" and (
+        segments > 1 or limit_rate is not None or host_limit_rate or spread_mirrors
+    ):
+        raise click.UsageError(i18ntexts["async_engine_unsupported_option"])
+    from dogaas.metrics import JSONLinesStatsWriter, PrometheusTextfileWriter
+
+    stats_hooks = []
+    if stats_file:
+        stats_hooks.append(JSONLinesStatsWriter(stats_file))
+    prometheus_writer = None
+    if prometheus_textfile:
+        prometheus_writer = PrometheusTextfileWriter(prometheus_textfile)
+        stats_hooks.append(prometheus_writer.observe)
+    if stats_hooks:
+        get_task_manager().on_stats = lambda stats: [
+            stats_hook(stats) for stats_hook in stats_hooks
+        ]
+    if limit_rate is not None or host_limit_rate:
+        get_task_manager().bandwidth_limiter = make_bandwidth_limiter(
+            limit_rate, dict(host_limit_rate)
+        )
+    task_names = _select_task_names(names, all_tasks, patterns)
+    from dogaas.postprocess import make_process_pool
+
+    # no worker is started unless a task has a CPU-bound post-processing stage
+    postprocess_executor = make_process_pool(jobs)
+    get_task_manager().postprocess_executor = postprocess_executor
+    try:
+        if not task_names:
+            click.echo(i18ntexts["there_are_no_tasks"], err=True)
+        elif len(task_names) == 1 and engine == "threads":
+            if not _download(
+                task_names[0], dirpath_for_dest, segments, resume, force, spread_mirrors
+            ):
+                sys.exit(1)
+        else:
+            _download_tasks(
+                task_names,
+                dirpath_for_dest,
+                jobs,
+                segments,
+                resume,
+                force,
+                spread_mirrors,
+                adaptive,
+                engine,
+                order,
+            )
+    finally:
+        postprocess_executor.shutdown()
+        if prometheus_writer:
+            prometheus_writer.write()
+
+
+@cli.command(help=i18ntexts["help_msg_plan"])
+@click.option(
+    "--name",
+    "-N",
+    "names",
+    type=TaskNameType(),
+    multiple=True,
+    help=i18ntexts["input_dl_task_name"],
+)
+@click.option("--all", "-A", "all_tasks", is_flag=True, help=i18ntexts["help_opt_all"])
+@click.option(
+    "--filter", "-F", "patterns", multiple=True, help=i18ntexts["help_opt_filter"]
+)
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=16,
+    show_default=True,
+    help=i18ntexts["help_opt_plan_jobs"],
+)
+@click.option(
+    "--order",
+    type=click.Choice(["priority", "largest", "smallest"]),
+    default="priority",
+    show_default=True,
+    help=i18ntexts["help_opt_order"],
+)
+@click.option("--refresh", is_flag=True, help=i18ntexts["help_opt_refresh"])
+def plan(names, all_tasks, patterns, jobs, order, refresh):
+    from tqdm import tqdm
+
+    task_manager = get_task_manager()
+    task_names = list(dict.fromkeys(_select_task_names(names, all_tasks, patterns)))
+    if not task_names:
+        click.echo(i18ntexts["there_are_no_tasks"], err=True)
+        return
+    # counts the requests sent, not the metadata still fresh in the cache
+    progress_bar = tqdm(unit="req", leave=False)
+    try:
+        download_plan = task_manager.plan(
+            task_names,
+            jobs=jobs,
+            force=refresh,
+            on_fetch=lambda url, metadata: progress_bar.update(),
+        )
+    finally:
+        progress_bar.close()
+        save_caches()
+    for task_name in task_manager.sort_task_names(task_names, order):
+        metadata = download_plan.metadata[task_name]
+        if not metadata.ok:
+            click.secho(f"{task_name} {metadata.error}", fg="red")
+            continue
+        size = (
+            "?"
+            if metadata.size is None
+            else tqdm.format_sizeof(metadata.size, "iB", 1024)
+        )
+        click.echo(
+            f"{task_name} {size} {metadata.content_type or '-'}"
+            + (" Range" if metadata.accepts_ranges else "")
+        )
+    failed_task_names = download_plan.failed_task_names
+    click.secho(
+        i18ntexts["plan_summary"].format(
+            count=len(task_names),
+            total=tqdm.format_sizeof(download_plan.total_bytes, "iB", 1024),
+            unknown=len(download_plan.unknown_size_task_names),
+            ranges=len(download_plan.range_task_names),
+            failed=len(failed_task_names),
+        ),
+        fg="yellow" if failed_task_names else "bright_green",
+    )
+    if failed_task_names:
+        sys.exit(1)
+
+
+@cli.command(help=i18ntexts["help_msg_status"])
+def status():
+    snapshot = require_daemon_client().call("status")
+    if not snapshot:
+        click.echo(i18ntexts["no_downloads"], err=True)
+    for task_name, progress in snapshot.items():
+        line = f"{task_name} {progress['state']}"
+        if progress["ratio"] is not None:
+            line += f" {progress['ratio']:.0%}"
+        if progress["state"] == "downloading":
+            line += f" {progress['bytes_per_sec'] / 1024 / 1024:.1f}MiB/s"
+        if progress["error"]:
+            line += f" ({progress['error']})"
+        click.echo(line)
+
+
+def _control_downloads(method: str, names):
+    require_daemon_client().call(method, task_names=list(names) or None)
+
+
+@cli.command(help=i18ntexts["help_msg_pause"])
+@click.argument("names", nargs=-1)
+def pause(names):
+    _control_downloads("pause", names)
+
+
+@cli.command(help=i18ntexts["help_msg_resume"])
+@click.argument("names", nargs=-1)
+def resume(names):
+    _control_downloads("resume", names)
+
+
+@cli.command(help=i18ntexts["help_msg_cancel"])
+@click.argument("names", nargs=-1)
+def cancel(names):
+    _control_downloads("cancel", names)
+
+
+@cli.group(help=i18ntexts["help_msg_daemon"])
+def daemon():
+    pass
+
+
+@daemon.command("start", help=i18ntexts["help_msg_daemon_start"])
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help=i18ntexts["help_opt_jobs"],
+)
+@click.option(
+    "--segments",
+    "-s",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help=i18ntexts["help_opt_segments"],
+)
+def daemon_start(jobs, segments):
+    import signal
+    from dogaas.daemon import DaemonAlreadyRunningError, DownloadDaemon
+
+    download_daemon = DownloadDaemon(
+        get_task_manager(),
+        DAEMON_SOCKET_FILEPATH,
+        queue_filepath=DOWNLOAD_QUEUE_FILEPATH,
+        jobs=jobs,
+        segments=segments,
+        on_tasks_change=save_tasks,
+    )
+    signal.signal(signal.SIGTERM, lambda signum, frame: download_daemon.shutdown())
+    click.echo(
+        i18ntexts["daemon_started"].format(socket=DAEMON_SOCKET_FILEPATH), err=True
+    )
+    try:
+        download_daemon.serve_forever()
+    except DaemonAlreadyRunningError:
+        click.echo(i18ntexts["daemon_already_running"], err=True)
+        sys.exit(1)
+    finally:
+        save_caches()
+
+
+@daemon.command("stop", help=i18ntexts["help_msg_daemon_stop"])
+def daemon_stop():
+    require_daemon_client().call("shutdown")
+
+
+@cli.command(help=i18ntexts["help_msg_worker"])
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help=i18ntexts["help_opt_jobs"],
+)
+@click.option(
+    "--batch-size", type=click.IntRange(min=1), help=i18ntexts["help_opt_batch_size"]
+)
+@click.option(
+    "--lease",
+    type=click.FloatRange(min=1),
+    default=60.0,
+    show_default=True,
+    help=i18ntexts["help_opt_lease"],
+)
+@click.option("--owner", help=i18ntexts["help_opt_owner"])
+@click.option("--retry-failed", is_flag=True, help=i18ntexts["help_opt_retry_failed"])
+@click.option("--no-wait", is_flag=True, help=i18ntexts["help_opt_no_wait"])
+@click.option(
+    "--dirpath-for-dest",
+    "--dest",
+    prompt=i18ntexts["input_destdir_for_dl"],
+    type=click.Path(file_okay=False),
+)
+def worker(jobs, batch_size, lease, owner, retry_failed, no_wait, dirpath_for_dest):
+    if WHERE_TO_SAVE_TASK != TASKS_DB_FILEPATH:
+        raise click.UsageError(i18ntexts["worker_needs_sqlite"])
+    import signal
+    from dogaas.downloader import DownloadScheduler
+    from dogaas.worker import Worker
+
+    task_manager = get_task_manager()
+    if retry_failed:
+        task_manager.tasks.reset_task_states(["failed"])
+    task_worker = Worker(
+        DownloadScheduler(task_manager, jobs=jobs),
+        owner=owner,
+        batch_size=batch_size,
+        lease_s=lease,
+    )
+    # the tasks being downloaded are finished, and the rest left to others
+    signal.signal(signal.SIGTERM, lambda signum, frame: task_worker.stop())
+    click.echo(i18ntexts["worker_started"].format(owner=task_worker.owner), err=True)
+
+    def on_done(result):
+        if result.ok:
+            click.echo(i18ntexts["dl_complete"] + f": {result.task_name}")
+        else:
+            click.echo(
+                i18ntexts["dl_failed"] + f": {result.task_name} ({result.error})"
+            )
+
+    try:
+        counts = task_worker.run(dirpath_for_dest, on_done=on_done, wait=not no_wait)
+    finally:
+        save_caches()
+    states = task_manager.tasks.count_task_states()
+    click.secho(
+        i18ntexts["worker_summary"].format(
+            succeeded=counts["done"],
+            failed=counts["failed"],
+            pending=states["pending"],
+            claimed=states["claimed"],
+            done=states["done"],
+            failed_in_all=states["failed"],
+        ),
+        fg="yellow" if counts["failed"] else "bright_green",
+    )
 
 
 @cli.command(help=i18ntexts["help_msg_shell"])
@@ -171,8 +1245,7 @@ def repl():
                 _tasks()
             case "download":
                 name = click.prompt(
-                    i18ntexts["input_dl_task_name"],
-                    type=click.Choice(task_manager.tasks.keys()),
+                    i18ntexts["input_dl_task_name"], type=TaskNameType()
                 )
                 dirpath_for_dest = click.prompt(
                     i18ntexts["input_destdir_for_dl"], type=click.Path(file_okay=False)
@@ -0,0 +1,888 @@
+"""An asyncio download core for workloads of many small files.
+
+A single event loop drives thousands of fetches, with no thread per
+download, over `AsyncConnectionPool`: a small HTTP/1.1 client on asyncio
+streams which keeps connections alive per host. `AsyncDownloader` and
+`AsyncTaskManager` mirror `Downloader` and `DownloadScheduler`, with the
+same `.part` files, checksums, fetch cache, retries, stats and progress
+events.
+
+What only the threaded core does (mirrors, post-processing pipelines,
+segments, resuming and bandwidth limits) is left to it: tasks with mirrors
+or post-processing are handed to a `Downloader` on a worker thread.
+"""
+
+from dataclasses import dataclass, replace
+from datetime import timedelta
+from pathlib import Path
+from typing import AsyncIterator, Callable, Iterable, Optional
+from urllib.parse import urljoin, urlsplit
+import asyncio
+import hashlib
+import socket
+import time
+import ssl
+import os
+
+from requests.structures import CaseInsensitiveDict
+import requests
+
+from .cache import FetchCache, FetchRecord
+from .checksum import parse_checksum
+from .concurrency import CircuitOpenError, parse_retry_after
+from .downloader import (
+    ChecksumMismatchError,
+    DownloadError,
+    DownloadResult,
+    DownloadScheduler,
+    ProgressEvent,
+    ProgressThrottle,
+    TaskManager,
+    filename_from_url,
+    partial_filepath,
+    partial_state_filepath,
+    share_download_result,
+)
+from .metrics import DownloadStats
+from .store import ContentStore
+from .transport import ConnectionTimings, host_of_url
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+USER_AGENT = "dogaas"
+
+
+def _open_new_part(filepath: Path):
+    """Truncate the `.part` file of `filepath`; the state of a segmented
+    download of it, left by `Downloader`, would otherwise resume over the
+    new bytes."""
+    partial_state_filepath(filepath).unlink(missing_ok=True)
+    return open(partial_filepath(filepath), "wb")
+
+
+@dataclass
+class _Connection:
+    key: tuple[str, str, int]
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+    timings: ConnectionTimings
+    requests_sent: int = 0
+
+    def close(self):
+        self.writer.close()
+
+
+def _parse_content_length(value: str, url: str) -> int:
+    """The length of a `Content-Length` header, which repeats it joined with
+    commas if sent more than once.
+
+    Raises:
+        DownloadError: the lengths are not one non-negative integer.
+    """
+    lengths = {length.strip() for length in value.split(",")}
+    if (
+        len(lengths) != 1
+        or not (length := lengths.pop()).isascii()
+        or not length.isdigit()
+    ):
+        raise DownloadError(f"malformed Content-Length {value!r} from `{url}`")
+    return int(length)
+
+
+class AsyncResponse:
+    """A response of `AsyncConnectionPool` whose body is read as a stream.
+
+    The connection goes back to the pool once the body is read to the end;
+    `aclose` must be awaited otherwise.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        status_code: int,
+        reason: str,
+        headers: CaseInsensitiveDict,
+        elapsed: timedelta,
+        connection: _Connection,
+        pool: "AsyncConnectionPool",
+        has_body: bool,
+    ):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.elapsed = elapsed
+        self.timings = (
+            ConnectionTimings(reused=True)
+            if connection.requests_sent > 1
+            else connection.timings
+        )
+        self._connection: Optional[_Connection] = connection
+        self._pool = pool
+        self._is_chunked = "chunked" in headers.get("Transfer-Encoding", "").lower()
+        self._remaining: Optional[int] = None
+        if not has_body:
+            self._remaining = 0
+        elif not self._is_chunked and "Content-Length" in headers:
+            self._remaining = _parse_content_length(headers["Content-Length"], url)
+        self._is_reusable = headers.get("Connection", "").lower() != "close" and (
+            self._is_chunked or self._remaining is not None
+        )
+        if self._remaining == 0:
+            self._release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(
+                f"{self.status_code} {self.reason} for url: {self.url}"
+            )
+
+    def _release(self):
+        if self._connection is not None:
+            self._pool._release(self._connection, self._is_reusable)
+            self._connection = None
+
+    async def aclose(self):
+        """Drop the connection unless the body was read to the end."""
+        if self._connection is not None:
+            self._is_reusable = False
+            self._release()
+
+    async def _read(self, coroutine):
+        return await asyncio.wait_for(coroutine, self._pool.timeout)
+
+    async def iter_content(self, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+        connection = self._connection
+        if connection is None:
+            return
+        reader = connection.reader
+        try:
+            if self._is_chunked:
+                while True:
+                    size_line = await self._read(reader.readline())
+                    if not size_line:
+                        raise DownloadError("connection closed in a chunk header")
+                    size = int(size_line.split(b";")[0], 16)
+                    if size == 0:
+                        # trailers end with an empty line
+                        while (await self._read(reader.readline())).strip():
+                            pass
+                        break
+                    while size > 0:
+                        chunk = await self._read(
+                            reader.readexactly(min(chunk_size, size))
+                        )
+                        size -= len(chunk)
+                        yield chunk
+                    await self._read(reader.readexactly(2))
+            elif self._remaining is not None:
+                while self._remaining > 0:
+                    chunk = await self._read(
+                        reader.read(min(chunk_size, self._remaining))
+                    )
+                    if not chunk:
+                        raise DownloadError(
+                            f"connection closed with {self._remaining} bytes"
+                            f" of `{self.url}` left"
+                        )
+                    self._remaining -= len(chunk)
+                    yield chunk
+            else:
+                while chunk := await self._read(reader.read(chunk_size)):
+                    yield chunk
+        except BaseException as e:
+            await self.aclose()
+            if isinstance(e, asyncio.IncompleteReadError):
+                raise DownloadError(
+                    f"connection closed while reading `{self.url}`"
+                ) from e
+            raise
+        self._release()
+
+    async def read(self) -> bytes:
+        return b"".join([chunk async for chunk in self.iter_content()])
+
+
+class AsyncConnectionPool:
+    """Keep-alive HTTP/1.1 connections, at most `max_connections_per_host`
+    at once to each host, for asyncio code.
+
+    `timeout` is the seconds a connection or a read may take.
+    """
+
+    def __init__(
+        self,
+        max_connections_per_host: int = 32,
+        timeout: float = 30.0,
+        max_redirects: int = 10,
+        ssl_context: Optional[ssl.SSLContext] = None,
+    ):
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self._ssl_context = ssl_context
+        self._idle: dict[tuple[str, str, int], list[_Connection]] = {}
+        self._slots: dict[tuple[str, str, int], asyncio.Semaphore] = {}
+
+    @staticmethod
+    def _key_of(url: str) -> tuple[str, str, int]:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"`{url}` is not a valid URL")
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        return parts.scheme, parts.hostname, port
+
+    async def _open(self, key: tuple[str, str, int]) -> _Connection:
+        scheme, host, port = key
+        loop = asyncio.get_running_loop()
+        started_at = time.perf_counter()
+        addresses = await asyncio.wait_for(
+            loop.getaddrinfo(host, port, type=socket.SOCK_STREAM), self.timeout
+        )
+        resolved_at = time.perf_counter()
+        error: Optional[OSError] = None
+        for family, type_, proto, _, address in addresses:
+            sock = socket.socket(family, type_, proto)
+            sock.setblocking(False)
+            try:
+                await asyncio.wait_for(loop.sock_connect(sock, address), self.timeout)
+                break
+            except OSError as e:
+                sock.close()
+                error = e
+        else:
+            raise error or OSError(f"no address of `{host}`")
+        connected_at = time.perf_counter()
+        if scheme == "https":
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    sock=sock, ssl=self._ssl_context, server_hostname=host
+                ),
+                self.timeout,
+            )
+        else:
+            reader, writer = await asyncio.open_connection(sock=sock)
+        return _Connection(
+            key,
+            reader,
+            writer,
+            ConnectionTimings(
+                reused=False,
+                dns_s=resolved_at - started_at,
+                connect_s=connected_at - resolved_at,
+                tls_s=time.perf_counter() - connected_at,
+            ),
+        )
+
+    def _release(self, connection: _Connection, is_reusable: bool):
+        if is_reusable and not connection.reader.at_eof():
+            self._idle.setdefault(connection.key, []).append(connection)
+        else:
+            connection.close()
+        self._slots[connection.key].release()
+
+    async def _send(
+        self,
+        connection: _Connection,
+        method: str,
+        url: str,
+        headers: Optional[dict[str, str]],
+    ) -> AsyncResponse:
+        scheme, host, port = connection.key
+        parts = urlsplit(url)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        default_port = 443 if scheme == "https" else 80
+        request_headers = {
+            "Host": host if port == default_port else f"{host}:{port}",
+            "User-Agent": USER_AGENT,
+            "Accept-Encoding": "identity",
+            "Connection": "keep-alive",
+        } | (headers or {})
+        lines = [f"{method} {target} HTTP/1.1"]
+        lines += [f"{name}: {value}" for name, value in request_headers.items()]
+        started_at = time.perf_counter()
+        connection.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        connection.requests_sent += 1
+        await asyncio.wait_for(connection.writer.drain(), self.timeout)
+        status_line = await asyncio.wait_for(connection.reader.readline(), self.timeout)
+        if not status_line:
+            raise ConnectionResetError(f"`{host}` closed the connection")
+        _, status, *reason = status_line.decode("latin-1").split(None, 2)
+        response_headers = CaseInsensitiveDict()
+        while True:
+            line = await asyncio.wait_for(connection.reader.readline(), self.timeout)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            name, value = name.strip(), value.strip()
+            if name in response_headers:
+                value = f"{response_headers[name]}, {value}"
+            response_headers[name] = value
+        status_code = int(status)
+        return AsyncResponse(
+            url,
+            status_code,
+            reason[0].strip() if reason else "",
+            response_headers,
+            timedelta(seconds=time.perf_counter() - started_at),
+            connection,
+            self,
+            has_body=method != "HEAD"
+            and status_code not in (204, 304)
+            and not 100 <= status_code < 200,
+        )
+
+    async def request(
+        self, method: str, url: str, headers: Optional[dict[str, str]] = None
+    ) -> AsyncResponse:
+        key = self._key_of(url)
+        slots = self._slots.setdefault(
+            key, asyncio.Semaphore(self.max_connections_per_host)
+        )
+        await slots.acquire()
+        connection = None
+        try:
+            idle = self._idle.get(key, [])
+            while idle:
+                connection = idle.pop()
+                if not connection.reader.at_eof():
+                    try:
+                        return await self._send(connection, method, url, headers)
+                    except (ConnectionError, asyncio.IncompleteReadError):
+                        # the server closed the idle connection meanwhile
+                        pass
+                connection.close()
+                connection = None
+            connection = await self._open(key)
+            return await self._send(connection, method, url, headers)
+        except BaseException:
+            if connection is not None:
+                connection.close()
+            slots.release()
+            raise
+
+    async def get(
+        self, url: str, headers: Optional[dict[str, str]] = None
+    ) -> AsyncResponse:
+        """Send `GET`, following redirects; the response is `url`'s last."""
+        for _ in range(self.max_redirects + 1):
+            response = await self.request("GET", url, headers)
+            location = response.headers.get("Location")
+            if response.status_code not in REDIRECT_STATUSES or not location:
+                return response
+            await response.aclose()
+            url = urljoin(url, location)
+        raise DownloadError(f"more than {self.max_redirects} redirects")
+
+    async def aclose(self):
+        for connections in self._idle.values():
+            for connection in connections:
+                connection.close()
+        self._idle.clear()
+
+
+class AsyncDownloader:
+    """`Downloader` for asyncio: a single stream into a `.part` file.
+
+    Small files are fetched again whole rather than resumed, so no
+    `.part.json` sidecar is kept.
+    """
+
+    def __init__(
+        self,
+        response: AsyncResponse,
+        pool: AsyncConnectionPool,
+        fetch_cache: Optional[FetchCache] = None,
+        fetch_cache_key: Optional[str] = None,
+        fetch_record: Optional[FetchRecord] = None,
+        checksum: Optional[str] = None,
+        stats: Optional[DownloadStats] = None,
+        on_stats: Optional[Callable[[DownloadStats], None]] = None,
+        filename: Optional[str] = None,
+        content_store: Optional[ContentStore] = None,
+    ):
+        """
+        Args:
+            response (AsyncResponse): response of the content, unread.
+            pool (AsyncConnectionPool): makes the request again if `response`
+                is `304 Not Modified` for a file which is not there.
+            See `Downloader` for the others.
+        """
+        self._response = response
+        self._pool = pool
+        self._fetch_cache = fetch_cache
+        self._fetch_cache_key = fetch_cache_key or response.url
+        self._fetch_record = fetch_record
+        self.checksum = checksum
+        self._filename = filename
+        self._content_store = content_store
+        self.skipped = False
+        self.stats = stats if stats is not None else DownloadStats(response.url)
+        self.stats.record_response(response)
+        self._on_stats = on_stats
+
+    @property
+    def response(self) -> AsyncResponse:
+        return self._response
+
+    def get_filesize(self) -> int:
+        if self.is_not_modified():
+            return self._fetch_record.size
+        if "Content-Length" not in self.response.headers:
+            return 0
+        return _parse_content_length(
+            self.response.headers["Content-Length"], self.response.url
+        )
+
+    def is_not_modified(self) -> bool:
+        return self._fetch_record is not None and self.response.status_code == 304
+
+    def dest_filepath(self, dirpath_for_dest: Path | str) -> Path:
+        if self.is_not_modified() and not self._filename:
+            return (
+                Path(dirpath_for_dest).absolute()
+                / Path(self._fetch_record.filepath).name
+            )
+        return Path(dirpath_for_dest).absolute() / (
+            self._filename or filename_from_url(self.response.url)
+        )
+
+    async def download(
+        self, dirpath_for_dest: Path | str, chunk_size: int = 64 * 1024
+    ) -> AsyncIterator[int]:
+        """Write the content into `dirpath_for_dest`, yielding the bytes
+        written so far, like `Downloader.download`."""
+        error = None
+        try:
+            async for progress in self._download(dirpath_for_dest, chunk_size):
+                yield progress
+        except GeneratorExit:
+            error = DownloadError("interrupted")
+            raise
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            await self.response.aclose()
+            self.stats.skipped = self.skipped
+            self.stats.finish(error)
+            if self._on_stats:
+                self._on_stats(self.stats)
+
+    def _link_not_modified(self, filepath: Path) -> bool:
+        """See `Downloader._link_not_modified`."""
+        record = self._fetch_record
+        if self._content_store is None or not record.digest:
+            return False
+        if not self._content_store.link(record.digest, filepath, record.size):
+            return False
+        if self._fetch_cache is not None:
+            self._fetch_cache.record(
+                self._fetch_cache_key, replace(record, filepath=str(filepath))
+            )
+        return True
+
+    async def _download(
+        self, dirpath_for_dest: Path | str, chunk_size: int
+    ) -> AsyncIterator[int]:
+        if self.is_not_modified():
+            filepath = self.dest_filepath(dirpath_for_dest)
+            if (
+                Path(self._fetch_record.filepath) == filepath
+                and self._fetch_record.is_intact()
+            ) or self._link_not_modified(filepath):
+                self.skipped = True
+                yield self._fetch_record.size
+                return
+            await self.response.aclose()
+            self._fetch_record = None
+            self._response = await self._pool.get(self._fetch_cache_key)
+            self.stats.add(retries=1)
+            self.stats.record_response(self._response)
+        filepath = self.dest_filepath(dirpath_for_dest)
+        part_filepath = partial_filepath(filepath)
+        hasher = None
+        algorithm = expected_hexdigest = None
+        if self.checksum:
+            algorithm, expected_hexdigest = parse_checksum(self.checksum)
+        elif self._content_store is not None:
+            algorithm = "sha256"
+        if algorithm:
+            hasher = hashlib.new(algorithm)
+        downloaded_bytes = 0
+        read_s = write_s = 0.0
+        # the file is opened and written off the event loop, so a slow disk
+        # stalls this download only; a chunk is written while the next is read
+        file = await asyncio.to_thread(_open_new_part, filepath)
+        writing: Optional[asyncio.Future] = None
+        try:
+            chunks = aiter(self.response.iter_content(chunk_size))
+            while True:
+                started_at = time.perf_counter()
+                try:
+                    chunk = await anext(chunks)
+                except StopAsyncIteration:
+                    break
+                finally:
+                    read_s += time.perf_counter() - started_at
+                started_at = time.perf_counter()
+                if writing:
+                    await writing
+                writing = asyncio.create_task(asyncio.to_thread(file.write, chunk))
+                write_s += time.perf_counter() - started_at
+                if hasher:
+                    hasher.update(chunk)
+                downloaded_bytes += len(chunk)
+                yield downloaded_bytes
+            if writing:
+                started_at = time.perf_counter()
+                await writing
+                write_s += time.perf_counter() - started_at
+        finally:
+            if writing:
+                # the file is not closed under a write still running
+                await asyncio.gather(writing, return_exceptions=True)
+            await asyncio.to_thread(file.close)
+            self.stats.add(
+                read_s=read_s, write_s=write_s, downloaded_bytes=downloaded_bytes
+            )
+        digest = None
+        if hasher:
+            hexdigest = hasher.hexdigest()
+            if expected_hexdigest and hexdigest != expected_hexdigest:
+                part_filepath.unlink(missing_ok=True)
+                raise ChecksumMismatchError(
+                    f"{algorithm} of `{self.response.url}` is {hexdigest}"
+                    f" but {expected_hexdigest} is expected"
+                )
+            digest = f"{algorithm}:{hexdigest}"
+        os.replace(part_filepath, filepath)
+        if self._content_store is not None:
+            self._content_store.add(filepath, digest)
+        if self._fetch_cache is not None:
+            self._fetch_cache.record(
+                self._fetch_cache_key,
+                FetchRecord(
+                    filepath=str(filepath),
+                    size=downloaded_bytes,
+                    etag=self.response.headers.get("ETag"),
+                    last_modified=self.response.headers.get("Last-Modified"),
+                    digest=digest,
+                ),
+            )
+
+    async def iter_progress(
+        self,
+        dirpath_for_dest: Path | str,
+        interval: Optional[float] = 0.1,
+        min_bytes: Optional[int] = None,
+        **download_kwargs,
+    ) -> AsyncIterator[ProgressEvent]:
+        """Like `Downloader.iter_progress`; the last event has `done` set."""
+        throttle = ProgressThrottle(self.get_filesize(), interval, min_bytes)
+        progress = 0
+        async for progress in self.download(dirpath_for_dest, **download_kwargs):
+            if event := throttle.update(progress):
+                yield event
+        yield throttle.finish(progress)
+
+
+class AsyncTaskManager:
+    """Download the tasks of a `TaskManager` from one event loop.
+
+    The requests follow the `retry_policy` and `circuit_breaker` of the task
+    manager, and the downloads feed its `fetch_cache` and `on_stats`.
+    """
+
+    def __init__(
+        self, task_manager: TaskManager, pool: Optional[AsyncConnectionPool] = None
+    ):
+        """
+        Args:
+            pool (AsyncConnectionPool): a new one if not given, which
+                `aclose` closes.
+        """
+        self.task_manager = task_manager
+        self.pool = pool if pool is not None else AsyncConnectionPool()
+        # results of the transfers running, by `TaskManager.content_key`
+        self._flights: dict[tuple, asyncio.Future] = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.pool.aclose()
+
+    @property
+    def tasks(self):
+        return self.task_manager.tasks
+
+    async def make_downloader_from_task(
+        self, task_name: str, force: bool = False, filename: Optional[str] = None
+    ) -> AsyncDownloader:
+        """Request the content of a task like
+        `TaskManager.make_downloader_from_task`, retrying failed requests."""
+        task = self.tasks[task_name]
+        stats = DownloadStats(task.url, task_name=task_name)
+        fetch_cache = self.task_manager.fetch_cache
+        fetch_record = None
+        if fetch_cache is not None and not force:
+            fetch_record = fetch_cache.get(task.url)
+            if fetch_record is not None and not fetch_record.is_intact():
+                fetch_record = None
+        headers = fetch_record.conditional_headers() if fetch_record else None
+        try:
+            response = await self._request(task.url, headers, stats)
+        except Exception as e:
+            stats.finish(e)
+            if self.task_manager.on_stats:
+                self.task_manager.on_stats(stats)
+            raise
+        return AsyncDownloader(
+            response,
+            self.pool,
+            fetch_cache=fetch_cache,
+            fetch_cache_key=task.url,
+            fetch_record=fetch_record,
+            checksum=task.checksum,
+            stats=stats,
+            on_stats=self.task_manager.on_stats,
+            filename=filename,
+            content_store=self.task_manager.content_store,
+        )
+
+    async def _request(
+        self, url: str, headers: Optional[dict[str, str]], stats: DownloadStats
+    ) -> AsyncResponse:
+        policy = self.task_manager.retry_policy
+        circuit_breaker = self.task_manager.circuit_breaker
+        host = host_of_url(url)
+        retry_after = None
+        for attempt in range(policy.max_attempts):
+            if attempt:
+                stats.add(retries=1)
+                await asyncio.sleep(policy.delay(attempt - 1, retry_after))
+            if not circuit_breaker.allow(host):
+                raise CircuitOpenError(
+                    f"requests to {host} are paused after repeated failures"
+                )
+            is_last_attempt = attempt == policy.max_attempts - 1
+            try:
+                response = await self.pool.get(url, headers)
+            except (OSError, asyncio.TimeoutError, DownloadError):
+                circuit_breaker.record_failure(host)
+                if is_last_attempt:
+                    raise
+                continue
+            if not policy.is_retryable_status(response.status_code):
+                circuit_breaker.record_success(host)
+                return response
+            circuit_breaker.record_failure(host)
+            if is_last_attempt:
+                return response
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            await response.aclose()
+
+    async def _run_task(
+        self,
+        task_name: str,
+        dirpath_for_dest: Path | str,
+        chunk_size: int,
+        progress_interval: Optional[float],
+        force: bool,
+        on_progress: Optional[Callable[[str, ProgressEvent], None]],
+        filename: Optional[str] = None,
+    ) -> DownloadResult:
+        """Like `DownloadScheduler._run_task`: a task of the same content
+        being downloaded already, from another `run` too, shares that
+        transfer."""
+        task = self.tasks[task_name]
+        if task.mirrors or task.postprocess:
+            return await self._run_threaded(
+                task_name,
+                dirpath_for_dest,
+                chunk_size,
+                progress_interval,
+                force,
+                on_progress,
+                filename,
+            )
+        filepath = Path(dirpath_for_dest).absolute() / (
+            filename or filename_from_url(task.url)
+        )
+        if not force and self.task_manager.link_from_store(task_name, filepath):
+            return DownloadResult(
+                task_name, filepath, filepath.stat().st_size, skipped=True
+            )
+        key = self.task_manager.content_key(task_name)
+        if (flight := self._flights.get(key)) is not None:
+            leader = await asyncio.shield(flight)
+            return share_download_result(leader, task_name, dirpath_for_dest, filename)
+        flight = self._flights[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await self._transfer(
+                task_name,
+                dirpath_for_dest,
+                chunk_size,
+                progress_interval,
+                force,
+                on_progress,
+                filename,
+            )
+        except BaseException:
+            flight.cancel()
+            raise
+        else:
+            flight.set_result(result)
+        finally:
+            del self._flights[key]
+        return result
+
+    async def _transfer(
+        self,
+        task_name: str,
+        dirpath_for_dest: Path | str,
+        chunk_size: int,
+        progress_interval: Optional[float],
+        force: bool,
+        on_progress: Optional[Callable[[str, ProgressEvent], None]],
+        filename: Optional[str] = None,
+    ) -> DownloadResult:
+        result = DownloadResult(task_name)
+        try:
+            downloader = await self.make_downloader_from_task(
+                task_name, force, filename
+            )
+            result.stats = downloader.stats
+            try:
+                downloader.response.raise_for_status()
+            except requests.HTTPError as e:
+                await downloader.response.aclose()
+                downloader.stats.finish(e)
+                if self.task_manager.on_stats:
+                    self.task_manager.on_stats(downloader.stats)
+                raise
+            result.filepath = downloader.dest_filepath(dirpath_for_dest)
+            async for event in downloader.iter_progress(
+                dirpath_for_dest, interval=progress_interval, chunk_size=chunk_size
+            ):
+                result.downloaded_bytes = event.downloaded_bytes
+                if on_progress:
+                    on_progress(task_name, event)
+            result.skipped = downloader.skipped
+        except Exception as e:
+            result.error = e
+        return result
+
+    async def _run_threaded(
+        self,
+        task_name: str,
+        dirpath_for_dest: Path | str,
+        chunk_size: int,
+        progress_interval: Optional[float],
+        force: bool,
+        on_progress: Optional[Callable[[str, ProgressEvent], None]],
+        filename: Optional[str] = None,
+    ) -> DownloadResult:
+        """Download a task with what only `Downloader` does on a thread."""
+        loop = asyncio.get_running_loop()
+        scheduler = DownloadScheduler(
+            self.task_manager,
+            jobs=1,
+            chunk_size=chunk_size,
+            progress_interval=progress_interval,
+            force=force,
+        )
+
+        def on_thread_progress(task_name: str, event: ProgressEvent):
+            if on_progress:
+                loop.call_soon_threadsafe(on_progress, task_name, event)
+
+        return await asyncio.to_thread(
+            scheduler._run_task,
+            task_name,
+            dirpath_for_dest,
+            on_thread_progress,
+            filename,
+        )
+
+    async def run(
+        self,
+        dirpath_for_dest: Path | str,
+        task_names: Optional[Iterable[str]] = None,
+        concurrency: int = 256,
+        chunk_size: int = 64 * 1024,
+        progress_interval: Optional[float] = 0.1,
+        force: bool = False,
+        on_progress: Optional[Callable[[str, ProgressEvent], None]] = None,
+        on_done: Optional[Callable[[DownloadResult], None]] = None,
+        order: str = "priority",
+    ) -> list[DownloadResult]:
+        """Download `task_names` (all tasks if `None`) with up to
+        `concurrency` at once, urgent ones first, like `DownloadScheduler.run`.
+        `order` is that of `TaskManager.sort_task_names`.
+
+        `on_progress` and `on_done` are called on the event loop.
+
+        Returns:
+            list[DownloadResult]: results in the order of `task_names`.
+        """
+        if concurrency < 1:
+            raise ValueError("`concurrency` must be 1 or more")
+        if task_names is None:
+            task_names = self.task_manager.select_task_names()
+        task_names = list(dict.fromkeys(task_names))
+        for task_name in task_names:
+            if task_name not in self.tasks:
+                raise KeyError(task_name)
+        filenames = self.task_manager.dest_filenames(task_names, dirpath_for_dest)
+        followers = self.task_manager.group_same_content(
+            self.task_manager.sort_task_names(task_names, order)
+        )
+        # workers take the names from the end
+        pending = list(followers)[::-1]
+        results: dict[str, DownloadResult] = {}
+
+        async def work():
+            while pending:
+                task_name = pending.pop()
+                leader = await self._run_task(
+                    task_name,
+                    dirpath_for_dest,
+                    chunk_size,
+                    progress_interval,
+                    force,
+                    on_progress,
+                    filenames.get(task_name),
+                )
+                for task_name in [task_name, *followers[task_name]]:
+                    result = leader
+                    if task_name != leader.task_name:
+                        result = share_download_result(
+                            leader,
+                            task_name,
+                            dirpath_for_dest,
+                            filenames.get(task_name),
+                        )
+                    results[task_name] = result
+                    if on_done:
+                        on_done(result)
+
+        await asyncio.gather(*(work() for _ in range(min(concurrency, len(pending)))))
+        return [results[task_name] for task_name in task_names]
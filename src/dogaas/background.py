@@ -0,0 +1,296 @@
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+import threading
+import queue
+import time
+
+import requests
+
+from .downloader import Downloader, TaskManager
+
+QUEUED = "queued"
+DOWNLOADING = "downloading"
+PAUSED = "paused"
+CANCELLED = "cancelled"
+DONE = "done"
+SKIPPED = "skipped"
+FAILED = "failed"
+FINISHED_STATES = (CANCELLED, DONE, SKIPPED, FAILED)
+
+
+@dataclass
+class TaskProgress:
+    task_name: str
+    state: str = QUEUED
+    downloaded_bytes: int = 0
+    total_bytes: int = 0
+    bytes_per_sec: float = 0.0
+    error: Optional[Exception] = None
+    dirpath_for_dest: Optional[str] = None
+
+    @property
+    def ratio(self) -> Optional[float]:
+        if self.total_bytes <= 0:
+            return None
+        return min(1.0, self.downloaded_bytes / self.total_bytes)
+
+
+class BackgroundDownloadManager:
+    """Download tasks on worker threads while a UI keeps running.
+
+    Progress is collected from the workers and handed to `on_update` as one
+    snapshot at most every `update_interval` seconds, so the UI can redraw
+    everything with a single update however many tasks are running.
+
+    Pausing a running task stops its transfer and keeps the `.part` file,
+    which `resume` continues with a range request; cancelling stops it for
+    good, also keeping the `.part` file for a later download.
+    """
+
+    def __init__(
+        self,
+        task_manager: TaskManager,
+        dirpath_for_dest: Optional[Path | str] = None,
+        jobs: int = 4,
+        segments: int = 1,
+        on_update: Optional[Callable[[dict[str, TaskProgress]], None]] = None,
+        update_interval: float = 0.25,
+    ):
+        """
+        Args:
+            dirpath_for_dest (Path | str): where tasks are downloaded unless
+                `enqueue` is given another directory.
+            on_update (Callable[[dict[str, TaskProgress]], None]): called
+                from a helper thread with copies of the progress of every
+                task enqueued so far, keyed by task name.
+            update_interval (float): seconds between `on_update` calls.
+        """
+        if jobs < 1:
+            raise ValueError("`jobs` must be 1 or more")
+        self.task_manager = task_manager
+        self.dirpath_for_dest = dirpath_for_dest
+        self.segments = segments
+        self.on_update = on_update
+        self.update_interval = update_interval
+        self._lock = threading.Lock()
+        self._progress: dict[str, TaskProgress] = {}
+        # the state a running task is asked to stop with
+        self._stop_requests: dict[str, str] = {}
+        # of the running tasks, to abort a transfer asked to stop
+        self._downloaders: dict[str, Downloader] = {}
+        self._queue: queue.Queue[Optional[str]] = queue.Queue()
+        self._changed = threading.Event()
+        self._closed = threading.Event()
+        self._workers = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(jobs)
+        ]
+        self._notifier = threading.Thread(target=self._notify, daemon=True)
+        for thread in (*self._workers, self._notifier):
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def snapshot(self) -> dict[str, TaskProgress]:
+        with self._lock:
+            return {
+                task_name: replace(progress)
+                for task_name, progress in self._progress.items()
+            }
+
+    def _set(self, task_name: str, **changes):
+        with self._lock:
+            progress = self._progress[task_name]
+            for name, value in changes.items():
+                setattr(progress, name, value)
+        self._changed.set()
+
+    def enqueue(
+        self,
+        task_names: Iterable[str],
+        dirpath_for_dest: Optional[Path | str] = None,
+        paused: bool = False,
+    ):
+        """Queue tasks which are not queued or running already.
+
+        With `paused`, the tasks are only registered as paused, waiting for
+        `resume`.
+        """
+        dirpath_for_dest = dirpath_for_dest or self.dirpath_for_dest
+        if dirpath_for_dest is None:
+            raise ValueError("`dirpath_for_dest` is not given")
+        for task_name in task_names:
+            if task_name not in self.task_manager.tasks:
+                raise KeyError(task_name)
+            with self._lock:
+                progress = self._progress.get(task_name)
+                if progress is not None and progress.state in (QUEUED, DOWNLOADING):
+                    continue
+                self._progress[task_name] = TaskProgress(
+                    task_name,
+                    state=PAUSED if paused else QUEUED,
+                    dirpath_for_dest=str(dirpath_for_dest),
+                )
+            if not paused:
+                self._queue.put(task_name)
+        self._changed.set()
+
+    def _select(self, task_names: Optional[Iterable[str]]) -> list[str]:
+        with self._lock:
+            if task_names is None:
+                return list(self._progress)
+            return [name for name in task_names if name in self._progress]
+
+    def _stop(self, task_names: Optional[Iterable[str]], state: str):
+        for task_name in self._select(task_names):
+            with self._lock:
+                progress = self._progress[task_name]
+                if progress.state == QUEUED:
+                    # the worker skips it when it comes out of the queue
+                    progress.state = state
+                elif progress.state == DOWNLOADING:
+                    self._stop_requests[task_name] = state
+                    self._abort(task_name)
+                elif progress.state == PAUSED and state == CANCELLED:
+                    progress.state = state
+        self._changed.set()
+
+    def pause(self, task_names: Optional[Iterable[str]] = None):
+        """Pause `task_names`, or every task if `None`."""
+        self._stop(task_names, PAUSED)
+
+    def cancel(self, task_names: Optional[Iterable[str]] = None):
+        """Cancel `task_names`, or every task if `None`."""
+        self._stop(task_names, CANCELLED)
+
+    def resume(self, task_names: Optional[Iterable[str]] = None):
+        """Queue paused `task_names` again, or every paused task if `None`."""
+        for task_name in self._select(task_names):
+            with self._lock:
+                progress = self._progress[task_name]
+                if progress.state != PAUSED:
+                    continue
+                progress.state = QUEUED
+            self._queue.put(task_name)
+        self._changed.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until no task is queued or running; `False` on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if all(
+                    progress.state in (*FINISHED_STATES, PAUSED)
+                    for progress in self._progress.values()
+                ):
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+
+    def close(self, cancel: bool = True):
+        """Stop the threads.
+
+        With `cancel`, every task is cancelled; otherwise running tasks are
+        stopped and left queued with the others, for example to be saved
+        and continued later.
+        """
+        if cancel:
+            self.cancel()
+        else:
+            with self._lock:
+                for task_name, progress in self._progress.items():
+                    if progress.state == DOWNLOADING:
+                        self._stop_requests.setdefault(task_name, QUEUED)
+                        self._abort(task_name)
+        self._closed.set()
+        for _ in self._workers:
+            self._queue.put(None)
+        for thread in (*self._workers, self._notifier):
+            thread.join()
+
+    def _work(self):
+        while (task_name := self._queue.get()) is not None:
+            with self._lock:
+                progress = self._progress[task_name]
+                if progress.state != QUEUED or self._closed.is_set():
+                    continue
+                progress.state = DOWNLOADING
+                self._stop_requests.pop(task_name, None)
+            self._changed.set()
+            self._download(task_name, progress.dirpath_for_dest)
+
+    def _abort(self, task_name: str):
+        """Stop the transfer of `task_name` now, rather than when its next
+        bytes come, which a stalled one may wait for until its socket times
+        out. Called with `_lock` held."""
+        if downloader := self._downloaders.get(task_name):
+            downloader.abort()
+
+    def _download(self, task_name: str, dirpath_for_dest: str):
+        try:
+            downloader = self.task_manager.make_downloader_from_task(task_name)
+            with self._lock:
+                self._downloaders[task_name] = downloader
+                if task_name in self._stop_requests:
+                    # asked to stop while the request was made
+                    downloader.abort()
+            try:
+                downloader.response.raise_for_status()
+            except requests.HTTPError as e:
+                # `iter_progress` is not reached to report the stats
+                downloader.response.close()
+                downloader.stats.finish(e)
+                if self.task_manager.on_stats:
+                    self.task_manager.on_stats(downloader.stats)
+                raise
+            progresses = downloader.iter_progress(
+                dirpath_for_dest,
+                interval=self.update_interval,
+                segments=self.segments,
+            )
+            try:
+                for event in progresses:
+                    self._set(
+                        task_name,
+                        downloaded_bytes=event.downloaded_bytes,
+                        total_bytes=event.total_bytes,
+                        bytes_per_sec=event.bytes_per_sec,
+                    )
+                    with self._lock:
+                        stop_state = self._stop_requests.pop(task_name, None)
+                    if stop_state is not None:
+                        self._set(task_name, state=stop_state, bytes_per_sec=0.0)
+                        return
+            finally:
+                progresses.close()
+            self._set(task_name, state=SKIPPED if downloader.skipped else DONE)
+        except Exception as e:
+            with self._lock:
+                stop_state = self._stop_requests.pop(task_name, None)
+            if stop_state is not None:
+                # the error of the transfer aborted by the request
+                self._set(task_name, state=stop_state, bytes_per_sec=0.0)
+            else:
+                self._set(task_name, state=FAILED, error=e, bytes_per_sec=0.0)
+        finally:
+            with self._lock:
+                self._downloaders.pop(task_name, None)
+
+    def _notify(self):
+        updated_at = 0.0
+        while not self._closed.is_set():
+            if not self._changed.wait(timeout=0.1):
+                continue
+            if (wait_s := updated_at + self.update_interval - time.monotonic()) > 0:
+                time.sleep(wait_s)
+            self._changed.clear()
+            updated_at = time.monotonic()
+            if self.on_update:
+                self.on_update(self.snapshot())
+        if self.on_update:
+            self.on_update(self.snapshot())
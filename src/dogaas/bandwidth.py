@@ -0,0 +1,136 @@
+from typing import Callable, Optional
+import itertools
+import threading
+import heapq
+import time
+import re
+
+RATE_UNITS = {"": 1, "k": 1024, "m": 1024**2, "g": 1024**3}
+
+
+def parse_rate(rate: str | int | float) -> float:
+    """Parse bytes per second such as `500K`, `1.5M` or `2MB`."""
+    if isinstance(rate, (int, float)):
+        return float(rate)
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?(?:/s)?\s*", rate, re.I)
+    if not match:
+        raise ValueError(f"`{rate}` is not a valid rate")
+    return float(match[1]) * RATE_UNITS[match[2].lower()]
+
+
+class TokenBucket:
+    """Tokens are bytes, refilled at `rate` per second up to `burst`.
+
+    A chunk larger than the tokens left may be taken while any token is
+    left, putting the bucket into debt, so chunks larger than `burst` still
+    pass at the right average rate.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if rate <= 0:
+            raise ValueError("`rate` must be positive")
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self._clock = clock
+        self._tokens = self.burst
+        self._updated_at = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    def seconds_until_available(self) -> float:
+        self._refill()
+        return 0.0 if self._tokens > 0 else -self._tokens / self.rate
+
+    def take(self, nbytes: int):
+        self._refill()
+        self._tokens -= nbytes
+
+
+class BandwidthLimiter:
+    """Share bandwidth between downloads with a global cap and per-host caps.
+
+    `acquire` blocks the download loop until the bytes it has just read fit
+    the caps. While a download with a higher priority is waiting, downloads
+    with a lower priority wait behind it.
+    """
+
+    def __init__(
+        self,
+        global_rate: Optional[float] = None,
+        per_host_rates: Optional[dict[str, float]] = None,
+        default_host_rate: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            global_rate (float): bytes per second for all downloads together.
+            per_host_rates (dict[str, float]): bytes per second by hostname.
+            default_host_rate (float): bytes per second for each other host.
+        """
+        self._clock = clock
+        self._global_bucket = (
+            TokenBucket(global_rate, clock=clock) if global_rate else None
+        )
+        self.per_host_rates = {
+            host.lower(): rate for host, rate in (per_host_rates or {}).items()
+        }
+        self.default_host_rate = default_host_rate
+        self._host_buckets: dict[str, Optional[TokenBucket]] = {}
+        self._condition = threading.Condition()
+        self._waiters: list[tuple[int, int]] = []
+        self._sequence = itertools.count()
+
+    @property
+    def is_limited(self) -> bool:
+        return bool(
+            self._global_bucket or self.per_host_rates or self.default_host_rate
+        )
+
+    def _host_bucket(self, host: str) -> Optional[TokenBucket]:
+        host = host.lower()
+        if host not in self._host_buckets:
+            rate = self.per_host_rates.get(host, self.default_host_rate)
+            self._host_buckets[host] = (
+                TokenBucket(rate, clock=self._clock) if rate else None
+            )
+        return self._host_buckets[host]
+
+    def acquire(self, host: str, nbytes: int, priority: int = 0):
+        if not self.is_limited:
+            return
+        with self._condition:
+            buckets = [
+                bucket
+                for bucket in (self._global_bucket, self._host_bucket(host))
+                if bucket is not None
+            ]
+            if not buckets:
+                return
+            waiter = (-priority, next(self._sequence))
+            heapq.heappush(self._waiters, waiter)
+            try:
+                while True:
+                    timeout = None
+                    if -self._waiters[0][0] <= priority:
+                        timeout = max(
+                            bucket.seconds_until_available() for bucket in buckets
+                        )
+                        if timeout <= 0:
+                            for bucket in buckets:
+                                bucket.take(nbytes)
+                            return
+                    self._condition.wait(timeout)
+            finally:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
@@ -0,0 +1,88 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+import threading
+import os
+
+from serde import serialize, deserialize, SerdeError
+from serde.json import from_json, to_json
+
+
+@deserialize
+@serialize
+@dataclass
+class FetchRecord:
+    """What a finished download left behind, to revalidate it later."""
+
+    filepath: str
+    size: int = 0
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # `algorithm:hexdigest` of the content, by which `ContentStore` has it
+    digest: Optional[str] = None
+
+    def is_intact(self) -> bool:
+        """Whether the downloaded file is still there with the same size."""
+        try:
+            return os.stat(self.filepath).st_size == self.size
+        except OSError:
+            return False
+
+    def conditional_headers(self) -> dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class FetchCache:
+    """`FetchRecord`s by URL, kept in a JSON file if `filepath` is given."""
+
+    def __init__(self, filepath: Optional[Path | str] = None):
+        self.filepath = Path(filepath) if filepath is not None else None
+        self._records: dict[str, FetchRecord] = {}
+        self._lock = threading.Lock()
+        self._is_dirty = False
+        if self.filepath is not None and self.filepath.exists():
+            try:
+                with open(self.filepath, encoding="utf-8") as f:
+                    self._records = from_json(dict[str, FetchRecord], f.read())
+            except (ValueError, SerdeError):
+                # a broken cache only costs full downloads
+                self._records = {}
+
+    def get(self, url: str) -> Optional[FetchRecord]:
+        with self._lock:
+            return self._records.get(url)
+
+    def record(self, url: str, record: FetchRecord):
+        with self._lock:
+            self._records[url] = record
+            self._is_dirty = True
+
+    def urls_by_filepath(self) -> dict[str, str]:
+        """The URL whose download was recorded at each file path."""
+        with self._lock:
+            return {record.filepath: url for url, record in self._records.items()}
+
+    def forget(self, url: str):
+        with self._lock:
+            if self._records.pop(url, None) is not None:
+                self._is_dirty = True
+
+    def save(self):
+        if self.filepath is None:
+            return
+        with self._lock:
+            if not self._is_dirty:
+                return
+            # of this process, so workers saving at the same time do not mix files
+            tmp_filepath = self.filepath.with_name(
+                f"{self.filepath.name}.{os.getpid()}.tmp"
+            )
+            with open(tmp_filepath, "w", encoding="utf-8") as f:
+                f.write(to_json(self._records))
+            os.replace(tmp_filepath, self.filepath)
+            self._is_dirty = False
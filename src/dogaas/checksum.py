@@ -0,0 +1,69 @@
+from pathlib import Path
+from typing import Optional
+import threading
+import hashlib
+import queue
+
+ALGORITHMS = {"sha256": 64, "sha1": 40, "md5": 32}
+
+
+def parse_checksum(checksum: str) -> tuple[str, str]:
+    """Split `algorithm:hexdigest` such as `sha256:9f86d0...`.
+
+    Raises:
+        ValueError: unknown algorithm or a digest of the wrong length.
+    """
+    algorithm, _, hexdigest = checksum.partition(":")
+    algorithm = algorithm.lower()
+    hexdigest = hexdigest.lower()
+    if algorithm not in ALGORITHMS:
+        raise ValueError(
+            f"`{checksum}` must start with one of {', '.join(ALGORITHMS)}"
+            " followed by `:`"
+        )
+    if len(hexdigest) != ALGORITHMS[algorithm] or not all(
+        c in "0123456789abcdef" for c in hexdigest
+    ):
+        raise ValueError(f"`{checksum}` is not a valid {algorithm} digest")
+    return algorithm, hexdigest
+
+
+class StreamingHasher:
+    """Hash chunks on a helper thread while they are being downloaded.
+
+    `update` only queues the chunk, so the read loop does not wait for the
+    hashing unless `max_pending_chunks` chunks are already queued.
+    """
+
+    def __init__(self, algorithm: str, max_pending_chunks: int = 256):
+        self._hash = hashlib.new(algorithm)
+        self._chunks: queue.Queue[Optional[bytes]] = queue.Queue(max_pending_chunks)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._is_closed = False
+
+    def _run(self):
+        while (chunk := self._chunks.get()) is not None:
+            self._hash.update(chunk)
+
+    def update(self, chunk: bytes):
+        self._chunks.put(chunk)
+
+    def update_from_file(self, filepath: Path, size: int, chunk_size=1024 * 1024):
+        """Hash the first `size` bytes of `filepath`, e.g. a resumed `.part`."""
+        with open(filepath, "rb") as file:
+            while size > 0 and (chunk := file.read(min(chunk_size, size))):
+                self.update(chunk)
+                size -= len(chunk)
+
+    def close(self):
+        """Let the helper thread end once the queued chunks are hashed."""
+        if not self._is_closed:
+            self._is_closed = True
+            self._chunks.put(None)
+
+    def hexdigest(self) -> str:
+        """Wait for the queued chunks and return the digest."""
+        self.close()
+        self._thread.join()
+        return self._hash.hexdigest()
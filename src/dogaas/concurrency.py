@@ -0,0 +1,304 @@
+"""How hard to push each host: retries, circuit breakers, adaptive limits,
+and sending the same request only once at a time.
+
+Hosts are keyed as `scheme://host[:port]`, like `transport.host_of_url`.
+Only the standard library is imported here.
+"""
+
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Hashable, Optional
+import threading
+import random
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """A request was not sent because its host keeps failing."""
+
+
+def parse_retry_after(
+    value: Optional[str], now: Optional[float] = None
+) -> Optional[float]:
+    """Seconds to wait from a `Retry-After` header of seconds or a date."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at - (time.time() if now is None else now))
+
+
+@dataclass
+class RetryPolicy:
+    """Exponential backoff with full jitter.
+
+    The delay before retry `n` (from 0) is drawn from 0 to
+    `min(max_delay, base_delay * 2 ** n)`, so clients which failed together
+    do not come back together; a `Retry-After` asks for at least as long.
+    """
+
+    max_attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    retry_statuses: frozenset[int] = field(
+        default_factory=lambda: frozenset({408, 425, 429, 500, 502, 503, 504})
+    )
+
+    def is_retryable_status(self, status_code: int) -> bool:
+        return status_code in self.retry_statuses
+
+    def delay(
+        self,
+        retry: int,
+        retry_after: Optional[float] = None,
+        rand: Callable[[], float] = random.random,
+    ) -> float:
+        delay = rand() * min(self.max_delay, self.base_delay * 2**retry)
+        if retry_after is not None:
+            delay = max(delay, min(self.max_delay, retry_after))
+        return delay
+
+
+@dataclass
+class _Circuit:
+    state: str = CLOSED
+    failures: int = 0
+    opened_at: float = 0.0
+
+
+class CircuitBreaker:
+    """Stop sending requests to hosts which keep failing.
+
+    After `failure_threshold` failures in a row the circuit of a host opens,
+    and `allow` refuses it for `reset_timeout` seconds. Then a single trial
+    request is allowed, which closes the circuit if it succeeds and opens it
+    again if not.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._circuits: dict[str, _Circuit] = {}
+        self._lock = threading.Lock()
+
+    def state(self, host: str) -> str:
+        with self._lock:
+            circuit = self._circuits.get(host)
+            return circuit.state if circuit else CLOSED
+
+    def allow(self, host: str) -> bool:
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if circuit is None or circuit.state == CLOSED:
+                return True
+            if (
+                circuit.state == OPEN
+                and self._clock() - circuit.opened_at >= self.reset_timeout
+            ):
+                circuit.state = HALF_OPEN
+                return True
+            return False
+
+    def record_success(self, host: str):
+        with self._lock:
+            self._circuits.pop(host, None)
+
+    def record_failure(self, host: str):
+        with self._lock:
+            circuit = self._circuits.setdefault(host, _Circuit())
+            circuit.failures += 1
+            if circuit.state == HALF_OPEN or circuit.failures >= self.failure_threshold:
+                circuit.state = OPEN
+                circuit.opened_at = self._clock()
+
+
+@dataclass
+class _HostLimit:
+    limit: float
+    window_started_at: float
+    in_flight: int = 0
+    backoff_until: float = 0.0
+    window_bytes: int = 0
+    # whether the limit was used up during the window, so it held us back
+    is_limited: bool = False
+    last_bytes_per_sec: Optional[float] = None
+    ttfb_s: Optional[float] = None
+
+
+class HostConcurrencyController:
+    """Limit the downloads running at once per host, adapting the limits
+    AIMD-style.
+
+    A host's limit grows by one after each `window_s` in which it was used up
+    and the host's throughput grew by more than `min_improvement`; it is
+    multiplied by `decrease_factor` on errors and on first bytes which take
+    `slow_ttfb_factor` times longer than usual. `Retry-After` also keeps new
+    downloads away from the host until then.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 2,
+        min_limit: int = 1,
+        max_limit: int = 16,
+        decrease_factor: float = 0.5,
+        window_s: float = 2.0,
+        min_improvement: float = 0.05,
+        slow_ttfb_factor: float = 3.0,
+        min_slow_ttfb_s: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError("`min_limit <= initial_limit <= max_limit` must hold")
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.window_s = window_s
+        self.min_improvement = min_improvement
+        self.slow_ttfb_factor = slow_ttfb_factor
+        self.min_slow_ttfb_s = min_slow_ttfb_s
+        self._clock = clock
+        self._hosts: dict[str, _HostLimit] = {}
+        self._condition = threading.Condition()
+
+    def _host(self, host: str) -> _HostLimit:
+        host_limit = self._hosts.get(host)
+        if host_limit is None:
+            host_limit = _HostLimit(self.initial_limit, self._clock())
+            self._hosts[host] = host_limit
+        return host_limit
+
+    def limit(self, host: str) -> int:
+        with self._condition:
+            return int(self._host(host).limit)
+
+    def try_acquire(self, host: str) -> bool:
+        """Take a slot of `host` if one is free; `release` gives it back."""
+        with self._condition:
+            host_limit = self._host(host)
+            if self._clock() < host_limit.backoff_until or host_limit.in_flight >= int(
+                host_limit.limit
+            ):
+                return False
+            host_limit.in_flight += 1
+            if host_limit.in_flight >= int(host_limit.limit):
+                host_limit.is_limited = True
+            return True
+
+    def release(self, host: str):
+        with self._condition:
+            self._host(host).in_flight -= 1
+            self._condition.notify_all()
+
+    def wait(self, timeout: float):
+        """Wait until a slot may have become free, at most `timeout`."""
+        with self._condition:
+            self._condition.wait(timeout)
+
+    def record_transfer(self, host: str, nbytes: int):
+        with self._condition:
+            host_limit = self._host(host)
+            host_limit.window_bytes += nbytes
+            now = self._clock()
+            elapsed = now - host_limit.window_started_at
+            if elapsed < self.window_s:
+                return
+            bytes_per_sec = host_limit.window_bytes / elapsed
+            if host_limit.is_limited and (
+                host_limit.last_bytes_per_sec is None
+                or bytes_per_sec
+                > host_limit.last_bytes_per_sec * (1 + self.min_improvement)
+            ):
+                host_limit.limit = min(self.max_limit, host_limit.limit + 1)
+                self._condition.notify_all()
+            host_limit.last_bytes_per_sec = bytes_per_sec
+            host_limit.window_started_at = now
+            host_limit.window_bytes = 0
+            host_limit.is_limited = host_limit.in_flight >= int(host_limit.limit)
+
+    def record_ttfb(self, host: str, ttfb_s: float):
+        with self._condition:
+            host_limit = self._host(host)
+            usual_ttfb_s = host_limit.ttfb_s
+            if usual_ttfb_s is not None and ttfb_s > max(
+                self.min_slow_ttfb_s, usual_ttfb_s * self.slow_ttfb_factor
+            ):
+                self._decrease(host_limit)
+            host_limit.ttfb_s = (
+                ttfb_s if usual_ttfb_s is None else usual_ttfb_s * 0.8 + ttfb_s * 0.2
+            )
+
+    def record_error(self, host: str, retry_after: Optional[float] = None):
+        with self._condition:
+            host_limit = self._host(host)
+            self._decrease(host_limit)
+            if retry_after:
+                host_limit.backoff_until = max(
+                    host_limit.backoff_until, self._clock() + retry_after
+                )
+
+    def _decrease(self, host_limit: _HostLimit):
+        host_limit.limit = max(self.min_limit, host_limit.limit * self.decrease_factor)
+        # the throughput before the decrease is no yardstick for after it
+        host_limit.last_bytes_per_sec = None
+
+
+@dataclass
+class _Flight:
+    done: threading.Event = field(default_factory=threading.Event)
+    value: Any = None
+    error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Call a function once for all the callers asking for the same key
+    while it runs, like `singleflight` of Go.
+
+    The first caller of a key runs the function; the others wait for it and
+    share its value or exception. Once it returns, the next caller of the
+    key runs the function again.
+    """
+
+    def __init__(self):
+        self._flights: dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> tuple[Any, bool]:
+        """Return the value of `function` and whether it was shared, i.e. run
+        by another caller."""
+        with self._lock:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self._flights[key] = _Flight()
+        if not is_leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, True
+        try:
+            flight.value = function()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.value, False
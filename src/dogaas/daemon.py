@@ -0,0 +1,317 @@
+"""A long-running process which owns the tasks and the downloads.
+
+`DownloadDaemon` keeps a `TaskManager`, its warm connection pools and one
+`BackgroundDownloadManager` in memory, and serves them to the clients of
+`dogaas.ipc` over a Unix socket. All clients share one download queue,
+which is saved to `queue_filepath` so downloads carry on after a restart.
+"""
+
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Callable, Optional
+import socketserver
+import threading
+import json
+import time
+import os
+
+from .background import (
+    DOWNLOADING,
+    FINISHED_STATES,
+    PAUSED,
+    QUEUED,
+    BackgroundDownloadManager,
+    TaskProgress,
+)
+from .downloader import DownloaderTask, TaskManager
+from .ipc import DaemonClient, decode_message, encode_message
+from .postprocess import make_process_pool
+
+
+class DaemonAlreadyRunningError(Exception):
+    pass
+
+
+def progress_to_dict(progress: TaskProgress) -> dict:
+    progress_dict = asdict(progress)
+    if progress.error is not None:
+        progress_dict["error"] = f"{type(progress.error).__name__}: {progress.error}"
+    return progress_dict | {"ratio": progress.ratio}
+
+
+def progress_from_dict(progress_dict: dict) -> TaskProgress:
+    """Inverse of `progress_to_dict`; the error is left as its message."""
+    return TaskProgress(
+        **{name: value for name, value in progress_dict.items() if name != "ratio"}
+    )
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: "_UnixServer"
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = decode_message(line)
+                method = request["method"]
+                params = request.get("params", {})
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply_error(e)
+                continue
+            if method == "watch":
+                self._watch(**params)
+                return
+            try:
+                result = self.server.daemon.handle(method, params)
+            except Exception as e:
+                self._reply_error(e)
+            else:
+                self.wfile.write(encode_message({"result": result}))
+            if method == "shutdown":
+                return
+
+    def _reply_error(self, error: Exception):
+        self.wfile.write(
+            encode_message(
+                {"error": {"type": type(error).__name__, "message": str(error)}}
+            )
+        )
+
+    def _watch(self, interval: float = 0.5, until_done: bool = False):
+        daemon = self.server.daemon
+        try:
+            while not daemon.is_shutting_down:
+                snapshot = daemon.status()
+                self.wfile.write(encode_message({"result": snapshot}))
+                self.wfile.flush()
+                if until_done and all(
+                    progress["state"] in (*FINISHED_STATES, PAUSED)
+                    for progress in snapshot.values()
+                ):
+                    return
+                time.sleep(interval)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, daemon: "DownloadDaemon"):
+        self.daemon = daemon
+        super().__init__(socket_path, _RequestHandler)
+
+
+class DownloadDaemon:
+    def __init__(
+        self,
+        task_manager: TaskManager,
+        socket_path: Path | str,
+        queue_filepath: Optional[Path | str] = None,
+        jobs: int = 4,
+        segments: int = 1,
+        on_tasks_change: Optional[Callable[[], None]] = None,
+    ):
+        """
+        Args:
+            socket_path (Path | str): where the Unix socket is created; a
+                stale socket file left by a dead daemon is replaced.
+            queue_filepath (Path | str): where the unfinished downloads are
+                saved; the queue lives in memory only if not given.
+            on_tasks_change (Callable[[], None]): called after a client
+                changes the tasks, e.g. to save tasks kept in memory.
+        """
+        self.task_manager = task_manager
+        self.socket_path = Path(socket_path)
+        self.queue_filepath = Path(queue_filepath) if queue_filepath else None
+        self.on_tasks_change = on_tasks_change
+        self.is_shutting_down = False
+        self._tasks_lock = threading.Lock()
+        self._saved_queue: Optional[dict] = None
+        self._postprocess_executor = None
+        if task_manager.postprocess_executor is None:
+            # no worker is started unless a task has a CPU-bound stage
+            self._postprocess_executor = make_process_pool(jobs)
+            task_manager.postprocess_executor = self._postprocess_executor
+        self.download_manager = BackgroundDownloadManager(
+            task_manager,
+            jobs=jobs,
+            segments=segments,
+            on_update=self._save_queue,
+        )
+        self._methods: dict[str, Callable] = {
+            "ping": self.ping,
+            "list_tasks": self.list_tasks,
+            "count_tasks": self.count_tasks,
+            "select_task_names": self.select_task_names,
+            "add_task": self.add_task,
+            "add_tasks": self.add_tasks,
+            "remove_task": self.remove_task,
+            "rename_task": self.rename_task,
+            "rewrite_task_url": self.rewrite_task_url,
+            "download": self.download,
+            "pause": self.download_manager.pause,
+            "resume": self.download_manager.resume,
+            "cancel": self.download_manager.cancel,
+            "status": self.status,
+            "shutdown": self.shutdown,
+        }
+        self._server: Optional[_UnixServer] = None
+
+    def handle(self, method: str, params: dict):
+        if method not in self._methods:
+            raise ValueError(f"unknown method `{method}`")
+        return self._methods[method](**params)
+
+    def ping(self) -> dict:
+        return {"pid": os.getpid()}
+
+    def _read_tasks(self, read: Callable[[], Any]) -> Any:
+        # a dict store cannot be iterated while another client changes it
+        with self._tasks_lock:
+            return read()
+
+    def list_tasks(self, **query) -> list[list]:
+        return self._read_tasks(
+            lambda: [
+                [task_name, task.url, task.priority]
+                for task_name, task in self.task_manager.query_tasks(**query)
+            ]
+        )
+
+    def count_tasks(self, **query) -> int:
+        return self._read_tasks(lambda: self.task_manager.count_tasks(**query))
+
+    def select_task_names(self, patterns: Optional[list[str]] = None) -> list[str]:
+        return self._read_tasks(lambda: self.task_manager.select_task_names(patterns))
+
+    def _change_tasks(self, change: Callable[[], Any]) -> Any:
+        with self._tasks_lock:
+            result = change()
+            # saved before another client can change the tasks again
+            if self.on_tasks_change:
+                self.on_tasks_change()
+        return result
+
+    def add_task(
+        self,
+        name: str,
+        url: str,
+        priority: int = 0,
+        checksum: Optional[str] = None,
+        postprocess: Optional[list[str]] = None,
+        mirrors: Optional[list[str]] = None,
+        raise_if_duplicate: bool = True,
+    ):
+        task = DownloaderTask(
+            url,
+            priority=priority,
+            checksum=checksum,
+            postprocess=postprocess or [],
+            mirrors=mirrors or [],
+        )
+        self._change_tasks(
+            lambda: self.task_manager.add_task(
+                name, task, raise_if_duplicate=raise_if_duplicate
+            )
+        )
+
+    def add_tasks(self, entries: list[list], skip_duplicate_urls: bool = True) -> dict:
+        """Add one batch of `[name or None, url]`; returns the `ImportReport`."""
+        report = self._change_tasks(
+            lambda: self.task_manager.add_tasks(
+                ((name, url) for name, url in entries),
+                batch_size=max(1, len(entries)),
+                skip_duplicate_urls=skip_duplicate_urls,
+            )
+        )
+        return asdict(report)
+
+    def remove_task(self, name: str):
+        self._change_tasks(lambda: self.task_manager.remove_task(name))
+
+    def rename_task(self, name: str, new_name: str):
+        self._change_tasks(lambda: self.task_manager.rename_task(name, new_name))
+
+    def rewrite_task_url(self, name: str, url: str):
+        self._change_tasks(lambda: self.task_manager.rewrite_task_url(name, url))
+
+    def download(
+        self, task_names: list[str], dirpath_for_dest: str, paused: bool = False
+    ):
+        self.download_manager.enqueue(
+            task_names, Path(dirpath_for_dest).absolute(), paused=paused
+        )
+
+    def status(self) -> dict[str, dict]:
+        return {
+            task_name: progress_to_dict(progress)
+            for task_name, progress in self.download_manager.snapshot().items()
+        }
+
+    def _save_queue(self, snapshot: dict[str, TaskProgress]):
+        """Write the unfinished downloads to `queue_filepath` when changed."""
+        if self.queue_filepath is None:
+            return
+        saved_queue = {
+            task_name: {
+                "dirpath_for_dest": progress.dirpath_for_dest,
+                "paused": progress.state == PAUSED,
+            }
+            for task_name, progress in snapshot.items()
+            if progress.state in (QUEUED, DOWNLOADING, PAUSED)
+        }
+        if saved_queue == self._saved_queue:
+            return
+        temp_filepath = self.queue_filepath.with_name(self.queue_filepath.name + ".tmp")
+        temp_filepath.write_text(json.dumps(saved_queue, indent=4), encoding="utf-8")
+        os.replace(temp_filepath, self.queue_filepath)
+        self._saved_queue = saved_queue
+
+    def _restore_queue(self):
+        if self.queue_filepath is None or not self.queue_filepath.exists():
+            return
+        saved_queue = json.loads(self.queue_filepath.read_text(encoding="utf-8"))
+        for task_name, entry in saved_queue.items():
+            if task_name in self.task_manager.tasks:
+                self.download_manager.enqueue(
+                    [task_name], entry["dirpath_for_dest"], paused=entry["paused"]
+                )
+
+    def serve_forever(self):
+        """Restore the queue, then serve clients until `shutdown`."""
+        if client := DaemonClient.connect(self.socket_path):
+            client.close()
+            raise DaemonAlreadyRunningError(str(self.socket_path))
+        self._restore_queue()
+        self.socket_path.unlink(missing_ok=True)
+        self._server = _UnixServer(str(self.socket_path), self)
+        socket_inode = self.socket_path.stat().st_ino
+        try:
+            self._server.serve_forever(poll_interval=0.1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+            self._server.server_close()
+            # leave the socket of a daemon started after this one alone
+            try:
+                if self.socket_path.stat().st_ino == socket_inode:
+                    self.socket_path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def shutdown(self):
+        """Stop serving; unfinished downloads stay in the saved queue."""
+        if self.is_shutting_down:
+            return
+        self.is_shutting_down = True
+        self.download_manager.on_update = None
+        self.download_manager.close(cancel=False)
+        self._save_queue(self.download_manager.snapshot())
+        if self._postprocess_executor:
+            self._postprocess_executor.shutdown()
+        if self._server:
+            # `shutdown` blocks until `serve_forever` returns, which it does
+            # only after this request is handled
+            threading.Thread(target=self._server.shutdown).start()
@@ -0,0 +1,208 @@
+"""Write downloads to disk on a thread of their own.
+
+The network and the disk then work at the same time, so a transfer goes as
+fast as the slower of the two instead of taking the time of both. Only the
+standard library is imported here.
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Optional
+import threading
+import queue
+import time
+import os
+
+# when `FileWriter` makes the written bytes durable with `os.fsync`:
+# never, at every `checkpoint` and on `close`, or only on `close`
+FSYNC_POLICIES = ("never", "checkpoint", "end")
+
+
+@dataclass
+class WritePolicy:
+    """How the content of a download is written.
+
+    `buffers` buffers of `buffer_size` bytes are shared by the reading and
+    the writing, so at most that much content waits for the disk. With
+    `preallocate`, the whole file is reserved up front when its size is
+    known, so the disk need not find room while writing.
+    """
+
+    buffer_size: int = 1024 * 1024
+    buffers: int = 8
+    fsync: str = "never"
+    preallocate: bool = True
+
+    def __post_init__(self):
+        if self.fsync not in FSYNC_POLICIES:
+            raise ValueError(f"`fsync` must be one of {FSYNC_POLICIES}")
+        if self.buffer_size < 1 or self.buffers < 1:
+            raise ValueError("`buffer_size` and `buffers` must be 1 or more")
+
+
+class BufferPool:
+    """At most `count` reusable `bytearray`s of `buffer_size` bytes.
+
+    `acquire` blocks while all of them are in use, which bounds the memory
+    a transfer takes however far the disk falls behind.
+    """
+
+    def __init__(self, buffer_size: int = 1024 * 1024, count: int = 8):
+        self.buffer_size = buffer_size
+        self.count = count
+        self._free: list[bytearray] = []
+        self._allocated = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> bytearray:
+        with self._condition:
+            while not self._free:
+                if self._allocated < self.count:
+                    # allocated on demand, so small files take one buffer
+                    self._allocated += 1
+                    return bytearray(self.buffer_size)
+                self._condition.wait()
+            return self._free.pop()
+
+    def release(self, buffer: bytearray):
+        with self._condition:
+            self._free.append(buffer)
+            self._condition.notify()
+
+
+def preallocate(file: BinaryIO, size: int):
+    """Reserve `size` bytes for `file`, leaving its position as it is.
+
+    The file becomes `size` bytes long; where the file system cannot
+    reserve the blocks, it is only extended.
+    """
+    if size <= 0:
+        return
+    file.flush()
+    try:
+        os.posix_fallocate(file.fileno(), 0, size)
+    except (AttributeError, OSError):
+        if os.fstat(file.fileno()).st_size < size:
+            file.truncate(size)
+
+
+def fsync_path(filepath: Path):
+    """Make what was written to `filepath` through any handle durable."""
+    with open(filepath, "rb+") as file:
+        os.fsync(file.fileno())
+
+
+class FileWriter:
+    """Copy written bytes into the buffers of a `BufferPool` and write full
+    buffers to `file` from its current position on a dedicated thread.
+
+    `write` returns as soon as the bytes are copied, so the caller only
+    waits for the disk when every buffer of `pool` is full; the queue to the
+    thread never holds more than those buffers.
+    """
+
+    def __init__(self, file: BinaryIO, pool: BufferPool, fsync: str = "never"):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"`fsync` must be one of {FSYNC_POLICIES}")
+        self._file = file
+        self._pool = pool
+        self._fsync = fsync
+        self._buffer: Optional[bytearray] = None
+        self._filled = 0
+        # `None` ends the thread; an `Event` is set once everything before
+        # it is written
+        self._queue: queue.Queue = queue.Queue()
+        self._error: Optional[BaseException] = None
+        # seconds the thread spent writing, and the bytes it wrote
+        self.write_s = 0.0
+        self.written_bytes = 0
+        self._is_closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while (item := self._queue.get()) is not None:
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            buffer, nbytes = item
+            try:
+                if self._error is None:
+                    started_at = time.perf_counter()
+                    self._file.write(memoryview(buffer)[:nbytes])
+                    self.write_s += time.perf_counter() - started_at
+                    self.written_bytes += nbytes
+            except BaseException as e:
+                # keep taking buffers so `write` never waits for a dead thread
+                self._error = e
+            finally:
+                self._pool.release(buffer)
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    def write(self, data: bytes | memoryview):
+        """Queue `data` to be written.
+
+        Raises:
+            OSError: writing queued bytes has failed already.
+        """
+        self._raise_if_failed()
+        view = memoryview(data)
+        while view:
+            if self._buffer is None:
+                self._buffer = self._pool.acquire()
+                self._filled = 0
+            nbytes = min(len(view), len(self._buffer) - self._filled)
+            self._buffer[self._filled : self._filled + nbytes] = view[:nbytes]
+            self._filled += nbytes
+            view = view[nbytes:]
+            if self._filled == len(self._buffer):
+                self._hand_over()
+
+    def _hand_over(self):
+        if self._buffer is not None and self._filled:
+            self._queue.put((self._buffer, self._filled))
+        elif self._buffer is not None:
+            self._pool.release(self._buffer)
+        self._buffer = None
+
+    def _drain(self, do_fsync: bool):
+        self._hand_over()
+        written = threading.Event()
+        self._queue.put(written)
+        written.wait()
+        self._raise_if_failed()
+        self._file.flush()
+        if do_fsync:
+            os.fsync(self._file.fileno())
+
+    def checkpoint(self) -> int:
+        """Wait until everything written so far has reached the OS, or the
+        disk with the `checkpoint` policy, and return the bytes written."""
+        self._drain(self._fsync == "checkpoint")
+        return self.written_bytes
+
+    def close(self) -> int:
+        """Write everything, end the thread and return the bytes written;
+        `file` stays open."""
+        if self._is_closed:
+            return self.written_bytes
+        try:
+            self._drain(self._fsync != "never")
+        finally:
+            self.abort()
+        return self.written_bytes
+
+    def abort(self):
+        """End the thread once the queued buffers are written, dropping the
+        bytes which did not fill a buffer yet."""
+        if self._is_closed:
+            return
+        self._is_closed = True
+        if self._buffer is not None:
+            self._pool.release(self._buffer)
+            self._buffer = None
+        self._queue.put(None)
+        self._thread.join()
@@ -1,17 +1,51 @@
-from dataclasses import dataclass
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field, replace
+from fnmatch import fnmatchcase
 from pathlib import Path
 from urllib.parse import urlparse, unquote
-from typing import Callable, Optional
+from typing import Callable, Iterable, Iterator, MutableMapping, Optional
+import threading
+import hashlib
+import queue
+import time
+import uuid
 import abc
+import os
 import re
 
-from serde import serialize, deserialize
+from serde import serialize, deserialize, SerdeError
 from serde.json import from_json, to_json
 import requests
 
+from .bandwidth import BandwidthLimiter
+from .cache import FetchCache, FetchRecord
+from .checksum import StreamingHasher, parse_checksum
+from .diskio import BufferPool, FileWriter, WritePolicy, fsync_path, preallocate
+from .concurrency import (
+    CircuitBreaker,
+    CircuitOpenError,
+    HostConcurrencyController,
+    RetryPolicy,
+    SingleFlight,
+    parse_retry_after,
+)
+from .jsonstream import iter_json_object, write_json_object
+from .metadata import DownloadPlan, MetadataCache, RemoteMetadata, prefetch_metadata
+from .metrics import DownloadStats, timed_chunks
+from .mirrors import MirrorStatsCache, probe_mirrors
+from .postprocess import Pipeline, validate_pipeline
+from .store import ContentStore, place_file
+from .transport import SessionPool, host_of_url, shut_down_connection
+
+_URL_PATTERN = re.compile(r"^https?://")
+
+# how `TaskManager.sort_task_names` orders tasks of the same priority
+ORDERS = ("priority", "largest", "smallest")
+
 
 def is_url(url: str, raise_if_not=False) -> bool:
-    if re.match(r"^https?://", url):
+    if _URL_PATTERN.match(url):
         return True
     else:
         if raise_if_not:
@@ -23,30 +57,166 @@ def filename_from_url(url: str) -> str:
     return unquote(Path(urlparse(url).path).name)
 
 
+def unique_filename(filename: str, url: str) -> str:
+    """`filename` made unique to `url`, e.g. `a-1f2e3d4c.tar.gz`."""
+    tag = hashlib.sha256(url.encode()).hexdigest()[:8]
+    if filename.startswith(".") or "." not in filename:
+        return f"{filename}-{tag}"
+    stem, _, extensions = filename.partition(".")
+    return f"{stem}-{tag}.{extensions}"
+
+
+def resolve_filename_collisions(
+    task_urls: Iterable[tuple[str, str]],
+    owner_of: Optional[Callable[[str], Optional[str]]] = None,
+) -> dict[str, str]:
+    """Filenames for the tasks of `(task_name, url)` whose URLs share a
+    name with other URLs, by task name; see `TaskManager.dest_filenames`.
+
+    Args:
+        owner_of (Callable[[str], Optional[str]]): the URL a filename is
+            taken by already, if any.
+    """
+    urls_by_filename: dict[str, dict[str, list[str]]] = {}
+    for task_name, url in task_urls:
+        urls_by_filename.setdefault(filename_from_url(url), {}).setdefault(
+            url, []
+        ).append(task_name)
+    filenames = {}
+    for filename, task_names_by_url in urls_by_filename.items():
+        owner = owner_of(filename) if owner_of else None
+        if len(task_names_by_url) == 1 and owner in (None, *task_names_by_url):
+            continue
+        if owner is None:
+            owner = min(task_names_by_url)
+        for url, task_names in task_names_by_url.items():
+            if url != owner:
+                for task_name in task_names:
+                    filenames[task_name] = unique_filename(filename, url)
+    return filenames
+
+
+def split_byte_ranges(size: int, count: int) -> list[tuple[int, int]]:
+    """Split `size` bytes into at most `count` inclusive `(start, end)` ranges."""
+    count = max(1, min(count, size))
+    step, remainder = divmod(size, count)
+    ranges = []
+    start = 0
+    for i in range(count):
+        end = start + step + (1 if i < remainder else 0) - 1
+        ranges.append((start, end))
+        start = end + 1
+    return ranges
+
+
+def partial_filepath(filepath: Path) -> Path:
+    return filepath.with_name(filepath.name + ".part")
+
+
+def partial_state_filepath(filepath: Path) -> Path:
+    return filepath.with_name(filepath.name + ".part.json")
+
+
 class DuplicateTaskError(Exception):
     pass
 
 
+class DownloadError(Exception):
+    pass
+
+
+class ChecksumMismatchError(DownloadError):
+    pass
+
+
 @deserialize
 @serialize
-@dataclass
+@dataclass(slots=True)
 class DownloaderTask:
+    """A URL to download and how.
+
+    There may be a million tasks in memory, so they have slots, are
+    validated once when made or rewritten, and keep their lists as tuples,
+    which share one empty tuple when unused.
+    """
+
     _url: str
+    priority: int = 0
+    checksum: Optional[str] = None
+    # stage specs of `dogaas.postprocess`, e.g. `("gunzip",)`
+    postprocess: tuple[str, ...] = ()
+    # other URLs of the same content, used when they are faster or `url` fails
+    mirrors: tuple[str, ...] = ()
 
     @property
     def url(self) -> str:
-        is_url(self._url, raise_if_not=True)
         return self._url
 
+    @property
+    def urls(self) -> list[str]:
+        return [self._url, *self.mirrors]
+
     def __post_init__(self):
-        is_url(self.url, raise_if_not=True)
+        is_url(self._url, raise_if_not=True)
+        if self.checksum is not None:
+            algorithm, hexdigest = parse_checksum(self.checksum)
+            self.checksum = f"{algorithm}:{hexdigest}"
+        self.postprocess = (
+            tuple(validate_pipeline(self.postprocess)) if self.postprocess else ()
+        )
+        self.mirrors = tuple(self.mirrors) if self.mirrors else ()
+        for mirror in self.mirrors:
+            is_url(mirror, raise_if_not=True)
 
     def rewrite_url(self, new_url: str):
         if is_url(new_url, raise_if_not=True):
             self._url = new_url
 
+    def to_dict(self) -> dict:
+        """The task for `json`, which writes it as pyserde does."""
+        return {
+            "_url": self._url,
+            "priority": self.priority,
+            "checksum": self.checksum,
+            "postprocess": self.postprocess,
+            "mirrors": self.mirrors,
+        }
 
-Tasks = dict[str, DownloaderTask]
+    @classmethod
+    def from_dict(cls, data: dict) -> "DownloaderTask":
+        """Inverse of `to_dict`, far quicker than pyserde for many tasks.
+
+        Raises:
+            ValueError: `data` is not a valid task.
+        """
+        try:
+            url = data["_url"]
+            priority = data.get("priority", 0)
+            checksum = data.get("checksum")
+            postprocess = data.get("postprocess") or ()
+            mirrors = data.get("mirrors") or ()
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"not a task: {data!r}") from e
+        if (
+            not isinstance(url, str)
+            or not isinstance(priority, int)
+            or not isinstance(checksum, (str, type(None)))
+            or not isinstance(postprocess, (list, tuple))
+            or not isinstance(mirrors, (list, tuple))
+        ):
+            raise ValueError(f"not a task: {data!r}")
+        return cls(url, priority, checksum, postprocess, mirrors)
+
+
+Tasks = MutableMapping[str, DownloaderTask]
+
+
+@dataclass
+class ImportReport:
+    added: int = 0
+    duplicate_urls: int = 0
+    duplicate_names: int = 0
+    invalid_entries: list[tuple[Optional[str], str]] = field(default_factory=list)
 
 
 class TaskDatabaseInterface(metaclass=abc.ABCMeta):
@@ -59,15 +229,181 @@ class TaskDatabaseInterface(metaclass=abc.ABCMeta):
         raise NotImplementedError
 
 
+# a task waits to be claimed, is being downloaded by the owner of its
+# lease, or has ended
+TASK_STATES = ("pending", "claimed", "done", "failed")
+
+
+@dataclass
+class TaskState:
+    state: str = "pending"
+    # who holds the lease of a claimed task, and until when
+    owner: Optional[str] = None
+    lease_expires_at: Optional[float] = None
+    # how many times the task was claimed
+    attempts: int = 0
+    error: Optional[str] = None
+
+
+class TaskLeaseInterface(metaclass=abc.ABCMeta):
+    """Task states shared by many workers, which claim tasks for a lease.
+
+    A worker keeps its claims by renewing their leases while it downloads;
+    the tasks of a worker which stopped renewing are claimed again once
+    their leases expire.
+    """
+
+    @abc.abstractmethod
+    def claim_tasks(
+        self, owner: str, count: int = 1, lease_s: float = 60.0, max_attempts: int = 5
+    ) -> list[tuple[str, DownloaderTask]]:
+        """Claim up to `count` pending or expired tasks, urgent ones first,
+        with the other claimable tasks of their URLs, which are downloaded
+        together. Tasks of a URL another owner holds are not claimed.
+
+        An expired task claimed `max_attempts` times already fails instead,
+        so a task which keeps bringing its workers down is not retried
+        forever.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def renew_leases(
+        self, owner: str, task_names: Iterable[str], lease_s: float = 60.0
+    ) -> list[str]:
+        """Extend the leases of `owner` and return the names still held."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def complete_task(
+        self, owner: str, task_name: str, error: Optional[str] = None
+    ) -> bool:
+        """Mark a task `owner` holds done, or failed with `error`.
+
+        Returns:
+            bool: whether `owner` still held the task.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def release_tasks(self, owner: str, task_names: Optional[Iterable[str]] = None):
+        """Give the tasks `owner` holds (all of them if `None`) back as
+        pending."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def task_state(self, task_name: str) -> TaskState:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def count_task_states(self) -> dict[str, int]:
+        """Number of tasks in each of `TASK_STATES`."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def reset_task_states(
+        self, states: Iterable[str] = ("failed",), name: Optional[str] = None
+    ) -> int:
+        """Make the tasks in `states` pending again, with no attempts; only
+        those matching the pattern `name` if given.
+
+        Returns:
+            int: the number of tasks reset.
+        """
+        raise NotImplementedError
+
+
 class TaskManager(TaskDatabaseInterface):
+    # seconds without a byte before a task with mirrors moves to another one
+    mirror_stall_timeout = 30.0
+    mirror_probe_timeout = 5.0
+
     def __init__(
         self,
         tasks: Optional[dict[str, DownloaderTask]] = None,
-        on_add: Optional[Callable[..., None]] = None,
-        on_remove: Optional[Callable[..., None]] = None,
-        on_rename: Optional[Callable[..., None]] = None,
+        on_add: Optional[Callable[[list[str]], None]] = None,
+        on_remove: Optional[Callable[[str], None]] = None,
+        on_rename: Optional[Callable[[str, str], None]] = None,
+        session_pool: Optional[SessionPool] = None,
+        task_database: Optional[TaskDatabaseInterface] = None,
+        bandwidth_limiter: Optional[BandwidthLimiter] = None,
+        fetch_cache: Optional[FetchCache] = None,
+        on_stats: Optional[Callable[[DownloadStats], None]] = None,
+        postprocess_executor: Optional[Executor] = None,
+        mirror_stats: Optional[MirrorStatsCache] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        concurrency: Optional[HostConcurrencyController] = None,
+        metadata_cache: Optional[MetadataCache] = None,
+        write_policy: Optional[WritePolicy] = None,
+        content_store: Optional[ContentStore] = None,
     ):
-        self.tasks: Tasks = {}
+        """
+        Args:
+            on_add (Callable[[list[str]], None]): called with the names of
+                the tasks added.
+            on_remove (Callable[[str], None]): called with the name of the
+                task removed.
+            on_rename (Callable[[str, str], None]): called with the old and
+                the new name of the task renamed.
+            task_database (TaskDatabaseInterface): mapping of task names to
+                tasks which stores them, such as
+                `dogaas.taskdb.SQLiteTaskDatabase`. Tasks are kept in a `dict`
+                if not given.
+            bandwidth_limiter (BandwidthLimiter): shared by every download
+                made from the tasks; no limit if not given.
+            fetch_cache (FetchCache): validators of finished downloads, used
+                to skip unchanged content with conditional requests.
+            on_stats (Callable[[DownloadStats], None]): called with the
+                stats of every download made from the tasks when it ends,
+                successfully or not.
+            postprocess_executor (Executor): process pool the CPU-bound
+                post-processing stages of the tasks run in, such as
+                `dogaas.postprocess.make_process_pool`; they run on a thread
+                of this process if not given.
+            mirror_stats (MirrorStatsCache): probes and transfer rates of
+                the mirrors of the tasks; kept in memory if not given.
+            retry_policy (RetryPolicy): how often and after how long failed
+                requests and transfers are retried.
+            circuit_breaker (CircuitBreaker): stops requests to hosts which
+                keep failing.
+            concurrency (HostConcurrencyController): adaptive limits of the
+                downloads running at once per host, which `DownloadScheduler`
+                keeps to and the downloads feed; no limits if not given.
+            metadata_cache (MetadataCache): sizes, types, `Range` support and
+                validators of the URLs of the tasks, from `HEAD` requests;
+                kept in memory if not given.
+            write_policy (WritePolicy): buffers, preallocation and fsync of
+                the downloads made from the tasks.
+            content_store (ContentStore): keeps the finished downloads by
+                digest, so identical content shares one copy on disk and
+                tasks whose checksum is stored are not downloaded at all;
+                no store if not given.
+        """
+        self.tasks: Tasks = task_database if task_database is not None else {}
+        self.session_pool = session_pool if session_pool is not None else SessionPool()
+        self.bandwidth_limiter = (
+            bandwidth_limiter if bandwidth_limiter is not None else BandwidthLimiter()
+        )
+        self.fetch_cache = fetch_cache
+        self.on_stats = on_stats
+        self.postprocess_executor = postprocess_executor
+        self.mirror_stats = (
+            mirror_stats if mirror_stats is not None else MirrorStatsCache()
+        )
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.circuit_breaker = (
+            circuit_breaker if circuit_breaker is not None else CircuitBreaker()
+        )
+        self.concurrency = concurrency
+        self.metadata_cache = (
+            metadata_cache if metadata_cache is not None else MetadataCache()
+        )
+        self.write_policy = write_policy if write_policy is not None else WritePolicy()
+        self.content_store = content_store
+        # in-flight transfers of `DownloadScheduler`s, shared by tasks of
+        # the same content
+        self.single_flight = SingleFlight()
         self.on_add = on_add
         self.on_remove = on_remove
         self.on_rename = on_rename
@@ -79,19 +415,97 @@ class TaskManager(TaskDatabaseInterface):
         self, name: str, task: DownloaderTask, raise_if_duplicate: bool = False
     ):
         if isinstance(task, DownloaderTask):
-            if self.tasks.get(name, False) and raise_if_duplicate:
+            if raise_if_duplicate and name in self.tasks:
                 raise DuplicateTaskError(f"task `{name}` already exists")
             self.tasks[name] = task
             if self.on_add:
-                self.on_add()
+                self.on_add([name])
         else:
             raise TypeError("`task` must be `DownloaderTask`")
 
+    def _unique_task_name(self, name: str, taken_names: Iterable[str]) -> str:
+        unique_name = name
+        i = 1
+        while unique_name in taken_names or unique_name in self.tasks:
+            i += 1
+            unique_name = f"{name}_{i}"
+        return unique_name
+
+    def add_tasks(
+        self,
+        entries: Iterable[tuple[Optional[str], str]],
+        batch_size: int = 1000,
+        skip_duplicate_urls: bool = True,
+        on_batch: Optional[Callable[[ImportReport], None]] = None,
+    ) -> ImportReport:
+        """Add tasks from a stream of `(name or None, url)` in batches.
+
+        Invalid URLs are collected in the report instead of raising. A task
+        without a name is named after the file name of its URL, made unique
+        with a `_2`, `_3`... suffix, while an explicitly given name which is
+        already taken is reported as a duplicate. URLs already in the tasks
+        or earlier in `entries` are skipped with `skip_duplicate_urls`.
+
+        Each batch is written in one go and `on_add` is called once per batch
+        rather than once per task; `on_batch` is called after each batch with
+        the report so far.
+        """
+        report = ImportReport()
+        if isinstance(self.tasks, TaskDatabaseInterface):
+            is_known_url = self.tasks.contains_url
+        else:
+            known_urls = {task.url for task in self.tasks.values()}
+            is_known_url = known_urls.__contains__
+        seen_urls: set[str] = set()
+        batch: dict[str, DownloaderTask] = {}
+
+        def flush():
+            if not batch:
+                return
+            if isinstance(self.tasks, TaskDatabaseInterface):
+                self.tasks.add_tasks(batch.items())
+            else:
+                self.tasks.update(batch)
+            report.added += len(batch)
+            added_names = list(batch)
+            batch.clear()
+            if self.on_add:
+                self.on_add(added_names)
+            if on_batch:
+                on_batch(report)
+
+        for name, url in entries:
+            try:
+                task = DownloaderTask(url)
+            except (ValueError, TypeError):
+                report.invalid_entries.append((name, url))
+                continue
+            if skip_duplicate_urls:
+                if url in seen_urls or is_known_url(url):
+                    report.duplicate_urls += 1
+                    continue
+                seen_urls.add(url)
+            if name is None:
+                name = self._unique_task_name(
+                    filename_from_url(url) or urlparse(url).netloc, batch.keys()
+                )
+            elif name in batch or name in self.tasks:
+                report.duplicate_names += 1
+                continue
+            batch[name] = task
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+        return report
+
     def rename_task(self, task_name: str, new_name: str):
         if isinstance(task_name, str):
-            self.tasks[new_name] = self.tasks.pop(task_name)
+            if isinstance(self.tasks, TaskDatabaseInterface):
+                self.tasks.rename_task(task_name, new_name)
+            else:
+                self.tasks[new_name] = self.tasks.pop(task_name)
             if self.on_rename:
-                self.on_rename()
+                self.on_rename(task_name, new_name)
         else:
             raise TypeError("`task_name` must be a `str`")
 
@@ -108,52 +522,1719 @@ class TaskManager(TaskDatabaseInterface):
         if isinstance(task_name, str):
             self.tasks.pop(task_name)
             if self.on_remove:
-                self.on_remove()
+                self.on_remove(task_name)
         else:
             raise TypeError("`task_name` must be `str`")
 
-    def make_downloader_from_task(self, task_name: str) -> "Downloader":
-        """Try to request content to download by task then return `Downloader`."""
+    def rewrite_task_url(self, task_name: str, new_url: str):
+        task = self.tasks[task_name]
+        task.rewrite_url(new_url)
+        # write back for stores which hand out copies of their tasks
+        self.tasks[task_name] = task
+
+    def query_tasks(
+        self,
+        name: Optional[str] = None,
+        url: Optional[str] = None,
+        host: Optional[str] = None,
+        offset: int = 0,
+        limit: Optional[int] = None,
+    ) -> Iterator[tuple[str, DownloaderTask]]:
+        """Yield `(name, task)` filtered by shell-style `name` and `url`
+        patterns and a `host` name, skipping `offset` matches and stopping
+        after `limit`. The work is left to the task database if it can.
+        """
+        if isinstance(self.tasks, TaskDatabaseInterface):
+            yield from self.tasks.query_tasks(name, url, host, offset, limit)
+            return
+        if limit is not None and limit <= 0:
+            return
+        for task_name, task in self.tasks.items():
+            if (
+                (name is None or fnmatchcase(task_name, name))
+                and (url is None or fnmatchcase(task.url, url))
+                and (host is None or urlparse(task.url).hostname == host.lower())
+            ):
+                if offset > 0:
+                    offset -= 1
+                    continue
+                yield task_name, task
+                if limit is not None:
+                    limit -= 1
+                    if limit <= 0:
+                        return
+
+    def count_tasks(
+        self,
+        name: Optional[str] = None,
+        url: Optional[str] = None,
+        host: Optional[str] = None,
+    ) -> int:
+        if isinstance(self.tasks, TaskDatabaseInterface):
+            return self.tasks.count_tasks(name, url, host)
+        return sum(1 for _ in self.query_tasks(name, url, host))
+
+    def select_task_names(self, patterns: Optional[Iterable[str]] = None) -> list[str]:
+        """Return task names matching any of shell-style `patterns`.
+
+        All task names are returned when `patterns` is `None` or empty.
+        """
+        patterns = list(patterns) if patterns else []
+        if not patterns:
+            return list(self.tasks.keys())
+        return [
+            task_name
+            for task_name in self.tasks.keys()
+            if any(fnmatchcase(task_name, pattern) for pattern in patterns)
+        ]
+
+    def dest_filenames(
+        self, task_names: Optional[Iterable[str]], dirpath_for_dest: Path | str
+    ) -> dict[str, str]:
+        """Filenames for the tasks of `task_names` whose URLs share a name
+        in `dirpath_for_dest` with other URLs, which would overwrite each
+        other.
+
+        Of the URLs sharing a name, the one whose download `fetch_cache`
+        recorded there keeps it, or else the first in sorted order; the
+        others get `unique_filename`s. Tasks which keep the name of their
+        URL are not returned. `task_names` of `None` is every task, read in
+        one pass.
+        """
+        dirpath_for_dest = Path(dirpath_for_dest).absolute()
+        if task_names is None:
+            task_urls = (
+                (task_name, task.url) for task_name, task in self.tasks.items()
+            )
+        else:
+            task_urls = (
+                (task_name, self.tasks[task_name].url) for task_name in task_names
+            )
+        urls_by_filepath = {}
+        if self.fetch_cache is not None:
+            urls_by_filepath = self.fetch_cache.urls_by_filepath()
+
+        def owner_of(filename: str) -> Optional[str]:
+            return urls_by_filepath.get(str(dirpath_for_dest / filename))
+
+        return resolve_filename_collisions(task_urls, owner_of)
+
+    def content_key(self, task_name: str) -> tuple:
+        """Tasks of the same key get the same files from one transfer."""
+        task = self.tasks[task_name]
+        return (task.url, task.checksum, tuple(task.postprocess or ()))
+
+    def group_same_content(self, task_names: Iterable[str]) -> dict[str, list[str]]:
+        """The other tasks of `task_names` with the `content_key` of each
+        first task of a key, by the name of that task."""
+        groups: dict[str, list[str]] = {}
+        first_task_names: dict[tuple, str] = {}
+        for task_name in task_names:
+            key = self.content_key(task_name)
+            if key in first_task_names:
+                groups[first_task_names[key]].append(task_name)
+            else:
+                first_task_names[key] = task_name
+                groups[task_name] = []
+        return groups
+
+    def link_from_store(self, task_name: str, dest_filepath: Path | str) -> bool:
+        """Put the content of a task at `dest_filepath` from `content_store`
+        without downloading it, if its checksum is stored there."""
+        task = self.tasks[task_name]
+        if self.content_store is None or not task.checksum or task.postprocess:
+            return False
+        return self.content_store.link(task.checksum, dest_filepath)
+
+    def prefetch_metadata(
+        self,
+        task_names: Optional[Iterable[str]] = None,
+        jobs: int = 16,
+        force: bool = False,
+        on_fetch: Optional[Callable[[str, RemoteMetadata], None]] = None,
+    ) -> dict[str, RemoteMetadata]:
+        """Send `HEAD` for the tasks `task_names` (all tasks if `None`) in
+        parallel and return their metadata by task name.
+
+        Metadata still fresh in `metadata_cache` is not requested again
+        unless `force` is set.
+
+        Args:
+            jobs (int): requests sent at once.
+            on_fetch (Callable[[str, RemoteMetadata], None]): called from
+                worker threads with the URL and the metadata of each request.
+        """
+        if task_names is None:
+            task_names = self.select_task_names()
+        urls = {task_name: self.tasks[task_name].url for task_name in task_names}
+        metadata = prefetch_metadata(
+            self.session_pool,
+            urls.values(),
+            self.metadata_cache,
+            jobs=jobs,
+            force=force,
+            on_fetch=on_fetch,
+        )
+        return {task_name: metadata[url] for task_name, url in urls.items()}
+
+    def plan(
+        self,
+        task_names: Optional[Iterable[str]] = None,
+        jobs: int = 16,
+        force: bool = False,
+        on_fetch: Optional[Callable[[str, RemoteMetadata], None]] = None,
+    ) -> DownloadPlan:
+        """The total size, dead links and `Range` support of `task_names`,
+        from `prefetch_metadata`."""
+        return DownloadPlan(self.prefetch_metadata(task_names, jobs, force, on_fetch))
+
+    def sort_task_names(
+        self, task_names: Iterable[str], order: str = "priority"
+    ) -> list[str]:
+        """`task_names` the most urgent first.
+
+        Tasks of the same priority stay in the given order, or go from the
+        largest or the smallest in `metadata_cache` by `order`; tasks of
+        unknown size go after them.
+        """
+        if order not in ORDERS:
+            raise ValueError(f"`order` must be one of {ORDERS}")
+        task_names = list(task_names)
+        tasks = [self.tasks[task_name] for task_name in task_names]
+        if order == "priority":
+            keys = [(-task.priority,) for task in tasks]
+        else:
+            sign = -1 if order == "largest" else 1
+            keys = []
+            for task in tasks:
+                size = self.metadata_cache.size_of(task.url)
+                keys.append((-task.priority, size is None, sign * (size or 0)))
+        return [
+            task_names[i] for i in sorted(range(len(task_names)), key=keys.__getitem__)
+        ]
+
+    def make_downloader_from_task(
+        self, task_name: str, force: bool = False, filename: Optional[str] = None
+    ) -> "Downloader":
+        """Try to request content to download by task then return `Downloader`.
+
+        The request goes through `session_pool`, so connections to a host are
+        kept alive and reused by later tasks. If `fetch_cache` has a record of
+        an earlier download whose file is intact, the request is conditional
+        (`If-None-Match` / `If-Modified-Since`) unless `force` is set, and the
+        `Downloader` skips the transfer on `304 Not Modified`.
+
+        For a task with mirrors, the mirrors whose stats in `mirror_stats`
+        are stale are probed at once, and the most promising one is
+        requested first. Failed requests are retried as `_request` tells.
+
+        The stats of the download are counted from here, and passed to
+        `on_stats` already if the request fails. `filename` is that of the
+        file downloaded, the name in the URL if not given.
+        """
         if isinstance(task_name, str):
-            response = requests.get(self.tasks[task_name].url, stream=True)
-            return Downloader(response)
+            task = self.tasks[task_name]
+            stats = DownloadStats(task.url, task_name=task_name)
+            fetch_record = None
+            if self.fetch_cache is not None and not force:
+                fetch_record = self.fetch_cache.get(task.url)
+                if fetch_record is not None and not fetch_record.is_intact():
+                    fetch_record = None
+            request_kwargs = {
+                "stream": True,
+                "headers": (
+                    fetch_record.conditional_headers() if fetch_record else None
+                ),
+            }
+            urls = [task.url]
+            if task.mirrors:
+                urls = self._rank_mirrors(task.urls)
+                request_kwargs["timeout"] = self.mirror_stall_timeout
+            try:
+                url, response = self._request(task, urls, stats, **request_kwargs)
+            except Exception as e:
+                stats.finish(e)
+                if self.on_stats:
+                    self.on_stats(stats)
+                raise
+            mirror_kwargs = {}
+            if task.mirrors:
+                mirror_kwargs = {
+                    "mirrors": [mirror for mirror in urls if mirror != url],
+                    "mirror_stats": self.mirror_stats,
+                    "stall_timeout": self.mirror_stall_timeout,
+                    # the same name whichever mirror is used
+                    "filename": filename_from_url(task.url),
+                    "requested_url": url,
+                }
+            if filename is not None:
+                mirror_kwargs["filename"] = filename
+            return Downloader(
+                response,
+                session=self.session_pool,
+                bandwidth_limiter=self.bandwidth_limiter,
+                priority=task.priority,
+                fetch_cache=self.fetch_cache,
+                fetch_cache_key=task.url,
+                fetch_record=fetch_record,
+                checksum=task.checksum,
+                stats=stats,
+                on_stats=self.on_stats,
+                postprocess=task.postprocess,
+                postprocess_executor=self.postprocess_executor,
+                concurrency=self.concurrency,
+                write_policy=self.write_policy,
+                content_store=self.content_store,
+                **mirror_kwargs,
+            )
         else:
             raise TypeError("`task_name` must be `str`")
 
+    def _request(
+        self, task: DownloaderTask, urls: list[str], stats: DownloadStats, **kwargs
+    ) -> tuple[str, requests.Response]:
+        """Request the first of `urls` which answers and return it with the
+        response.
+
+        A connection error or a retryable status of `retry_policy` moves on
+        to the next URL, and from the last one back to the first after a
+        jittered backoff, until `retry_policy.max_attempts` rounds failed.
+        Another error status moves on to the next URL, but is returned from
+        the last one. URLs whose host has an open circuit in
+        `circuit_breaker` are not requested.
+
+        Raises:
+            CircuitOpenError: if the circuits of the hosts of every URL are
+                open.
+        """
+        policy = self.retry_policy
+        error: Optional[Exception] = None
+        retry_after = None
+        is_first_request = True
+        for attempt in range(policy.max_attempts):
+            if attempt:
+                time.sleep(policy.delay(attempt - 1, retry_after))
+            retry_after = None
+            is_last_attempt = attempt == policy.max_attempts - 1
+            is_any_allowed = False
+            for i, url in enumerate(urls):
+                is_last_url = i == len(urls) - 1
+                host = host_of_url(url)
+                if not self.circuit_breaker.allow(host):
+                    continue
+                is_any_allowed = True
+                if not is_first_request:
+                    stats.add(retries=1)
+                is_first_request = False
+                try:
+                    response = self.session_pool.get(url, **kwargs)
+                except requests.RequestException as e:
+                    error = e
+                    self._record_request_failure(task, url)
+                    continue
+                if policy.is_retryable_status(response.status_code):
+                    seconds = parse_retry_after(response.headers.get("Retry-After"))
+                    self._record_request_failure(task, url, seconds)
+                    if is_last_attempt and is_last_url:
+                        return url, response
+                    response.close()
+                    if seconds is not None:
+                        retry_after = max(retry_after or 0.0, seconds)
+                    error = requests.HTTPError(
+                        f"{response.status_code} Error for url: {url}",
+                        response=response,
+                    )
+                    continue
+                self.circuit_breaker.record_success(host)
+                if self.concurrency is not None:
+                    self.concurrency.record_ttfb(host, response.elapsed.total_seconds())
+                if response.status_code >= 400 and not is_last_url:
+                    response.close()
+                    self.mirror_stats.record_failure(url)
+                    error = requests.HTTPError(
+                        f"{response.status_code} Error for url: {url}",
+                        response=response,
+                    )
+                    continue
+                return url, response
+            if not is_any_allowed:
+                hosts = ", ".join(dict.fromkeys(map(host_of_url, urls)))
+                raise CircuitOpenError(
+                    f"requests to {hosts} are paused after repeated failures"
+                ) from error
+        raise error
+
+    def _record_request_failure(
+        self, task: DownloaderTask, url: str, retry_after: Optional[float] = None
+    ):
+        host = host_of_url(url)
+        self.circuit_breaker.record_failure(host)
+        if self.concurrency is not None:
+            self.concurrency.record_error(host, retry_after)
+        if task.mirrors:
+            self.mirror_stats.record_failure(url)
+
+    def _rank_mirrors(self, urls: list[str]) -> list[str]:
+        stale_urls = [url for url in urls if not self.mirror_stats.is_fresh(url)]
+        for url, ttfb_s in probe_mirrors(
+            self.session_pool, stale_urls, timeout=self.mirror_probe_timeout
+        ).items():
+            self.mirror_stats.record_probe(url, ttfb_s)
+        return self.mirror_stats.rank(urls)
+
     def save_tasks_to_json(
         self, dirpath_for_dest: Path | str, filename_without_ext_str: str
     ):
-        with open(
-            Path(dirpath_for_dest).absolute() / f"{filename_without_ext_str}.json", "w"
-        ) as f:
-            f.write(to_json(self.tasks))
+        """Write the tasks as they are iterated, never as one whole string.
+
+        The tasks go to a temporary file renamed over the old one, so a
+        reader never sees half a file and saves made at the same time leave
+        the whole file of one of them.
+        """
+        filepath = (
+            Path(dirpath_for_dest).absolute() / f"{filename_without_ext_str}.json"
+        )
+        tmp_filepath = filepath.with_name(f"{filepath.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_filepath, "w", encoding="utf-8") as f:
+                write_json_object(
+                    f, ((name, task.to_dict()) for name, task in self.tasks.items())
+                )
+            os.replace(tmp_filepath, filepath)
+        except BaseException:
+            tmp_filepath.unlink(missing_ok=True)
+            raise
 
     def load_tasks_from_json(self, filepath: Path | str):
+        """Read the tasks a chunk of the file at a time.
+
+        Raises:
+            ValueError: the file is not JSON or holds something which is not
+                a task.
+        """
         if not Path(filepath).exists():
             raise FileNotFoundError()
         with open(Path(filepath), encoding="utf-8") as f:
-            self.tasks = from_json(dict[str, DownloaderTask], f.read())
+            self.tasks = {
+                name: DownloaderTask.from_dict(data)
+                for name, data in iter_json_object(f)
+            }
+
+
+@dataclass
+class ProgressEvent:
+    downloaded_bytes: int
+    total_bytes: int = 0
+    bytes_per_sec: float = 0.0
+    done: bool = False
+
+    @property
+    def ratio(self) -> Optional[float]:
+        if self.total_bytes <= 0:
+            return None
+        return min(1.0, self.downloaded_bytes / self.total_bytes)
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Estimated seconds left, or `None` if it cannot be estimated."""
+        if self.done:
+            return 0.0
+        if self.total_bytes <= 0 or self.bytes_per_sec <= 0:
+            return None
+        return max(0, self.total_bytes - self.downloaded_bytes) / self.bytes_per_sec
+
+
+class ProgressThrottle:
+    """Coalesce cumulative byte counts into `ProgressEvent`s.
+
+    An event is emitted once `interval` seconds or `min_bytes` bytes have
+    passed since the previous one, whichever comes first; a threshold of
+    `None` is disabled. The speed is smoothed over the emitted events.
+    """
+
+    smoothing = 0.3
+
+    def __init__(
+        self,
+        total_bytes: int = 0,
+        interval: Optional[float] = 0.1,
+        min_bytes: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.min_bytes = min_bytes
+        self._clock = clock
+        self._last_bytes: Optional[int] = None
+        self._last_time = 0.0
+        self._bytes_per_sec = 0.0
+
+    def _event(self, downloaded_bytes: int, now: float, done=False) -> ProgressEvent:
+        if self._last_bytes is not None and now > self._last_time:
+            bytes_per_sec = (downloaded_bytes - self._last_bytes) / (
+                now - self._last_time
+            )
+            if self._bytes_per_sec:
+                bytes_per_sec = (
+                    self.smoothing * bytes_per_sec
+                    + (1 - self.smoothing) * self._bytes_per_sec
+                )
+            self._bytes_per_sec = bytes_per_sec
+        self._last_bytes = downloaded_bytes
+        self._last_time = now
+        return ProgressEvent(
+            downloaded_bytes, self.total_bytes, self._bytes_per_sec, done
+        )
+
+    def update(self, downloaded_bytes: int) -> Optional[ProgressEvent]:
+        now = self._clock()
+        if self._last_bytes is None:
+            # the first count may include bytes resumed from a `.part` file,
+            # so it only sets the baseline of the speed
+            return self._event(downloaded_bytes, now)
+        if self.interval is None and self.min_bytes is None:
+            return self._event(downloaded_bytes, now)
+        if self.interval is not None and now - self._last_time >= self.interval:
+            return self._event(downloaded_bytes, now)
+        if (
+            self.min_bytes is not None
+            and downloaded_bytes - self._last_bytes >= self.min_bytes
+        ):
+            return self._event(downloaded_bytes, now)
+        return None
+
+    def finish(self, downloaded_bytes: int) -> ProgressEvent:
+        return self._event(downloaded_bytes, self._clock(), done=True)
+
+
+@deserialize
+@serialize
+@dataclass
+class PartialDownload:
+    """Sidecar state of a `.part` file to resume an interrupted download.
+
+    `segments` holds `[start, end, done]` for each byte range, where `end` is
+    `-1` when the size is unknown and `done` is the count of bytes written
+    from `start`.
+    """
+
+    url: str
+    size: int = 0
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    segments: list[list[int]] = field(default_factory=list)
+
+    @property
+    def bytes_done(self) -> int:
+        return sum(done for _, _, done in self.segments)
+
+    @property
+    def validator(self) -> Optional[str]:
+        """Value for `If-Range`; weak ETags are not allowed there."""
+        if self.etag and not self.etag.startswith("W/"):
+            return self.etag
+        return self.last_modified
+
+    def save(self, filepath: Path):
+        tmp_filepath = filepath.with_name(filepath.name + ".tmp")
+        with open(tmp_filepath, "w", encoding="utf-8") as f:
+            f.write(to_json(self))
+        os.replace(tmp_filepath, filepath)
+
+    @classmethod
+    def load(cls, filepath: Path) -> Optional["PartialDownload"]:
+        try:
+            with open(filepath, encoding="utf-8") as f:
+                return from_json(cls, f.read())
+        except (OSError, ValueError, SerdeError):
+            return None
 
 
 class Downloader:
-    def __init__(self, response: requests.Response):
+    # how often the `.part.json` sidecar is rewritten while downloading
+    partial_state_interval = 1.0
+
+    def __init__(
+        self,
+        response: requests.Response,
+        session=None,
+        bandwidth_limiter: Optional[BandwidthLimiter] = None,
+        priority: int = 0,
+        fetch_cache: Optional[FetchCache] = None,
+        fetch_cache_key: Optional[str] = None,
+        fetch_record: Optional[FetchRecord] = None,
+        checksum: Optional[str] = None,
+        stats: Optional[DownloadStats] = None,
+        on_stats: Optional[Callable[[DownloadStats], None]] = None,
+        postprocess: Optional[list[str]] = None,
+        postprocess_executor: Optional[Executor] = None,
+        mirrors: Optional[list[str]] = None,
+        mirror_stats: Optional[MirrorStatsCache] = None,
+        stall_timeout: Optional[float] = None,
+        filename: Optional[str] = None,
+        requested_url: Optional[str] = None,
+        concurrency: Optional[HostConcurrencyController] = None,
+        write_policy: Optional[WritePolicy] = None,
+        content_store: Optional[ContentStore] = None,
+    ):
+        """
+        Args:
+            response (requests.Response): streamed response of the content.
+            session: object with a `requests`-like `get` used for extra
+                requests such as byte ranges. Defaults to `requests`.
+            bandwidth_limiter (BandwidthLimiter): throttles the reads.
+            priority (int): priority of the reads in `bandwidth_limiter`.
+            fetch_cache (FetchCache): records the validators of the finished
+                download under `fetch_cache_key` (the URL by default).
+            fetch_record (FetchRecord): the record `response` was
+                conditionally requested with.
+            checksum (str): expected `algorithm:hexdigest` of the content.
+            stats (DownloadStats): collects the timings of the download,
+                counted from its creation; a new one is made if not given.
+            on_stats (Callable[[DownloadStats], None]): called with `stats`
+                when `download` ends, successfully or not.
+            postprocess (list[str]): stage specs of a `dogaas.postprocess`
+                pipeline the content is streamed through while downloading.
+            postprocess_executor (Executor): see `Pipeline`.
+            mirrors (list[str]): other URLs of the same content, in the
+                order they are tried when a transfer fails or stalls.
+            mirror_stats (MirrorStatsCache): records the transfer rates and
+                failures of the mirrors.
+            stall_timeout (float): seconds without a byte after which the
+                extra requests of the download fail.
+            filename (str): name of the file; taken from the URL of
+                `response` if not given.
+            requested_url (str): the URL `response` was requested with, by
+                which `mirror_stats` knows the mirror if it redirected.
+            concurrency (HostConcurrencyController): fed with the bytes
+                read, by the host of `requested_url`.
+            write_policy (WritePolicy): how the content is written; the
+                defaults of `WritePolicy` if not given.
+            content_store (ContentStore): where the finished file is stored
+                by its digest, which is computed with the algorithm of
+                `checksum`, or SHA-256 without one.
+        """
         self._response = response
+        self._session = session if session is not None else requests
+        self._bandwidth_limiter = bandwidth_limiter
+        self.priority = priority
+        self._fetch_cache = fetch_cache
+        self._fetch_cache_key = fetch_cache_key or response.url
+        self._fetch_record = fetch_record
+        self.checksum = checksum
+        self.postprocess = postprocess or []
+        self._postprocess_executor = postprocess_executor
+        # files and directories made by `postprocess`
+        self.outputs: list[Path] = []
+        self._mirrors = mirrors or []
+        self._mirror_stats = mirror_stats
+        self._stall_timeout = stall_timeout
+        self._filename = filename
+        self._requested_url = requested_url or response.url
+        self._concurrency = concurrency
+        self.write_policy = write_policy if write_policy is not None else WritePolicy()
+        self._content_store = content_store
+        self.skipped = False
+        self.stats = stats if stats is not None else DownloadStats(response.url)
+        self.stats.record_response(response)
+        self._on_stats = on_stats
+        self._aborted = threading.Event()
+        # range requests, whose connections `abort` shuts down too
+        self._range_responses: list[requests.Response] = []
+        self._range_responses_lock = threading.Lock()
 
     @property
     def response(self) -> requests.Response:
         return self._response
 
+    def abort(self):
+        """Stop the download running on another thread, which then raises
+        `DownloadError`; also a transfer waiting for bytes which do not come.
+
+        The `.part` file is kept to resume, as when the connection breaks.
+        """
+        self._aborted.set()
+        with self._range_responses_lock:
+            responses = [self._response, *self._range_responses]
+        for response in responses:
+            shut_down_connection(response)
+
+    def _raise_if_aborted(self):
+        if self._aborted.is_set():
+            raise DownloadError(f"downloading `{self.response.url}` was aborted")
+
     def get_filesize_str(self) -> str:
         return self.response.headers.get("Content-Length", 0)
 
+    def get_filesize(self) -> int:
+        if self.is_not_modified():
+            return self._fetch_record.size
+        try:
+            return int(self.get_filesize_str())
+        except ValueError:
+            return 0
+
+    def is_not_modified(self) -> bool:
+        return self._fetch_record is not None and self.response.status_code == 304
+
+    def supports_range(self) -> bool:
+        headers = self.response.headers
+        return (
+            headers.get("Accept-Ranges", "").lower() == "bytes"
+            and headers.get("Content-Encoding", "identity").lower() == "identity"
+            and self.get_filesize() > 0
+        )
+
+    def dest_filepath(self, dirpath_for_dest: Path | str) -> Path:
+        if self.is_not_modified() and not self._filename:
+            return (
+                Path(dirpath_for_dest).absolute()
+                / Path(self._fetch_record.filepath).name
+            )
+        return Path(dirpath_for_dest).absolute() / (
+            self._filename or filename_from_url(self.response.url)
+        )
+
+    def _throttle(self, nbytes: int) -> float:
+        """Count `nbytes` just read, wait for `bandwidth_limiter` and return
+        the seconds waited."""
+        if self._concurrency is not None:
+            self._concurrency.record_transfer(host_of_url(self._requested_url), nbytes)
+        if not self._bandwidth_limiter:
+            return 0.0
+        started_at = time.perf_counter()
+        self._bandwidth_limiter.acquire(
+            urlparse(self.response.url).hostname or "", nbytes, self.priority
+        )
+        return time.perf_counter() - started_at
+
+    def _new_partial_download(self, segments: int) -> PartialDownload:
+        size = self.get_filesize()
+        if segments > 1:
+            byte_ranges = split_byte_ranges(size, segments)
+        else:
+            byte_ranges = [(0, size - 1)]
+        return PartialDownload(
+            url=self.response.url,
+            size=size,
+            etag=self.response.headers.get("ETag"),
+            last_modified=self.response.headers.get("Last-Modified"),
+            segments=[[start, end, 0] for start, end in byte_ranges],
+        )
+
+    def _resumable_partial_download(
+        self, part_filepath: Path, state_filepath: Path
+    ) -> Optional[PartialDownload]:
+        """Return the saved state if the `.part` file still matches the content."""
+        if not part_filepath.exists():
+            return None
+        state = PartialDownload.load(state_filepath)
+        if (
+            state is None
+            or state.url != self.response.url
+            or state.size != self.get_filesize()
+            or state.validator is None
+            or state.etag != self.response.headers.get("ETag")
+            or state.last_modified != self.response.headers.get("Last-Modified")
+            or not self.response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        ):
+            return None
+        if len(state.segments) == 1:
+            # the sidecar may lag behind or run ahead of what reached the disk
+            state.segments[0][2] = min(
+                state.segments[0][2], part_filepath.stat().st_size
+            )
+        return state
+
     def download(
-        self, dirpath_for_dest: Path | str, chunk_size=1024, yield_progress=True
+        self,
+        dirpath_for_dest: Path | str,
+        chunk_size=64 * 1024,
+        yield_progress=True,
+        segments=1,
+        min_segment_size=1024 * 1024,
+        resume=True,
+        spread_mirrors=False,
     ) -> None | float:
-        dlfile_name = filename_from_url(self.response.url)
-        progress = 0
-        with open(Path(dirpath_for_dest).absolute() / dlfile_name, "wb") as file:
-            for chunk in self.response.iter_content(chunk_size=chunk_size):
-                progress += len(chunk)
-                file.write(chunk)
+        """Write the content into `dirpath_for_dest`.
+
+        The content is written to a `.part` file next to the destination,
+        with a `.part.json` sidecar recording the bytes done and the ETag /
+        Last-Modified validators, and is renamed into place on completion.
+        With `resume`, a `.part` file left by an interrupted download of the
+        same content is continued with a `Range` + `If-Range` request.
+
+        When `segments` is more than 1 and the server supports byte ranges,
+        the content is split into up to `segments` ranges of at least
+        `min_segment_size` bytes which are fetched over parallel connections.
+        Otherwise the response is read as a single stream. With
+        `spread_mirrors`, the segments are fetched from the mirrors
+        round-robin instead of all from the fastest one.
+
+        If the response is `304 Not Modified` to a conditional request, the
+        transfer is skipped and `skipped` is set, as long as the earlier file
+        is the one in `dirpath_for_dest`; otherwise the content is requested
+        again in full.
+
+        The content of a single stream goes through the `postprocess`
+        pipeline as it arrives; segments arrive out of order, so the
+        finished `.part` file is read through it in one pass instead. The
+        outputs are moved into place after the file, and set in `outputs`.
+
+        `stats` is completed and passed to `on_stats` when the download ends,
+        also if it fails or is closed early.
+        """
+        error = None
+        try:
+            yield from self._download(
+                dirpath_for_dest,
+                chunk_size,
+                yield_progress,
+                segments,
+                min_segment_size,
+                resume,
+                spread_mirrors,
+            )
+        except GeneratorExit:
+            error = DownloadError("interrupted")
+            raise
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.stats.skipped = self.skipped
+            self.stats.finish(error)
+            if self._on_stats:
+                self._on_stats(self.stats)
+
+    def _digest_algorithm(self) -> Optional[str]:
+        """The algorithm the content is hashed with, if it is hashed."""
+        if self.checksum:
+            return parse_checksum(self.checksum)[0]
+        if self._content_store is not None:
+            return "sha256"
+        return None
+
+    def _link_not_modified(self, filepath: Path) -> bool:
+        """Put the content of the `304 Not Modified` response at `filepath`,
+        where it was not downloaded, from `content_store`."""
+        record = self._fetch_record
+        if self._content_store is None or not record.digest:
+            return False
+        if not self._content_store.link(record.digest, filepath, record.size):
+            return False
+        if self._fetch_cache is not None:
+            self._fetch_cache.record(
+                self._fetch_cache_key, replace(record, filepath=str(filepath))
+            )
+        return True
+
+    def _download(
+        self,
+        dirpath_for_dest: Path | str,
+        chunk_size: int,
+        yield_progress: bool,
+        segments: int,
+        min_segment_size: int,
+        resume: bool,
+        spread_mirrors: bool,
+    ):
+        if self.is_not_modified():
+            filepath = self.dest_filepath(dirpath_for_dest)
+            if (
+                Path(self._fetch_record.filepath) == filepath
+                and self._fetch_record.is_intact()
+            ) or (not self.postprocess and self._link_not_modified(filepath)):
+                self.skipped = True
                 if yield_progress:
-                    yield progress
+                    yield self._fetch_record.size
+                return
+            self.response.close()
+            self._fetch_record = None
+            self._response = self._session.get(self._fetch_cache_key, stream=True)
+            self.stats.add(retries=1)
+            self.stats.record_response(self._response)
+        filepath = self.dest_filepath(dirpath_for_dest)
+        part_filepath = partial_filepath(filepath)
+        state_filepath = partial_state_filepath(filepath)
+        state = None
+        if resume:
+            state = self._resumable_partial_download(part_filepath, state_filepath)
+        if state is None:
+            segments = min(
+                segments, -(-self.get_filesize() // max(1, min_segment_size))
+            )
+            if not self.supports_range():
+                segments = 1
+            state = self._new_partial_download(segments)
+            # a state left over would describe bytes this truncates
+            state_filepath.unlink(missing_ok=True)
+            with open(part_filepath, "wb") as file:
+                if len(state.segments) > 1:
+                    # segments are written at their offsets in parallel
+                    if self.write_policy.preallocate:
+                        preallocate(file, state.size)
+                    else:
+                        file.truncate(state.size)
+        elif state.bytes_done > 0:
+            # the body of the first response is not needed any more
+            self.response.close()
+        self.stats.segments = len(state.segments)
+        self.stats.resumed_bytes = state.bytes_done
+        hasher = None
+        algorithm = self._digest_algorithm()
+        pipeline = None
+        if self.postprocess:
+            pipeline = Pipeline(self.postprocess, filepath, self._postprocess_executor)
+        try:
+            if len(state.segments) > 1:
+                progresses = self._download_segments(
+                    part_filepath, state_filepath, state, chunk_size, spread_mirrors
+                )
+            else:
+                if algorithm:
+                    hasher = StreamingHasher(algorithm)
+                progresses = self._download_stream(
+                    part_filepath,
+                    state_filepath,
+                    state,
+                    chunk_size,
+                    [consumer for consumer in (hasher, pipeline) if consumer],
+                )
+            try:
+                for progress in progresses:
+                    if yield_progress:
+                        yield progress
+            finally:
+                if hasher:
+                    hasher.close()
+            if len(state.segments) > 1 and self.write_policy.fsync != "never":
+                fsync_path(part_filepath)
+            digest = None
+            if algorithm:
+                if hasher is None:
+                    # segments arrive out of order, so the file is hashed whole
+                    hasher = StreamingHasher(algorithm)
+                    hasher.update_from_file(part_filepath, part_filepath.stat().st_size)
+                if self.checksum:
+                    self._verify_checksum(part_filepath, state_filepath, hasher)
+                digest = f"{algorithm}:{hasher.hexdigest()}"
+            if pipeline and len(state.segments) > 1:
+                pipeline.update_from_file(part_filepath, state.size)
+            os.replace(part_filepath, filepath)
+            state_filepath.unlink(missing_ok=True)
+            if self._content_store is not None:
+                self._content_store.add(filepath, digest)
+            if pipeline:
+                started_at = time.perf_counter()
+                self.outputs = pipeline.close()
+                self.stats.add(postprocess_s=time.perf_counter() - started_at)
+        except BaseException:
+            if pipeline:
+                pipeline.abort()
+            raise
+        if self._fetch_cache is not None:
+            self._fetch_cache.record(
+                self._fetch_cache_key,
+                FetchRecord(
+                    filepath=str(filepath),
+                    size=filepath.stat().st_size,
+                    etag=state.etag,
+                    last_modified=state.last_modified,
+                    digest=digest,
+                ),
+            )
+
+    def iter_progress(
+        self,
+        dirpath_for_dest: Path | str,
+        interval: Optional[float] = 0.1,
+        min_bytes: Optional[int] = None,
+        **download_kwargs,
+    ) -> Iterator[ProgressEvent]:
+        """Download like `download` but yield coalesced `ProgressEvent`s.
+
+        See `ProgressThrottle` for `interval` and `min_bytes`. The last event
+        has `done` set.
+        """
+        throttle = ProgressThrottle(self.get_filesize(), interval, min_bytes)
+        progress = 0
+        for progress in self.download(
+            dirpath_for_dest, yield_progress=True, **download_kwargs
+        ):
+            if event := throttle.update(progress):
+                yield event
+        yield throttle.finish(progress)
+
+    def _verify_checksum(
+        self,
+        part_filepath: Path,
+        state_filepath: Path,
+        hasher: StreamingHasher,
+    ):
+        """Compare the digest of the content `hasher` was fed with `checksum`.
+
+        Raises:
+            ChecksumMismatchError: the `.part` file is removed as well, since
+                resuming it could not fix the content.
+        """
+        algorithm, expected_hexdigest = parse_checksum(self.checksum)
+        if (hexdigest := hasher.hexdigest()) != expected_hexdigest:
+            part_filepath.unlink(missing_ok=True)
+            state_filepath.unlink(missing_ok=True)
+            raise ChecksumMismatchError(
+                f"{algorithm} of `{self.response.url}` is {hexdigest}"
+                f" but {expected_hexdigest} is expected"
+            )
+
+    def _download_stream(
+        self,
+        part_filepath: Path,
+        state_filepath: Path,
+        state: PartialDownload,
+        chunk_size: int,
+        consumers: Iterable[StreamingHasher | Pipeline] = (),
+    ):
+        """Write the response into `part_filepath`, also handing every byte
+        of the content to `consumers` in order.
+
+        If the transfer fails or stalls, the rest is requested from the
+        mirrors in turn."""
+        segment = state.segments[0]
+        if 0 <= segment[1] < segment[2]:
+            # everything was written before the rename was interrupted
+            for consumer in consumers:
+                consumer.update_from_file(part_filepath, segment[2])
+            yield segment[2]
+            return
+        url = self.response.url
+        mirrors = list(self._mirrors)
+        response = self.response
+        if segment[2] > 0:
+            try:
+                response = self._request_range(segment[2], segment[1], state.validator)
+            except requests.RequestException as e:
+                url, response = self._fail_over(url, mirrors, segment[2], state.size, e)
+            else:
+                if response.status_code == 200:
+                    # If-Range did not match, so the whole content is sent again
+                    segment[2] = 0
+                    self.stats.resumed_bytes = 0
+                elif response.status_code != 206:
+                    # e.g. 416 or 503: the `.part` file is kept to resume later
+                    response.close()
+                    response.raise_for_status()
+                    raise DownloadError(
+                        f"resuming `{url}` was answered {response.status_code}"
+                    )
+        for consumer in consumers:
+            # bytes kept from the interrupted download are part of the content
+            consumer.update_from_file(part_filepath, segment[2])
+        saved_at = time.monotonic()
+        read_s = [0.0]
+        throttle_s = 0.0
+        downloaded_bytes = 0
+        resumed_bytes = segment[2]
+        policy = self.write_policy
+        writer = None
+        try:
+            with open(part_filepath, "r+b") as file:
+                file.seek(segment[2])
+                file.truncate()
+                if policy.preallocate:
+                    preallocate(file, state.size)
+                buffer_size = policy.buffer_size
+                if state.size > 0:
+                    buffer_size = max(1, min(buffer_size, state.size - segment[2]))
+                writer = FileWriter(
+                    file, BufferPool(buffer_size, policy.buffers), policy.fsync
+                )
+                try:
+                    while True:
+                        started_at = time.perf_counter()
+                        bytes_before = downloaded_bytes
+                        try:
+                            with response:
+                                for chunk in timed_chunks(
+                                    response.iter_content(chunk_size=chunk_size), read_s
+                                ):
+                                    throttle_s += self._throttle(len(chunk))
+                                    # the disk catches up on the writer's thread
+                                    writer.write(chunk)
+                                    downloaded_bytes += len(chunk)
+                                    for consumer in consumers:
+                                        consumer.update(chunk)
+                                    segment[2] += len(chunk)
+                                    if (
+                                        time.monotonic() - saved_at
+                                        >= self.partial_state_interval
+                                    ):
+                                        writer.checkpoint()
+                                        state.save(state_filepath)
+                                        saved_at = time.monotonic()
+                                    yield segment[2]
+                        except requests.RequestException as e:
+                            # the bytes queued to the writer are kept, so the
+                            # next mirror goes on after the last byte read
+                            url, response = self._fail_over(
+                                url, mirrors, segment[2], state.size, e
+                            )
+                            continue
+                        self._record_transfer(
+                            url,
+                            downloaded_bytes - bytes_before,
+                            time.perf_counter() - started_at,
+                        )
+                        break
+                    # a shut down connection may end like a whole body
+                    self._raise_if_aborted()
+                    writer.close()
+                finally:
+                    try:
+                        # keep the bytes read before an interruption to resume
+                        writer.close()
+                    except Exception:
+                        # the error of the transfer, if any, is the one raised
+                        pass
+                    segment[2] = resumed_bytes + writer.written_bytes
+                    # the rest of the preallocation goes, so that the size of
+                    # the `.part` file is the bytes written, as resuming checks
+                    file.truncate(segment[2])
+        finally:
+            state.save(state_filepath)
+            self.stats.add(
+                read_s=read_s[0],
+                write_s=writer.write_s if writer is not None else 0.0,
+                throttle_s=throttle_s,
+                downloaded_bytes=downloaded_bytes,
+            )
+
+    def _mirror_of(self, url: str) -> str:
+        """The URL `mirror_stats` knows the mirror serving `url` by."""
+        return self._requested_url if url == self.response.url else url
+
+    def _record_transfer(self, url: str, nbytes: int, seconds: float):
+        if self._mirror_stats is not None:
+            self._mirror_stats.record_transfer(self._mirror_of(url), nbytes, seconds)
+
+    def _record_failure(self, url: str):
+        if self._mirror_stats is not None:
+            self._mirror_stats.record_failure(self._mirror_of(url))
+
+    def _fail_over(
+        self,
+        url: str,
+        mirrors: list[str],
+        start: int,
+        size: int,
+        error: Exception,
+    ) -> tuple[str, requests.Response]:
+        """Request the content from byte `start` on from the next mirror
+        which sends it, removing the mirrors tried from `mirrors`.
+
+        Raises:
+            Exception: `error`, when no mirror is left.
+        """
+        self._record_failure(url)
+        while mirrors:
+            url = mirrors.pop(0)
+            self.stats.add(retries=1)
+            try:
+                response = self._request_range(
+                    start, size - 1 if size > 0 else -1, url=url
+                )
+            except requests.RequestException:
+                pass
+            else:
+                if self._is_range_of(response, start, size):
+                    return url, response
+                response.close()
+            self._record_failure(url)
+        raise error
+
+    @staticmethod
+    def _is_range_of(response: requests.Response, start: int, size: int) -> bool:
+        """Whether `response` is the content of `size` bytes from `start` on,
+        the check for mirrors which cannot be asked with `If-Range`."""
+        if response.status_code == 200:
+            return start == 0
+        if response.status_code != 206:
+            return False
+        content_range = response.headers.get("Content-Range", "")
+        match = re.fullmatch(r"bytes (\d+)-\d+/(\d+|\*)", content_range.strip())
+        return (
+            match is not None
+            and int(match[1]) == start
+            and match[2] in (str(size), "*")
+        )
+
+    def _request_range(
+        self,
+        start: int,
+        end: int,
+        validator: Optional[str] = None,
+        url: Optional[str] = None,
+    ) -> requests.Response:
+        headers = {"Range": f"bytes={start}-{end if end >= 0 else ''}"}
+        if validator:
+            headers["If-Range"] = validator
+        kwargs = {}
+        if self._stall_timeout is not None:
+            kwargs["timeout"] = self._stall_timeout
+        self._raise_if_aborted()
+        response = self._session.get(
+            url or self.response.url, headers=headers, stream=True, **kwargs
+        )
+        with self._range_responses_lock:
+            self._range_responses.append(response)
+        # aborted while requesting
+        if self._aborted.is_set():
+            response.close()
+            self._raise_if_aborted()
+        self.stats.record_response(response)
+        return response
+
+    def _fetch_segment(
+        self,
+        part_filepath: Path,
+        chunk_size: int,
+        segment: list[int],
+        validator: Optional[str],
+        response: Optional[requests.Response],
+        progress_queue: queue.Queue,
+        stop: threading.Event,
+        urls: Optional[list[str]] = None,
+    ):
+        """Fetch the rest of `segment` from the first of `urls`, going on
+        with the next one whenever a request fails or ends early."""
+        urls = list(urls or [self.response.url])
+        url = urls.pop(0)
+        start, end, _ = segment
+        while start + segment[2] <= end:
+            try:
+                if response is None:
+                    # mirrors have validators of their own
+                    response = self._request_range(
+                        start + segment[2],
+                        end,
+                        validator if url == self.response.url else None,
+                        url=url,
+                    )
+                    if response.status_code != 206 or (
+                        url != self.response.url
+                        and not self._is_range_of(
+                            response, start + segment[2], self.get_filesize()
+                        )
+                    ):
+                        response.close()
+                        raise DownloadError(
+                            f"expected 206 for range {start + segment[2]}-{end} of"
+                            f" `{url}` but got {response.status_code}"
+                        )
+                self._fetch_range(
+                    part_filepath,
+                    chunk_size,
+                    segment,
+                    url,
+                    response,
+                    progress_queue,
+                    stop,
+                )
+                if stop.is_set():
+                    return
+                if start + segment[2] <= end:
+                    raise DownloadError(f"range {start}-{end} of `{url}` ended early")
+            except (requests.RequestException, DownloadError):
+                if stop.is_set() or not urls:
+                    raise
+                self._record_failure(url)
+                self.stats.add(retries=1)
+                url = urls.pop(0)
+                response = None
+
+    def _fetch_range(
+        self,
+        part_filepath: Path,
+        chunk_size: int,
+        segment: list[int],
+        url: str,
+        response: requests.Response,
+        progress_queue: queue.Queue,
+        stop: threading.Event,
+    ):
+        start, end, _ = segment
+        started_at = time.perf_counter()
+        read_s = [0.0]
+        write_s = throttle_s = 0.0
+        downloaded_bytes = 0
+        # unbuffered, so the bytes counted in `segment` have reached the OS
+        try:
+            with response, open(part_filepath, "r+b", buffering=0) as file:
+                file.seek(start + segment[2])
+                for chunk in timed_chunks(
+                    response.iter_content(chunk_size=chunk_size), read_s
+                ):
+                    if stop.is_set():
+                        return
+                    chunk = chunk[: end - start + 1 - segment[2]]
+                    throttle_s += self._throttle(len(chunk))
+                    write_started_at = time.perf_counter()
+                    file.write(chunk)
+                    write_s += time.perf_counter() - write_started_at
+                    downloaded_bytes += len(chunk)
+                    segment[2] += len(chunk)
+                    progress_queue.put(len(chunk))
+                    if start + segment[2] > end:
+                        break
+        finally:
+            self.stats.add(
+                read_s=read_s[0],
+                write_s=write_s,
+                throttle_s=throttle_s,
+                downloaded_bytes=downloaded_bytes,
+            )
+            self._record_transfer(
+                url, downloaded_bytes, time.perf_counter() - started_at
+            )
+
+    def _save_segments_state(
+        self, part_filepath: Path, state_filepath: Path, state: PartialDownload
+    ):
+        """Save `state` while segments are being written; with the
+        `checkpoint` fsync policy, only the counts of bytes already on disk."""
+        if self.write_policy.fsync != "checkpoint":
+            state.save(state_filepath)
+            return
+        # the counts are taken before the fsync, so they never run ahead of it
+        snapshot = replace(
+            state, segments=[list(segment) for segment in state.segments]
+        )
+        fsync_path(part_filepath)
+        snapshot.save(state_filepath)
+
+    def _download_segments(
+        self,
+        part_filepath: Path,
+        state_filepath: Path,
+        state: PartialDownload,
+        chunk_size: int,
+        spread_mirrors: bool = False,
+    ):
+        urls = [self.response.url, *self._mirrors]
+        progress_queue = queue.Queue()
+        stop = threading.Event()
+        progress = state.bytes_done
+        saved_at = time.monotonic()
+
+        def urls_for(i: int) -> list[str]:
+            """Every URL to try for segment `i`, the first one spread over
+            the mirrors round-robin with `spread_mirrors`."""
+            if not spread_mirrors:
+                return urls
+            i %= len(urls)
+            return urls[i:] + urls[:i]
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(state.segments)) as executor:
+                futures = [
+                    executor.submit(
+                        self._fetch_segment,
+                        part_filepath,
+                        chunk_size,
+                        segment,
+                        state.validator,
+                        # the first range reuses the stream opened from byte 0
+                        self.response if i == 0 and progress == 0 else None,
+                        progress_queue,
+                        stop,
+                        urls_for(i),
+                    )
+                    for i, segment in enumerate(state.segments)
+                ]
+                try:
+                    while True:
+                        if time.monotonic() - saved_at >= self.partial_state_interval:
+                            self._save_segments_state(
+                                part_filepath, state_filepath, state
+                            )
+                            saved_at = time.monotonic()
+                        try:
+                            progress += progress_queue.get(timeout=0.05)
+                        except queue.Empty:
+                            if all(f.done() for f in futures) or any(
+                                f.done() and f.exception() for f in futures
+                            ):
+                                break
+                            continue
+                        while not progress_queue.empty():
+                            progress += progress_queue.get_nowait()
+                        yield progress
+                finally:
+                    stop.set()
+        finally:
+            state.save(state_filepath)
+        for future in futures:
+            future.result()
+        if not progress_queue.empty():
+            while not progress_queue.empty():
+                progress += progress_queue.get_nowait()
+            yield progress
+
+
+@dataclass
+class DownloadResult:
+    task_name: str
+    filepath: Optional[Path] = None
+    downloaded_bytes: int = 0
+    error: Optional[Exception] = None
+    skipped: bool = False
+    stats: Optional[DownloadStats] = None
+    # the task whose transfer was shared instead of making one
+    coalesced_with: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def share_download_result(
+    leader: DownloadResult,
+    task_name: str,
+    dirpath_for_dest: Path | str,
+    filename: Optional[str] = None,
+) -> DownloadResult:
+    """The result of `task_name` from the transfer of the same content made
+    for `leader`, whose file is placed as `filename` in `dirpath_for_dest`,
+    the name of the file of `leader` if not given."""
+    result = DownloadResult(
+        task_name,
+        filepath=leader.filepath,
+        downloaded_bytes=leader.downloaded_bytes,
+        error=leader.error,
+        skipped=leader.skipped,
+        coalesced_with=leader.task_name,
+    )
+    if not leader.ok or leader.filepath is None:
+        return result
+    filepath = Path(dirpath_for_dest).absolute() / (filename or leader.filepath.name)
+    if filepath != leader.filepath:
+        try:
+            place_file(leader.filepath, filepath)
+        except OSError as e:
+            result.error = e
+        result.filepath = filepath
+    return result
+
+
+class DownloadScheduler:
+    """Run many tasks of a `TaskManager` on a bounded pool of worker threads."""
+
+    def __init__(
+        self,
+        task_manager: TaskManager,
+        jobs: int = 4,
+        chunk_size=64 * 1024,
+        segments: int = 1,
+        resume: bool = True,
+        progress_interval: Optional[float] = 0.1,
+        force: bool = False,
+        spread_mirrors: bool = False,
+        order: str = "priority",
+    ):
+        """
+        Args:
+            order (str): how tasks of the same priority are taken, one of
+                `ORDERS`; see `TaskManager.sort_task_names`.
+        """
+        if not isinstance(task_manager, TaskManager):
+            raise TypeError("`task_manager` must be `TaskManager`")
+        if jobs < 1:
+            raise ValueError("`jobs` must be 1 or more")
+        self.task_manager = task_manager
+        self.jobs = jobs
+        self.chunk_size = chunk_size
+        self.segments = segments
+        self.resume = resume
+        self.progress_interval = progress_interval
+        self.force = force
+        self.spread_mirrors = spread_mirrors
+        if order not in ORDERS:
+            raise ValueError(f"`order` must be one of {ORDERS}")
+        self.order = order
+        self._lock = threading.Lock()
+        self._progress: dict[str, tuple[int, int]] = {}
+
+    @property
+    def downloaded_bytes(self) -> int:
+        with self._lock:
+            return sum(done for done, _ in self._progress.values())
+
+    @property
+    def total_bytes(self) -> int:
+        """Sum of the sizes known so far; grows as tasks start."""
+        with self._lock:
+            return sum(total for _, total in self._progress.values())
+
+    def _update_progress(self, task_name: str, done: int, total: int):
+        with self._lock:
+            self._progress[task_name] = (done, total)
+
+    def _run_task(
+        self,
+        task_name: str,
+        dirpath_for_dest: Path | str,
+        on_progress: Optional[Callable[[str, ProgressEvent], None]],
+        filename: Optional[str] = None,
+    ) -> DownloadResult:
+        """Download a task into `filename` in `dirpath_for_dest`, the name
+        in its URL if not given.
+
+        The content is linked from the content store of `task_manager` when
+        its checksum is stored there, and a task of the same content being
+        downloaded already, from another `run` too, shares that transfer.
+        """
+        task = self.task_manager.tasks[task_name]
+        filepath = Path(dirpath_for_dest).absolute() / (
+            filename or filename_from_url(task.url)
+        )
+        if not self.force and self.task_manager.link_from_store(task_name, filepath):
+            return DownloadResult(
+                task_name, filepath, filepath.stat().st_size, skipped=True
+            )
+        leader, is_shared = self.task_manager.single_flight.do(
+            self.task_manager.content_key(task_name),
+            lambda: self._transfer(task_name, dirpath_for_dest, on_progress, filename),
+        )
+        if not is_shared:
+            return leader
+        if (
+            task.postprocess
+            and leader.filepath is not None
+            and leader.filepath != filepath.with_name(filename or leader.filepath.name)
+        ):
+            # the outputs of the pipeline are made next to the file
+            return self._transfer(task_name, dirpath_for_dest, on_progress, filename)
+        return share_download_result(leader, task_name, dirpath_for_dest, filename)
+
+    def _transfer(
+        self,
+        task_name: str,
+        dirpath_for_dest: Path | str,
+        on_progress: Optional[Callable[[str, ProgressEvent], None]],
+        filename: Optional[str] = None,
+    ) -> DownloadResult:
+        """Download a task, retrying a transfer which broke off.
+
+        A transfer failing with a `requests` error is started again after a
+        backoff of `retry_policy`, resuming the `.part` file with `resume`.
+        Failed requests are already retried by `make_downloader_from_task`.
+        """
+        result = DownloadResult(task_name)
+        policy = self.task_manager.retry_policy
+        concurrency = self.task_manager.concurrency
+        for attempt in range(policy.max_attempts):
+            is_transferring = False
+            try:
+                downloader = self.task_manager.make_downloader_from_task(
+                    task_name, force=self.force, filename=filename
+                )
+                downloader.stats.add(retries=attempt)
+                result.stats = downloader.stats
+                try:
+                    downloader.response.raise_for_status()
+                except requests.HTTPError as e:
+                    downloader.response.close()
+                    downloader.stats.finish(e)
+                    if self.task_manager.on_stats:
+                        self.task_manager.on_stats(downloader.stats)
+                    raise
+                result.filepath = downloader.dest_filepath(dirpath_for_dest)
+                self._update_progress(task_name, 0, downloader.get_filesize())
+                is_transferring = True
+                for event in downloader.iter_progress(
+                    dirpath_for_dest,
+                    interval=self.progress_interval,
+                    chunk_size=self.chunk_size,
+                    segments=self.segments,
+                    resume=self.resume,
+                    spread_mirrors=self.spread_mirrors,
+                ):
+                    result.downloaded_bytes = event.downloaded_bytes
+                    self._update_progress(
+                        task_name, event.downloaded_bytes, event.total_bytes
+                    )
+                    if on_progress:
+                        on_progress(task_name, event)
+                result.skipped = downloader.skipped
+                result.error = None
+                break
+            except Exception as e:
+                result.error = e
+                if (
+                    not is_transferring
+                    or not isinstance(e, requests.RequestException)
+                    or attempt == policy.max_attempts - 1
+                ):
+                    break
+                if concurrency is not None:
+                    concurrency.record_error(
+                        host_of_url(self.task_manager.tasks[task_name].url)
+                    )
+                time.sleep(policy.delay(attempt))
+        return result
+
+    def run(
+        self,
+        dirpath_for_dest: Path | str,
+        task_names: Optional[Iterable[str]] = None,
+        on_progress: Optional[Callable[[str, ProgressEvent], None]] = None,
+        on_done: Optional[Callable[[DownloadResult], None]] = None,
+        filenames: Optional[dict[str, str]] = None,
+    ) -> list[DownloadResult]:
+        """Download `task_names` (all tasks if `None`) into `dirpath_for_dest`.
+
+        `on_progress` and `on_done` are called from worker threads, the former
+        at most every `progress_interval` seconds per task. Errors do not stop
+        the batch; they are reported on each `DownloadResult`.
+
+        Tasks of the same content are downloaded once, by the most urgent of
+        them, and the others share its result. URLs of different content
+        which have the same filename are saved under the names of
+        `TaskManager.dest_filenames`, or of `filenames` if given, e.g. as
+        resolved over more tasks than the batch.
+
+        Returns:
+            list[DownloadResult]: results in the order of `task_names`.
+        """
+        if task_names is None:
+            task_names = self.task_manager.select_task_names()
+        task_names = list(dict.fromkeys(task_names))
+        for task_name in task_names:
+            if task_name not in self.task_manager.tasks:
+                raise KeyError(task_name)
+        with self._lock:
+            self._progress = {}
+        results: dict[str, DownloadResult] = {}
+        priorities = {
+            task_name: self.task_manager.tasks[task_name].priority
+            for task_name in task_names
+        }
+        task_names_by_priority = self.task_manager.sort_task_names(
+            task_names, self.order
+        )
+        if filenames is None:
+            filenames = self.task_manager.dest_filenames(task_names, dirpath_for_dest)
+        followers = self.task_manager.group_same_content(task_names_by_priority)
+
+        def done(leader: DownloadResult):
+            for task_name in [leader.task_name, *followers[leader.task_name]]:
+                result = leader
+                if task_name != leader.task_name:
+                    result = share_download_result(
+                        leader, task_name, dirpath_for_dest, filenames.get(task_name)
+                    )
+                results[task_name] = result
+                if on_done:
+                    on_done(result)
+
+        task_names_to_run = [
+            name for name in task_names_by_priority if name in followers
+        ]
+        if self.task_manager.concurrency is not None:
+            for result in self._run_by_host(
+                task_names_to_run,
+                priorities,
+                dirpath_for_dest,
+                on_progress,
+                filenames,
+            ):
+                done(result)
+        else:
+            # workers pick tasks up in submission order, so urgent ones go first
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                futures = {
+                    executor.submit(
+                        self._run_task,
+                        task_name,
+                        dirpath_for_dest,
+                        on_progress,
+                        filenames.get(task_name),
+                    ): task_name
+                    for task_name in task_names_to_run
+                }
+                try:
+                    for future in as_completed(futures):
+                        done(future.result())
+                except BaseException:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+        return [results[task_name] for task_name in task_names]
+
+    def _run_by_host(
+        self,
+        task_names: list[str],
+        priorities: dict[str, int],
+        dirpath_for_dest: Path | str,
+        on_progress: Optional[Callable[[str, ProgressEvent], None]],
+        filenames: Optional[dict[str, str]] = None,
+    ) -> Iterator[DownloadResult]:
+        """Run `task_names`, urgent ones first, within the per-host limits of
+        `task_manager.concurrency`, yielding the results as they come.
+
+        A free worker takes the most urgent task among the hosts with a free
+        slot, so a host at its limit or backing off does not hold up the
+        tasks of the others.
+        """
+        concurrency = self.task_manager.concurrency
+        queues: dict[str, deque[str]] = {}
+        for task_name in task_names:
+            host = host_of_url(self.task_manager.tasks[task_name].url)
+            queues.setdefault(host, deque()).append(task_name)
+        lock = threading.Lock()
+        stop = threading.Event()
+        results: queue.Queue[DownloadResult] = queue.Queue()
+
+        def take() -> Optional[tuple[str, str]]:
+            while not stop.is_set():
+                with lock:
+                    if not queues:
+                        return None
+                    for host in sorted(
+                        queues, key=lambda host: -priorities[queues[host][0]]
+                    ):
+                        if concurrency.try_acquire(host):
+                            task_name = queues[host].popleft()
+                            if not queues[host]:
+                                del queues[host]
+                            return host, task_name
+                concurrency.wait(0.1)
+            return None
+
+        def work():
+            while (taken := take()) is not None:
+                host, task_name = taken
+                try:
+                    result = self._run_task(
+                        task_name,
+                        dirpath_for_dest,
+                        on_progress,
+                        (filenames or {}).get(task_name),
+                    )
+                finally:
+                    concurrency.release(host)
+                results.put(result)
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [executor.submit(work) for _ in range(self.jobs)]
+            try:
+                for _ in task_names:
+                    while True:
+                        try:
+                            yield results.get(timeout=0.1)
+                            break
+                        except queue.Empty:
+                            for future in futures:
+                                if future.done() and future.exception():
+                                    raise future.exception()
+            finally:
+                stop.set()
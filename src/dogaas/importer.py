@@ -0,0 +1,81 @@
+from typing import Iterable, Iterator, Optional
+import json
+import csv
+
+FORMATS = ("urls", "csv", "jsonl")
+
+TaskEntry = tuple[Optional[str], str]
+
+
+def detect_format(filename: str) -> str:
+    """Guess the format of a task list from its file name; `urls` by default."""
+    lowered_filename = filename.lower()
+    if lowered_filename.endswith(".csv"):
+        return "csv"
+    if lowered_filename.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    return "urls"
+
+
+def iter_url_lines(lines: Iterable[str]) -> Iterator[TaskEntry]:
+    """One URL per line. Blank lines and lines starting with `#` are skipped."""
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield None, line
+
+
+def iter_csv_rows(lines: Iterable[str]) -> Iterator[TaskEntry]:
+    """`name,url` or `url` rows, optionally under a header naming the columns."""
+    name_column, url_column = None, 0
+    is_first_row = True
+    for row in csv.reader(lines):
+        row = [cell.strip() for cell in row]
+        if not any(row):
+            continue
+        if is_first_row:
+            is_first_row = False
+            header = [cell.lower() for cell in row]
+            if "url" in header:
+                url_column = header.index("url")
+                name_column = header.index("name") if "name" in header else None
+                continue
+            if len(row) >= 2:
+                name_column, url_column = 0, 1
+        url = row[url_column] if url_column < len(row) else ""
+        name = None
+        if name_column is not None and name_column < len(row):
+            name = row[name_column]
+        yield name or None, url
+
+
+def iter_jsonl_objects(lines: Iterable[str]) -> Iterator[TaskEntry]:
+    """`{"name": ..., "url": ...}` per line; `name` is optional. A line which
+    is not such an object is passed through as the URL so it fails validation.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            obj = json.loads(line)
+        except ValueError:
+            yield None, line
+            continue
+        if isinstance(obj, dict) and isinstance(obj.get("url"), str):
+            name = obj.get("name")
+            yield name if isinstance(name, str) and name else None, obj["url"]
+        else:
+            yield None, line
+
+
+def iter_task_entries(lines: Iterable[str], format: str) -> Iterator[TaskEntry]:
+    """Stream `(name or None, url)` from the lines of a task list."""
+    if format == "urls":
+        return iter_url_lines(lines)
+    elif format == "csv":
+        return iter_csv_rows(lines)
+    elif format == "jsonl":
+        return iter_jsonl_objects(lines)
+    else:
+        raise ValueError(f"`{format}` is not one of {', '.join(FORMATS)}")
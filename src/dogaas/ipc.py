@@ -0,0 +1,122 @@
+"""Client side of the local API of `dogaas.daemon`.
+
+The daemon listens on a Unix socket. Each request is one line of JSON,
+`{"method": ..., "params": {...}}`, answered by one line of JSON holding
+either `{"result": ...}` or `{"error": {"type": ..., "message": ...}}`.
+`watch` is the exception: it is answered with a line per progress
+snapshot until the client hangs up or, with `until_done`, no download is
+left.
+
+Only the standard library is imported here, so thin clients such as
+`cli_app` talk to the daemon without loading the download stack.
+"""
+
+from pathlib import Path
+from typing import Any, Iterator, Optional
+import threading
+import socket
+import json
+
+
+class DaemonError(Exception):
+    """An error raised by the daemon while handling a request."""
+
+    def __init__(self, error_type: str, message: str):
+        super().__init__(f"{error_type}: {message}" if message else error_type)
+        self.error_type = error_type
+        self.message = message
+
+
+def encode_message(message: dict) -> bytes:
+    return json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def decode_message(line: bytes) -> dict:
+    return json.loads(line.decode("utf-8"))
+
+
+class DaemonClient:
+    """Connection to a running daemon.
+
+    Requests from several threads are sent one at a time.
+    """
+
+    def __init__(self, socket_path: Path | str, timeout: Optional[float] = 10):
+        self.socket_path = str(socket_path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        try:
+            self._socket.connect(self.socket_path)
+        except OSError:
+            self._socket.close()
+            raise
+        self._file = self._socket.makefile("rwb")
+        self._lock = threading.Lock()
+
+    @classmethod
+    def connect(cls, socket_path: Path | str) -> Optional["DaemonClient"]:
+        """Return a client if a daemon listens on `socket_path`, else `None`."""
+        if not Path(socket_path).exists():
+            return None
+        try:
+            return cls(socket_path)
+        except OSError:
+            return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _send(self, method: str, params: dict):
+        self._file.write(encode_message({"method": method, "params": params}))
+        self._file.flush()
+
+    def _receive(self) -> Optional[dict]:
+        line = self._file.readline()
+        if not line:
+            return None
+        response = decode_message(line)
+        if "error" in response:
+            raise DaemonError(
+                response["error"]["type"], response["error"].get("message", "")
+            )
+        return response
+
+    def call(self, method: str, **params) -> Any:
+        """Send a request and return its result.
+
+        Raises:
+            DaemonError: the daemon raised an error for the request.
+            ConnectionError: the daemon closed the connection.
+        """
+        with self._lock:
+            self._send(method, params)
+            response = self._receive()
+        if response is None:
+            raise ConnectionError("the daemon closed the connection")
+        return response.get("result")
+
+    def watch(
+        self, interval: float = 0.5, until_done: bool = False
+    ) -> Iterator[dict[str, dict]]:
+        """Yield the progress of every download every `interval` seconds.
+
+        The connection is used up by watching; use another client for other
+        requests meanwhile. Closing the client from another thread ends the
+        watch.
+        """
+        self._socket.settimeout(None)
+        self._send("watch", {"interval": interval, "until_done": until_done})
+        while (response := self._receive()) is not None:
+            yield response["result"]
+
+    def close(self):
+        try:
+            # wake up a thread blocked in reading a response
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._file.close()
+        self._socket.close()
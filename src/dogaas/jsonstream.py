@@ -0,0 +1,123 @@
+"""Read and write a large JSON object one member at a time.
+
+`tasks.json` holds one object whose members are the tasks; these keep only
+a chunk of the file and one member in memory instead of the whole text.
+"""
+
+from typing import Any, Iterable, Iterator, TextIO
+import json
+import re
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+_encoder = json.JSONEncoder()
+
+
+class _Reader:
+    def __init__(self, f: TextIO, chunk_size: int):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._text = ""
+        self._pos = 0
+        self._is_eof = False
+
+    def _read_more(self) -> bool:
+        if self._is_eof:
+            return False
+        chunk = self._f.read(self._chunk_size)
+        if not chunk:
+            self._is_eof = True
+            return False
+        self._text = self._text[self._pos :] + chunk
+        self._pos = 0
+        return True
+
+    def _error(self, message: str) -> json.JSONDecodeError:
+        return json.JSONDecodeError(message, self._text, self._pos)
+
+    def peek(self) -> str:
+        """The next character which is not whitespace, without taking it."""
+        while True:
+            self._pos = _WHITESPACE.match(self._text, self._pos).end()
+            if self._pos < len(self._text):
+                return self._text[self._pos]
+            if not self._read_more():
+                raise self._error("Unexpected end of data")
+
+    def take(self, expected: str) -> str:
+        char = self.peek()
+        if char not in expected:
+            raise self._error(f"Expecting one of {expected!r}")
+        self._pos += 1
+        return char
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._text, self._pos)
+            except json.JSONDecodeError:
+                if not self._read_more():
+                    raise
+                continue
+            # a number at the end of the text may go on in the next chunk
+            if end == len(self._text) and self._read_more():
+                continue
+            self._pos = end
+            return value
+
+    def end(self):
+        while True:
+            self._pos = _WHITESPACE.match(self._text, self._pos).end()
+            if self._pos < len(self._text):
+                raise self._error("Extra data")
+            if not self._read_more():
+                return
+
+
+def iter_json_object(
+    f: TextIO, chunk_size: int = 64 * 1024
+) -> Iterator[tuple[str, Any]]:
+    """Yield the `(key, value)` members of the JSON object in `f` in order.
+
+    Raises:
+        json.JSONDecodeError: `f` does not hold a JSON object.
+    """
+    reader = _Reader(f, chunk_size)
+    reader.take("{")
+    if reader.peek() == "}":
+        reader.take("}")
+    else:
+        while True:
+            key = reader.value()
+            if not isinstance(key, str):
+                raise reader._error("Expecting a string key")
+            reader.take(":")
+            yield key, reader.value()
+            if reader.take(",}") == "}":
+                break
+    reader.end()
+
+
+def write_json_object(
+    f: TextIO, items: Iterable[tuple[str, Any]], batch_size: int = 10_000
+):
+    """Write `items` as the members of one JSON object, a batch at a time."""
+    f.write("{")
+    separator = ""
+    batch: dict[str, Any] = {}
+
+    def flush():
+        nonlocal separator
+        if batch:
+            # one call into the C encoder per batch, without its braces
+            f.write(separator + _encoder.encode(batch)[1:-1])
+            separator = ", "
+            batch.clear()
+
+    for key, value in items:
+        batch[key] = value
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    f.write("}")
@@ -0,0 +1,195 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+import threading
+import time
+import os
+
+from serde import serialize, deserialize, SerdeError
+from serde.json import from_json, to_json
+import requests
+
+# answers of servers which do not take `HEAD`, so a `GET` is sent instead
+_HEAD_NOT_ALLOWED_STATUSES = frozenset({405, 501})
+
+
+@deserialize
+@serialize
+@dataclass
+class RemoteMetadata:
+    """What a server tells of a URL without sending its content."""
+
+    # the URL after redirects
+    url: str
+    status_code: int = 0
+    size: Optional[int] = None
+    content_type: Optional[str] = None
+    accepts_ranges: bool = False
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # why the request failed, if it did
+    error: Optional[str] = None
+    fetched_at: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and 200 <= self.status_code < 400
+
+    @classmethod
+    def from_response(cls, response: requests.Response) -> "RemoteMetadata":
+        headers = response.headers
+        try:
+            size = int(headers["Content-Length"])
+        except (KeyError, ValueError):
+            size = None
+        is_encoded = headers.get("Content-Encoding", "identity").lower() != "identity"
+        return cls(
+            url=response.url,
+            status_code=response.status_code,
+            # the length of an encoded body is not the size of the file
+            size=None if is_encoded or response.status_code >= 400 else size,
+            content_type=headers.get("Content-Type"),
+            accepts_ranges=(
+                headers.get("Accept-Ranges", "").lower() == "bytes" and not is_encoded
+            ),
+            etag=headers.get("ETag"),
+            last_modified=headers.get("Last-Modified"),
+            error=(
+                f"{response.status_code} {response.reason}"
+                if response.status_code >= 400
+                else None
+            ),
+            fetched_at=time.time(),
+        )
+
+
+def fetch_metadata(session, url: str, timeout=10) -> RemoteMetadata:
+    """Send `HEAD` to `url`, or a `GET` whose body is not read if the server
+    does not take `HEAD`.
+
+    Args:
+        session: object with a `requests`-like `head` and `get`, e.g.
+            `SessionPool`.
+    """
+    try:
+        with session.head(url, timeout=timeout) as response:
+            if response.status_code not in _HEAD_NOT_ALLOWED_STATUSES:
+                return RemoteMetadata.from_response(response)
+        with session.get(url, stream=True, timeout=timeout) as response:
+            return RemoteMetadata.from_response(response)
+    except requests.RequestException as e:
+        return RemoteMetadata(
+            url=url, error=f"{type(e).__name__}: {e}", fetched_at=time.time()
+        )
+
+
+class MetadataCache:
+    """`RemoteMetadata` by URL, kept in a JSON file if `filepath` is given.
+
+    Metadata older than `ttl` seconds is stale and fetched again.
+    """
+
+    def __init__(self, filepath: Optional[Path | str] = None, ttl: float = 3600):
+        self.filepath = Path(filepath) if filepath is not None else None
+        self.ttl = ttl
+        self._records: dict[str, RemoteMetadata] = {}
+        self._lock = threading.Lock()
+        self._is_dirty = False
+        if self.filepath is not None and self.filepath.exists():
+            try:
+                with open(self.filepath, encoding="utf-8") as f:
+                    self._records = from_json(dict[str, RemoteMetadata], f.read())
+            except (ValueError, SerdeError):
+                # a broken cache only costs requesting the metadata again
+                self._records = {}
+
+    def get(self, url: str) -> Optional[RemoteMetadata]:
+        with self._lock:
+            return self._records.get(url)
+
+    def is_fresh(self, url: str) -> bool:
+        metadata = self.get(url)
+        return metadata is not None and time.time() - metadata.fetched_at < self.ttl
+
+    def record(self, url: str, metadata: RemoteMetadata):
+        with self._lock:
+            self._records[url] = metadata
+            self._is_dirty = True
+
+    def size_of(self, url: str) -> Optional[int]:
+        """Size in the metadata of `url`, stale or not, as a hint."""
+        metadata = self.get(url)
+        return metadata.size if metadata is not None else None
+
+    def save(self):
+        if self.filepath is None:
+            return
+        with self._lock:
+            if not self._is_dirty:
+                return
+            tmp_filepath = self.filepath.with_name(
+                f"{self.filepath.name}.{os.getpid()}.tmp"
+            )
+            with open(tmp_filepath, "w", encoding="utf-8") as f:
+                f.write(to_json(self._records))
+            os.replace(tmp_filepath, self.filepath)
+            self._is_dirty = False
+
+
+def prefetch_metadata(
+    session,
+    urls: Iterable[str],
+    cache: MetadataCache,
+    jobs: int = 16,
+    timeout=10,
+    force: bool = False,
+    on_fetch: Optional[Callable[[str, RemoteMetadata], None]] = None,
+) -> dict[str, RemoteMetadata]:
+    """Fetch the metadata of every URL which is not fresh in `cache` (all
+    of them if `force`), `jobs` at once, and return that of every URL.
+
+    Args:
+        on_fetch (Callable[[str, RemoteMetadata], None]): called from worker
+            threads with each URL fetched and its metadata.
+    """
+    urls = list(dict.fromkeys(urls))
+    stale_urls = [url for url in urls if force or not cache.is_fresh(url)]
+
+    def fetch(url: str):
+        metadata = fetch_metadata(session, url, timeout=timeout)
+        cache.record(url, metadata)
+        if on_fetch:
+            on_fetch(url, metadata)
+
+    if stale_urls:
+        with ThreadPoolExecutor(max_workers=min(jobs, len(stale_urls))) as executor:
+            # `list` re-raises what a worker raised, such as from `on_fetch`
+            list(executor.map(fetch, stale_urls))
+    return {url: cache.get(url) for url in urls}
+
+
+@dataclass
+class DownloadPlan:
+    """The metadata of a batch of tasks, to see what it holds before any
+    byte of content moves."""
+
+    metadata: dict[str, RemoteMetadata] = field(default_factory=dict)
+
+    @property
+    def total_bytes(self) -> int:
+        """Sum of the known sizes of the tasks which answered."""
+        return sum(m.size or 0 for m in self.metadata.values() if m.ok)
+
+    @property
+    def failed_task_names(self) -> list[str]:
+        return [name for name, m in self.metadata.items() if not m.ok]
+
+    @property
+    def unknown_size_task_names(self) -> list[str]:
+        return [name for name, m in self.metadata.items() if m.ok and m.size is None]
+
+    @property
+    def range_task_names(self) -> list[str]:
+        """Tasks which can be resumed and split into segments."""
+        return [name for name, m in self.metadata.items() if m.ok and m.accepts_ranges]
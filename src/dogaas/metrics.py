@@ -0,0 +1,269 @@
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import IO, Iterable, Iterator, Optional
+from urllib.parse import urlparse
+import threading
+import json
+import time
+import os
+
+from requests import Response
+
+from .transport import connection_timings
+
+
+def timed_chunks(chunks: Iterable[bytes], seconds: list[float]) -> Iterator[bytes]:
+    """Yield `chunks`, adding the time spent waiting for each to `seconds[0]`."""
+    iterator = iter(chunks)
+    while True:
+        started_at = time.perf_counter()
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            seconds[0] += time.perf_counter() - started_at
+        yield chunk
+
+
+@dataclass
+class DownloadStats:
+    """Where the time of one download went.
+
+    The phases of segmented downloads are summed over the segments, so they
+    can add up to more than `total_s`. `downloaded_bytes` counts only what
+    came over the network, not the bytes kept from an interrupted download.
+    `postprocess_s` is how long the post-processing pipeline was waited for
+    after the transfer.
+    """
+
+    url: str
+    task_name: Optional[str] = None
+    started_at: float = field(default_factory=time.time)
+    status: int = 0
+    dns_s: float = 0.0
+    connect_s: float = 0.0
+    tls_s: float = 0.0
+    ttfb_s: float = 0.0
+    read_s: float = 0.0
+    write_s: float = 0.0
+    throttle_s: float = 0.0
+    postprocess_s: float = 0.0
+    total_s: float = 0.0
+    downloaded_bytes: int = 0
+    resumed_bytes: int = 0
+    segments: int = 1
+    requests: int = 0
+    retries: int = 0
+    new_connections: int = 0
+    reused_connections: int = 0
+    skipped: bool = False
+    error: Optional[str] = None
+
+    def __post_init__(self):
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @property
+    def host(self) -> str:
+        return urlparse(self.url).hostname or ""
+
+    @property
+    def bytes_per_sec(self) -> float:
+        return self.downloaded_bytes / self.total_s if self.total_s > 0 else 0.0
+
+    def add(self, **amounts: float):
+        """Add to the fields named by the keywords; safe across threads."""
+        with self._lock:
+            for name, amount in amounts.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def record_response(self, response: Response):
+        """Count a request and the connection it went over.
+
+        The first response also sets `status` and `ttfb_s`, the time from
+        the request to its headers apart from opening the connection.
+        """
+        timings = connection_timings(response)
+        with self._lock:
+            setup_s = 0.0
+            if timings is not None:
+                if timings.reused:
+                    self.reused_connections += 1
+                else:
+                    self.new_connections += 1
+                setup_s = timings.dns_s + timings.connect_s + timings.tls_s
+                self.dns_s += timings.dns_s
+                self.connect_s += timings.connect_s
+                self.tls_s += timings.tls_s
+            if self.requests == 0:
+                self.status = response.status_code
+                self.ttfb_s = max(0.0, response.elapsed.total_seconds() - setup_s)
+            self.requests += 1
+
+    def finish(self, error: Optional[BaseException] = None):
+        with self._lock:
+            self.total_s = time.perf_counter() - self._started
+            if error is not None:
+                self.error = f"{type(error).__name__}: {error}"
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return asdict(self) | {
+                "host": self.host,
+                "bytes_per_sec": self.bytes_per_sec,
+            }
+
+
+class JSONLinesStatsWriter:
+    """Write each `DownloadStats` as a line of JSON to `stream`."""
+
+    def __init__(self, stream: IO[str]):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def __call__(self, stats: DownloadStats):
+        line = json.dumps(stats.to_dict(), ensure_ascii=False)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class PrometheusTextfileWriter:
+    """Aggregate `DownloadStats` into a file for the node exporter's
+    textfile collector.
+
+    The counters start from zero in every process, which Prometheus treats
+    as a counter reset. The file is replaced atomically on `write`, so the
+    collector never reads half of it.
+    """
+
+    PHASES = (
+        "dns",
+        "connect",
+        "tls",
+        "ttfb",
+        "read",
+        "write",
+        "throttle",
+        "postprocess",
+    )
+
+    def __init__(self, filepath: Path | str):
+        self.filepath = Path(filepath)
+        self._lock = threading.Lock()
+        self._downloads: dict[tuple[str, str], int] = {}
+        self._bytes: dict[str, int] = {}
+        self._seconds: dict[tuple[str, str], float] = {}
+        self._requests: dict[str, int] = {}
+        self._retries: dict[str, int] = {}
+        self._connections: dict[tuple[str, str], int] = {}
+        self._last_finished_at = 0.0
+
+    def __call__(self, stats: DownloadStats):
+        self.observe(stats)
+
+    def observe(self, stats: DownloadStats):
+        stats = stats.to_dict()
+        host = stats["host"]
+        if stats["error"]:
+            result = "error"
+        elif stats["skipped"]:
+            result = "not_modified"
+        else:
+            result = "ok"
+        with self._lock:
+            key = (host, result)
+            self._downloads[key] = self._downloads.get(key, 0) + 1
+            self._bytes[host] = self._bytes.get(host, 0) + stats["downloaded_bytes"]
+            for phase in (*self.PHASES, "total"):
+                key = (host, phase)
+                self._seconds[key] = self._seconds.get(key, 0.0) + stats[f"{phase}_s"]
+            self._requests[host] = self._requests.get(host, 0) + stats["requests"]
+            self._retries[host] = self._retries.get(host, 0) + stats["retries"]
+            for reused, count in (
+                ("false", stats["new_connections"]),
+                ("true", stats["reused_connections"]),
+            ):
+                key = (host, reused)
+                self._connections[key] = self._connections.get(key, 0) + count
+            self._last_finished_at = stats["started_at"] + stats["total_s"]
+
+    def render(self) -> str:
+        def metric(name, help_text, kind, samples):
+            lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for labels, value in samples:
+                label_text = ",".join(
+                    f'{label}="{_escape_label_value(label_value)}"'
+                    for label, label_value in labels.items()
+                )
+                if label_text:
+                    lines.append(f"{name}{{{label_text}}} {value}")
+                else:
+                    lines.append(f"{name} {value}")
+            return lines
+
+        with self._lock:
+            lines = [
+                *metric(
+                    "dogaas_downloads_total",
+                    "Finished downloads by result.",
+                    "counter",
+                    (
+                        ({"host": host, "result": result}, count)
+                        for (host, result), count in sorted(self._downloads.items())
+                    ),
+                ),
+                *metric(
+                    "dogaas_downloaded_bytes_total",
+                    "Bytes received over the network.",
+                    "counter",
+                    (({"host": host}, n) for host, n in sorted(self._bytes.items())),
+                ),
+                *metric(
+                    "dogaas_download_seconds_total",
+                    "Seconds spent per phase of the downloads.",
+                    "counter",
+                    (
+                        ({"host": host, "phase": phase}, seconds)
+                        for (host, phase), seconds in sorted(self._seconds.items())
+                    ),
+                ),
+                *metric(
+                    "dogaas_requests_total",
+                    "HTTP requests sent by the downloads.",
+                    "counter",
+                    (({"host": h}, n) for h, n in sorted(self._requests.items())),
+                ),
+                *metric(
+                    "dogaas_retries_total",
+                    "Requests sent again for content already requested.",
+                    "counter",
+                    (({"host": h}, n) for h, n in sorted(self._retries.items())),
+                ),
+                *metric(
+                    "dogaas_connections_total",
+                    "Connections used by the downloads.",
+                    "counter",
+                    (
+                        ({"host": host, "reused": reused}, count)
+                        for (host, reused), count in sorted(self._connections.items())
+                    ),
+                ),
+                *metric(
+                    "dogaas_last_download_finished_timestamp_seconds",
+                    "When the last observed download finished.",
+                    "gauge",
+                    [({}, self._last_finished_at)],
+                ),
+            ]
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        temp_filepath = self.filepath.with_name(f".{self.filepath.name}.{os.getpid()}")
+        temp_filepath.write_text(self.render(), encoding="utf-8")
+        os.replace(temp_filepath, self.filepath)
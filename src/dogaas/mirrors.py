@@ -0,0 +1,157 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Optional
+import threading
+import time
+import os
+
+from serde import serialize, deserialize, SerdeError
+from serde.json import from_json, to_json
+import requests
+
+
+@deserialize
+@serialize
+@dataclass
+class MirrorStats:
+    """What was measured of a mirror, as moving averages."""
+
+    ttfb_s: Optional[float] = None
+    bytes_per_sec: Optional[float] = None
+    # failures since the last success
+    failures: int = 0
+    probed_at: float = 0.0
+
+    def expected_seconds(self, size: int = 0) -> float:
+        """Rough time to fetch `size` bytes; unknown mirrors come last."""
+        if self.ttfb_s is None:
+            return float("inf")
+        if self.bytes_per_sec:
+            return self.ttfb_s + size / self.bytes_per_sec
+        return self.ttfb_s
+
+
+def _average(old: Optional[float], new: float, weight: float) -> float:
+    return new if old is None else old + weight * (new - old)
+
+
+class MirrorStatsCache:
+    """`MirrorStats` by URL, kept in a JSON file if `filepath` is given.
+
+    Probes older than `ttl` seconds are stale, so mirrors are probed again
+    at most once per `ttl` while the transfer rates keep being updated by
+    the downloads themselves.
+    """
+
+    # weight of the newest measurement in the averages
+    weight = 0.3
+
+    def __init__(self, filepath: Optional[Path | str] = None, ttl: float = 3600):
+        self.filepath = Path(filepath) if filepath is not None else None
+        self.ttl = ttl
+        self._stats: dict[str, MirrorStats] = {}
+        self._lock = threading.Lock()
+        self._is_dirty = False
+        if self.filepath is not None and self.filepath.exists():
+            try:
+                with open(self.filepath, encoding="utf-8") as f:
+                    self._stats = from_json(dict[str, MirrorStats], f.read())
+            except (ValueError, SerdeError):
+                # a broken cache only costs probing again
+                self._stats = {}
+
+    def get(self, url: str) -> Optional[MirrorStats]:
+        with self._lock:
+            return self._stats.get(url)
+
+    def is_fresh(self, url: str) -> bool:
+        stats = self.get(url)
+        return stats is not None and time.time() - stats.probed_at < self.ttl
+
+    def _update(self, url: str, **changes):
+        with self._lock:
+            stats = self._stats.setdefault(url, MirrorStats())
+            for name, value in changes.items():
+                setattr(stats, name, value)
+            self._is_dirty = True
+            return stats
+
+    def record_probe(self, url: str, ttfb_s: Optional[float]):
+        """Record a probe; `None` if the mirror did not answer."""
+        stats = self.get(url) or MirrorStats()
+        if ttfb_s is None:
+            self._update(url, failures=stats.failures + 1, probed_at=time.time())
+        else:
+            self._update(
+                url,
+                ttfb_s=_average(stats.ttfb_s, ttfb_s, self.weight),
+                failures=0,
+                probed_at=time.time(),
+            )
+
+    def record_transfer(self, url: str, nbytes: int, seconds: float):
+        if nbytes <= 0 or seconds <= 0:
+            return
+        stats = self.get(url) or MirrorStats()
+        self._update(
+            url,
+            bytes_per_sec=_average(stats.bytes_per_sec, nbytes / seconds, self.weight),
+            failures=0,
+        )
+
+    def record_failure(self, url: str):
+        stats = self.get(url) or MirrorStats()
+        self._update(url, failures=stats.failures + 1)
+
+    def rank(self, urls: Iterable[str], size: int = 1024 * 1024) -> list[str]:
+        """`urls` from the most to the least promising to fetch `size` bytes
+        from; failing mirrors go last, and the given order breaks ties."""
+        urls = list(urls)
+
+        def key(url: str):
+            stats = self.get(url) or MirrorStats()
+            return (stats.failures > 0, stats.expected_seconds(size))
+
+        return sorted(urls, key=key)
+
+    def save(self):
+        if self.filepath is None:
+            return
+        with self._lock:
+            if not self._is_dirty:
+                return
+            tmp_filepath = self.filepath.with_name(
+                f"{self.filepath.name}.{os.getpid()}.tmp"
+            )
+            with open(tmp_filepath, "w", encoding="utf-8") as f:
+                f.write(to_json(self._stats))
+            os.replace(tmp_filepath, self.filepath)
+            self._is_dirty = False
+
+
+def probe_mirrors(
+    session, urls: Iterable[str], timeout=5
+) -> dict[str, Optional[float]]:
+    """Send `HEAD` to every URL at once and return the seconds each took to
+    answer, or `None` for those which failed.
+
+    Args:
+        session: object with a `requests`-like `head`, e.g. `SessionPool`.
+    """
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return {}
+
+    def probe(url: str) -> Optional[float]:
+        started_at = time.perf_counter()
+        try:
+            with session.head(url, timeout=timeout) as response:
+                if response.status_code >= 400:
+                    return None
+        except requests.RequestException:
+            return None
+        return time.perf_counter() - started_at
+
+    with ThreadPoolExecutor(max_workers=min(16, len(urls))) as executor:
+        return dict(zip(urls, executor.map(probe, urls)))
@@ -0,0 +1,577 @@
+"""Post-processing of downloads while their content arrives.
+
+A pipeline is a list of stage specs such as `["gunzip", "digest:sha256"]`,
+kept on `DownloaderTask.postprocess`. Each stage gets the content a chunk
+at a time, in order, and hands what it makes of it to the next stage, like
+a shell pipe:
+
+- `gunzip`: decompress gzip.
+- `tee:PATH`: write a copy of the content to `PATH`, relative to the
+  directory of the download.
+- `digest:ALGORITHM`: write `hexdigest  name` to `name.ALGORITHM`.
+- `untar`: extract a (compressed) tar archive into a directory.
+- `unzip`: extract a zip archive into a directory. Zip keeps its index at
+  the end, so nothing is extracted before the last chunk.
+
+When a stage changes the content, as `gunzip` does, the content coming out
+of the last stage is written to a file named after the download without
+the extension, e.g. `data.csv` for `data.csv.gz`; `untar` and `unzip` take
+the content and produce a directory named like that instead.
+
+Outputs are written to temporary names and only moved into place by
+`Pipeline.close`, so an interrupted download leaves no half-written output.
+"""
+
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+import multiprocessing
+import threading
+import tempfile
+import tarfile
+import zipfile
+import hashlib
+import shutil
+import queue
+import zlib
+import os
+
+from .checksum import ALGORITHMS
+
+
+class PostProcessError(Exception):
+    pass
+
+
+class _Aborted(Exception):
+    pass
+
+
+def _temporary_path(path: Path) -> Path:
+    return path.with_name(f".{path.name}.part")
+
+
+def _strip_suffixes(name: str, suffixes: Iterable[str], fallback: str) -> str:
+    for suffix in suffixes:
+        if name.lower().endswith(suffix) and len(name) > len(suffix):
+            return name[: -len(suffix)]
+    return name + fallback
+
+
+class Stage:
+    """One step of a pipeline.
+
+    `open` is given the path the incoming content would be saved at and
+    returns the path of the content the stage hands on, or `None` if it
+    hands nothing on. Outputs go to temporary paths, collected in `pending`
+    as `(temporary, final)` pairs.
+    """
+
+    name = ""
+    # run in a worker process when `Pipeline` is given a process pool
+    cpu_bound = False
+
+    def __init__(self, argument: Optional[str] = None):
+        if argument is not None:
+            raise ValueError(f"`{self.name}` takes no argument")
+        self.pending: list[tuple[Path, Path]] = []
+
+    def open(self, filepath: Path) -> Optional[Path]:
+        return filepath
+
+    def process(self, chunk: bytes) -> bytes:
+        return chunk
+
+    def flush(self) -> bytes:
+        """Called after the last chunk; returns what is left to hand on."""
+        return b""
+
+    def abort(self):
+        for temporary_path, _ in self.pending:
+            if temporary_path.is_dir():
+                shutil.rmtree(temporary_path, ignore_errors=True)
+            else:
+                temporary_path.unlink(missing_ok=True)
+
+
+class _FileStage(Stage):
+    """Write the content to `filepath`; used as the end of a pipeline."""
+
+    def __init__(self, filepath: Path):
+        super().__init__()
+        self.filepath = filepath
+
+    def open(self, filepath: Path) -> Optional[Path]:
+        temporary_path = _temporary_path(self.filepath)
+        self._file = open(temporary_path, "wb")
+        self.pending.append((temporary_path, self.filepath))
+        return None
+
+    def process(self, chunk: bytes) -> bytes:
+        self._file.write(chunk)
+        return b""
+
+    def flush(self) -> bytes:
+        self._file.close()
+        return b""
+
+    def abort(self):
+        self._file.close()
+        super().abort()
+
+
+class Gunzip(Stage):
+    name = "gunzip"
+    cpu_bound = True
+
+    def open(self, filepath: Path) -> Optional[Path]:
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        name = filepath.name
+        if name.lower().endswith(".tgz"):
+            return filepath.with_name(name[:-4] + ".tar")
+        return filepath.with_name(_strip_suffixes(name, [".gz"], ".gunzip"))
+
+    def process(self, chunk: bytes) -> bytes:
+        try:
+            data = self._decompressor.decompress(chunk)
+            # a gzip file may hold several members one after another
+            while self._decompressor.eof and self._decompressor.unused_data:
+                rest = self._decompressor.unused_data
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                data += self._decompressor.decompress(rest)
+        except zlib.error as e:
+            raise PostProcessError(f"gunzip: {e}") from None
+        return data
+
+    def flush(self) -> bytes:
+        if not self._decompressor.eof:
+            raise PostProcessError("gunzip: the gzip stream ended early")
+        return self._decompressor.flush()
+
+
+class Tee(Stage):
+    name = "tee"
+
+    def __init__(self, argument: Optional[str] = None):
+        super().__init__()
+        if not argument:
+            raise ValueError("`tee` needs a path, e.g. `tee:copy.bin`")
+        self.path = Path(argument)
+
+    def open(self, filepath: Path) -> Optional[Path]:
+        self._file_stage = _FileStage(filepath.parent / self.path)
+        self._file_stage.open(filepath)
+        self.pending = self._file_stage.pending
+        return filepath
+
+    def process(self, chunk: bytes) -> bytes:
+        self._file_stage.process(chunk)
+        return chunk
+
+    def flush(self) -> bytes:
+        self._file_stage.flush()
+        return b""
+
+    def abort(self):
+        self._file_stage.abort()
+
+
+class Digest(Stage):
+    name = "digest"
+    cpu_bound = True
+
+    def __init__(self, argument: Optional[str] = None):
+        super().__init__()
+        if argument is None or argument.lower() not in ALGORITHMS:
+            raise ValueError(f"`digest` needs one of {', '.join(ALGORITHMS)}")
+        self.algorithm = argument.lower()
+
+    def open(self, filepath: Path) -> Optional[Path]:
+        self._hash = hashlib.new(self.algorithm)
+        self._filepath = filepath
+        return filepath
+
+    def process(self, chunk: bytes) -> bytes:
+        self._hash.update(chunk)
+        return chunk
+
+    def flush(self) -> bytes:
+        digest_filepath = self._filepath.with_name(
+            f"{self._filepath.name}.{self.algorithm}"
+        )
+        temporary_path = _temporary_path(digest_filepath)
+        self.pending.append((temporary_path, digest_filepath))
+        # the format of `sha256sum` and friends
+        temporary_path.write_text(
+            f"{self._hash.hexdigest()}  {self._filepath.name}\n", encoding="utf-8"
+        )
+        return b""
+
+
+class _ExtractStage(Stage):
+    cpu_bound = True
+    suffixes: tuple[str, ...] = ()
+
+    def open(self, filepath: Path) -> Optional[Path]:
+        dirpath = filepath.with_name(
+            _strip_suffixes(filepath.name, self.suffixes, ".d")
+        )
+        self._temporary_dirpath = _temporary_path(dirpath)
+        shutil.rmtree(self._temporary_dirpath, ignore_errors=True)
+        self._temporary_dirpath.mkdir()
+        self.pending.append((self._temporary_dirpath, dirpath))
+        return None
+
+
+class _ChunkReader:
+    """File-like end of a queue of chunks, for readers which pull data."""
+
+    def __init__(self, chunks: "queue.Queue[Optional[bytes]]"):
+        self._chunks = chunks
+        self._buffer = b""
+        self._is_done = False
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._is_done and (size < 0 or len(self._buffer) < size):
+            chunk = self._chunks.get()
+            if chunk is None:
+                self._is_done = True
+            else:
+                self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class Untar(_ExtractStage):
+    """Extract members as they arrive, on a thread pulling from the chunks."""
+
+    name = "untar"
+    suffixes = (".tar.gz", ".tar.bz2", ".tar.xz", ".tgz", ".tar")
+
+    def open(self, filepath: Path) -> Optional[Path]:
+        result = super().open(filepath)
+        self._chunks: queue.Queue[Optional[bytes]] = queue.Queue(64)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._extract, daemon=True)
+        self._thread.start()
+        return result
+
+    def _extract(self):
+        reader = _ChunkReader(self._chunks)
+        try:
+            with tarfile.open(fileobj=reader, mode="r|*") as archive:
+                archive.extractall(self._temporary_dirpath, filter="data")
+        except Exception as e:
+            self._error = e
+        # let `process` and `flush` go on whatever the archive had left
+        while not reader._is_done:
+            reader.read(64 * 1024)
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise PostProcessError(f"untar: {self._error}") from self._error
+
+    def process(self, chunk: bytes) -> bytes:
+        self._raise_if_failed()
+        self._chunks.put(chunk)
+        return b""
+
+    def flush(self) -> bytes:
+        self._chunks.put(None)
+        self._thread.join()
+        self._raise_if_failed()
+        return b""
+
+    def abort(self):
+        if self._thread.is_alive():
+            self._chunks.put(None)
+            self._thread.join()
+        super().abort()
+
+
+class Unzip(_ExtractStage):
+    name = "unzip"
+    suffixes = (".zip",)
+
+    def open(self, filepath: Path) -> Optional[Path]:
+        result = super().open(filepath)
+        self._spool = tempfile.SpooledTemporaryFile(
+            max_size=8 * 1024 * 1024, dir=filepath.parent
+        )
+        return result
+
+    def process(self, chunk: bytes) -> bytes:
+        self._spool.write(chunk)
+        return b""
+
+    def flush(self) -> bytes:
+        try:
+            with zipfile.ZipFile(self._spool) as archive:
+                archive.extractall(self._temporary_dirpath)
+        except (zipfile.BadZipFile, OSError) as e:
+            raise PostProcessError(f"unzip: {e}") from e
+        finally:
+            self._spool.close()
+        return b""
+
+    def abort(self):
+        self._spool.close()
+        super().abort()
+
+
+STAGES: dict[str, type[Stage]] = {
+    stage.name: stage for stage in (Gunzip, Tee, Digest, Untar, Unzip)
+}
+
+
+def parse_stage(spec: str) -> Stage:
+    """Make the stage of a spec such as `digest:sha256`.
+
+    Raises:
+        ValueError: unknown stage or a wrong argument.
+    """
+    name, separator, argument = spec.partition(":")
+    if name not in STAGES:
+        raise ValueError(f"`{spec}` must start with one of {', '.join(STAGES)}")
+    return STAGES[name](argument if separator else None)
+
+
+def validate_pipeline(specs: Iterable[str]) -> list[str]:
+    """Check that `specs` make a pipeline; returns them as a list.
+
+    Raises:
+        ValueError: a spec is wrong, or a stage follows one handing nothing on.
+    """
+    specs = list(specs)
+    stages = [parse_stage(spec) for spec in specs]
+    for stage, spec in zip(stages[:-1], specs):
+        if isinstance(stage, _ExtractStage):
+            raise ValueError(f"nothing comes out of `{spec}` for the stages after it")
+    return specs
+
+
+def run_stages(
+    specs: list[str], dest_filepath: Path | str, chunks: Iterable[bytes]
+) -> list[tuple[str, str]]:
+    """Run the pipeline of `specs` over `chunks`, the content of
+    `dest_filepath`; returns the `(temporary, final)` paths of the outputs.
+    """
+    dest_filepath = Path(dest_filepath)
+    stages = [parse_stage(spec) for spec in specs]
+    opened: list[Stage] = []
+    try:
+        filepath: Optional[Path] = dest_filepath
+        for stage in stages:
+            filepath = stage.open(filepath)
+            opened.append(stage)
+        if filepath is not None and filepath != dest_filepath:
+            stage = _FileStage(filepath)
+            stage.open(filepath)
+            opened.append(stage)
+        for chunk in chunks:
+            _push(opened, chunk)
+        for i, stage in enumerate(opened):
+            _push(opened[i + 1 :], stage.flush())
+    except BaseException:
+        for stage in opened:
+            stage.abort()
+        raise
+    return [
+        (str(temporary_path), str(final_path))
+        for stage in opened
+        for temporary_path, final_path in stage.pending
+    ]
+
+
+def _push(stages: list[Stage], chunk: bytes):
+    for stage in stages:
+        if not chunk:
+            return
+        chunk = stage.process(chunk)
+
+
+def _run_stages_from_connection(
+    specs: list[str], dest_filepath: str, connection
+) -> list[tuple[str, str]]:
+    """`run_stages` in a worker process, over chunks sent through a pipe."""
+
+    def receive() -> Iterator[bytes]:
+        # an empty message ends the content; a closed pipe aborts it
+        while chunk := connection.recv_bytes():
+            yield chunk
+
+    try:
+        connection.send_bytes(b"ready")
+        return run_stages(specs, dest_filepath, receive())
+    finally:
+        connection.close()
+
+
+def make_process_pool(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """A process pool for pipelines; give it a worker per parallel download,
+    since each running pipeline keeps a worker busy.
+
+    Workers are spawned rather than forked, as forking a process with
+    running download threads could copy their locks in a held state.
+    """
+    return ProcessPoolExecutor(
+        max_workers, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+class Pipeline:
+    """Run the stages of `specs` on a helper thread while downloading.
+
+    `update` only queues the chunk, so the read loop does not wait for the
+    stages unless `max_pending_chunks` chunks are already queued. With
+    `executor`, a process pool such as `make_process_pool`, the stages run
+    in a worker process if any of them is CPU-bound, and the helper thread
+    only passes the chunks on through a pipe.
+    """
+
+    def __init__(
+        self,
+        specs: Iterable[str],
+        dest_filepath: Path | str,
+        executor: Optional[Executor] = None,
+        max_pending_chunks: int = 256,
+    ):
+        self.specs = validate_pipeline(specs)
+        self.dest_filepath = Path(dest_filepath)
+        self._executor = executor
+        self._chunks: queue.Queue = queue.Queue(max_pending_chunks)
+        self._pending: list[tuple[str, str]] = []
+        self._error: Optional[BaseException] = None
+        self._is_closed = False
+        # whether the helper thread has taken the end of the chunks
+        self._is_drained = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def runs_in_process(self) -> bool:
+        return self._executor is not None and any(
+            parse_stage(spec).cpu_bound for spec in self.specs
+        )
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            if isinstance(self._error, PostProcessError):
+                raise self._error
+            raise PostProcessError(str(self._error)) from self._error
+
+    def update(self, chunk: bytes):
+        """Queue a chunk.
+
+        Raises:
+            PostProcessError: a stage has failed already.
+        """
+        self._raise_if_failed()
+        if chunk:
+            self._chunks.put(chunk)
+
+    def update_from_file(self, filepath: Path, size: int, chunk_size=1024 * 1024):
+        """Queue the first `size` bytes of `filepath`, e.g. a resumed `.part`."""
+        with open(filepath, "rb") as file:
+            while size > 0 and (chunk := file.read(min(chunk_size, size))):
+                self.update(chunk)
+                size -= len(chunk)
+
+    def close(self) -> list[Path]:
+        """Wait for the stages and move their outputs into place.
+
+        Returns:
+            list[Path]: the outputs.
+
+        Raises:
+            PostProcessError: a stage has failed; its outputs are removed.
+        """
+        if not self._is_closed:
+            self._is_closed = True
+            self._chunks.put(None)
+            self._thread.join()
+        self._raise_if_failed()
+        outputs = []
+        for temporary_path, final_path in self._pending:
+            final_path = Path(final_path)
+            if final_path.is_dir() and not final_path.is_symlink():
+                shutil.rmtree(final_path)
+            os.replace(temporary_path, final_path)
+            outputs.append(final_path)
+        self._pending = []
+        return outputs
+
+    def abort(self):
+        """Stop the stages and remove their outputs."""
+        if not self._is_closed:
+            self._is_closed = True
+            self._chunks.put(_Aborted)
+            self._thread.join()
+        for temporary_path, _ in self._pending:
+            temporary_path = Path(temporary_path)
+            if temporary_path.is_dir():
+                shutil.rmtree(temporary_path, ignore_errors=True)
+            else:
+                temporary_path.unlink(missing_ok=True)
+        self._pending = []
+
+    def _iter_chunks(self) -> Iterator[bytes]:
+        while (chunk := self._chunks.get()) is not None:
+            if chunk is _Aborted:
+                self._is_drained = True
+                raise _Aborted()
+            yield chunk
+        self._is_drained = True
+
+    def _run(self):
+        try:
+            if self.runs_in_process:
+                self._pending = self._run_in_process()
+            else:
+                self._pending = run_stages(
+                    self.specs, self.dest_filepath, self._iter_chunks()
+                )
+        except _Aborted:
+            return
+        except BaseException as e:
+            self._error = e
+            # keep taking chunks so `update` never blocks on a full queue
+            while not self._is_drained:
+                self._is_drained = self._chunks.get() in (None, _Aborted)
+
+    def _run_in_process(self) -> list[tuple[str, str]]:
+        connection, worker_connection = multiprocessing.Pipe()
+        try:
+            future = self._executor.submit(
+                _run_stages_from_connection,
+                self.specs,
+                str(self.dest_filepath),
+                worker_connection,
+            )
+            # our copy of the worker's end is closed once the worker holds
+            # its own, so a dead worker shows up as a broken pipe
+            while not connection.poll(0.05):
+                if future.done():
+                    future.result()
+                    raise PostProcessError("the worker ended before starting")
+            connection.recv_bytes()
+            worker_connection.close()
+            try:
+                for chunk in self._iter_chunks():
+                    connection.send_bytes(chunk)
+                connection.send_bytes(b"")
+            except _Aborted:
+                connection.close()
+                # wait for the worker to remove its outputs
+                future.exception()
+                raise
+            except OSError:
+                # the worker failed; its error tells why
+                future.result()
+                raise
+            return future.result()
+        finally:
+            connection.close()
+            worker_connection.close()
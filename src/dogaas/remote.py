@@ -0,0 +1,170 @@
+"""Stand-ins for `TaskManager` and `BackgroundDownloadManager` which leave
+the work to a running `dogaas.daemon`, so a UI can act as a thin client."""
+
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+import threading
+
+from .background import TaskProgress
+from .daemon import progress_from_dict
+from .downloader import DownloaderTask, ImportReport, TaskManager
+from .ipc import DaemonClient
+
+
+def _names_or_none(task_names: Optional[Iterable[str]]) -> Optional[list[str]]:
+    return None if task_names is None else list(task_names)
+
+
+class RemoteTaskManager(TaskManager):
+    """Copy of the tasks of a daemon; every change is made by the daemon
+    first, then to the copy, so the callbacks fire as with `TaskManager`.
+
+    Tasks changed by other clients show up after `reload`.
+    """
+
+    def __init__(self, client: DaemonClient, **kwargs):
+        super().__init__(**kwargs)
+        self.client = client
+        self.reload()
+
+    def reload(self):
+        self.tasks = {
+            name: DownloaderTask(url, priority=priority)
+            for name, url, priority in self.client.call("list_tasks")
+        }
+
+    def add_task(
+        self, name: str, task: DownloaderTask, raise_if_duplicate: bool = False
+    ):
+        if not isinstance(task, DownloaderTask):
+            raise TypeError("`task` must be `DownloaderTask`")
+        self.client.call(
+            "add_task",
+            name=name,
+            url=task.url,
+            priority=task.priority,
+            checksum=task.checksum,
+            postprocess=task.postprocess,
+            mirrors=task.mirrors,
+            raise_if_duplicate=raise_if_duplicate,
+        )
+        super().add_task(name, task)
+
+    def add_tasks(
+        self,
+        entries: Iterable[tuple[Optional[str], str]],
+        batch_size: int = 1000,
+        skip_duplicate_urls: bool = True,
+        on_batch: Optional[Callable[[ImportReport], None]] = None,
+    ) -> ImportReport:
+        report = ImportReport()
+        entries = iter(entries)
+        while batch := [list(entry) for entry in islice(entries, batch_size)]:
+            batch_report = self.client.call(
+                "add_tasks", entries=batch, skip_duplicate_urls=skip_duplicate_urls
+            )
+            report.added += batch_report["added"]
+            report.duplicate_urls += batch_report["duplicate_urls"]
+            report.duplicate_names += batch_report["duplicate_names"]
+            report.invalid_entries += map(tuple, batch_report["invalid_entries"])
+            # the daemon names unnamed tasks, so the new names are only known
+            # from its tasks
+            old_names = set(self.tasks)
+            self.reload()
+            if self.on_add and (added_names := set(self.tasks) - old_names):
+                self.on_add(sorted(added_names))
+            if on_batch:
+                on_batch(report)
+        return report
+
+    def rename_task(self, task_name: str, new_name: str):
+        self.client.call("rename_task", name=task_name, new_name=new_name)
+        super().rename_task(task_name, new_name)
+
+    def remove_task(self, task_name: str):
+        self.client.call("remove_task", name=task_name)
+        super().remove_task(task_name)
+
+    def rewrite_task_url(self, task_name: str, new_url: str):
+        self.client.call("rewrite_task_url", name=task_name, url=new_url)
+        super().rewrite_task_url(task_name, new_url)
+
+
+class RemoteDownloadManager:
+    """The interface of `BackgroundDownloadManager` over the download queue
+    of a daemon.
+
+    `on_update` is called from a helper thread with the progress of every
+    download of the daemon, including those requested by other clients.
+    Closing stops watching; the downloads go on in the daemon.
+    """
+
+    def __init__(
+        self,
+        socket_path: Path | str,
+        on_update: Optional[Callable[[dict[str, TaskProgress]], None]] = None,
+        update_interval: float = 0.25,
+    ):
+        self.client = DaemonClient(socket_path)
+        self.on_update = on_update
+        self._watcher = DaemonClient(socket_path)
+        self._watch_thread = threading.Thread(
+            target=self._watch, args=(update_interval,), daemon=True
+        )
+        self._watch_thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def snapshot(self) -> dict[str, TaskProgress]:
+        return {
+            task_name: progress_from_dict(progress)
+            for task_name, progress in self.client.call("status").items()
+        }
+
+    def enqueue(
+        self,
+        task_names: Iterable[str],
+        dirpath_for_dest: Path | str,
+        paused: bool = False,
+    ):
+        self.client.call(
+            "download",
+            task_names=list(task_names),
+            dirpath_for_dest=str(Path(dirpath_for_dest).absolute()),
+            paused=paused,
+        )
+
+    def pause(self, task_names: Optional[Iterable[str]] = None):
+        self.client.call("pause", task_names=_names_or_none(task_names))
+
+    def cancel(self, task_names: Optional[Iterable[str]] = None):
+        self.client.call("cancel", task_names=_names_or_none(task_names))
+
+    def resume(self, task_names: Optional[Iterable[str]] = None):
+        self.client.call("resume", task_names=_names_or_none(task_names))
+
+    def close(self, cancel: bool = False):
+        if cancel:
+            self.cancel()
+        self._watcher.close()
+        self._watch_thread.join()
+        self.client.close()
+
+    def _watch(self, interval: float):
+        try:
+            for snapshot in self._watcher.watch(interval=interval):
+                if self.on_update:
+                    self.on_update(
+                        {
+                            task_name: progress_from_dict(progress)
+                            for task_name, progress in snapshot.items()
+                        }
+                    )
+        except (OSError, ValueError):
+            # closed by `close`, or the daemon went away
+            pass
@@ -0,0 +1,128 @@
+"""A local store of downloaded files by the digest of their content.
+
+A file goes into the store as a hard link, so storing it takes no space,
+and every later file with the same content becomes a clone or a hard link
+of the stored one instead of another copy. Only the standard library is
+imported here.
+"""
+
+from pathlib import Path
+from typing import Optional
+import threading
+import shutil
+import uuid
+import os
+
+from .checksum import parse_checksum
+
+# `FICLONE` of <linux/fs.h>: share the blocks of a file copy-on-write
+_FICLONE = 0x40049409
+
+
+def _reflink(src: Path, dest: Path):
+    """Clone `src` into `dest` copy-on-write, as `cp --reflink=always`.
+
+    Raises:
+        OSError: the platform or the file system cannot.
+    """
+    import fcntl
+
+    with open(src, "rb") as src_file, open(dest, "wb") as dest_file:
+        try:
+            fcntl.ioctl(dest_file.fileno(), _FICLONE, src_file.fileno())
+        except OSError:
+            dest_file.close()
+            dest.unlink(missing_ok=True)
+            raise
+
+
+def place_file(src: Path | str, dest: Path | str, allow_hardlink: bool = True):
+    """Put the content of `src` at `dest`, replacing it, as cheaply as
+    possible: a clone, else a hard link if `allow_hardlink`, else a copy."""
+    src = Path(src)
+    dest = Path(dest)
+    tmp_filepath = dest.with_name(f".{dest.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        try:
+            _reflink(src, tmp_filepath)
+        except (ImportError, OSError):
+            try:
+                if not allow_hardlink:
+                    raise OSError("hard links are not allowed")
+                os.link(src, tmp_filepath)
+            except OSError:
+                shutil.copyfile(src, tmp_filepath)
+        os.replace(tmp_filepath, dest)
+    except BaseException:
+        tmp_filepath.unlink(missing_ok=True)
+        raise
+
+
+class ContentStore:
+    """Files under `dirpath` by `algorithm:hexdigest`.
+
+    Files linked from the store share its copy; since a hard link has no
+    copy of its own, writing into a downloaded file in place would change
+    the stored one, so its size is checked before it is linked again.
+    """
+
+    def __init__(self, dirpath: Path | str):
+        self.dirpath = Path(dirpath)
+        self._lock = threading.Lock()
+
+    def path_of(self, digest: str) -> Path:
+        """Where the content of `digest` (`algorithm:hexdigest`) is stored.
+
+        Raises:
+            ValueError: `digest` is not valid.
+        """
+        algorithm, hexdigest = parse_checksum(digest)
+        return self.dirpath / algorithm / hexdigest[:2] / hexdigest
+
+    def has(self, digest: str) -> bool:
+        return self.path_of(digest).is_file()
+
+    def add(self, filepath: Path | str, digest: str) -> bool:
+        """Store `filepath` whose content is `digest`, or, if the content is
+        stored already, make `filepath` share the stored copy.
+
+        Returns:
+            bool: whether the content is in the store now; not if the store
+                is on another file system and the content was not there.
+        """
+        filepath = Path(filepath)
+        object_path = self.path_of(digest)
+        with self._lock:
+            if object_path.is_file():
+                if os.path.samefile(object_path, filepath):
+                    return True
+                if object_path.stat().st_size == filepath.stat().st_size:
+                    try:
+                        place_file(object_path, filepath)
+                    except OSError:
+                        # the downloaded copy stays as it is
+                        pass
+                    return True
+                # changed in place through a hard link; the new file takes over
+                object_path.unlink()
+            object_path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(filepath, object_path)
+            except OSError:
+                return False
+            return True
+
+    def link(self, digest: str, dest: Path | str, size: Optional[int] = None) -> bool:
+        """Put the stored content of `digest` at `dest`.
+
+        Returns:
+            bool: whether it was stored, with `size` bytes if given.
+        """
+        object_path = self.path_of(digest)
+        try:
+            if size is not None and object_path.stat().st_size != size:
+                return False
+            place_file(object_path, dest)
+        except OSError:
+            return False
+        return True
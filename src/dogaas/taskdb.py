@@ -0,0 +1,485 @@
+from collections.abc import ItemsView, MutableMapping, ValuesView
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+from urllib.parse import urlparse
+import threading
+import sqlite3
+import json
+import time
+
+from .downloader import (
+    TASK_STATES,
+    DownloaderTask,
+    DuplicateTaskError,
+    TaskDatabaseInterface,
+    TaskLeaseInterface,
+    TaskState,
+)
+from .jsonstream import iter_json_object
+
+
+def host_of_task_url(url: str) -> str:
+    return (urlparse(url).hostname or "").lower()
+
+
+# adding a task of an existing name replaces it and keeps its state
+_UPSERT = (
+    "INSERT INTO tasks (name, url, host, data, priority) VALUES (?, ?, ?, ?, ?)"
+    " ON CONFLICT (name) DO UPDATE SET url = excluded.url, host = excluded.host,"
+    " data = excluded.data, priority = excluded.priority"
+)
+
+
+class _TaskItemsView(ItemsView):
+    def __iter__(self):
+        yield from self._mapping.query_tasks()
+
+
+class _TaskValuesView(ValuesView):
+    def __iter__(self):
+        for _, task in self._mapping.query_tasks():
+            yield task
+
+
+# columns of the state of a task, added to databases made without them
+_STATE_COLUMNS = {
+    "priority": "INTEGER NOT NULL DEFAULT 0",
+    "state": "TEXT NOT NULL DEFAULT 'pending'",
+    "owner": "TEXT",
+    "lease_expires_at": "REAL",
+    "attempts": "INTEGER NOT NULL DEFAULT 0",
+    "error": "TEXT",
+}
+
+
+class SQLiteTaskDatabase(TaskDatabaseInterface, TaskLeaseInterface, MutableMapping):
+    """Tasks stored in a SQLite file, usable as `TaskManager.tasks`.
+
+    Every change is written as a single row, and names, URLs and hosts are
+    indexed so lookups and filtered listings do not load every task.
+    Iteration follows insertion order like `dict`.
+
+    The file also keeps the state of every task, so worker processes
+    sharing it claim tasks with leases instead of downloading them twice.
+    Claims are made in write transactions, which SQLite serializes between
+    processes by locking the file; on a network file system, its locks must
+    work for that. The leases are timed by `clock` of each worker, so the
+    clocks of workers on several machines must agree to within a fraction
+    of a lease.
+    """
+
+    # rows fetched per query while iterating
+    page_size = 1000
+
+    def __init__(
+        self,
+        filepath: Path | str,
+        timeout: float = 30.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            timeout (float): seconds to wait for a transaction of another
+                process before failing with `sqlite3.OperationalError`.
+            clock (Callable[[], float]): the time leases expire by.
+        """
+        self.filepath = Path(filepath)
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(
+            self.filepath,
+            timeout=timeout,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE,
+                    url TEXT NOT NULL,
+                    host TEXT NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS tasks_url ON tasks (url);
+                CREATE INDEX IF NOT EXISTS tasks_host ON tasks (host);
+                """)
+            self._add_state_columns()
+
+    def _add_state_columns(self):
+        columns = {row[1] for row in self._execute("PRAGMA table_info(tasks)")}
+        if set(_STATE_COLUMNS) <= columns:
+            return
+        with self._transaction():
+            for column, definition in _STATE_COLUMNS.items():
+                if column not in columns:
+                    self._connection.execute(
+                        f"ALTER TABLE tasks ADD COLUMN {column} {definition}"
+                    )
+            self._connection.execute(
+                "UPDATE tasks SET priority ="
+                " COALESCE(json_extract(data, '$.priority'), 0)"
+            )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS tasks_claim"
+            " ON tasks (state, priority DESC, id)"
+        )
+
+    @contextmanager
+    def _transaction(self):
+        """A write transaction, which takes the lock of the file at once so
+        that what it reads cannot change under it."""
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _execute(self, sql: str, parameters=()) -> list[tuple]:
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    @staticmethod
+    def _row_values(name: str, task: DownloaderTask) -> tuple[str, str, str, str, int]:
+        if not isinstance(task, DownloaderTask):
+            raise TypeError("`task` must be `DownloaderTask`")
+        return (
+            name,
+            task.url,
+            host_of_task_url(task.url),
+            json.dumps(task.to_dict()),
+            task.priority,
+        )
+
+    def __getitem__(self, name: str) -> DownloaderTask:
+        rows = self._execute("SELECT data FROM tasks WHERE name = ?", (name,))
+        if not rows:
+            raise KeyError(name)
+        return DownloaderTask.from_dict(json.loads(rows[0][0]))
+
+    def __setitem__(self, name: str, task: DownloaderTask):
+        self._execute(
+            _UPSERT,
+            self._row_values(name, task),
+        )
+
+    def __delitem__(self, name: str):
+        with self._lock:
+            cursor = self._connection.execute(
+                "DELETE FROM tasks WHERE name = ?", (name,)
+            )
+            if cursor.rowcount == 0:
+                raise KeyError(name)
+
+    def __contains__(self, name) -> bool:
+        return bool(self._execute("SELECT 1 FROM tasks WHERE name = ?", (name,)))
+
+    def __iter__(self) -> Iterator[str]:
+        for (name,) in self._query("name", "", ()):
+            yield name
+
+    def __len__(self) -> int:
+        return self._execute("SELECT COUNT(*) FROM tasks")[0][0]
+
+    def items(self):
+        return _TaskItemsView(self)
+
+    def values(self):
+        return _TaskValuesView(self)
+
+    def add_task(
+        self, name: str, task: DownloaderTask, raise_if_duplicate: bool = False
+    ):
+        if raise_if_duplicate:
+            try:
+                self._execute(
+                    "INSERT INTO tasks (name, url, host, data, priority)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    self._row_values(name, task),
+                )
+            except sqlite3.IntegrityError:
+                raise DuplicateTaskError(f"task `{name}` already exists")
+        else:
+            self[name] = task
+
+    def add_tasks(self, tasks: Iterable[tuple[str, DownloaderTask]]):
+        """Insert or replace many tasks in one transaction."""
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                self._connection.executemany(
+                    _UPSERT,
+                    (self._row_values(name, task) for name, task in tasks),
+                )
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def contains_url(self, url: str) -> bool:
+        return bool(self._execute("SELECT 1 FROM tasks WHERE url = ?", (url,)))
+
+    def remove_task(self, task_name: str):
+        del self[task_name]
+
+    def rename_task(self, task_name: str, new_name: str):
+        if task_name == new_name:
+            # the DELETE below would remove the task itself
+            if task_name not in self:
+                raise KeyError(task_name)
+            return
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                self._connection.execute(
+                    "DELETE FROM tasks WHERE name = ?", (new_name,)
+                )
+                cursor = self._connection.execute(
+                    "UPDATE tasks SET name = ? WHERE name = ?", (new_name, task_name)
+                )
+                if cursor.rowcount == 0:
+                    raise KeyError(task_name)
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    @staticmethod
+    def _where(
+        name: Optional[str], url: Optional[str], host: Optional[str]
+    ) -> tuple[str, tuple]:
+        conditions = []
+        parameters = []
+        if name is not None:
+            conditions.append("name GLOB ?")
+            parameters.append(name)
+        if url is not None:
+            conditions.append("url GLOB ?")
+            parameters.append(url)
+        if host is not None:
+            conditions.append("host = ?")
+            parameters.append(host.lower())
+        if not conditions:
+            return "", ()
+        return " AND " + " AND ".join(conditions), tuple(parameters)
+
+    def _query(
+        self, columns: str, where: str, parameters: tuple, offset=0, limit=None
+    ) -> Iterator[tuple]:
+        """Yield `columns` of matching rows, fetching `page_size` rows at a time."""
+        last_id = -1
+        remaining = limit
+        while remaining is None or remaining > 0:
+            page_size = (
+                self.page_size if remaining is None else min(self.page_size, remaining)
+            )
+            rows = self._execute(
+                f"SELECT id, {columns} FROM tasks WHERE id > ?{where}"
+                " ORDER BY id LIMIT ? OFFSET ?",
+                (last_id, *parameters, page_size, offset),
+            )
+            if not rows:
+                return
+            offset = 0
+            last_id = rows[-1][0]
+            if remaining is not None:
+                remaining -= len(rows)
+            for row in rows:
+                yield row[1:]
+
+    def query_tasks(
+        self,
+        name: Optional[str] = None,
+        url: Optional[str] = None,
+        host: Optional[str] = None,
+        offset: int = 0,
+        limit: Optional[int] = None,
+    ) -> Iterator[tuple[str, DownloaderTask]]:
+        """Yield `(name, task)` in insertion order.
+
+        `name` and `url` are shell-style patterns and `host` is a hostname.
+        """
+        where, parameters = self._where(name, url, host)
+        for task_name, data in self._query(
+            "name, data", where, parameters, offset, limit
+        ):
+            yield task_name, DownloaderTask.from_dict(json.loads(data))
+
+    def count_tasks(
+        self,
+        name: Optional[str] = None,
+        url: Optional[str] = None,
+        host: Optional[str] = None,
+    ) -> int:
+        where, parameters = self._where(name, url, host)
+        return self._execute(f"SELECT COUNT(*) FROM tasks WHERE 1{where}", parameters)[
+            0
+        ][0]
+
+    def migrate_from_json(self, filepath: Path | str) -> int:
+        """Insert the tasks of a `tasks.json` saved by `TaskManager` in one go.
+
+        Returns:
+            int: the number of tasks read from the file.
+        """
+        count = 0
+
+        def iter_tasks(f) -> Iterator[tuple[str, DownloaderTask]]:
+            nonlocal count
+            for name, data in iter_json_object(f):
+                count += 1
+                yield name, DownloaderTask.from_dict(data)
+
+        with open(Path(filepath), encoding="utf-8") as f:
+            self.add_tasks(iter_tasks(f))
+        return count
+
+    def claim_tasks(
+        self, owner: str, count: int = 1, lease_s: float = 60.0, max_attempts: int = 5
+    ) -> list[tuple[str, DownloaderTask]]:
+        now = self._clock()
+        with self._transaction():
+            self._connection.execute(
+                "UPDATE tasks SET state = 'failed', owner = NULL,"
+                " lease_expires_at = NULL, error = ?"
+                " WHERE state = 'claimed' AND lease_expires_at <= ? AND attempts >= ?",
+                (f"lease expired {max_attempts} times", now, max_attempts),
+            )
+            # URLs another worker is downloading wait until it is done with
+            # them, so that two workers never write the same file
+            not_held_elsewhere = (
+                " AND url NOT IN (SELECT url FROM tasks WHERE state = 'claimed'"
+                " AND lease_expires_at > :now AND owner != :owner)"
+            )
+            parameters = {"now": now, "owner": owner}
+            # tasks of workers which stopped go first; they were urgent
+            rows = self._connection.execute(
+                "SELECT id, name, url, data FROM tasks"
+                " WHERE state = 'claimed' AND lease_expires_at <= :now"
+                f"{not_held_elsewhere} ORDER BY priority DESC, id LIMIT :count",
+                {**parameters, "count": count},
+            ).fetchall()
+            if len(rows) < count:
+                rows += self._connection.execute(
+                    "SELECT id, name, url, data FROM tasks WHERE state = 'pending'"
+                    f"{not_held_elsewhere} ORDER BY priority DESC, id LIMIT :count",
+                    {**parameters, "count": count - len(rows)},
+                ).fetchall()
+            # and the other tasks of the same URLs come along
+            ids = {row[0] for row in rows}
+            for url in dict.fromkeys(row[2] for row in rows):
+                rows += [
+                    row
+                    for row in self._connection.execute(
+                        "SELECT id, name, url, data FROM tasks WHERE url = :url"
+                        " AND (state = 'pending'"
+                        " OR (state = 'claimed' AND lease_expires_at <= :now))",
+                        {"url": url, "now": now},
+                    )
+                    if row[0] not in ids
+                ]
+            self._connection.executemany(
+                "UPDATE tasks SET state = 'claimed', owner = ?,"
+                " lease_expires_at = ?, attempts = attempts + 1, error = NULL"
+                " WHERE id = ?",
+                ((owner, now + lease_s, row[0]) for row in rows),
+            )
+        return [
+            (name, DownloaderTask.from_dict(json.loads(data)))
+            for _, name, _, data in rows
+        ]
+
+    def renew_leases(
+        self, owner: str, task_names: Iterable[str], lease_s: float = 60.0
+    ) -> list[str]:
+        task_names = list(task_names)
+        lease_expires_at = self._clock() + lease_s
+        held = []
+        with self._transaction():
+            for task_name in task_names:
+                cursor = self._connection.execute(
+                    "UPDATE tasks SET lease_expires_at = ?"
+                    " WHERE name = ? AND state = 'claimed' AND owner = ?",
+                    (lease_expires_at, task_name, owner),
+                )
+                if cursor.rowcount:
+                    held.append(task_name)
+        return held
+
+    def complete_task(
+        self, owner: str, task_name: str, error: Optional[str] = None
+    ) -> bool:
+        # an expired lease still counts until another worker claims the task
+        with self._lock:
+            cursor = self._connection.execute(
+                "UPDATE tasks SET state = ?, owner = NULL, lease_expires_at = NULL,"
+                " error = ? WHERE name = ? AND state = 'claimed' AND owner = ?",
+                ("done" if error is None else "failed", error, task_name, owner),
+            )
+            return cursor.rowcount > 0
+
+    def release_tasks(self, owner: str, task_names: Optional[Iterable[str]] = None):
+        with self._transaction():
+            if task_names is None:
+                self._connection.execute(
+                    "UPDATE tasks SET state = 'pending', owner = NULL,"
+                    " lease_expires_at = NULL WHERE state = 'claimed' AND owner = ?",
+                    (owner,),
+                )
+                return
+            self._connection.executemany(
+                "UPDATE tasks SET state = 'pending', owner = NULL,"
+                " lease_expires_at = NULL"
+                " WHERE name = ? AND state = 'claimed' AND owner = ?",
+                ((task_name, owner) for task_name in task_names),
+            )
+
+    def task_state(self, task_name: str) -> TaskState:
+        rows = self._execute(
+            "SELECT state, owner, lease_expires_at, attempts, error FROM tasks"
+            " WHERE name = ?",
+            (task_name,),
+        )
+        if not rows:
+            raise KeyError(task_name)
+        return TaskState(*rows[0])
+
+    def count_task_states(self) -> dict[str, int]:
+        counts = dict.fromkeys(TASK_STATES, 0)
+        for state, count in self._execute(
+            "SELECT state, COUNT(*) FROM tasks GROUP BY state"
+        ):
+            counts[state] = count
+        return counts
+
+    def reset_task_states(
+        self, states: Iterable[str] = ("failed",), name: Optional[str] = None
+    ) -> int:
+        states = list(states)
+        if not set(states) <= set(TASK_STATES):
+            raise ValueError(f"`states` must be of {TASK_STATES}")
+        where, parameters = self._where(name, None, None)
+        with self._lock:
+            cursor = self._connection.execute(
+                "UPDATE tasks SET state = 'pending', owner = NULL,"
+                " lease_expires_at = NULL, attempts = 0, error = NULL"
+                f" WHERE state IN ({', '.join('?' * len(states))}){where}",
+                (*states, *parameters),
+            )
+            return cursor.rowcount
@@ -0,0 +1,65 @@
+"""Task name lookups straight from the saved task file.
+
+They only use the standard library, so the CLI can complete and validate
+task names without importing the download stack or loading every task.
+Names are looked up in the index of a `tasks.db`; a `tasks.json` is
+scanned one task at a time, so set `"task_database": "sqlite"` in
+`config.json` for lookups which stay fast with many tasks.
+"""
+
+from pathlib import Path
+from typing import Iterator
+import sqlite3
+
+from .jsonstream import iter_json_object
+
+
+def _connect_read_only(filepath: Path) -> sqlite3.Connection:
+    return sqlite3.connect(f"{filepath.absolute().as_uri()}?mode=ro", uri=True)
+
+
+def _glob_escape(text: str) -> str:
+    return "".join(f"[{c}]" if c in "*?[]" else c for c in text)
+
+
+def iter_task_names(filepath: Path | str, prefix: str = "") -> Iterator[str]:
+    """Yield the names starting with `prefix` in a `tasks.json` / `tasks.db`."""
+    filepath = Path(filepath)
+    if not filepath.exists():
+        return
+    if filepath.suffix == ".db":
+        connection = _connect_read_only(filepath)
+        try:
+            rows = connection.execute(
+                "SELECT name FROM tasks WHERE name GLOB ? ORDER BY id",
+                (_glob_escape(prefix) + "*",),
+            ).fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+        finally:
+            connection.close()
+        for (name,) in rows:
+            yield name
+    else:
+        with open(filepath, encoding="utf-8") as f:
+            # a lookup stopping at its name does not read the rest
+            for name, _ in iter_json_object(f):
+                if name.startswith(prefix):
+                    yield name
+
+
+def has_task_name(filepath: Path | str, name: str) -> bool:
+    filepath = Path(filepath)
+    if filepath.suffix == ".db" and filepath.exists():
+        connection = _connect_read_only(filepath)
+        try:
+            return bool(
+                connection.execute(
+                    "SELECT 1 FROM tasks WHERE name = ?", (name,)
+                ).fetchall()
+            )
+        except sqlite3.OperationalError:
+            return False
+        finally:
+            connection.close()
+    return any(task_name == name for task_name in iter_task_names(filepath))
@@ -0,0 +1,240 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, Optional
+from urllib.parse import urlparse
+import threading
+import socket
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NameResolutionError, NewConnectionError
+import requests
+
+
+def host_of_url(url: str) -> str:
+    """Return `scheme://host[:port]` which identifies a connection pool."""
+    parsed_url = urlparse(url)
+    return f"{parsed_url.scheme}://{parsed_url.netloc}".lower()
+
+
+@dataclass
+class ConnectionTimings:
+    """How the connection which carried a response was opened.
+
+    The seconds are 0 for a `reused` connection, whose cost was paid by an
+    earlier request.
+    """
+
+    reused: bool
+    dns_s: float = 0.0
+    connect_s: float = 0.0
+    tls_s: float = 0.0
+
+
+class _TimedConnectionMixin:
+    """Record the DNS, TCP and TLS time of opening the connection."""
+
+    dns_s = 0.0
+    connect_s = 0.0
+    tls_s = 0.0
+    requests_sent = 0
+
+    def _new_conn(self) -> socket.socket:
+        started_at = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(
+                self._dns_host, self.port, type=socket.SOCK_STREAM
+            )
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+        resolved_at = time.perf_counter()
+        dns_host = self._dns_host
+        try:
+            # connect to the addresses resolved above so the lookup is not
+            # repeated inside urllib3
+            for i, address in enumerate(addresses):
+                self._dns_host = address[4][0]
+                try:
+                    sock = super()._new_conn()
+                    break
+                except NewConnectionError:
+                    if i == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = dns_host
+        self.dns_s = resolved_at - started_at
+        self.connect_s = time.perf_counter() - resolved_at
+        return sock
+
+    def connect(self):
+        started_at = time.perf_counter()
+        super().connect()
+        self.tls_s = max(
+            0.0, time.perf_counter() - started_at - self.dns_s - self.connect_s
+        )
+
+    def request(self, *args, **kwargs):
+        self.requests_sent += 1
+        return super().request(*args, **kwargs)
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+def connection_timings(response: requests.Response) -> Optional[ConnectionTimings]:
+    """Return how the connection of a streamed `response` was opened.
+
+    `None` if the response did not come through a `SessionPool` or its
+    connection was already released. Responses of
+    `dogaas.asyncdownloader.AsyncConnectionPool` carry theirs as `timings`.
+    """
+    if isinstance(timings := getattr(response, "timings", None), ConnectionTimings):
+        return timings
+    connection = getattr(response.raw, "connection", None)
+    if not isinstance(connection, _TimedConnectionMixin):
+        return None
+    if connection.requests_sent > 1:
+        return ConnectionTimings(reused=True)
+    return ConnectionTimings(
+        reused=False,
+        dns_s=connection.dns_s,
+        connect_s=connection.connect_s,
+        tls_s=connection.tls_s,
+    )
+
+
+def shut_down_connection(response: requests.Response):
+    """Shut the socket of a streamed `response` down, so that a read waiting
+    for its bytes on another thread returns at once.
+
+    Nothing is done if the connection was already released.
+    """
+    sock = getattr(getattr(response.raw, "connection", None), "sock", None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        # already closed
+        pass
+
+
+class SessionPool:
+    """Keep-alive `requests.Session`s, one per host, shared by many downloads.
+
+    It has the same `get` / `head` as `requests`, so it can be passed wherever
+    the `requests` module would be used to make requests.
+    """
+
+    def __init__(
+        self,
+        pool_maxsize: int = 10,
+        per_host_pool_maxsize: Optional[dict[str, int]] = None,
+        headers: Optional[dict[str, str]] = None,
+    ):
+        """
+        Args:
+            pool_maxsize (int): connections kept alive per host.
+            per_host_pool_maxsize (dict[str, int]): overrides `pool_maxsize`
+                for hosts given as `scheme://host[:port]` or a bare hostname.
+            headers (dict[str, str]): headers sent with every request.
+        """
+        self.pool_maxsize = pool_maxsize
+        self.per_host_pool_maxsize = per_host_pool_maxsize or {}
+        self.headers = headers or {}
+        self._sessions: dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def pool_maxsize_for(self, host: str) -> int:
+        return self.per_host_pool_maxsize.get(
+            host,
+            self.per_host_pool_maxsize.get(urlparse(host).hostname, self.pool_maxsize),
+        )
+
+    def session_for(self, url: str) -> requests.Session:
+        host = host_of_url(url)
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                session.headers.update(self.headers)
+                pool_maxsize = self.pool_maxsize_for(host)
+                adapter = _TimedHTTPAdapter(
+                    pool_connections=1, pool_maxsize=pool_maxsize
+                )
+                session.mount(f"{host}/", adapter)
+                self._sessions[host] = session
+        return session
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        return self.session_for(url).request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("allow_redirects", True)
+        return self.request("HEAD", url, **kwargs)
+
+    def warm_up(self, urls: Iterable[str], connections_per_host: int = 1, timeout=5):
+        """Open connections to the hosts of `urls` ahead of the downloads.
+
+        A `HEAD` request is sent to one URL per host, `connections_per_host`
+        times in parallel; failures are ignored since the downloads report
+        their own errors.
+        """
+        url_by_host: dict[str, str] = {}
+        for url in urls:
+            url_by_host.setdefault(host_of_url(url), url)
+        warm_up_urls = [
+            url
+            for host, url in url_by_host.items()
+            for _ in range(min(connections_per_host, self.pool_maxsize_for(host)))
+        ]
+        if not warm_up_urls:
+            return
+
+        def head(url):
+            try:
+                self.head(url, timeout=timeout).close()
+            except requests.RequestException:
+                pass
+
+        with ThreadPoolExecutor(max_workers=min(32, len(warm_up_urls))) as executor:
+            list(executor.map(head, warm_up_urls))
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
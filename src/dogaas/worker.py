@@ -0,0 +1,192 @@
+"""Drain one task list from many processes, or machines sharing its file.
+
+Each `Worker` claims a batch of tasks with leases, downloads them with a
+`DownloadScheduler`, and renews the leases on a thread while it does, so
+no two workers download the same task and the tasks of a worker which
+died are picked up by the others once its leases expire.
+"""
+
+from pathlib import Path
+from typing import Callable, Optional
+import threading
+import logging
+import socket
+import uuid
+import os
+
+from .downloader import (
+    DownloadResult,
+    DownloadScheduler,
+    ProgressEvent,
+    TaskLeaseInterface,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def default_owner() -> str:
+    """`host:pid:random`, unique to a worker even across machines."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class Worker:
+    def __init__(
+        self,
+        scheduler: DownloadScheduler,
+        owner: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        lease_s: float = 60.0,
+        heartbeat_s: Optional[float] = None,
+        poll_s: float = 5.0,
+        max_attempts: int = 5,
+    ):
+        """
+        Args:
+            scheduler (DownloadScheduler): downloads the claimed tasks; the
+                tasks of its task manager must be a `TaskLeaseInterface`,
+                such as `dogaas.taskdb.SQLiteTaskDatabase`.
+            owner (str): the name the leases are held by; `default_owner()`
+                if not given.
+            batch_size (int): tasks claimed at once; four per job of
+                `scheduler` if not given.
+            lease_s (float): seconds a claim lasts without being renewed.
+            heartbeat_s (float): seconds between renewals; a third of
+                `lease_s` if not given.
+            poll_s (float): seconds between looks for tasks whose leases
+                expired, while the other workers hold the rest.
+            max_attempts (int): see `TaskLeaseInterface.claim_tasks`.
+        """
+        tasks = scheduler.task_manager.tasks
+        if not isinstance(tasks, TaskLeaseInterface):
+            raise TypeError(
+                "the tasks of the task manager must be `TaskLeaseInterface`"
+            )
+        self.scheduler = scheduler
+        self.tasks: TaskLeaseInterface = tasks
+        self.owner = owner or default_owner()
+        self.batch_size = batch_size or scheduler.jobs * 4
+        self.lease_s = lease_s
+        self.heartbeat_s = heartbeat_s if heartbeat_s is not None else lease_s / 3
+        self.poll_s = poll_s
+        self.max_attempts = max_attempts
+        # claimed tasks which are not done yet
+        self._held: set[str] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        # tasks whose leases were lost, e.g. while this process was suspended
+        self.lost_task_names: list[str] = []
+
+    def stop(self):
+        """Claim no more tasks; `run` returns once those claimed are done."""
+        self._stop.set()
+
+    def _heartbeat(self, batch_done: threading.Event):
+        while not batch_done.wait(self.heartbeat_s):
+            with self._lock:
+                task_names = list(self._held)
+            try:
+                held = set(
+                    self.tasks.renew_leases(self.owner, task_names, self.lease_s)
+                )
+            except Exception:
+                # e.g. `database is locked` with many workers; the leases
+                # outlast a few missed beats, so the next one tries again
+                logger.exception("renewing the leases of %s failed", self.owner)
+                continue
+            with self._lock:
+                # a task may have been completed while renewing
+                lost = [name for name in task_names if name not in held]
+                lost = [name for name in lost if name in self._held]
+                self._held.difference_update(lost)
+                self.lost_task_names.extend(lost)
+
+    def _complete(self, result: DownloadResult) -> bool:
+        """Record the result, and return whether the task was still held."""
+        error = None
+        if not result.ok:
+            error = f"{type(result.error).__name__}: {result.error}"
+        with self._lock:
+            self._held.discard(result.task_name)
+        if self.tasks.complete_task(self.owner, result.task_name, error):
+            return True
+        with self._lock:
+            if result.task_name not in self.lost_task_names:
+                self.lost_task_names.append(result.task_name)
+        return False
+
+    def run(
+        self,
+        dirpath_for_dest: Path | str,
+        on_progress: Optional[Callable[[str, ProgressEvent], None]] = None,
+        on_done: Optional[Callable[[DownloadResult], None]] = None,
+        wait: bool = True,
+    ) -> dict[str, int]:
+        """Claim and download tasks into `dirpath_for_dest` until none is
+        pending. With `wait`, also until no other worker holds a task, since
+        its lease may expire.
+
+        The filename collisions are resolved once over the whole task list,
+        like `TaskManager.dest_filenames`, so every worker saves a task
+        under the same name whatever its batch; tasks added while this runs
+        keep the names of their URLs. Tasks still claimed when this raises
+        are given back as pending.
+
+        `on_done` is only called with the results recorded; those of tasks
+        whose leases were lost to another worker go to `lost_task_names`.
+
+        Returns:
+            dict[str, int]: the number of tasks this worker made `done` and
+                `failed`.
+        """
+        counts = {"done": 0, "failed": 0}
+        # a scan of every task, too slow to repeat for each batch
+        filenames: Optional[dict[str, str]] = None
+
+        def done(result: DownloadResult):
+            if not self._complete(result):
+                return
+            counts["done" if result.ok else "failed"] += 1
+            if on_done:
+                on_done(result)
+
+        try:
+            while not self._stop.is_set():
+                claimed = self.tasks.claim_tasks(
+                    self.owner, self.batch_size, self.lease_s, self.max_attempts
+                )
+                if not claimed:
+                    states = self.tasks.count_task_states()
+                    if not wait or not (states["pending"] or states["claimed"]):
+                        break
+                    self._stop.wait(self.poll_s)
+                    continue
+                task_names = [task_name for task_name, _ in claimed]
+                if filenames is None:
+                    filenames = self.scheduler.task_manager.dest_filenames(
+                        None, dirpath_for_dest
+                    )
+                with self._lock:
+                    self._held.update(task_names)
+                batch_done = threading.Event()
+                heartbeat = threading.Thread(
+                    target=self._heartbeat, args=(batch_done,), daemon=True
+                )
+                heartbeat.start()
+                try:
+                    self.scheduler.run(
+                        dirpath_for_dest,
+                        task_names,
+                        on_progress=on_progress,
+                        on_done=done,
+                        filenames=filenames,
+                    )
+                finally:
+                    batch_done.set()
+                    heartbeat.join()
+        finally:
+            with self._lock:
+                held = list(self._held)
+                self._held.clear()
+            if held:
+                self.tasks.release_tasks(self.owner, held)
+        return counts
@@ -1,13 +1,22 @@
 # TODO: refactoring code
 
 from pathlib import Path
+import threading
 import sys
 import json
-from typing import Callable
 
 import flet as ft
 
+from dogaas.background import (
+    DOWNLOADING,
+    PAUSED,
+    QUEUED,
+    BackgroundDownloadManager,
+    TaskProgress,
+)
 from dogaas.downloader import TaskManager, DownloaderTask, is_url
+from dogaas.ipc import DaemonClient
+from dogaas.remote import RemoteDownloadManager, RemoteTaskManager
 
 THIS_SCRIPT_DIR = Path(sys.argv[0]).parent.absolute()
 CONFIG_FILENAME = "config.json"
@@ -52,16 +61,23 @@ def close_dialog(page: ft.Page, dialog: ft.AlertDialog):
     page.update()
 
 
-task_manager = TaskManager()
+DAEMON_SOCKET_FILEPATH = Path(
+    config.get("daemon_socket") or THIS_SCRIPT_DIR / "dogaas.sock"
+)
+
+
+def make_task_manager() -> TaskManager:
+    """Use the tasks of the daemon if it is running, else tasks of our own."""
+    if client := DaemonClient.connect(DAEMON_SOCKET_FILEPATH):
+        return RemoteTaskManager(client)
+    return TaskManager()
+
+
+task_manager = make_task_manager()
 
 
 class TaskDisplay(ft.UserControl):
-    def __init__(
-        self,
-        task_name: str,
-        task_manager: TaskManager,
-        delete_task_func: Callable,
-    ):
+    def __init__(self, task_name: str, task_manager: TaskManager):
         super().__init__()
         if isinstance(task_name, str):
             self.task_name = task_name
@@ -71,65 +87,71 @@ class TaskDisplay(ft.UserControl):
             self.task_manager = task_manager
         else:
             raise TypeError("`task_manager` must be `TaskManager`")
-        self.delete_task_func = delete_task_func
 
     def build(self):
-        remove_btn = ft.Ref[ft.IconButton]()
         self.taskname_display = ft.Ref[ft.TextField]()
         self.url_display = ft.Ref[ft.TextField]()
         self.checkbox = ft.Ref[ft.Checkbox]()
-        return ft.Container(
-            ft.Row(
-                [
-                    ft.Checkbox(ref=self.checkbox, value=False),
-                    ft.Column(
-                        [
-                            ft.TextField(
-                                ref=self.taskname_display,
-                                value=self.task_name,
-                                on_submit=lambda e: self.rename_task(),
-                            ),
-                            ft.TextField(
-                                ref=self.url_display,
-                                value=self.task_manager.tasks[self.task_name].url,
-                                on_submit=lambda e: self.rewrite_task_url(),
-                            ),
-                        ],
-                        expand=1,
-                    ),
-                    ft.IconButton(
-                        ref=remove_btn,
-                        icon=ft.icons.DELETE,
-                        on_click=lambda e: self.remove_task(),
-                    ),
-                ],
-                expand=1,
-            ),
-            padding=2,
-            border_radius=3,
-            border=ft.Border(*[ft.BorderSide(1, ft.colors.TEAL)] * 4),
+        return ft.Row(
+            [
+                ft.Checkbox(ref=self.checkbox, value=False),
+                ft.Column(
+                    [
+                        ft.TextField(
+                            ref=self.taskname_display,
+                            value=self.task_name,
+                            dense=True,
+                            on_submit=lambda e: self.rename_task(),
+                        ),
+                        ft.TextField(
+                            ref=self.url_display,
+                            value=self.task_manager.tasks[self.task_name].url,
+                            dense=True,
+                            on_submit=lambda e: self.rewrite_task_url(),
+                        ),
+                    ],
+                    expand=1,
+                    spacing=2,
+                ),
+                ft.IconButton(
+                    icon=ft.icons.DELETE,
+                    on_click=lambda e: self.remove_task(),
+                ),
+            ],
         )
 
-    def rename_task(self):
-        if self.taskname_display.current.value:
-            self.task_manager.rename_task(
-                self.task_name, self.taskname_display.current.value
-            )
+    @property
+    def is_selected(self) -> bool:
+        return bool(self.checkbox.current and self.checkbox.current.value)
+
+    def show_task_name(self, task_name: str):
+        """Show the task as renamed to `task_name`, without rebuilding it."""
+        self.task_name = task_name
+        if self.taskname_display.current:
+            self.taskname_display.current.value = task_name
             self.taskname_display.current.error_text = None
             self.taskname_display.current.update()
-            self.task_name = self.taskname_display.current.value
-        else:
+
+    def rename_task(self):
+        new_name = self.taskname_display.current.value
+        if not new_name:
             self.taskname_display.current.error_text = i18ntexts["input_dl_task_name"]
             self.taskname_display.current.update()
+        elif new_name != self.task_name and new_name in self.task_manager.tasks:
+            self.taskname_display.current.error_text = i18ntexts["duplicate_task_name"]
+            self.taskname_display.current.update()
+        elif new_name != self.task_name:
+            # `TaskListView.on_task_rename` shows the new name
+            self.task_manager.rename_task(self.task_name, new_name)
 
     def remove_task(self):
+        # `TaskListView.on_task_remove` takes this display out of the list
         self.task_manager.remove_task(self.task_name)
-        self.delete_task_func(self)
 
     def rewrite_task_url(self):
         if is_url(self.url_display.current.value):
-            self.task_manager.tasks[self.task_name].rewrite_url(
-                self.url_display.current.value
+            self.task_manager.rewrite_task_url(
+                self.task_name, self.url_display.current.value
             )
             self.url_display.current.error_text = None
             self.url_display.current.update()
@@ -138,13 +160,230 @@ class TaskDisplay(ft.UserControl):
             self.url_display.current.update()
 
 
+class TaskListView(ft.UserControl):
+    """Tasks of a `TaskManager` on an `ft.ListView`, built a page at a time.
+
+    Only the first `page_size` tasks get a `TaskDisplay` at first and another
+    page is built whenever the list is scrolled near its end. The list
+    follows the changes of the tasks through the `on_task_*` methods, which
+    are meant to be the `on_add` / `on_remove` / `on_rename` callbacks of
+    the `TaskManager`, so only the rows which changed are sent to the page.
+    """
+
+    page_size = 100
+    # how close to the end of the list, in pixels, the next page is built
+    scroll_threshold = 500
+
+    def __init__(self, task_manager: TaskManager):
+        super().__init__()
+        self.task_manager = task_manager
+        self._task_names: list[str] = task_manager.select_task_names()
+        self._displays: dict[str, TaskDisplay] = {}
+        self._limit = self.page_size
+        self._lock = threading.RLock()
+        self.list_view = ft.Ref[ft.ListView]()
+
+    def build(self):
+        return ft.ListView(
+            ref=self.list_view,
+            controls=self._new_displays(),
+            expand=1,
+            spacing=4,
+            on_scroll_interval=100,
+            on_scroll=self._on_scroll,
+        )
+
+    @property
+    def selected_task_names(self) -> list[str]:
+        with self._lock:
+            return [
+                task_name
+                for task_name, display in self._displays.items()
+                if display.is_selected
+            ]
+
+    def _new_displays(self) -> list[TaskDisplay]:
+        """Make displays for unbuilt tasks until `_limit` are built."""
+        displays = []
+        with self._lock:
+            for task_name in self._task_names[len(self._displays) : self._limit]:
+                display = TaskDisplay(task_name, self.task_manager)
+                self._displays[task_name] = display
+                displays.append(display)
+        return displays
+
+    def _append_new_displays(self) -> bool:
+        if displays := self._new_displays():
+            self.list_view.current.controls.extend(displays)
+            self.list_view.current.update()
+        return bool(displays)
+
+    def _on_scroll(self, e: ft.OnScrollEvent):
+        if e.pixels >= e.max_scroll_extent - self.scroll_threshold:
+            with self._lock:
+                if len(self._displays) < len(self._task_names):
+                    self._limit = len(self._displays) + self.page_size
+            self._append_new_displays()
+
+    def on_task_add(self, task_names: list[str]):
+        with self._lock:
+            self._task_names.extend(task_names)
+            if self.list_view.current:
+                self._append_new_displays()
+
+    def on_task_remove(self, task_name: str):
+        with self._lock:
+            self._task_names.remove(task_name)
+            display = self._displays.pop(task_name, None)
+            if display is not None and self.list_view.current:
+                self.list_view.current.controls.remove(display)
+                # the next task moves up to keep the page full
+                if not self._append_new_displays():
+                    self.list_view.current.update()
+
+    def on_task_rename(self, task_name: str, new_name: str):
+        with self._lock:
+            self._task_names[self._task_names.index(task_name)] = new_name
+            display = self._displays.pop(task_name, None)
+            if display is not None:
+                self._displays[new_name] = display
+                display.show_task_name(new_name)
+
+
+class DownloadProgressDisplay(ft.UserControl):
+    """Progress of one task in `DownloadsView`, with its own controls."""
+
+    def __init__(self, task_name: str, download_manager: BackgroundDownloadManager):
+        super().__init__()
+        self.task_name = task_name
+        self.download_manager = download_manager
+
+    def build(self):
+        self.progress_bar = ft.ProgressBar(value=0, expand=1)
+        self.status_text = ft.Text(size=12)
+        self.pause_btn = ft.IconButton(
+            icon=ft.icons.PAUSE, on_click=lambda e: self.toggle_pause()
+        )
+        self.cancel_btn = ft.IconButton(
+            icon=ft.icons.CLOSE,
+            on_click=lambda e: self.download_manager.cancel([self.task_name]),
+        )
+        return ft.Row(
+            [
+                ft.Column(
+                    [ft.Text(self.task_name), self.progress_bar, self.status_text],
+                    expand=1,
+                    spacing=2,
+                ),
+                self.pause_btn,
+                self.cancel_btn,
+            ]
+        )
+
+    def toggle_pause(self):
+        if self.pause_btn.icon == ft.icons.PLAY_ARROW:
+            self.download_manager.resume([self.task_name])
+        else:
+            self.download_manager.pause([self.task_name])
+
+    def show(self, progress: TaskProgress):
+        """Change the controls without sending them; the view updates once."""
+        self.progress_bar.value = progress.ratio
+        status = i18ntexts[f"dl_state_{progress.state}"]
+        if progress.state == DOWNLOADING:
+            status += f" {progress.bytes_per_sec / 1024 / 1024:.1f} MiB/s"
+        elif progress.error is not None:
+            status += f" ({progress.error})"
+        self.status_text.value = status
+        is_active = progress.state in (QUEUED, DOWNLOADING, PAUSED)
+        self.pause_btn.icon = (
+            ft.icons.PLAY_ARROW if progress.state == PAUSED else ft.icons.PAUSE
+        )
+        self.pause_btn.visible = is_active
+        self.cancel_btn.visible = is_active
+
+
+class DownloadsView(ft.UserControl):
+    """Progress of the downloads of a `BackgroundDownloadManager`.
+
+    `show` is the `on_update` of the manager, so the whole view is redrawn
+    with one update at most every `update_interval` of the manager. With the
+    tasks of a daemon, the daemon downloads them and keeps downloading after
+    the view is closed.
+    """
+
+    def __init__(self, task_manager: TaskManager):
+        super().__init__()
+        if isinstance(task_manager, RemoteTaskManager):
+            self.download_manager = RemoteDownloadManager(
+                task_manager.client.socket_path, on_update=self.show
+            )
+        else:
+            self.download_manager = BackgroundDownloadManager(
+                task_manager, on_update=self.show
+            )
+        self._displays: dict[str, DownloadProgressDisplay] = {}
+        self.list_view = ft.Ref[ft.ListView]()
+
+    def build(self):
+        return ft.Column(
+            [
+                ft.Row(
+                    [
+                        ft.TextButton(
+                            i18ntexts["pause_all"],
+                            icon=ft.icons.PAUSE,
+                            on_click=lambda e: self.download_manager.pause(),
+                        ),
+                        ft.TextButton(
+                            i18ntexts["resume_all"],
+                            icon=ft.icons.PLAY_ARROW,
+                            on_click=lambda e: self.download_manager.resume(),
+                        ),
+                        ft.TextButton(
+                            i18ntexts["cancel_all"],
+                            icon=ft.icons.CLOSE,
+                            on_click=lambda e: self.download_manager.cancel(),
+                        ),
+                    ]
+                ),
+                ft.ListView(ref=self.list_view, expand=1, spacing=4),
+            ],
+            expand=1,
+        )
+
+    def show(self, snapshot: dict[str, TaskProgress]):
+        if not self.list_view.current:
+            return
+        for task_name, progress in snapshot.items():
+            display = self._displays.get(task_name)
+            if display is None:
+                display = DownloadProgressDisplay(task_name, self.download_manager)
+                self._displays[task_name] = display
+                self.list_view.current.controls.append(display)
+                # a new display has to be built before it can be changed
+                self.list_view.current.update()
+            display.show(progress)
+        self.update()
+
+    def close(self):
+        self.download_manager.close()
+
+
 class DownloaderScene(ft.UserControl):
-    def __init__(self, page: ft.Page):
+    def __init__(self, page: ft.Page, task_manager: TaskManager):
         super().__init__()
         self.page = page
+        self.task_manager = task_manager
+        self.downloads_view = DownloadsView(task_manager)
+        self.dest_picker = ft.FilePicker(on_result=self._on_dest_picked)
+        self._task_names_to_download: list[str] = []
 
     def build(self):
-        self.tasks_view = ft.Ref[ft.Column]()
+        self.tasks_view = TaskListView(self.task_manager)
+        self.task_manager.on_add = self.tasks_view.on_task_add
+        self.task_manager.on_remove = self.tasks_view.on_task_remove
+        self.task_manager.on_rename = self.tasks_view.on_task_rename
         self.new_taskname_txtfield = ft.Ref[ft.TextField]()
         self.new_taskurl_txtfield = ft.Ref[ft.TextField]()
         add_task_btn = ft.Ref[ft.ElevatedButton]()
@@ -159,6 +398,7 @@ class DownloaderScene(ft.UserControl):
                     ft.TextField(
                         ref=self.new_taskurl_txtfield,
                         hint_text=i18ntexts["input_dl_url"],
+                        on_submit=lambda e: self.add_task(),
                     ),
                     ft.Row(
                         [
@@ -167,15 +407,11 @@ class DownloaderScene(ft.UserControl):
                                 text=i18ntexts["add_task"],
                                 icon=ft.icons.ADD,
                                 expand=1,
+                                on_click=lambda e: self.add_task(),
                             )
                         ]
                     ),
-                    ft.Column(
-                        ref=self.tasks_view,
-                        expand=1,
-                        spacing=4,
-                        scroll=ft.ScrollMode.ALWAYS,
-                    ),
+                    self.tasks_view,
                     ft.Row(
                         [
                             ft.ElevatedButton(
@@ -183,9 +419,11 @@ class DownloaderScene(ft.UserControl):
                                 text=i18ntexts["download"],
                                 icon=ft.icons.DOWNLOAD,
                                 expand=1,
+                                on_click=lambda e: self.download_selected_tasks(),
                             )
                         ]
                     ),
+                    ft.Container(self.downloads_view, height=240),
                 ],
                 expand=1,
             ),
@@ -193,6 +431,41 @@ class DownloaderScene(ft.UserControl):
             expand=1,
         )
 
+    def download_selected_tasks(self):
+        """Ask for the destination, then download the checked tasks."""
+        self._task_names_to_download = self.tasks_view.selected_task_names
+        if self._task_names_to_download:
+            self.dest_picker.get_directory_path()
+
+    def _on_dest_picked(self, e: ft.FilePickerResultEvent):
+        if e.path and self._task_names_to_download:
+            # runs on worker threads, so the page stays responsive
+            self.downloads_view.download_manager.enqueue(
+                self._task_names_to_download, e.path
+            )
+        self._task_names_to_download = []
+
+    def add_task(self):
+        name_field = self.new_taskname_txtfield.current
+        url_field = self.new_taskurl_txtfield.current
+        name_field.error_text = None
+        url_field.error_text = None
+        if not name_field.value:
+            name_field.error_text = i18ntexts["input_dl_task_name"]
+        elif name_field.value in self.task_manager.tasks:
+            name_field.error_text = i18ntexts["duplicate_task_name"]
+        if not is_url(url_field.value or ""):
+            url_field.error_text = i18ntexts["input_dl_url"]
+        if name_field.error_text is None and url_field.error_text is None:
+            # `TaskListView.on_task_add` shows the new task
+            self.task_manager.add_task(
+                name_field.value, DownloaderTask(url_field.value)
+            )
+            name_field.value = ""
+            url_field.value = ""
+        name_field.update()
+        url_field.update()
+
 
 class SettingsScene(ft.UserControl):
     def __init__(self, page: ft.Page):
@@ -236,11 +509,15 @@ class SettingsScene(ft.UserControl):
 
 def main(page: ft.Page):
     page.title = "Dogaas"
+    downloader_scene = DownloaderScene(page, task_manager)
+    page.overlay.append(downloader_scene.dest_picker)
+    page.on_disconnect = lambda e: downloader_scene.downloads_view.close()
     tabs = ft.Tabs(
         selected_index=0,
         tabs=[
             ft.Tab(
-                text=i18ntexts["tab_header_downloader"], content=DownloaderScene(page)
+                text=i18ntexts["tab_header_downloader"],
+                content=downloader_scene,
             ),
             ft.Tab(text=i18ntexts["tab_header_settings"], content=SettingsScene(page)),
         ],
@@ -0,0 +1,14 @@
+import pytest
+
+from benchmarks.server import StandInServer
+
+
+@pytest.fixture
+def http_server():
+    """Serve `server.files` (path -> bytes) on localhost.
+
+    See `benchmarks.server.StandInServer` for the knobs and the records of
+    the requests.
+    """
+    with StandInServer() as server:
+        yield server
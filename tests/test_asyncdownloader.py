@@ -0,0 +1,173 @@
+import asyncio
+import gzip
+import hashlib
+
+import pytest
+
+from src.dogaas.asyncdownloader import AsyncConnectionPool, AsyncTaskManager
+from src.dogaas.cache import FetchCache
+from src.dogaas.concurrency import RetryPolicy
+from src.dogaas.downloader import (
+    ChecksumMismatchError,
+    DownloadError,
+    DownloaderTask,
+    TaskManager,
+)
+
+
+def run(task_manager, tmp_path, **kwargs):
+    async def main():
+        async with AsyncTaskManager(task_manager) as async_task_manager:
+            return await async_task_manager.run(tmp_path, **kwargs)
+
+    return asyncio.run(main())
+
+
+def test_run(http_server, tmp_path):
+    task_manager = TaskManager()
+    for i in range(50):
+        http_server.files[f"/{i}.bin"] = bytes([i]) * (1000 + i)
+        task_manager.add_task(
+            str(i), DownloaderTask(f"{http_server.url}/{i}.bin", priority=i % 3)
+        )
+    events = {}
+    done = []
+    results = run(
+        task_manager,
+        tmp_path,
+        concurrency=8,
+        chunk_size=256,
+        progress_interval=None,
+        on_progress=lambda name, event: events.setdefault(name, []).append(event),
+        on_done=lambda result: done.append(result.task_name),
+    )
+    assert [result.task_name for result in results] == [str(i) for i in range(50)]
+    assert all(result.ok for result in results)
+    for i in range(50):
+        assert (tmp_path / f"{i}.bin").read_bytes() == bytes([i]) * (1000 + i)
+        assert events[str(i)][-1].done and events[str(i)][-1].total_bytes == 1000 + i
+    # urgent ones go first
+    assert all(int(name) % 3 == 2 for name in done[:8])
+    assert not list(tmp_path.glob("*.part"))
+    assert sum(result.stats.reused_connections for result in results) > 0
+
+
+def test_skip_and_verify(http_server, tmp_path):
+    body = b"a" * 3000
+    http_server.files["/a.bin"] = body
+    http_server.files["/b.bin"] = body
+    task_manager = TaskManager(fetch_cache=FetchCache())
+    task_manager.add_task(
+        "a",
+        DownloaderTask(
+            f"{http_server.url}/a.bin",
+            checksum="sha256:" + hashlib.sha256(body).hexdigest(),
+        ),
+    )
+    task_manager.add_task(
+        "b",
+        DownloaderTask(
+            f"{http_server.url}/b.bin",
+            checksum="sha256:" + hashlib.sha256(b"b").hexdigest(),
+        ),
+    )
+    result_a, result_b = run(task_manager, tmp_path)
+    assert result_a.ok and not result_a.skipped
+    assert isinstance(result_b.error, ChecksumMismatchError)
+    assert not (tmp_path / "b.bin").exists() and not (tmp_path / "b.bin.part").exists()
+    (result_a,) = run(task_manager, tmp_path, task_names=["a"])
+    assert result_a.skipped
+    assert http_server.request_headers[-1]["If-None-Match"]
+
+
+def test_retry(http_server, tmp_path):
+    http_server.files["/a.bin"] = b"a"
+    http_server.error_rate = 1.0
+    task_manager = TaskManager(retry_policy=RetryPolicy(max_delay=0.01))
+    task_manager.add_task("a", DownloaderTask(f"{http_server.url}/a.bin"))
+    (result,) = run(task_manager, tmp_path)
+    assert "503" in str(result.error)
+    assert result.stats.retries == 2 and len(http_server.request_headers) == 3
+
+
+def test_drop_stale_partial_state(http_server, tmp_path):
+    http_server.files["/a.bin"] = b"a" * 100_000
+    # left by a segmented download of another version of the file
+    (tmp_path / "a.bin.part").write_bytes(b"b" * 50_000)
+    (tmp_path / "a.bin.part.json").write_text("{}")
+    task_manager = TaskManager()
+    task_manager.add_task("a", DownloaderTask(f"{http_server.url}/a.bin"))
+    (result,) = run(task_manager, tmp_path, chunk_size=1024)
+    assert result.ok
+    assert (tmp_path / "a.bin").read_bytes() == b"a" * 100_000
+    assert not (tmp_path / "a.bin.part.json").exists()
+
+
+def test_threaded_fallback(http_server, tmp_path):
+    http_server.files["/a.gz"] = gzip.compress(b"a" * 1000)
+    task_manager = TaskManager()
+    task_manager.add_task(
+        "a", DownloaderTask(f"{http_server.url}/a.gz", postprocess=["gunzip"])
+    )
+    events = []
+    (result,) = run(
+        task_manager, tmp_path, on_progress=lambda name, event: events.append(event)
+    )
+    assert result.ok and events[-1].done
+    assert (tmp_path / "a").read_bytes() == b"a" * 1000
+
+
+async def _serve_raw(reader, writer):
+    request_line = await reader.readline()
+    while (await reader.readline()).strip():
+        pass
+    if b"/old" in request_line:
+        writer.write(
+            b"HTTP/1.1 301 Moved Permanently\r\nLocation: /chunked.txt\r\n"
+            b"Content-Length: 0\r\n\r\n"
+        )
+    elif b"/length" in request_line:
+        # the same length sent twice, then two lengths which disagree
+        second = b"5" if b"/length/same" in request_line else b"6"
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\nContent-Length: "
+            + second
+            + b"\r\n\r\nhello"
+        )
+    else:
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"5\r\nhello\r\n7;ext=1\r\n, world\r\n0\r\nX-Trailer: 1\r\n\r\n"
+        )
+    await writer.drain()
+    writer.close()
+
+
+@pytest.mark.parametrize("path", ["/chunked.txt", "/old"])
+def test_redirect_and_chunked(path):
+    async def main():
+        server = await asyncio.start_server(_serve_raw, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            pool = AsyncConnectionPool()
+            response = await pool.get(f"http://127.0.0.1:{port}{path}")
+            assert response.url.endswith("/chunked.txt")
+            assert await response.read() == b"hello, world"
+            await pool.aclose()
+
+    asyncio.run(main())
+
+
+def test_repeated_content_length():
+    async def main():
+        server = await asyncio.start_server(_serve_raw, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            pool = AsyncConnectionPool()
+            response = await pool.get(f"http://127.0.0.1:{port}/length/same")
+            assert await response.read() == b"hello"
+            with pytest.raises(DownloadError):
+                await pool.get(f"http://127.0.0.1:{port}/length/other")
+            await pool.aclose()
+
+    asyncio.run(main())
@@ -0,0 +1,127 @@
+import threading
+import time
+
+from benchmarks.server import _Handler
+from src.dogaas.background import (
+    CANCELLED,
+    DONE,
+    DOWNLOADING,
+    FAILED,
+    PAUSED,
+    BackgroundDownloadManager,
+)
+from src.dogaas.downloader import DownloaderTask, TaskManager
+
+
+def make_task_manager(http_server, sizes: dict[str, int]) -> TaskManager:
+    taskmanager = TaskManager()
+    for name, size in sizes.items():
+        http_server.files[f"/{name}.bin"] = name.encode() * size
+        taskmanager.add_task(name, DownloaderTask(f"{http_server.url}/{name}.bin"))
+    return taskmanager
+
+
+def wait_for_state(manager, task_name, state, timeout=5):
+    deadline = time.monotonic() + timeout
+    while manager.snapshot()[task_name].state != state:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_download_and_throttle_updates(http_server, tmpdir):
+    http_server.bandwidth = 1_000_000
+    taskmanager = make_task_manager(http_server, {"a": 300_000, "b": 300_000})
+    updates = []
+    with BackgroundDownloadManager(
+        taskmanager, tmpdir, on_update=updates.append, update_interval=0.1
+    ) as manager:
+        started_at = time.monotonic()
+        manager.enqueue(["a", "b", "a"])
+        assert manager.wait(timeout=5)
+        elapsed = time.monotonic() - started_at
+        assert {p.state for p in manager.snapshot().values()} == {DONE}
+    assert tmpdir.join("a.bin").read_binary() == b"a" * 300_000
+    assert 2 <= len(updates) <= elapsed / 0.1 + 3
+    assert updates[-1]["b"].ratio == 1.0
+
+
+def test_pause_and_resume(http_server, tmpdir):
+    http_server.bandwidth = 500_000
+    taskmanager = make_task_manager(http_server, {"a": 400_000})
+    with BackgroundDownloadManager(
+        taskmanager, tmpdir, update_interval=0.05
+    ) as manager:
+        manager.enqueue(["a"])
+        wait_for_state(manager, "a", DOWNLOADING)
+        time.sleep(0.2)
+        manager.pause()
+        wait_for_state(manager, "a", PAUSED)
+        assert 0 < manager.snapshot()["a"].downloaded_bytes < 400_000
+        manager.resume(["a"])
+        assert manager.wait(timeout=5)
+        assert manager.snapshot()["a"].state == DONE
+    assert http_server.request_headers[-1]["Range"].startswith("bytes=")
+    assert tmpdir.join("a.bin").read_binary() == b"a" * 400_000
+
+
+def test_pause_stalled_transfer(http_server, tmpdir, monkeypatch):
+    taskmanager = make_task_manager(http_server, {"a": 100_000})
+    do_get = _Handler.do_GET
+    release = threading.Event()
+
+    def stall(handler):
+        handler.send_response(200)
+        handler.send_header("Content-Length", "100000")
+        handler.send_header("Accept-Ranges", "bytes")
+        handler.end_headers()
+        handler.wfile.write(b"a" * 1000)
+        handler.wfile.flush()
+        release.wait(10)
+        handler.close_connection = True
+
+    monkeypatch.setattr(_Handler, "do_GET", stall)
+    with BackgroundDownloadManager(
+        taskmanager, tmpdir, update_interval=0.05
+    ) as manager:
+        try:
+            manager.enqueue(["a"])
+            wait_for_state(manager, "a", DOWNLOADING)
+            time.sleep(0.2)
+            # no more bytes come to notice the request with
+            manager.pause()
+            wait_for_state(manager, "a", PAUSED, timeout=2)
+        finally:
+            # the stalled response ends, also if the pause failed
+            release.set()
+        monkeypatch.setattr(_Handler, "do_GET", do_get)
+        manager.resume(["a"])
+        assert manager.wait(timeout=5)
+        assert manager.snapshot()["a"].state == DONE
+    assert tmpdir.join("a.bin").read_binary() == b"a" * 100_000
+
+
+def test_cancel(http_server, tmpdir):
+    http_server.bandwidth = 500_000
+    taskmanager = make_task_manager(http_server, {"a": 400_000, "b": 1000})
+    with BackgroundDownloadManager(taskmanager, tmpdir, jobs=1) as manager:
+        manager.enqueue(["a", "b"])
+        wait_for_state(manager, "a", DOWNLOADING)
+        manager.cancel(["b"])
+        manager.cancel(["a"])
+        assert manager.wait(timeout=5)
+        assert {p.state for p in manager.snapshot().values()} == {CANCELLED}
+    assert len(http_server.request_headers) == 1
+    assert not tmpdir.join("a.bin").exists()
+
+
+def test_failure(http_server, tmpdir):
+    stats = []
+    taskmanager = TaskManager(on_stats=stats.append)
+    taskmanager.add_task("a", DownloaderTask(f"{http_server.url}/missing.bin"))
+    with BackgroundDownloadManager(taskmanager, tmpdir) as manager:
+        manager.enqueue(["a"])
+        assert manager.wait(timeout=5)
+        progress = manager.snapshot()["a"]
+        assert progress.state == FAILED and progress.error is not None
+    # reported as finished, not left running
+    assert "404" in stats[-1].error and stats[-1].total_s > 0
@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+from src.dogaas.bandwidth import BandwidthLimiter, TokenBucket, parse_rate
+from src.dogaas.downloader import TaskManager, DownloaderTask, DownloadScheduler
+
+
+def test_parse_rate():
+    assert parse_rate("500") == 500
+    assert parse_rate("500K") == 500 * 1024
+    assert parse_rate("1.5m") == 1.5 * 1024**2
+    assert parse_rate("2MB/s") == 2 * 1024**2
+    assert parse_rate(100) == 100
+    with pytest.raises(ValueError):
+        parse_rate("fast")
+
+
+class TestTokenBucket:
+    @staticmethod
+    def test_debt():
+        now = [0.0]
+        bucket = TokenBucket(100, clock=lambda: now[0])
+        assert bucket.seconds_until_available() == 0
+        bucket.take(300)
+        assert bucket.seconds_until_available() == 2.0
+        now[0] = 2.5
+        assert bucket.seconds_until_available() == 0
+        now[0] = 10.0
+        bucket.take(101)
+        assert bucket.seconds_until_available() == pytest.approx(0.01)
+
+
+class TestBandwidthLimiter:
+    @staticmethod
+    def test_unlimited():
+        BandwidthLimiter().acquire("example.com", 10**12)
+
+    @staticmethod
+    def test_per_host_rates():
+        limiter = BandwidthLimiter(per_host_rates={"Example.com": 1000})
+        limiter.acquire("example.org", 10**6)
+        limiter.acquire("EXAMPLE.COM", 1100)
+        started_at = time.monotonic()
+        limiter.acquire("example.com", 1)
+        assert time.monotonic() - started_at >= 0.09
+
+    @staticmethod
+    def test_priority():
+        limiter = BandwidthLimiter(global_rate=10000)
+        limiter.acquire("example.com", 13000)
+        finished = []
+
+        def acquire(priority):
+            limiter.acquire("example.com", 1000, priority)
+            finished.append(priority)
+
+        low = threading.Thread(target=acquire, args=(0,))
+        high = threading.Thread(target=acquire, args=(10,))
+        low.start()
+        time.sleep(0.05)
+        high.start()
+        low.join()
+        high.join()
+        assert finished == [10, 0]
+
+    @staticmethod
+    def test_download(http_server, tmpdir):
+        http_server.files["/a.bin"] = b"a" * 300_000
+        taskmanager = TaskManager(
+            bandwidth_limiter=BandwidthLimiter(global_rate=200_000)
+        )
+        taskmanager.add_task("task_a", DownloaderTask(f"{http_server.url}/a.bin"))
+        started_at = time.monotonic()
+        results = DownloadScheduler(taskmanager).run(tmpdir)
+        assert results[0].ok
+        # the first 200 KB pass as a burst
+        assert time.monotonic() - started_at >= 0.25
+
+
+def test_scheduler_priority(http_server, tmpdir):
+    taskmanager = TaskManager()
+    for i in range(4):
+        http_server.files[f"/{i}.bin"] = b"a"
+        taskmanager.add_task(
+            f"task_{i}", DownloaderTask(f"{http_server.url}/{i}.bin", priority=i % 2)
+        )
+    started = []
+    DownloadScheduler(taskmanager, jobs=1).run(
+        tmpdir, on_progress=lambda task_name, event: started.append(task_name)
+    )
+    assert list(dict.fromkeys(started)) == ["task_1", "task_3", "task_0", "task_2"]
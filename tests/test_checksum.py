@@ -0,0 +1,27 @@
+import hashlib
+
+import pytest
+
+from src.dogaas.checksum import StreamingHasher, parse_checksum
+
+
+def test_parse_checksum():
+    digest = hashlib.sha1(b"").hexdigest()
+    assert parse_checksum(f"SHA1:{digest.upper()}") == ("sha1", digest)
+    with pytest.raises(ValueError):
+        parse_checksum(f"sha512:{digest}")
+    with pytest.raises(ValueError):
+        parse_checksum(f"sha256:{digest}")
+    with pytest.raises(ValueError):
+        parse_checksum("md5:" + "z" * 32)
+
+
+def test_streaming_hasher(tmp_path):
+    filepath = tmp_path / "a.bin"
+    filepath.write_bytes(b"abc" * 1000)
+    hasher = StreamingHasher("md5", max_pending_chunks=2)
+    hasher.update_from_file(filepath, 1500, chunk_size=100)
+    for _ in range(500):
+        hasher.update(b"abc")
+    assert hasher.hexdigest() == hashlib.md5(b"abc" * 1000).hexdigest()
+    assert hasher.hexdigest() == hashlib.md5(b"abc" * 1000).hexdigest()
@@ -0,0 +1,79 @@
+from pathlib import Path
+import subprocess
+import shutil
+import sys
+
+import pytest
+
+SRC_DIR = Path(__file__).absolute().parent.parent / "src"
+HEAVY_MODULES = ("requests", "serde", "tqdm", "dogaas.downloader")
+
+# runs the CLI like `python cli_app.py ...` then reports the heavy imports
+PROBE = """
+import runpy, sys
+sys.path.insert(0, sys.argv[1])
+sys.argv = [sys.argv[1] + "/cli_app.py", *sys.argv[2:]]
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+except SystemExit:
+    pass
+print(",".join(name for name in {heavy_modules!r} if name in sys.modules))
+"""
+
+
+@pytest.fixture
+def cli_dir(tmp_path):
+    cli_dir = tmp_path / "src"
+    shutil.copytree(SRC_DIR, cli_dir, ignore=shutil.ignore_patterns("tasks.*"))
+    return cli_dir
+
+
+def run_cli(cli_dir: Path, *args: str) -> list[str]:
+    completed_process = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            PROBE.format(heavy_modules=HEAVY_MODULES),
+            str(cli_dir),
+            *args,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return [
+        name for name in completed_process.stdout.splitlines()[-1].split(",") if name
+    ]
+
+
+@pytest.mark.parametrize(
+    "args", [["--help"], ["download", "--help"], ["tasks", "--help"]]
+)
+def test_help_is_lazy(cli_dir, args):
+    assert run_cli(cli_dir, *args) == []
+    assert not list(cli_dir.glob("tasks.*"))
+
+
+def test_commands_load_tasks(cli_dir):
+    assert "dogaas.downloader" in run_cli(
+        cli_dir, "add", "-N", "task_a", "-L", "https://example.com/a.zip"
+    )
+    assert "requests" in run_cli(cli_dir, "tasks")
+
+
+def test_download_one_missing_task(cli_dir, http_server, tmp_path):
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    cli_app = str(cli_dir / "cli_app.py")
+    subprocess.run(
+        [sys.executable, cli_app, "add", "-N", "a", "-L", f"{http_server.url}/a.bin"],
+        check=True,
+    )
+    completed_process = subprocess.run(
+        [sys.executable, cli_app, "download", "-N", "a", "--dest", str(dest)],
+        capture_output=True,
+        text=True,
+    )
+    assert completed_process.returncode == 1
+    assert "404" in completed_process.stderr
+    assert not list(dest.iterdir())
@@ -0,0 +1,193 @@
+import threading
+import time
+
+import pytest
+
+from benchmarks.server import StandInServer
+from src.dogaas.concurrency import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    HostConcurrencyController,
+    RetryPolicy,
+    SingleFlight,
+    parse_retry_after,
+)
+from src.dogaas.downloader import DownloaderTask, DownloadScheduler, TaskManager
+from src.dogaas.transport import host_of_url
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def other_server():
+    with StandInServer() as server:
+        yield server
+
+
+def test_retry_policy():
+    policy = RetryPolicy(base_delay=0.5, max_delay=4.0)
+    assert policy.delay(0, rand=lambda: 1.0) == 0.5
+    assert policy.delay(2, rand=lambda: 0.5) == 1.0
+    assert policy.delay(10, rand=lambda: 1.0) == 4.0
+    assert policy.delay(0, retry_after=2, rand=lambda: 0.0) == 2.0
+    assert policy.delay(0, retry_after=60, rand=lambda: 0.0) == 4.0
+    assert policy.is_retryable_status(503) and not policy.is_retryable_status(404)
+    assert parse_retry_after("120") == 120.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:30 GMT", now=1445412480) == 30.0
+    assert parse_retry_after("soon") is None and parse_retry_after(None) is None
+
+
+def test_circuit_breaker():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+    breaker.record_failure("http://a")
+    assert breaker.allow("http://a") and breaker.state("http://a") == CLOSED
+    breaker.record_failure("http://a")
+    assert not breaker.allow("http://a") and breaker.state("http://a") == OPEN
+    assert breaker.allow("http://b")
+    clock.now = 10
+    assert breaker.allow("http://a") and breaker.state("http://a") == HALF_OPEN
+    # only one trial request at a time
+    assert not breaker.allow("http://a")
+    breaker.record_failure("http://a")
+    assert breaker.state("http://a") == OPEN
+    clock.now = 20
+    assert breaker.allow("http://a")
+    breaker.record_success("http://a")
+    assert breaker.state("http://a") == CLOSED
+
+
+def test_host_concurrency_controller():
+    clock = FakeClock()
+    controller = HostConcurrencyController(
+        initial_limit=2, max_limit=3, window_s=1.0, clock=clock
+    )
+    assert controller.try_acquire("http://a") and controller.try_acquire("http://a")
+    assert not controller.try_acquire("http://a")
+    assert controller.try_acquire("http://b")
+    # the limit was used up and the throughput grew
+    clock.now = 1
+    controller.record_transfer("http://a", 1000)
+    assert controller.limit("http://a") == 3
+    clock.now = 2
+    controller.record_transfer("http://a", 1000)
+    assert controller.limit("http://a") == 3
+    # no gain from the third slot, which stays anyway until a backoff
+    assert controller.try_acquire("http://a")
+    controller.record_error("http://a")
+    assert controller.limit("http://a") == 1
+    controller.record_error("http://a", retry_after=5)
+    assert controller.limit("http://a") == 1
+    for _ in range(3):
+        controller.release("http://a")
+    assert not controller.try_acquire("http://a")
+    clock.now = 7
+    assert controller.try_acquire("http://a")
+    # first bytes far slower than usual
+    controller.record_ttfb("http://b", 0.1)
+    controller.record_ttfb("http://b", 5.0)
+    assert controller.limit("http://b") == 1
+    with pytest.raises(ValueError):
+        HostConcurrencyController(initial_limit=4, max_limit=2)
+
+
+def test_single_flight():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+    shared = []
+
+    def function():
+        calls.append(1)
+        release.wait()
+        return len(calls)
+
+    def call():
+        shared.append(single_flight.do("a", function))
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while not calls:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert sorted(shared) == [(1, False), (1, True), (1, True), (1, True)]
+    # a call after the flight landed runs the function again
+    assert single_flight.do("a", function) == (2, False)
+    with pytest.raises(ZeroDivisionError):
+        single_flight.do("a", lambda: 1 / 0)
+
+
+def test_retry_request(http_server):
+    http_server.files["/a.bin"] = b"a" * 1000
+    http_server.error_rate = 1.0
+
+    class RecoveringPolicy(RetryPolicy):
+        def delay(self, retry, retry_after=None, rand=None):
+            # `Retry-After: 1` is asked, but the test need not wait for it
+            assert retry_after == 1.0
+            http_server.error_rate = 0.0
+            return 0.0
+
+    task_manager = TaskManager(retry_policy=RecoveringPolicy())
+    task_manager.add_task("a", DownloaderTask(f"{http_server.url}/a.bin"))
+    downloader = task_manager.make_downloader_from_task("a")
+    assert downloader.response.status_code == 200
+    assert downloader.stats.retries == 1
+    assert len(http_server.request_headers) == 2
+
+
+def test_give_up_and_open_circuit(http_server):
+    http_server.files["/a.bin"] = b"a"
+    http_server.error_rate = 1.0
+    stats = []
+    task_manager = TaskManager(
+        retry_policy=RetryPolicy(max_attempts=3, max_delay=0.01),
+        circuit_breaker=CircuitBreaker(failure_threshold=4),
+        on_stats=stats.append,
+    )
+    task_manager.add_task("a", DownloaderTask(f"{http_server.url}/a.bin"))
+    downloader = task_manager.make_downloader_from_task("a")
+    # the last answer is handed over to tell why
+    assert downloader.response.status_code == 503
+    assert downloader.stats.retries == 2
+    with pytest.raises(CircuitOpenError):
+        task_manager.make_downloader_from_task("a")
+    assert len(http_server.request_headers) == 4
+    assert stats[-1].error.startswith("CircuitOpenError")
+
+
+def test_schedule_by_host(http_server, other_server, tmp_path):
+    task_manager = TaskManager(
+        concurrency=HostConcurrencyController(initial_limit=1, max_limit=1)
+    )
+    for i in range(3):
+        http_server.files[f"/a{i}.bin"] = b"a" * 1000
+        other_server.files[f"/b{i}.bin"] = b"b" * 1000
+        task_manager.add_task(
+            f"a{i}", DownloaderTask(f"{http_server.url}/a{i}.bin", priority=1)
+        )
+        task_manager.add_task(f"b{i}", DownloaderTask(f"{other_server.url}/b{i}.bin"))
+    # the urgent host is backing off, which must not hold up the other one
+    task_manager.concurrency.record_error(host_of_url(http_server.url), 0.5)
+    done = []
+    started_at = time.monotonic()
+    results = DownloadScheduler(task_manager, jobs=4).run(
+        tmp_path, on_done=lambda result: done.append(result.task_name)
+    )
+    assert all(result.ok for result in results)
+    assert done[:3] == ["b0", "b1", "b2"] and sorted(done[3:]) == ["a0", "a1", "a2"]
+    assert time.monotonic() - started_at >= 0.5
+    assert (tmp_path / "a2.bin").read_bytes() == b"a" * 1000
@@ -0,0 +1,162 @@
+import threading
+import json
+
+import pytest
+
+from src.dogaas.daemon import DaemonAlreadyRunningError, DownloadDaemon
+from src.dogaas.downloader import DownloaderTask, TaskManager
+from src.dogaas.ipc import DaemonClient, DaemonError
+from src.dogaas.remote import RemoteDownloadManager, RemoteTaskManager
+
+
+@pytest.fixture
+def start_daemon(tmp_path):
+    daemons = []
+
+    def start(task_manager: TaskManager, **kwargs) -> DaemonClient:
+        daemon = DownloadDaemon(
+            task_manager,
+            tmp_path / "dogaas.sock",
+            queue_filepath=tmp_path / "queue.json",
+            **kwargs,
+        )
+        thread = threading.Thread(target=daemon.serve_forever)
+        thread.start()
+        daemons.append((daemon, thread))
+        for _ in range(100):
+            if client := DaemonClient.connect(tmp_path / "dogaas.sock"):
+                return client
+            threading.Event().wait(0.01)
+        raise TimeoutError()
+
+    yield start
+    for daemon, thread in daemons:
+        daemon.shutdown()
+        thread.join()
+
+
+def test_connect_without_daemon(tmp_path):
+    assert DaemonClient.connect(tmp_path / "dogaas.sock") is None
+
+
+def test_one_daemon_per_socket(start_daemon, tmp_path):
+    start_daemon(TaskManager())
+    with pytest.raises(DaemonAlreadyRunningError):
+        DownloadDaemon(TaskManager(), tmp_path / "dogaas.sock").serve_forever()
+    assert DaemonClient.connect(tmp_path / "dogaas.sock").call("ping")
+
+
+def test_manage_tasks(start_daemon):
+    changes = []
+    client = start_daemon(TaskManager(), on_tasks_change=lambda: changes.append(1))
+    client.call("add_task", name="a", url="https://example.com/a.zip")
+    client.call("add_task", name="b", url="https://example.com/b.zip", priority=2)
+    with pytest.raises(DaemonError) as excinfo:
+        client.call("add_task", name="a", url="https://example.com/c.zip")
+    assert excinfo.value.error_type == "DuplicateTaskError"
+    client.call("rename_task", name="a", new_name="A")
+    client.call("remove_task", name="b")
+    assert client.call("list_tasks") == [["A", "https://example.com/a.zip", 0]]
+    assert client.call("count_tasks") == 1
+    assert len(changes) == 4
+    with pytest.raises(DaemonError) as excinfo:
+        client.call("no_such_method")
+    assert excinfo.value.error_type == "ValueError"
+
+
+def test_save_tasks_under_lock(tmp_path):
+    locked = []
+    daemon = DownloadDaemon(
+        TaskManager(),
+        tmp_path / "dogaas.sock",
+        on_tasks_change=lambda: locked.append(daemon._tasks_lock.locked()),
+    )
+    daemon.handle("add_task", {"name": "a", "url": "https://example.com/a.zip"})
+    daemon.handle("rename_task", {"name": "a", "new_name": "A"})
+    # another client's change must not land between a change and its save
+    assert locked == [True, True]
+    daemon.shutdown()
+
+
+def test_read_tasks_under_lock(tmp_path):
+    daemon = DownloadDaemon(TaskManager(), tmp_path / "dogaas.sock")
+    daemon.handle("add_task", {"name": "a", "url": "https://example.com/a.zip"})
+    results = []
+    with daemon._tasks_lock:
+        # as if another client were changing the tasks
+        readers = [
+            threading.Thread(target=lambda: results.append(daemon.handle(method, {})))
+            for method in ("list_tasks", "count_tasks", "select_task_names")
+        ]
+        for reader in readers:
+            reader.start()
+        readers[-1].join(0.1)
+        assert not results
+    for reader in readers:
+        reader.join()
+    assert len(results) == 3
+    daemon.shutdown()
+
+
+def test_download_and_watch(start_daemon, http_server, tmp_path):
+    http_server.files["/a.bin"] = b"a" * 100_000
+    task_manager = TaskManager()
+    task_manager.add_task("a", DownloaderTask(f"{http_server.url}/a.bin"))
+    client = start_daemon(task_manager)
+    client.call("download", task_names=["a"], dirpath_for_dest=str(tmp_path))
+    with DaemonClient(tmp_path / "dogaas.sock") as watcher:
+        snapshots = list(watcher.watch(interval=0.05, until_done=True))
+    assert snapshots[-1]["a"]["state"] == "done"
+    assert snapshots[-1]["a"]["ratio"] == 1.0
+    assert (tmp_path / "a.bin").read_bytes() == b"a" * 100_000
+
+
+def test_restore_queue(start_daemon, http_server, tmp_path):
+    http_server.bandwidth = 200_000
+    http_server.files["/a.bin"] = b"a" * 400_000
+    task_manager = TaskManager()
+    task_manager.add_task("a", DownloaderTask(f"{http_server.url}/a.bin"))
+    client = start_daemon(task_manager)
+    client.call("download", task_names=["a"], dirpath_for_dest=str(tmp_path))
+    client.call("pause")
+    client.call("shutdown")
+    while (tmp_path / "dogaas.sock").exists():
+        threading.Event().wait(0.01)
+    assert json.loads((tmp_path / "queue.json").read_text()) == {
+        "a": {"dirpath_for_dest": str(tmp_path), "paused": True}
+    }
+
+    http_server.bandwidth = None
+    client = start_daemon(task_manager)
+    assert client.call("status")["a"]["state"] == "paused"
+    client.call("resume", task_names=["a"])
+    with DaemonClient(tmp_path / "dogaas.sock") as watcher:
+        assert list(watcher.watch(0.05, until_done=True))[-1]["a"]["state"] == "done"
+    client.call("shutdown")
+    assert json.loads((tmp_path / "queue.json").read_text()) == {}
+
+
+def test_remote_managers(start_daemon, http_server, tmp_path):
+    http_server.files["/a.bin"] = b"a" * 1000
+    daemon_task_manager = TaskManager()
+    client = start_daemon(daemon_task_manager)
+    added = []
+    task_manager = RemoteTaskManager(client, on_add=added.extend)
+    task_manager.add_task("a", DownloaderTask(f"{http_server.url}/a.bin"))
+    report = task_manager.add_tasks([(None, "https://example.com/b.zip")])
+    assert report.added == 1
+    task_manager.rename_task("b.zip", "b")
+    assert added == ["a", "b.zip"]
+    assert list(daemon_task_manager.tasks) == list(task_manager.tasks) == ["a", "b"]
+
+    snapshots = []
+    with RemoteDownloadManager(
+        tmp_path / "dogaas.sock", on_update=snapshots.append, update_interval=0.05
+    ) as download_manager:
+        download_manager.enqueue(["a"], tmp_path)
+        for _ in range(100):
+            if download_manager.snapshot()["a"].state == "done":
+                break
+            threading.Event().wait(0.02)
+    assert snapshots
+    assert (tmp_path / "a.bin").read_bytes() == b"a" * 1000
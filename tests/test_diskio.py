@@ -0,0 +1,83 @@
+import threading
+import io
+import os
+
+import pytest
+
+from src.dogaas.diskio import BufferPool, FileWriter, WritePolicy, preallocate
+from src.dogaas.downloader import DownloaderTask, TaskManager
+
+
+class BlockingFile(io.BytesIO):
+    """A disk which stalls until `unblock` is set."""
+
+    def __init__(self):
+        super().__init__()
+        self.unblock = threading.Event()
+
+    def write(self, data) -> int:
+        self.unblock.wait()
+        return super().write(data)
+
+
+def test_file_writer():
+    file = BlockingFile()
+    pool = BufferPool(buffer_size=4, count=3)
+    writer = FileWriter(file, pool)
+    # the stalled disk does not hold up writing until the buffers run out
+    writer.write(b"0123456789")
+    acquired = threading.Event()
+
+    def write_more():
+        writer.write(b"abc")
+        acquired.set()
+
+    thread = threading.Thread(target=write_more)
+    thread.start()
+    assert not acquired.wait(0.1)
+    file.unblock.set()
+    thread.join()
+    assert writer.checkpoint() == 13 and file.getvalue() == b"0123456789abc"
+    writer.write(b"d")
+    writer.abort()
+    assert file.getvalue() == b"0123456789abc"
+    with pytest.raises(ValueError):
+        FileWriter(file, pool, fsync="sometimes")
+
+
+def test_file_writer_error():
+    file = io.BytesIO()
+    writer = FileWriter(file, BufferPool(buffer_size=2, count=1))
+    file.close()
+    writer.write(b"ab")
+    with pytest.raises(ValueError):
+        writer.close()
+
+
+def test_preallocate(tmp_path):
+    with open(tmp_path / "a", "w+b") as file:
+        file.write(b"ab")
+        preallocate(file, 1000)
+        assert file.tell() == 2
+    assert os.path.getsize(tmp_path / "a") == 1000
+
+
+@pytest.mark.parametrize("fsync", ["never", "checkpoint", "end"])
+def test_download(http_server, tmp_path, monkeypatch, fsync):
+    content = bytes(range(256)) * 400
+    http_server.files["/a.bin"] = content
+    fsyncs = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: fsyncs.append(real_fsync(fd)))
+    task_manager = TaskManager(
+        write_policy=WritePolicy(buffer_size=1000, buffers=2, fsync=fsync)
+    )
+    task_manager.add_task("a", DownloaderTask(f"{http_server.url}/a.bin"))
+    downloader = task_manager.make_downloader_from_task("a")
+    downloader.partial_state_interval = 0
+    assert list(downloader.download(tmp_path, chunk_size=1500))[-1] == len(content)
+    assert (tmp_path / "a.bin").read_bytes() == content
+    assert downloader.stats.write_s > 0
+    assert {"never": 0, "end": 1}.get(fsync, len(fsyncs)) == len(fsyncs)
+    if fsync == "checkpoint":
+        assert len(fsyncs) > 1
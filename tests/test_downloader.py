@@ -1,9 +1,27 @@
+import hashlib
+import json
+
+from serde.json import from_json, to_json
+import requests
 import pytest
 
 # from unittest.mock import patch
 
 
-from src.dogaas.downloader import TaskManager, DownloaderTask, DuplicateTaskError
+from benchmarks.server import _Handler
+from src.dogaas.cache import FetchCache
+from src.dogaas.downloader import (
+    ChecksumMismatchError,
+    TaskManager,
+    DownloaderTask,
+    DownloadScheduler,
+    DuplicateTaskError,
+    PartialDownload,
+    ProgressThrottle,
+    partial_filepath,
+    partial_state_filepath,
+    split_byte_ranges,
+)
 
 # import requests
 
@@ -14,6 +32,32 @@ class TestDownloaderTask:
         with pytest.raises(ValueError):
             DownloaderTask("invalid_url")
 
+    @staticmethod
+    def test_checksum():
+        digest = hashlib.sha256(b"").hexdigest()
+        task = DownloaderTask("https://dummy_url_a", checksum=f"SHA256:{digest}")
+        assert task.checksum == f"sha256:{digest}"
+        assert from_json(DownloaderTask, to_json(task)) == task
+        with pytest.raises(ValueError):
+            DownloaderTask("https://dummy_url_a", checksum="crc32:00000000")
+
+    @staticmethod
+    def test_dict():
+        task = DownloaderTask(
+            "https://dummy_url_a", priority=2, mirrors=["https://dummy_url_b"]
+        )
+        assert not hasattr(task, "__dict__")
+        assert task.mirrors == ("https://dummy_url_b",) and task.postprocess == ()
+        assert json.loads(json.dumps(task.to_dict())) == json.loads(to_json(task))
+        assert DownloaderTask.from_dict(task.to_dict()) == task
+        # saved before the task had post-processing and mirrors
+        assert DownloaderTask.from_dict(
+            {"_url": "https://dummy_url_a", "priority": 0, "checksum": None}
+        ) == DownloaderTask("https://dummy_url_a")
+        for data in [{}, [], {"_url": "https://dummy_url_a", "priority": "high"}]:
+            with pytest.raises(ValueError):
+                DownloaderTask.from_dict(data)
+
 
 class TestTaskManager:
     @staticmethod
@@ -41,6 +85,23 @@ class TestTaskManager:
         assert taskmanager.tasks.get("task_a") is None
         assert taskmanager.tasks["task_A"].url == "https://dummy_url_a"
 
+    @staticmethod
+    def test_change_callbacks():
+        calls = []
+        taskmanager = TaskManager(
+            on_add=lambda names: calls.append(("add", names)),
+            on_remove=lambda name: calls.append(("remove", name)),
+            on_rename=lambda old, new: calls.append(("rename", old, new)),
+        )
+        taskmanager.add_task("task_a", DownloaderTask("https://dummy_url_a"))
+        taskmanager.rename_task("task_a", "task_A")
+        taskmanager.remove_task("task_A")
+        assert calls == [
+            ("add", ["task_a"]),
+            ("rename", "task_a", "task_A"),
+            ("remove", "task_A"),
+        ]
+
     @staticmethod
     def test_save_tasks_to_json(tmpdir):
         taskmanager = TaskManager()
@@ -55,3 +116,363 @@ class TestTaskManager:
         taskmanager.load_tasks_from_json(tmpdir.join("test.json"))
         with pytest.raises(FileNotFoundError):
             taskmanager.load_tasks_from_json(tmpdir.join("invalidfilename"))
+
+    @staticmethod
+    def test_tasks_json_compatible(tmpdir):
+        tasks = {
+            "task_a": DownloaderTask("https://dummy_url_a", priority=1),
+            "タスク": DownloaderTask("https://dummy_url_b", postprocess=["gunzip"]),
+        }
+        tmpdir.join("old.json").write_text(to_json(tasks), encoding="utf-8")
+        taskmanager = TaskManager()
+        taskmanager.load_tasks_from_json(tmpdir.join("old.json"))
+        assert taskmanager.tasks == tasks
+        taskmanager.save_tasks_to_json(tmpdir, "new")
+        text = tmpdir.join("new.json").read_text(encoding="utf-8")
+        assert from_json(dict[str, DownloaderTask], text) == tasks
+
+    @staticmethod
+    def test_select_task_names():
+        taskmanager = TaskManager()
+        taskmanager.add_task("photo_a", DownloaderTask("https://dummy_url_a"))
+        taskmanager.add_task("photo_b", DownloaderTask("https://dummy_url_b"))
+        taskmanager.add_task("video_a", DownloaderTask("https://dummy_url_c"))
+        assert taskmanager.select_task_names() == ["photo_a", "photo_b", "video_a"]
+        assert taskmanager.select_task_names(["photo_*"]) == ["photo_a", "photo_b"]
+        assert taskmanager.select_task_names(["*_a"]) == ["photo_a", "video_a"]
+
+    @staticmethod
+    def test_add_tasks():
+        calls = []
+        taskmanager = TaskManager(on_add=calls.append)
+        taskmanager.add_task("a.zip", DownloaderTask("https://example.com/a.zip"))
+        calls.clear()
+        report = taskmanager.add_tasks(
+            [
+                (None, "https://example.com/a.zip"),
+                (None, "https://example.org/a.zip"),
+                (None, "https://example.net/a.zip"),
+                ("task_b", "https://example.com/b.zip"),
+                ("task_b", "https://example.com/c.zip"),
+                (None, "https://example.com/b.zip"),
+                ("task_d", "invalid_url"),
+            ],
+            batch_size=2,
+        )
+        assert report.added == 3
+        assert report.duplicate_urls == 2
+        assert report.duplicate_names == 1
+        assert report.invalid_entries == [("task_d", "invalid_url")]
+        assert list(taskmanager.tasks) == ["a.zip", "a.zip_2", "a.zip_3", "task_b"]
+        assert calls == [["a.zip_2", "a.zip_3"], ["task_b"]]
+
+
+class TestProgressThrottle:
+    @staticmethod
+    def test_interval():
+        now = [0.0]
+        throttle = ProgressThrottle(1000, interval=1.0, clock=lambda: now[0])
+        assert throttle.update(0).downloaded_bytes == 0
+        now[0] = 0.5
+        assert throttle.update(100) is None
+        now[0] = 1.0
+        event = throttle.update(200)
+        assert event.downloaded_bytes == 200
+        assert event.bytes_per_sec == 200
+        assert event.eta == 4.0
+        assert event.ratio == 0.2
+        now[0] = 1.1
+        event = throttle.finish(1000)
+        assert event.done and event.eta == 0.0
+
+    @staticmethod
+    def test_min_bytes():
+        throttle = ProgressThrottle(interval=None, min_bytes=100, clock=lambda: 0.0)
+        throttle.update(0)
+        assert throttle.update(99) is None
+        event = throttle.update(100)
+        assert event.downloaded_bytes == 100
+        assert event.eta is None and event.ratio is None
+        assert throttle.update(150) is None
+
+
+class TestDownloader:
+    @staticmethod
+    def test_split_byte_ranges():
+        assert split_byte_ranges(10, 3) == [(0, 3), (4, 6), (7, 9)]
+        assert split_byte_ranges(2, 4) == [(0, 0), (1, 1)]
+        assert split_byte_ranges(5, 1) == [(0, 4)]
+
+    @staticmethod
+    def test_download_segments(http_server, tmpdir):
+        content = bytes(range(256)) * 1000
+        http_server.files["/large.bin"] = content
+        taskmanager = TaskManager()
+        taskmanager.add_task("task_a", DownloaderTask(f"{http_server.url}/large.bin"))
+        downloader = taskmanager.make_downloader_from_task("task_a")
+        progresses = list(
+            downloader.download(tmpdir, chunk_size=4096, segments=4, min_segment_size=1)
+        )
+        assert progresses[-1] == len(content)
+        assert downloader.dest_filepath(tmpdir).read_bytes() == content
+        ranges = [h["Range"] for h in http_server.request_headers if "Range" in h]
+        assert len(ranges) == 3
+
+    @staticmethod
+    def test_iter_progress(http_server, tmpdir):
+        content = b"a" * 100000
+        http_server.files["/large.bin"] = content
+        taskmanager = TaskManager()
+        taskmanager.add_task("task_a", DownloaderTask(f"{http_server.url}/large.bin"))
+        downloader = taskmanager.make_downloader_from_task("task_a")
+        events = list(
+            downloader.iter_progress(
+                tmpdir, interval=None, min_bytes=30000, chunk_size=1024
+            )
+        )
+        assert [event.downloaded_bytes for event in events] == [
+            1024,
+            31744,
+            62464,
+            93184,
+            100000,
+        ]
+        assert events[-1].done and events[-1].total_bytes == len(content)
+
+    @staticmethod
+    @pytest.mark.parametrize("segments", [1, 4])
+    def test_download_checksum(http_server, tmpdir, segments):
+        content = bytes(range(256)) * 1000
+        http_server.files["/large.bin"] = content
+        taskmanager = TaskManager()
+        for name, digest in [
+            ("good", hashlib.sha1(content).hexdigest()),
+            ("bad", hashlib.sha1(b"").hexdigest()),
+        ]:
+            taskmanager.add_task(
+                name,
+                DownloaderTask(
+                    f"{http_server.url}/large.bin", checksum=f"sha1:{digest}"
+                ),
+            )
+        downloader = taskmanager.make_downloader_from_task("bad")
+        with pytest.raises(ChecksumMismatchError):
+            list(downloader.download(tmpdir, segments=segments, min_segment_size=1))
+        filepath = downloader.dest_filepath(tmpdir)
+        assert not filepath.exists()
+        assert not partial_filepath(filepath).exists()
+        downloader = taskmanager.make_downloader_from_task("good")
+        list(downloader.download(tmpdir, segments=segments, min_segment_size=1))
+        assert filepath.read_bytes() == content
+
+    @staticmethod
+    def test_download_resume_checksum(http_server, tmpdir):
+        content = bytes(range(256)) * 400
+        http_server.files["/large.bin"] = content
+        taskmanager = TaskManager()
+        taskmanager.add_task(
+            "task_a",
+            DownloaderTask(
+                f"{http_server.url}/large.bin",
+                checksum="md5:" + hashlib.md5(content).hexdigest(),
+            ),
+        )
+        progresses = taskmanager.make_downloader_from_task("task_a").download(
+            tmpdir, chunk_size=1024
+        )
+        next(progresses)
+        progresses.close()
+        downloader = taskmanager.make_downloader_from_task("task_a")
+        list(downloader.download(tmpdir, chunk_size=1024))
+        assert "Range" in http_server.request_headers[-1]
+        assert downloader.dest_filepath(tmpdir).read_bytes() == content
+
+    @staticmethod
+    def test_download_segments_fallback(http_server, tmpdir):
+        content = bytes(range(256)) * 1000
+        http_server.files["/large.bin"] = content
+        http_server.accept_ranges = False
+        taskmanager = TaskManager()
+        taskmanager.add_task("task_a", DownloaderTask(f"{http_server.url}/large.bin"))
+        downloader = taskmanager.make_downloader_from_task("task_a")
+        list(downloader.download(tmpdir, segments=4, min_segment_size=1))
+        assert downloader.dest_filepath(tmpdir).read_bytes() == content
+        assert len(http_server.request_headers) == 1
+
+    @staticmethod
+    def test_download_resume(http_server, tmpdir):
+        content = bytes(range(256)) * 400
+        http_server.files["/large.bin"] = content
+        taskmanager = TaskManager()
+        taskmanager.add_task("task_a", DownloaderTask(f"{http_server.url}/large.bin"))
+        downloader = taskmanager.make_downloader_from_task("task_a")
+        progresses = downloader.download(tmpdir, chunk_size=1024)
+        for progress in progresses:
+            if progress >= 30000:
+                break
+        progresses.close()
+        filepath = downloader.dest_filepath(tmpdir)
+        assert not filepath.exists()
+        assert partial_filepath(filepath).stat().st_size == 30720
+        state = PartialDownload.load(partial_state_filepath(filepath))
+        assert state.bytes_done == 30720
+        assert state.etag is not None
+
+        downloader = taskmanager.make_downloader_from_task("task_a")
+        progresses = list(downloader.download(tmpdir, chunk_size=1024))
+        assert progresses[0] > 30720
+        assert progresses[-1] == len(content)
+        assert filepath.read_bytes() == content
+        assert not partial_filepath(filepath).exists()
+        assert not partial_state_filepath(filepath).exists()
+        assert http_server.request_headers[-1]["Range"] == "bytes=30720-102399"
+        assert http_server.request_headers[-1]["If-Range"] == state.etag
+
+    @staticmethod
+    @pytest.mark.parametrize("status", [416, 503])
+    def test_download_resume_refused(http_server, tmpdir, monkeypatch, status):
+        content = bytes(range(256)) * 400
+        http_server.files["/large.bin"] = content
+        taskmanager = TaskManager()
+        taskmanager.add_task("task_a", DownloaderTask(f"{http_server.url}/large.bin"))
+        downloader = taskmanager.make_downloader_from_task("task_a")
+        progresses = downloader.download(tmpdir, chunk_size=1024)
+        next(progresses)
+        progresses.close()
+        filepath = downloader.dest_filepath(tmpdir)
+        part_size = partial_filepath(filepath).stat().st_size
+        do_get = _Handler.do_GET
+
+        def refuse_ranges(handler):
+            if "Range" in handler.headers:
+                handler.send_error(status)
+            else:
+                do_get(handler)
+
+        monkeypatch.setattr(_Handler, "do_GET", refuse_ranges)
+        downloader = taskmanager.make_downloader_from_task("task_a")
+        with pytest.raises(requests.HTTPError):
+            list(downloader.download(tmpdir, chunk_size=1024))
+        # the error page is not saved, and the download can still be resumed
+        assert not filepath.exists()
+        assert partial_filepath(filepath).stat().st_size == part_size
+        assert partial_state_filepath(filepath).exists()
+        monkeypatch.setattr(_Handler, "do_GET", do_get)
+        downloader = taskmanager.make_downloader_from_task("task_a")
+        list(downloader.download(tmpdir, chunk_size=1024))
+        assert filepath.read_bytes() == content
+        assert "Range" in http_server.request_headers[-1]
+
+    @staticmethod
+    def test_download_resume_changed_content(http_server, tmpdir):
+        http_server.files["/large.bin"] = b"a" * 50000
+        taskmanager = TaskManager()
+        taskmanager.add_task("task_a", DownloaderTask(f"{http_server.url}/large.bin"))
+        downloader = taskmanager.make_downloader_from_task("task_a")
+        progresses = downloader.download(tmpdir, chunk_size=1024)
+        next(progresses)
+        progresses.close()
+        http_server.files["/large.bin"] = b"b" * 50000
+        downloader = taskmanager.make_downloader_from_task("task_a")
+        list(downloader.download(tmpdir))
+        assert downloader.dest_filepath(tmpdir).read_bytes() == b"b" * 50000
+        assert "Range" not in http_server.request_headers[-1]
+
+    @staticmethod
+    def test_download_segments_resume(http_server, tmpdir):
+        content = bytes(range(256)) * 1000
+        http_server.files["/large.bin"] = content
+        taskmanager = TaskManager()
+        taskmanager.add_task("task_a", DownloaderTask(f"{http_server.url}/large.bin"))
+        downloader = taskmanager.make_downloader_from_task("task_a")
+        progresses = downloader.download(
+            tmpdir, chunk_size=1024, segments=4, min_segment_size=1
+        )
+        next(progresses)
+        progresses.close()
+        filepath = downloader.dest_filepath(tmpdir)
+        state = PartialDownload.load(partial_state_filepath(filepath))
+        assert len(state.segments) == 4
+        assert 0 < state.bytes_done < len(content)
+
+        downloader = taskmanager.make_downloader_from_task("task_a")
+        progresses = list(
+            downloader.download(tmpdir, chunk_size=1024, segments=4, min_segment_size=1)
+        )
+        assert progresses[-1] == len(content)
+        assert filepath.read_bytes() == content
+
+
+class TestDownloadScheduler:
+    @staticmethod
+    def test_run(http_server, tmpdir):
+        taskmanager = TaskManager()
+        for i in range(5):
+            http_server.files[f"/file{i}.bin"] = bytes([i]) * 5000
+            taskmanager.add_task(
+                f"task_{i}", DownloaderTask(f"{http_server.url}/file{i}.bin")
+            )
+        taskmanager.add_task("missing", DownloaderTask(f"{http_server.url}/nothing"))
+        scheduler = DownloadScheduler(taskmanager, jobs=3)
+        results = scheduler.run(tmpdir)
+        assert [result.task_name for result in results] == [
+            "task_0",
+            "task_1",
+            "task_2",
+            "task_3",
+            "task_4",
+            "missing",
+        ]
+        for i, result in enumerate(results[:5]):
+            assert result.ok
+            assert result.downloaded_bytes == 5000
+            assert result.filepath.read_bytes() == bytes([i]) * 5000
+        assert not results[5].ok
+        assert scheduler.downloaded_bytes == scheduler.total_bytes == 25000
+
+
+class TestFetchCache:
+    @staticmethod
+    def test_skip_not_modified(http_server, tmpdir):
+        http_server.files["/a.bin"] = b"a" * 1000
+        taskmanager = TaskManager(fetch_cache=FetchCache(tmpdir.join("cache.json")))
+        taskmanager.add_task("task_a", DownloaderTask(f"{http_server.url}/a.bin"))
+        scheduler = DownloadScheduler(taskmanager)
+        assert not scheduler.run(tmpdir)[0].skipped
+        taskmanager.fetch_cache.save()
+
+        taskmanager.fetch_cache = FetchCache(tmpdir.join("cache.json"))
+        result = scheduler.run(tmpdir)[0]
+        assert result.ok and result.skipped
+        assert result.downloaded_bytes == 1000
+        assert "If-None-Match" in http_server.request_headers[-1]
+
+        http_server.files["/a.bin"] = b"b" * 1000
+        result = scheduler.run(tmpdir)[0]
+        assert not result.skipped
+        assert result.filepath.read_bytes() == b"b" * 1000
+
+        result = DownloadScheduler(taskmanager, force=True).run(tmpdir)[0]
+        assert not result.skipped
+        assert "If-None-Match" not in http_server.request_headers[-1]
+
+    @staticmethod
+    def test_refetch_if_file_changed(http_server, tmpdir):
+        http_server.files["/a.bin"] = b"a" * 1000
+        taskmanager = TaskManager(fetch_cache=FetchCache())
+        taskmanager.add_task("task_a", DownloaderTask(f"{http_server.url}/a.bin"))
+        result = DownloadScheduler(taskmanager).run(tmpdir)[0]
+        result.filepath.write_bytes(b"a")
+        assert not DownloadScheduler(taskmanager).run(tmpdir)[0].skipped
+        assert result.filepath.read_bytes() == b"a" * 1000
+
+    @staticmethod
+    def test_refetch_for_other_destination(http_server, tmpdir):
+        http_server.files["/a.bin"] = b"a" * 1000
+        taskmanager = TaskManager(fetch_cache=FetchCache())
+        taskmanager.add_task("task_a", DownloaderTask(f"{http_server.url}/a.bin"))
+        DownloadScheduler(taskmanager).run(tmpdir)
+        other_dirpath = tmpdir.mkdir("other")
+        result = DownloadScheduler(taskmanager).run(other_dirpath)[0]
+        assert not result.skipped
+        assert result.filepath.read_bytes() == b"a" * 1000
@@ -0,0 +1,51 @@
+import pytest
+
+from src.dogaas.importer import detect_format, iter_task_entries
+
+
+def test_detect_format():
+    assert detect_format("tasks.CSV") == "csv"
+    assert detect_format("tasks.jsonl") == "jsonl"
+    assert detect_format("<stdin>") == "urls"
+
+
+def test_iter_url_lines():
+    lines = ["https://example.com/a\n", "\n", "# comment\n", "  https://example.com/b"]
+    assert list(iter_task_entries(lines, "urls")) == [
+        (None, "https://example.com/a"),
+        (None, "https://example.com/b"),
+    ]
+
+
+def test_iter_csv_rows():
+    lines = ["url,name\n", "https://example.com/a,task_a\n", "https://example.com/b,\n"]
+    assert list(iter_task_entries(lines, "csv")) == [
+        ("task_a", "https://example.com/a"),
+        (None, "https://example.com/b"),
+    ]
+    lines = ["task_a,https://example.com/a\n", "task_b,https://example.com/b\n"]
+    assert list(iter_task_entries(lines, "csv")) == [
+        ("task_a", "https://example.com/a"),
+        ("task_b", "https://example.com/b"),
+    ]
+    # a row may leave out the trailing optional name
+    lines = ["url,name\n", "https://example.com/a\n"]
+    assert list(iter_task_entries(lines, "csv")) == [(None, "https://example.com/a")]
+
+
+def test_iter_jsonl_objects():
+    lines = [
+        '{"name": "task_a", "url": "https://example.com/a"}\n',
+        '{"url": "https://example.com/b"}\n',
+        "not json\n",
+    ]
+    assert list(iter_task_entries(lines, "jsonl")) == [
+        ("task_a", "https://example.com/a"),
+        (None, "https://example.com/b"),
+        (None, "not json"),
+    ]
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        iter_task_entries([], "xml")
@@ -0,0 +1,41 @@
+import io
+import json
+
+import pytest
+
+from src.dogaas.jsonstream import iter_json_object, write_json_object
+
+MEMBERS = [
+    ("a", {"_url": "https://a.example/é", "priority": -12, "mirrors": []}),
+    ('b"c', 1234567890),
+    ("タスク", [1.5e3, True, None, "}{"]),
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64 * 1024])
+def test_iter_json_object(chunk_size):
+    text = json.dumps(dict(MEMBERS), indent=4)
+    assert list(iter_json_object(io.StringIO(text), chunk_size)) == MEMBERS
+    assert list(iter_json_object(io.StringIO(" { } \n"), chunk_size)) == []
+
+
+@pytest.mark.parametrize(
+    "text", ["", "[]", '{"a": 1', '{"a": 1,}', '{"a" 1}', "{1: 2}"]
+)
+def test_iter_invalid_json_object(text):
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_object(io.StringIO(text), chunk_size=2))
+
+
+def test_extra_data():
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_object(io.StringIO('{"a": 1} {}')))
+
+
+def test_write_json_object():
+    f = io.StringIO()
+    write_json_object(f, iter(MEMBERS), batch_size=2)
+    assert json.loads(f.getvalue()) == dict(MEMBERS)
+    f = io.StringIO()
+    write_json_object(f, [])
+    assert f.getvalue() == "{}"
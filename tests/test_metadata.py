@@ -0,0 +1,89 @@
+import requests
+
+from benchmarks.server import _Handler
+from src.dogaas.downloader import DownloaderTask, DownloadScheduler, TaskManager
+from src.dogaas.metadata import MetadataCache, fetch_metadata
+from src.dogaas.transport import SessionPool
+
+
+def test_plan(http_server, tmp_path):
+    http_server.files["/a.bin"] = b"a" * 1000
+    http_server.files["/b.txt"] = b"b" * 10
+    http_server.accept_ranges = False
+    task_manager = TaskManager(metadata_cache=MetadataCache(tmp_path / "cache.json"))
+    task_manager.add_task("a", DownloaderTask(f"{http_server.url}/a.bin"))
+    task_manager.add_task("b", DownloaderTask(f"{http_server.url}/b.txt"))
+    task_manager.add_task("dead", DownloaderTask(f"{http_server.url}/dead"))
+    fetched = []
+    plan = task_manager.plan(on_fetch=lambda url, metadata: fetched.append(url))
+    assert plan.total_bytes == 1010 and plan.failed_task_names == ["dead"]
+    assert plan.metadata["dead"].status_code == 404
+    assert plan.metadata["a"].etag and not plan.range_task_names
+    assert len(fetched) == 3
+    assert all(headers for headers in http_server.request_headers)
+    # fresh metadata is not asked again, even from a saved cache
+    task_manager.metadata_cache.save()
+    task_manager.metadata_cache = MetadataCache(tmp_path / "cache.json")
+    assert task_manager.plan(["a"]).total_bytes == 1000
+    assert len(http_server.request_headers) == 3
+    task_manager.plan(["a"], force=True)
+    assert len(http_server.request_headers) == 4
+    task_manager.metadata_cache.ttl = 0
+    task_manager.plan(["b"])
+    assert len(http_server.request_headers) == 5
+
+
+def test_fetch_metadata_without_head(http_server, monkeypatch):
+    http_server.files["/a.bin"] = b"a" * 100
+    monkeypatch.setattr(_Handler, "do_HEAD", lambda handler: handler.send_error(405))
+    metadata = fetch_metadata(SessionPool(), f"{http_server.url}/a.bin")
+    assert metadata.ok and metadata.size == 100 and metadata.accepts_ranges
+    metadata = fetch_metadata(requests, "http://127.0.0.1:1/a.bin", timeout=1)
+    assert not metadata.ok and metadata.error.startswith("ConnectionError")
+
+
+def test_order(http_server, tmp_path):
+    task_manager = TaskManager()
+    for name, size, priority in [
+        ("small", 10, 0),
+        ("large", 1000, 0),
+        ("unknown", None, 0),
+        ("medium", 100, 0),
+        ("urgent", 1, 1),
+    ]:
+        if size is not None:
+            http_server.files[f"/{name}"] = b"x" * size
+        task_manager.add_task(
+            name, DownloaderTask(f"{http_server.url}/{name}", priority=priority)
+        )
+    task_manager.prefetch_metadata()
+    names = list(task_manager.tasks)
+    assert task_manager.sort_task_names(names) == [
+        "urgent",
+        "small",
+        "large",
+        "unknown",
+        "medium",
+    ]
+    assert task_manager.sort_task_names(names, "largest") == [
+        "urgent",
+        "large",
+        "medium",
+        "small",
+        "unknown",
+    ]
+    assert task_manager.sort_task_names(names, "smallest")[:4] == [
+        "urgent",
+        "small",
+        "medium",
+        "large",
+    ]
+    done = []
+    del http_server.request_headers[:]
+    results = DownloadScheduler(task_manager, jobs=1, order="largest").run(
+        tmp_path, on_done=lambda result: done.append(result.task_name)
+    )
+    assert done == ["urgent", "large", "medium", "small", "unknown"]
+    assert [result.ok for result in results] == [True, True, False, True, True]
+    # the downloads themselves send no `HEAD`
+    assert len(http_server.request_headers) == 5
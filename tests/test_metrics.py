@@ -0,0 +1,78 @@
+import io
+import json
+
+from src.dogaas.downloader import DownloadScheduler, DownloaderTask, TaskManager
+from src.dogaas.metrics import (
+    DownloadStats,
+    JSONLinesStatsWriter,
+    PrometheusTextfileWriter,
+)
+
+
+def test_download_stats(http_server, tmpdir):
+    http_server.files["/a.bin"] = b"a" * 300_000
+    http_server.files["/b.bin"] = b"b" * 1000
+    collected = []
+    taskmanager = TaskManager(on_stats=collected.append)
+    taskmanager.add_task("task_a", DownloaderTask(f"{http_server.url}/a.bin"))
+    taskmanager.add_task("task_b", DownloaderTask(f"{http_server.url}/b.bin"))
+    taskmanager.add_task("task_c", DownloaderTask(f"{http_server.url}/c.bin"))
+    results = DownloadScheduler(taskmanager, jobs=1, segments=3).run(tmpdir)
+    assert [stats.task_name for stats in collected] == ["task_a", "task_b", "task_c"]
+    stats_a, stats_b, stats_c = collected
+    assert results[0].stats is stats_a
+    assert stats_a.status == 200 and stats_a.error is None
+    assert stats_a.downloaded_bytes == 300_000 and stats_a.bytes_per_sec > 0
+    assert stats_a.segments == 1 and stats_a.requests == 1
+    assert stats_a.new_connections == 1 and stats_a.dns_s > 0
+    assert stats_a.read_s > 0 and stats_a.write_s > 0
+    assert stats_a.total_s >= stats_a.ttfb_s
+    assert stats_b.reused_connections == 1 and stats_b.connect_s == 0
+    assert stats_c.status == 404 and stats_c.error.startswith("HTTPError")
+
+
+def test_download_stats_interrupted(http_server, tmpdir):
+    http_server.files["/a.bin"] = b"a" * 300_000
+    collected = []
+    taskmanager = TaskManager(on_stats=collected.append)
+    taskmanager.add_task("task_a", DownloaderTask(f"{http_server.url}/a.bin"))
+    downloader = taskmanager.make_downloader_from_task("task_a")
+    progresses = downloader.download(tmpdir, chunk_size=1000)
+    next(progresses)
+    progresses.close()
+    assert collected == [downloader.stats]
+    assert downloader.stats.error == "DownloadError: interrupted"
+
+    downloader = taskmanager.make_downloader_from_task("task_a")
+    list(downloader.download(tmpdir))
+    assert downloader.stats.resumed_bytes > 0
+    assert downloader.stats.requests == 2
+    assert downloader.stats.resumed_bytes + downloader.stats.downloaded_bytes == 300_000
+
+
+def test_json_lines_stats_writer():
+    stream = io.StringIO()
+    writer = JSONLinesStatsWriter(stream)
+    writer(DownloadStats("https://example.com/a.bin", task_name="a"))
+    writer(DownloadStats("https://example.com/b.bin", task_name="b"))
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [line["task_name"] for line in lines] == ["a", "b"]
+    assert lines[0]["host"] == "example.com" and lines[0]["bytes_per_sec"] == 0
+
+
+def test_prometheus_textfile_writer(tmpdir):
+    writer = PrometheusTextfileWriter(tmpdir.join("dogaas.prom"))
+    stats = DownloadStats("https://example.com/a.bin", downloaded_bytes=100)
+    stats.finish()
+    writer.observe(stats)
+    writer.observe(stats)
+    failed_stats = DownloadStats("https://example.com/b.bin")
+    failed_stats.finish(OSError("disk full"))
+    writer.observe(failed_stats)
+    writer.write()
+    lines = tmpdir.join("dogaas.prom").read().splitlines()
+    assert 'dogaas_downloads_total{host="example.com",result="ok"} 2' in lines
+    assert 'dogaas_downloads_total{host="example.com",result="error"} 1' in lines
+    assert 'dogaas_downloaded_bytes_total{host="example.com"} 200' in lines
+    assert "# TYPE dogaas_download_seconds_total counter" in lines
+    assert tmpdir.listdir() == [tmpdir.join("dogaas.prom")]
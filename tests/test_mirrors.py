@@ -0,0 +1,119 @@
+import time
+
+import pytest
+
+from benchmarks.server import StandInServer
+from src.dogaas.downloader import DownloaderTask, TaskManager
+from src.dogaas.mirrors import MirrorStatsCache, probe_mirrors
+
+
+@pytest.fixture
+def mirror_server():
+    with StandInServer() as server:
+        yield server
+
+
+def test_task_mirrors():
+    task = DownloaderTask("https://a.example/x.bin", mirrors=["https://b.example/x"])
+    assert task.urls == ["https://a.example/x.bin", "https://b.example/x"]
+    with pytest.raises(ValueError):
+        DownloaderTask("https://a.example/x.bin", mirrors=["b.example/x"])
+
+
+def test_mirror_stats_cache(tmp_path):
+    cache = MirrorStatsCache(tmp_path / "mirrors.json", ttl=60)
+    cache.record_probe("https://a", 0.05)
+    cache.record_probe("https://b", 0.01)
+    cache.record_probe("https://c", None)
+    cache.record_transfer("https://a", 10_000_000, 1.0)
+    cache.record_transfer("https://b", 100_000, 1.0)
+    assert cache.rank(["https://c", "https://b", "https://a", "https://d"]) == [
+        "https://a",
+        "https://b",
+        "https://d",
+        "https://c",
+    ]
+    assert cache.rank(["https://a", "https://b"], size=1000) == [
+        "https://b",
+        "https://a",
+    ]
+    cache.save()
+    cache = MirrorStatsCache(tmp_path / "mirrors.json", ttl=60)
+    assert cache.is_fresh("https://a") and not cache.is_fresh("https://d")
+    assert cache.get("https://c").failures == 1
+    cache.get("https://a").probed_at = time.time() - 61
+    assert not cache.is_fresh("https://a")
+
+
+def test_probe_mirrors(http_server):
+    http_server.files["/a.bin"] = b"a"
+    ttfbs = probe_mirrors(
+        TaskManager().session_pool,
+        [f"{http_server.url}/a.bin", f"{http_server.url}/missing.bin"],
+    )
+    assert ttfbs[f"{http_server.url}/a.bin"] > 0
+    assert ttfbs[f"{http_server.url}/missing.bin"] is None
+
+
+def test_fail_over_on_request(http_server, mirror_server, tmp_path):
+    mirror_server.files["/a.bin"] = b"a" * 1000
+    task_manager = TaskManager()
+    task_manager.add_task(
+        "a",
+        DownloaderTask(
+            f"{http_server.url}/a.bin", mirrors=[f"{mirror_server.url}/a.bin"]
+        ),
+    )
+    downloader = task_manager.make_downloader_from_task("a")
+    list(downloader.download(tmp_path))
+    assert (tmp_path / "a.bin").read_bytes() == b"a" * 1000
+    assert task_manager.mirror_stats.get(f"{http_server.url}/a.bin").failures == 1
+
+
+def test_fail_over_mid_transfer(http_server, mirror_server, tmp_path):
+    content = bytes(range(256)) * 1000
+    http_server.files["/a.bin"] = content
+    # cut every body halfway
+    http_server.drop_rate = 1.0
+    mirror_server.files["/copy.bin"] = content
+    mirror_server.latency = 0.05
+    task_manager = TaskManager()
+    task_manager.add_task(
+        "a",
+        DownloaderTask(
+            f"{http_server.url}/a.bin", mirrors=[f"{mirror_server.url}/copy.bin"]
+        ),
+    )
+    downloader = task_manager.make_downloader_from_task("a")
+    list(downloader.download(tmp_path, chunk_size=1024))
+    assert (tmp_path / "a.bin").read_bytes() == content
+    assert downloader.stats.retries == 1
+    assert mirror_server.request_headers[-1]["Range"].startswith("bytes=")
+    mirror_stats = task_manager.mirror_stats
+    assert mirror_stats.get(f"{http_server.url}/a.bin").failures == 1
+    assert mirror_stats.get(f"{mirror_server.url}/copy.bin").bytes_per_sec > 0
+    assert mirror_stats.rank(task_manager.tasks["a"].urls)[0] == (
+        f"{mirror_server.url}/copy.bin"
+    )
+
+
+def test_spread_mirrors(http_server, mirror_server, tmp_path):
+    content = bytes(range(256)) * 1000
+    for server in (http_server, mirror_server):
+        server.files["/a.bin"] = content
+    task_manager = TaskManager()
+    task_manager.add_task(
+        "a",
+        DownloaderTask(
+            f"{http_server.url}/a.bin", mirrors=[f"{mirror_server.url}/a.bin"]
+        ),
+    )
+    downloader = task_manager.make_downloader_from_task("a")
+    list(
+        downloader.download(
+            tmp_path, segments=4, min_segment_size=1, spread_mirrors=True
+        )
+    )
+    assert (tmp_path / "a.bin").read_bytes() == content
+    for server in (http_server, mirror_server):
+        assert any("Range" in headers for headers in server.request_headers)
@@ -0,0 +1,130 @@
+import hashlib
+import tarfile
+import zipfile
+import gzip
+import io
+
+import pytest
+
+from src.dogaas.downloader import DownloaderTask, TaskManager
+from src.dogaas.postprocess import (
+    Pipeline,
+    PostProcessError,
+    make_process_pool,
+    run_stages,
+    validate_pipeline,
+)
+
+
+def chunked(data: bytes, size: int = 1000):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def make_tar_gz(files: dict[str, bytes]) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def test_validate_pipeline():
+    assert validate_pipeline(["gunzip", "digest:SHA1"]) == ["gunzip", "digest:SHA1"]
+    for specs in (["gzip"], ["digest:crc32"], ["tee"], ["gunzip:x"]):
+        with pytest.raises(ValueError):
+            validate_pipeline(specs)
+    with pytest.raises(ValueError):
+        validate_pipeline(["untar", "digest:md5"])
+
+
+def test_run_stages(tmp_path):
+    content = bytes(range(256)) * 100
+    # two gzip members in a row
+    data = gzip.compress(content[:10000]) + gzip.compress(content[10000:])
+    pending = run_stages(
+        ["tee:copy.gz", "gunzip", "digest:sha256"],
+        tmp_path / "a.bin.gz",
+        chunked(data),
+    )
+    assert sorted(final for _, final in pending) == [
+        str(tmp_path / name) for name in ("a.bin", "a.bin.sha256", "copy.gz")
+    ]
+    files = {final: open(temporary, "rb").read() for temporary, final in pending}
+    assert files[str(tmp_path / "copy.gz")] == data
+    assert files[str(tmp_path / "a.bin")] == content
+    assert files[str(tmp_path / "a.bin.sha256")] == (
+        f"{hashlib.sha256(content).hexdigest()}  a.bin\n".encode()
+    )
+
+
+def test_run_stages_failure(tmp_path):
+    with pytest.raises(PostProcessError):
+        run_stages(["gunzip"], tmp_path / "a.gz", [gzip.compress(b"a" * 1000)[:-10]])
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("use_process_pool", [False, True])
+def test_pipeline_extract(tmp_path, use_process_pool):
+    files = {"a.txt": b"a" * 100_000, "sub/b.txt": b"b"}
+    executor = make_process_pool(1) if use_process_pool else None
+    try:
+        pipeline = Pipeline(["gunzip", "untar"], tmp_path / "x.tar.gz", executor)
+        assert pipeline.runs_in_process == use_process_pool
+        for chunk in chunked(make_tar_gz(files)):
+            pipeline.update(chunk)
+        assert pipeline.close() == [tmp_path / "x"]
+    finally:
+        if executor:
+            executor.shutdown()
+    assert (tmp_path / "x" / "a.txt").read_bytes() == files["a.txt"]
+    assert (tmp_path / "x" / "sub" / "b.txt").read_bytes() == files["sub/b.txt"]
+
+
+def test_pipeline_failure_in_process(tmp_path):
+    with make_process_pool(1) as executor:
+        pipeline = Pipeline(["gunzip"], tmp_path / "a.gz", executor)
+        with pytest.raises(PostProcessError):
+            for chunk in chunked(b"not gzip" * 100_000, 64 * 1024):
+                pipeline.update(chunk)
+            pipeline.close()
+        pipeline.abort()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_pipeline_unzip_and_abort(tmp_path):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("a.txt", "a")
+    pipeline = Pipeline(["unzip"], tmp_path / "x.zip")
+    pipeline.update(buffer.getvalue())
+    assert pipeline.close() == [tmp_path / "x"]
+    assert (tmp_path / "x" / "a.txt").read_text() == "a"
+
+    pipeline = Pipeline(["unzip"], tmp_path / "y.zip")
+    pipeline.update(buffer.getvalue()[:10])
+    pipeline.abort()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["x"]
+
+
+@pytest.mark.parametrize("segments", [1, 4])
+def test_download_postprocess(http_server, tmp_path, segments):
+    content = bytes(range(256)) * 1000
+    data = gzip.compress(content)
+    http_server.files["/a.bin.gz"] = data
+    task_manager = TaskManager()
+    task_manager.add_task(
+        "a",
+        DownloaderTask(f"{http_server.url}/a.bin.gz", postprocess=["gunzip"]),
+    )
+    downloader = task_manager.make_downloader_from_task("a")
+    list(
+        downloader.download(
+            tmp_path, chunk_size=1024, segments=segments, min_segment_size=1
+        )
+    )
+    assert downloader.stats.segments == segments
+    assert downloader.outputs == [tmp_path / "a.bin"]
+    assert (tmp_path / "a.bin.gz").read_bytes() == data
+    assert (tmp_path / "a.bin").read_bytes() == content
@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import os
+
+from src.dogaas.asyncdownloader import AsyncTaskManager
+from src.dogaas.cache import FetchCache
+from src.dogaas.downloader import (
+    DownloaderTask,
+    DownloadScheduler,
+    TaskManager,
+    unique_filename,
+)
+from src.dogaas.store import ContentStore, place_file
+
+
+def sha256_of(content: bytes) -> str:
+    return "sha256:" + hashlib.sha256(content).hexdigest()
+
+
+def test_content_store(tmp_path):
+    store = ContentStore(tmp_path / "store")
+    (tmp_path / "a").write_bytes(b"abc")
+    (tmp_path / "b").write_bytes(b"abc")
+    digest = sha256_of(b"abc")
+    assert not store.has(digest)
+    assert store.add(tmp_path / "a", digest) and store.has(digest)
+    assert os.path.samefile(tmp_path / "a", store.path_of(digest))
+    # the same content again shares the stored copy
+    assert store.add(tmp_path / "b", digest)
+    assert (tmp_path / "b").read_bytes() == b"abc"
+    assert store.link(digest, tmp_path / "c")
+    assert not store.link(digest, tmp_path / "d", size=4)
+    assert not store.link(sha256_of(b"xyz"), tmp_path / "d")
+    assert not (tmp_path / "d").exists()
+    place_file(tmp_path / "a", tmp_path / "e", allow_hardlink=False)
+    assert (tmp_path / "e").read_bytes() == b"abc"
+    assert not os.path.samefile(tmp_path / "a", tmp_path / "e")
+
+
+def test_unique_filename():
+    assert unique_filename("a.tar.gz", "http://x/a.tar.gz").startswith("a-")
+    assert unique_filename("a.tar.gz", "http://x/a.tar.gz").endswith(".tar.gz")
+    assert unique_filename("a", "http://x/a") != unique_filename("a", "http://y/a")
+
+
+def test_coalesce_and_collisions(http_server, tmp_path):
+    http_server.files["/x/a.bin"] = b"x" * 10000
+    http_server.files["/y/a.bin"] = b"y" * 10000
+    task_manager = TaskManager(fetch_cache=FetchCache())
+    task_manager.add_task("x1", DownloaderTask(f"{http_server.url}/x/a.bin"))
+    task_manager.add_task("x2", DownloaderTask(f"{http_server.url}/x/a.bin"))
+    task_manager.add_task("y", DownloaderTask(f"{http_server.url}/y/a.bin"))
+    results = DownloadScheduler(task_manager, jobs=3).run(tmp_path)
+    assert all(result.ok for result in results)
+    assert len(http_server.request_headers) == 2
+    assert (
+        results[1].coalesced_with == "x1" and results[1].filepath == results[0].filepath
+    )
+    renamed = unique_filename("a.bin", f"{http_server.url}/y/a.bin")
+    assert results[2].filepath == tmp_path / renamed
+    assert (tmp_path / "a.bin").read_bytes() == b"x" * 10000
+    assert (tmp_path / renamed).read_bytes() == b"y" * 10000
+    # the name stays with the URL downloaded there first, whatever the batch
+    names = task_manager.dest_filenames(["y"], tmp_path)
+    assert names == {"y": renamed}
+    assert task_manager.dest_filenames(["y"], tmp_path / "other") == {}
+
+
+def test_link_from_store(http_server, tmp_path):
+    content = bytes(range(256)) * 40
+    http_server.files["/a.bin"] = content
+    http_server.files["/mirror/a.bin"] = content
+    store = ContentStore(tmp_path / "store")
+    task_manager = TaskManager(fetch_cache=FetchCache(), content_store=store)
+    for dirname in ["1", "2", "3"]:
+        (tmp_path / dirname).mkdir()
+    task_manager.add_task("a", DownloaderTask(f"{http_server.url}/a.bin"))
+    task_manager.add_task(
+        "b",
+        DownloaderTask(f"{http_server.url}/mirror/a.bin", checksum=sha256_of(content)),
+    )
+    (result,) = DownloadScheduler(task_manager).run(tmp_path / "1", ["a"])
+    assert result.ok and store.has(sha256_of(content))
+    record = task_manager.fetch_cache.get(f"{http_server.url}/a.bin")
+    assert record.digest == sha256_of(content)
+    # a checksum which is stored needs no request at all
+    (result,) = DownloadScheduler(task_manager).run(tmp_path / "2", ["b"])
+    assert result.ok and result.skipped
+    assert len(http_server.request_headers) == 1
+    assert os.path.samefile(tmp_path / "1" / "a.bin", tmp_path / "2" / "a.bin")
+    # nor does content not modified since it was downloaded elsewhere
+    (result,) = DownloadScheduler(task_manager).run(tmp_path / "3", ["a"])
+    assert result.ok and result.skipped
+    assert len(http_server.request_headers) == 2
+    assert (tmp_path / "3" / "a.bin").read_bytes() == content
+
+
+def test_async_coalesce(http_server, tmp_path):
+    content = b"a" * 5000
+    http_server.files["/a.bin"] = content
+    store = ContentStore(tmp_path / "store")
+    task_manager = TaskManager(content_store=store)
+    for i in range(5):
+        task_manager.add_task(str(i), DownloaderTask(f"{http_server.url}/a.bin"))
+
+    async def main():
+        async with AsyncTaskManager(task_manager) as async_task_manager:
+            return await async_task_manager.run(tmp_path)
+
+    results = asyncio.run(main())
+    assert all(result.ok for result in results)
+    assert len(http_server.request_headers) == 1
+    assert [result.coalesced_with for result in results] == [None] + ["0"] * 4
+    assert store.has(sha256_of(content))
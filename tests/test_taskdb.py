@@ -0,0 +1,235 @@
+import sqlite3
+import json
+
+import pytest
+
+from src.dogaas.downloader import (
+    TaskManager,
+    TaskState,
+    DownloaderTask,
+    DuplicateTaskError,
+)
+from src.dogaas.taskdb import SQLiteTaskDatabase
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def task_database(tmpdir):
+    with SQLiteTaskDatabase(tmpdir.join("tasks.db")) as task_database:
+        yield task_database
+
+
+@pytest.fixture(params=["dict", "sqlite"])
+def any_taskmanager(request, tmpdir):
+    """A `TaskManager` over each of the task stores."""
+    if request.param == "dict":
+        yield TaskManager()
+    else:
+        with SQLiteTaskDatabase(tmpdir.join("tasks.db")) as task_database:
+            yield TaskManager(task_database=task_database)
+
+
+def test_rename_task_to_itself(any_taskmanager):
+    any_taskmanager.add_task("task_a", DownloaderTask("https://example.com/a"))
+    any_taskmanager.add_task("task_b", DownloaderTask("https://example.com/b"))
+    any_taskmanager.rename_task("task_a", "task_a")
+    assert any_taskmanager.tasks["task_a"].url == "https://example.com/a"
+    assert any_taskmanager.count_tasks() == 2
+    with pytest.raises(KeyError):
+        any_taskmanager.rename_task("task_c", "task_c")
+
+
+class TestSQLiteTaskDatabase:
+    @staticmethod
+    def test_mapping(task_database):
+        task_database["task_a"] = DownloaderTask("https://example.com/a")
+        task_database["task_b"] = DownloaderTask("https://example.com/b")
+        assert task_database["task_a"].url == "https://example.com/a"
+        assert "task_b" in task_database
+        assert list(task_database) == ["task_a", "task_b"]
+        assert len(task_database) == 2
+        task_database["task_a"] = DownloaderTask("https://example.com/A")
+        assert [task.url for task in task_database.values()] == [
+            "https://example.com/A",
+            "https://example.com/b",
+        ]
+        del task_database["task_a"]
+        with pytest.raises(KeyError):
+            task_database["task_a"]
+        with pytest.raises(KeyError):
+            del task_database["task_a"]
+
+    @staticmethod
+    def test_persist(tmpdir):
+        with SQLiteTaskDatabase(tmpdir.join("tasks.db")) as task_database:
+            task_database.add_task("task_a", DownloaderTask("https://example.com/a"))
+        with SQLiteTaskDatabase(tmpdir.join("tasks.db")) as task_database:
+            assert task_database["task_a"].url == "https://example.com/a"
+
+    @staticmethod
+    def test_task_manager(task_database):
+        taskmanager = TaskManager(task_database=task_database)
+        taskmanager.add_task("task_a", DownloaderTask("https://example.com/a"))
+        with pytest.raises(DuplicateTaskError):
+            taskmanager.add_task(
+                "task_a",
+                DownloaderTask("https://example.com/a"),
+                raise_if_duplicate=True,
+            )
+        taskmanager.rename_task("task_a", "task_A")
+        assert list(task_database) == ["task_A"]
+        taskmanager.rewrite_task_url("task_A", "https://example.org/a")
+        assert task_database["task_A"].url == "https://example.org/a"
+        taskmanager.remove_task("task_A")
+        assert len(task_database) == 0
+
+    @staticmethod
+    def test_query_tasks(task_database):
+        for i in range(25):
+            host = "example.com" if i % 2 else "example.org"
+            task_database[f"task_{i:02}"] = DownloaderTask(f"https://{host}/{i}")
+        task_database.page_size = 4
+        taskmanager = TaskManager(task_database=task_database)
+        names = [name for name, _ in taskmanager.query_tasks(offset=10, limit=5)]
+        assert names == [f"task_{i:02}" for i in range(10, 15)]
+        names = [name for name, _ in taskmanager.query_tasks(host="EXAMPLE.com")]
+        assert names == [f"task_{i:02}" for i in range(1, 25, 2)]
+        assert taskmanager.count_tasks(name="task_1*") == 10
+        assert taskmanager.count_tasks(url="*.org/*") == 13
+
+    @staticmethod
+    def test_query_tasks_in_memory():
+        taskmanager = TaskManager()
+        for i in range(10):
+            taskmanager.add_task(
+                f"task_{i}", DownloaderTask(f"https://example.com/{i}")
+            )
+        names = [name for name, _ in taskmanager.query_tasks(offset=2, limit=3)]
+        assert names == ["task_2", "task_3", "task_4"]
+        assert taskmanager.count_tasks(host="example.org") == 0
+
+    @staticmethod
+    def test_add_tasks(task_database):
+        taskmanager = TaskManager(task_database=task_database)
+        taskmanager.add_task("a.zip", DownloaderTask("https://example.com/a.zip"))
+        report = taskmanager.add_tasks(
+            (None, f"https://example.com/{i % 3}/a.zip") for i in range(10)
+        )
+        assert report.added == 3
+        assert report.duplicate_urls == 7
+        assert task_database.contains_url("https://example.com/2/a.zip")
+        assert list(task_database) == ["a.zip", "a.zip_2", "a.zip_3", "a.zip_4"]
+
+    @staticmethod
+    def test_migrate_from_json(tmpdir, task_database):
+        taskmanager = TaskManager()
+        taskmanager.add_task("task_a", DownloaderTask("https://example.com/a"))
+        taskmanager.add_task("task_b", DownloaderTask("https://example.com/b"))
+        taskmanager.save_tasks_to_json(tmpdir, "tasks")
+        assert task_database.migrate_from_json(tmpdir.join("tasks.json")) == 2
+        assert dict(task_database.items()) == taskmanager.tasks
+
+    @staticmethod
+    def test_claim_tasks(tmpdir):
+        clock = FakeClock()
+        filepath = tmpdir.join("tasks.db")
+        with SQLiteTaskDatabase(filepath, clock=clock) as a, SQLiteTaskDatabase(
+            filepath, clock=clock
+        ) as b:
+            for i in range(5):
+                a[f"task_{i}"] = DownloaderTask(
+                    f"https://example.com/{i}", priority=i % 2
+                )
+            claimed = [name for name, _ in a.claim_tasks("a", count=3, lease_s=10)]
+            assert claimed == ["task_1", "task_3", "task_0"]
+            # another process only gets what is left
+            assert [name for name, _ in b.claim_tasks("b", count=5, lease_s=10)] == [
+                "task_2",
+                "task_4",
+            ]
+            assert b.claim_tasks("b") == []
+            assert a.count_task_states() == {
+                "pending": 0,
+                "claimed": 5,
+                "done": 0,
+                "failed": 0,
+            }
+            assert a.complete_task("a", "task_1")
+            assert a.complete_task("a", "task_3", error="404")
+            assert not b.complete_task("b", "task_0")
+            assert a.task_state("task_3") == TaskState(
+                "failed", attempts=1, error="404"
+            )
+            clock.now = 5
+            assert a.renew_leases("a", ["task_0", "task_2"], lease_s=10) == ["task_0"]
+            # the leases of `b` expire, those of `a` were renewed
+            clock.now = 12
+            assert [name for name, _ in a.claim_tasks("c", count=5)] == [
+                "task_2",
+                "task_4",
+            ]
+            assert a.task_state("task_2").attempts == 2
+            assert not b.complete_task("b", "task_2")
+            a.release_tasks("c")
+            assert a.task_state("task_4") == TaskState(attempts=2)
+            assert a.reset_task_states(["failed"]) == 1
+            assert a.count_task_states()["pending"] == 3
+
+    @staticmethod
+    def test_claim_tasks_of_a_url_together(task_database):
+        for name in ["a1", "b", "a2"]:
+            task_database[name] = DownloaderTask(f"https://example.com/{name[0]}")
+        claimed = task_database.claim_tasks("a", count=1)
+        assert [name for name, _ in claimed] == ["a1", "a2"]
+        task_database["a3"] = DownloaderTask("https://example.com/a")
+        # the URL is being downloaded by `a`
+        assert [name for name, _ in task_database.claim_tasks("b", count=5)] == ["b"]
+        assert task_database.complete_task("a", "a1")
+        assert task_database.complete_task("a", "a2")
+        assert [name for name, _ in task_database.claim_tasks("b")] == ["a3"]
+
+    @staticmethod
+    def test_claim_max_attempts(tmpdir):
+        clock = FakeClock()
+        with SQLiteTaskDatabase(tmpdir.join("tasks.db"), clock=clock) as database:
+            database["task_a"] = DownloaderTask("https://example.com/a")
+            for attempt in range(2):
+                assert database.claim_tasks("a", lease_s=1, max_attempts=2)
+                clock.now += 2
+            assert database.claim_tasks("a", max_attempts=2) == []
+            assert database.task_state("task_a").state == "failed"
+
+    @staticmethod
+    def test_add_state_columns(tmpdir):
+        filepath = str(tmpdir.join("tasks.db"))
+        connection = sqlite3.connect(filepath)
+        connection.executescript("""
+            CREATE TABLE tasks (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE,
+                url TEXT NOT NULL,
+                host TEXT NOT NULL,
+                data TEXT NOT NULL
+            );
+            """)
+        for name, priority in [("a", 0), ("b", 3)]:
+            task = DownloaderTask(f"https://example.com/{name}", priority=priority)
+            connection.execute(
+                "INSERT INTO tasks (name, url, host, data) VALUES (?, ?, ?, ?)",
+                (name, task.url, "example.com", json.dumps(task.to_dict())),
+            )
+        connection.commit()
+        connection.close()
+        with SQLiteTaskDatabase(filepath) as database:
+            assert list(database) == ["a", "b"]
+            assert [name for name, _ in database.claim_tasks("a", count=2)] == [
+                "b",
+                "a",
+            ]
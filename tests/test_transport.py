@@ -0,0 +1,78 @@
+from urllib3.connection import HTTPConnection, HTTPSConnection
+
+from src.dogaas.downloader import TaskManager, DownloaderTask
+from src.dogaas.transport import (
+    ConnectionTimings,
+    SessionPool,
+    connection_timings,
+    host_of_url,
+)
+
+
+def test_host_of_url():
+    assert host_of_url("https://Example.com/a/b.zip") == "https://example.com"
+    assert host_of_url("http://localhost:8080/x") == "http://localhost:8080"
+
+
+class TestSessionPool:
+    @staticmethod
+    def test_reuse_connection(http_server):
+        http_server.files["/a.bin"] = b"a" * 100
+        http_server.files["/b.bin"] = b"b" * 100
+        with SessionPool() as session_pool:
+            assert session_pool.get(f"{http_server.url}/a.bin").content == b"a" * 100
+            assert session_pool.get(f"{http_server.url}/b.bin").content == b"b" * 100
+            assert session_pool.session_for(
+                f"{http_server.url}/a.bin"
+            ) is session_pool.session_for(f"{http_server.url}/b.bin")
+        assert len(set(http_server.client_ports)) == 1
+
+    @staticmethod
+    def test_per_host_pool_maxsize():
+        session_pool = SessionPool(
+            pool_maxsize=4,
+            per_host_pool_maxsize={"example.com": 2, "https://example.org": 8},
+        )
+        assert session_pool.pool_maxsize_for("https://example.com") == 2
+        assert session_pool.pool_maxsize_for("https://example.org") == 8
+        assert session_pool.pool_maxsize_for("https://example.net") == 4
+
+    @staticmethod
+    def test_warm_up(http_server):
+        http_server.files["/a.bin"] = b"a" * 100
+        with SessionPool() as session_pool:
+            session_pool.warm_up([f"{http_server.url}/a.bin"])
+            session_pool.get(f"{http_server.url}/a.bin").close()
+        assert len(http_server.client_ports) == 2
+        assert len(set(http_server.client_ports)) == 1
+
+    @staticmethod
+    def test_task_manager_shares_pool(http_server, tmpdir):
+        http_server.files["/a.bin"] = b"a" * 100
+        http_server.files["/b.bin"] = b"b" * 100
+        taskmanager = TaskManager()
+        taskmanager.add_task("task_a", DownloaderTask(f"{http_server.url}/a.bin"))
+        taskmanager.add_task("task_b", DownloaderTask(f"{http_server.url}/b.bin"))
+        for task_name in ("task_a", "task_b"):
+            list(taskmanager.make_downloader_from_task(task_name).download(tmpdir))
+        taskmanager.session_pool.close()
+        assert len(set(http_server.client_ports)) == 1
+
+
+def test_connection_timings(http_server):
+    http_server.files["/a.bin"] = b"a" * 100
+    with SessionPool() as session_pool:
+        with session_pool.get(f"{http_server.url}/a.bin", stream=True) as response:
+            timings = connection_timings(response)
+            assert not timings.reused and timings.connect_s > 0
+            response.content
+        with session_pool.get(f"{http_server.url}/a.bin", stream=True) as response:
+            assert connection_timings(response) == ConnectionTimings(reused=True)
+
+
+def test_urllib3_internals():
+    # the timed connections override these private parts, which another
+    # major version of urllib3 may drop without warning
+    for connection_cls in (HTTPConnection, HTTPSConnection):
+        assert callable(connection_cls._new_conn)
+        assert connection_cls("example.com", 8080)._dns_host == "example.com"
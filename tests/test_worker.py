@@ -0,0 +1,159 @@
+import threading
+import sqlite3
+
+import pytest
+
+from src.dogaas.downloader import (
+    DownloaderTask,
+    DownloadResult,
+    DownloadScheduler,
+    TaskManager,
+    unique_filename,
+)
+from src.dogaas.taskdb import SQLiteTaskDatabase
+from src.dogaas.worker import Worker
+
+
+def test_workers_share_tasks(http_server, tmp_path):
+    db_filepath = tmp_path / "tasks.db"
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    with SQLiteTaskDatabase(db_filepath) as database:
+        for i in range(40):
+            http_server.files[f"/{i}.bin"] = bytes([i]) * 2000
+            database[str(i)] = DownloaderTask(f"{http_server.url}/{i}.bin")
+        http_server.files["/x/a.bin"] = b"x"
+        http_server.files["/y/a.bin"] = b"y"
+        database["x"] = DownloaderTask(f"{http_server.url}/x/a.bin")
+        database["y"] = DownloaderTask(f"{http_server.url}/y/a.bin")
+        # claimed by a worker which died
+        database.claim_tasks("dead", count=3, lease_s=0.2)
+    counts = []
+
+    def work():
+        with SQLiteTaskDatabase(db_filepath) as database:
+            scheduler = DownloadScheduler(TaskManager(task_database=database), jobs=2)
+            worker = Worker(scheduler, batch_size=3, heartbeat_s=0.05, poll_s=0.05)
+            counts.append(worker.run(dest))
+
+    threads = [threading.Thread(target=work) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(count["done"] for count in counts) == 42
+    assert not any(count["failed"] for count in counts)
+    assert len(http_server.request_headers) == 42
+    with SQLiteTaskDatabase(db_filepath) as database:
+        assert database.count_task_states()["done"] == 42
+    assert (dest / "0.bin").read_bytes() == bytes([0]) * 2000
+    # the batches of the workers agree on the names
+    assert (dest / "a.bin").read_bytes() == b"x"
+    renamed = unique_filename("a.bin", f"{http_server.url}/y/a.bin")
+    assert (dest / renamed).read_bytes() == b"y"
+
+
+def test_worker_gives_back_tasks(http_server, tmp_path):
+    with SQLiteTaskDatabase(tmp_path / "tasks.db") as database:
+        database["a"] = DownloaderTask(f"{http_server.url}/a.bin")
+        database["b"] = DownloaderTask(f"{http_server.url}/b.bin")
+        scheduler = DownloadScheduler(TaskManager(task_database=database))
+
+        def interrupt(result):
+            raise KeyboardInterrupt
+
+        worker = Worker(scheduler, batch_size=2)
+        with pytest.raises(KeyboardInterrupt):
+            worker.run(tmp_path, on_done=interrupt)
+        # the failed one is recorded and the other is pending again
+        assert database.count_task_states() == {
+            "pending": 1,
+            "claimed": 0,
+            "done": 0,
+            "failed": 1,
+        }
+        with pytest.raises(TypeError):
+            Worker(DownloadScheduler(TaskManager()))
+
+
+def test_workers_share_duplicate_urls(http_server, tmp_path):
+    db_filepath = tmp_path / "tasks.db"
+    http_server.files["/dup.bin"] = b"d" * 100000
+    with SQLiteTaskDatabase(db_filepath) as database:
+        for i in range(10):
+            http_server.files[f"/{i}.bin"] = bytes([i]) * 2000
+            database[str(i)] = DownloaderTask(f"{http_server.url}/{i}.bin")
+            database[f"dup{i}"] = DownloaderTask(f"{http_server.url}/dup.bin")
+    counts = []
+
+    def work():
+        with SQLiteTaskDatabase(db_filepath) as database:
+            scheduler = DownloadScheduler(TaskManager(task_database=database), jobs=2)
+            worker = Worker(scheduler, batch_size=1, poll_s=0.05)
+            counts.append(worker.run(tmp_path))
+
+    threads = [threading.Thread(target=work) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(count["done"] for count in counts) == 20
+    # the tasks of a URL are claimed together, so it is downloaded once
+    assert len(http_server.request_headers) == 11
+    assert (tmp_path / "dup.bin").read_bytes() == b"d" * 100000
+
+
+def test_scan_tasks_once_per_run(http_server, tmp_path, monkeypatch):
+    with SQLiteTaskDatabase(tmp_path / "tasks.db") as database:
+        for i in range(10):
+            http_server.files[f"/{i}.bin"] = bytes([i]) * 100
+            database[str(i)] = DownloaderTask(f"{http_server.url}/{i}.bin")
+        scans = []
+        items = database.items
+        monkeypatch.setattr(database, "items", lambda: scans.append(1) or items())
+        scheduler = DownloadScheduler(TaskManager(task_database=database))
+        counts = Worker(scheduler, batch_size=2).run(tmp_path)
+    assert counts == {"done": 10, "failed": 0}
+    # not once for each of the 5 batches
+    assert len(scans) == 1
+
+
+def test_heartbeat_survives_errors(http_server, tmp_path, caplog):
+    with SQLiteTaskDatabase(tmp_path / "tasks.db") as database:
+        database["a"] = DownloaderTask(f"{http_server.url}/a.bin")
+        worker = Worker(
+            DownloadScheduler(TaskManager(task_database=database)), heartbeat_s=0.01
+        )
+        database.claim_tasks(worker.owner)
+        worker._held.add("a")
+        renew_leases = database.renew_leases
+        calls = []
+
+        def flaky_renew_leases(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise sqlite3.OperationalError("database is locked")
+            return renew_leases(*args)
+
+        database.renew_leases = flaky_renew_leases
+        batch_done = threading.Event()
+        heartbeat = threading.Thread(target=worker._heartbeat, args=(batch_done,))
+        heartbeat.start()
+        while len(calls) < 3:
+            batch_done.wait(0.01)
+        batch_done.set()
+        heartbeat.join()
+        assert "database is locked" in caplog.text
+        assert worker._held == {"a"} and not worker.lost_task_names
+
+
+def test_lost_lease_is_not_counted(http_server, tmp_path):
+    with SQLiteTaskDatabase(tmp_path / "tasks.db") as database:
+        database["a"] = DownloaderTask(f"{http_server.url}/a.bin")
+        worker = Worker(DownloadScheduler(TaskManager(task_database=database)))
+        database.claim_tasks(worker.owner, lease_s=0)
+        # another worker took the task over once the lease expired
+        assert database.claim_tasks("other")
+        assert not worker._complete(DownloadResult("a"))
+        assert worker.lost_task_names == ["a"]
+        assert database.task_state("a").owner == "other"